@@ -0,0 +1,760 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  An event loop server for the session protocol (see session.py).   One
+  thread runs an asyncore loop (with poll, so there is no select() limit on
+  the number of descriptors) that does all of the socket I/O.   Each request
+  that has been read in full is handed to a bounded pool of worker threads
+  (a fairscheduler.FairScheduler, so clients share the workers fairly by
+  IP address).   The worker's reply goes back to the loop through a pipe,
+  and the loop sends it.
+
+  An idle or slow connection costs a socket and a few small buffers, not a
+  thread, so one server can hold tens of thousands of connections.
+  Resource use is bounded:
+
+    maxconnections: no new connections are accepted while this many are open
+    maxpending:     no more requests are read while this many are waiting
+                    for (or being handled by) a worker
+    maxrequestsize: a connection that announces a larger message is dropped
+    idletimeout:    a connection that has been idle this long is closed
+
+  A request that the scheduler rejects (the client is over its share) is
+  answered with busyreply.
+
+  If a metricsregistry.MetricsRegistry is given, the server records the
+  bytes it receives and sends (uppir_bytes_received_total and
+  uppir_bytes_sent_total), how long each reply takes to send once it is
+  ready (uppir_send_seconds) and the open connections
+  (uppir_active_connections).
+
+  A connection carries any number of requests (until the client sends -1).
+  A client may pipeline requests: up to MAX_PIPELINED_REQUESTS are read
+  ahead.   Each connection has one request with the workers at a time, so
+  its replies are in order.   The request handler must be thread safe (it
+  runs in the workers).   A deferred handler may instead hand the request
+  on and give the reply later, from another thread, so a request that
+  waits for something else does not hold a worker.
+
+"""
+
+import os
+
+import errno
+
+import fcntl
+
+import socket
+
+import asyncore
+
+import collections
+
+import threading
+
+import time
+
+# a bounded pool of worker threads that is shared fairly between clients
+import fairscheduler
+
+import traceback
+
+# for sessionmaxdigits
+import session
+
+try:
+  import resource
+except ImportError:
+  # raise_file_limit does nothing
+  resource = None
+
+
+# how many connections may wait in the kernel to be accepted
+LISTEN_BACKLOG = 1024
+
+# how many requests a connection reads ahead of its replies
+MAX_PIPELINED_REQUESTS = 16
+
+# how much is read from a socket at a time
+_RECV_SIZE = 65536
+
+
+
+def raise_file_limit():
+  """
+  <Purpose>
+    Raises this process's limit on open files (RLIMIT_NOFILE) to the hard
+    limit, so the server can hold more connections.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    The new limit, or None if it could not be changed.
+  """
+  if resource is None:
+    return None
+
+  try:
+    softlimit, hardlimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hardlimit == resource.RLIM_INFINITY:
+      # Linux will not set an infinite soft limit for files...
+      hardlimit = max(softlimit, 65536)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hardlimit, hardlimit))
+    return hardlimit
+  except (ValueError, resource.error):
+    return None
+
+
+
+
+
+def _run_request(requesthandler, requeststring, remoteaddress):
+  # Private helper that runs in a worker.   Returns (reply, errorstring) so
+  # that the loop can log the whole traceback of a request that raised.
+  try:
+    return (requesthandler(requeststring, remoteaddress), None)
+  except Exception:
+    return (None, traceback.format_exc())
+
+
+
+def _run_deferred_request(requesthandler, requeststring, remoteaddress, finish):
+  # Private helper like _run_request for a deferred handler (a deferred
+  # scheduler task).   The task finishes with (reply, errorstring) when the
+  # handler gives its reply.
+  def _reply(reply, error):
+    if error is None:
+      finish((reply, None), None)
+    else:
+      finish((None, ''.join(traceback.format_exception_only(type(error), error))), None)
+
+  try:
+    requesthandler(requeststring, remoteaddress, _reply)
+  except Exception:
+    finish((None, traceback.format_exc()), None)
+
+
+
+
+
+class _SessionChannel(asyncore.dispatcher):
+  # One client connection.   Requests are read (possibly several ahead) and
+  # handed to the workers one at a time, so the replies go out in order.
+  # The connection is closed after the client's -1 once every reply has
+  # been sent.
+
+  def __init__(self, server, sock, remoteaddress):
+    asyncore.dispatcher.__init__(self, sock, map=server._map)
+    self._server = server
+    self.remoteaddress = remoteaddress
+
+    # the size line of the message being read (until the '\n' is seen) and
+    # then the chunks of the message itself
+    self._header = ''
+    self._messagesize = None
+    self._chunks = []
+    self._chunkslength = 0
+
+    # requests that have been read but not yet given to a worker
+    self._requests = collections.deque()
+
+    # a request is with a worker
+    self._waiting = False
+
+    # waiting for room with the workers
+    self._stalled = False
+
+    # the client sent -1
+    self._clientdone = False
+
+    # the replies being sent (in order) and what is left of them to send
+    self._replies = collections.deque()
+    self._outviews = collections.deque()
+
+    # when each of those replies was ready to send
+    self._replytimes = collections.deque()
+
+    self.lastactivity = time.time()
+
+
+  def readable(self):
+    return not self._clientdone and len(self._requests) < MAX_PIPELINED_REQUESTS and self._server._pending < self._server.maxpending
+
+
+  def writable(self):
+    return len(self._outviews) > 0
+
+
+  def is_idle(self):
+    # no request is waiting for a worker.   (A client that stops partway
+    # through a message, or stops reading a reply, is idle.)
+    return not self._requests and not self._waiting
+
+
+  def handle_read(self):
+    data = self.recv(_RECV_SIZE)
+    if not data:
+      # recv already called handle_close
+      return
+
+    self.lastactivity = time.time()
+
+    if self._server._metrics is not None:
+      self._server._metrics.increment('uppir_bytes_received_total', len(data))
+
+    while True:
+      if self._messagesize is None:
+        if not data:
+          break
+
+        self._header = self._header + data
+        newlineposition = self._header.find('\n')
+        if newlineposition == -1:
+          if len(self._header) > session.sessionmaxdigits:
+            self._drop('Bad message size')
+            return
+          break
+
+        try:
+          messagesize = int(self._header[:newlineposition])
+        except ValueError:
+          self._drop('Bad message size')
+          return
+
+        data = self._header[newlineposition+1:]
+        self._header = ''
+
+        if messagesize == -1:
+          # the client will not send anything more (and anything after
+          # this is ignored)
+          self._clientdone = True
+          break
+
+        if messagesize < 0 or messagesize > self._server.maxrequestsize:
+          self._drop('Bad message size '+str(messagesize))
+          return
+
+        self._messagesize = messagesize
+
+      neededlength = self._messagesize - self._chunkslength
+      if neededlength > 0:
+        if not data:
+          break
+        self._chunks.append(data[:neededlength])
+        self._chunkslength = self._chunkslength + len(self._chunks[-1])
+        data = data[neededlength:]
+
+      if self._chunkslength == self._messagesize:
+        self._requests.append(''.join(self._chunks))
+        self._chunks = []
+        self._chunkslength = 0
+        self._messagesize = None
+
+    self._next_request()
+
+
+  def _next_request(self):
+    # Private helper.   Gives the next request to the workers (if there is
+    # one and none is with them now), or closes a finished connection.
+    if self._waiting or not self.connected:
+      return
+
+    if self._requests:
+      if self._server._pending >= self._server.maxpending:
+        # the workers are full.   The server calls us again when there is
+        # room.
+        if not self._stalled:
+          self._stalled = True
+          self._server._stalledchannels.append(self)
+        return
+
+      self._waiting = True
+      self._server._submit(self, self._requests.popleft())
+
+    elif self._clientdone and not self._outviews:
+      self.close()
+
+
+  def handle_reply(self, reply, errorstring):
+    # Called by the loop with the worker's result
+    self._waiting = False
+
+    if errorstring is not None:
+      self._server._logfunction('error handling a request from '+str(self.remoteaddress)+': '+errorstring)
+      self.close()
+      return
+
+    if not self.connected:
+      # the client went away in the meantime
+      self._server._release_reply(reply)
+      return
+
+    self._replies.append(reply)
+    self._replytimes.append(time.time())
+    self._outviews.append(memoryview(str(len(reply)) + '\n'))
+    self._outviews.append(memoryview(reply))
+
+    # the next request is worked on while this reply is sent
+    self._next_request()
+
+
+  def handle_write(self):
+    sentlength = self.send(self._outviews[0])
+    if not self.connected:
+      # send saw the connection close
+      return
+
+    self.lastactivity = time.time()
+
+    if self._server._metrics is not None:
+      self._server._metrics.increment('uppir_bytes_sent_total', sentlength)
+
+    if sentlength < len(self._outviews[0]):
+      self._outviews[0] = self._outviews[0][sentlength:]
+      return
+
+    self._outviews.popleft()
+
+    # a reply is done when its data (not just its size line) is sent
+    if len(self._outviews) % 2 == 0:
+      self._server._release_reply(self._replies.popleft())
+      replytime = self._replytimes.popleft()
+      if self._server._metrics is not None:
+        self._server._metrics.observe('uppir_send_seconds', time.time() - replytime)
+
+    if not self._outviews:
+      self._next_request()
+
+
+  def handle_close(self):
+    self.close()
+
+
+  def close(self):
+    while self._replies:
+      self._server._release_reply(self._replies.popleft())
+    self._replytimes.clear()
+    self._outviews.clear()
+    asyncore.dispatcher.close(self)
+
+
+  def handle_error(self):
+    self._server._logfunction('error on the connection from '+str(self.remoteaddress)+': '+traceback.format_exc())
+    self.close()
+
+
+  def _drop(self, reason):
+    self._server._logfunction('dropped the connection from '+str(self.remoteaddress)+': '+reason)
+    self.close()
+
+
+
+
+
+class _WakeupDispatcher(asyncore.file_dispatcher):
+  # The read end of the pipe the workers use to wake up the loop.
+
+  def __init__(self, server, readfd):
+    asyncore.file_dispatcher.__init__(self, readfd, map=server._map)
+    self._server = server
+
+
+  def writable(self):
+    return False
+
+
+  def handle_read(self):
+    try:
+      self.recv(_RECV_SIZE)
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+    self._server._deliver_replies()
+
+
+  def handle_error(self):
+    self._server._logfunction('error delivering replies: '+traceback.format_exc())
+
+
+
+
+
+class SessionServer(asyncore.dispatcher):
+  """
+  <Purpose>
+    Serves the session protocol with an event loop for the sockets and a
+    bounded pool of worker threads for the requests.
+
+  <Side Effects>
+    Listens on the address and starts numworkers threads.
+
+  <Example Use>
+    def handle_request(requeststring, remoteaddress):
+      return 'You said: '+requeststring
+
+    myserver = SessionServer(('127.0.0.1', 62294), handle_request)
+
+    # does not return until shutdown is called (from another thread)
+    myserver.serve_forever()
+
+  """
+
+  # these are public so that a caller can read the limits.   They should not
+  # be changed (except maxrequestsize, with set_maxrequestsize).
+  numworkers = None
+  maxpending = None
+  maxconnections = None
+  maxrequestsize = None
+  idletimeout = None
+
+  def __init__(self, address, requesthandler, releasereply=None, numworkers=4, maxpending=None, maxconnections=10000, maxrequestsize=1024*1024, idletimeout=None, scheduler=None, busyreply=None, metrics=None, logfunction=None, deferredhandler=False):
+    """
+    <Purpose>
+      Creates the listening socket and the workers.
+
+    <Arguments>
+      address: the (ip, port) to listen on.
+
+      requesthandler: a function (requeststring, remoteaddress) that returns
+                      the reply (a string or other buffer).   It runs in a
+                      worker thread.   If it raises, the error is logged and
+                      the connection is closed.
+
+      releasereply: a function that is called with each reply once it has
+                    been sent (or can no longer be sent).   This lets the
+                    handler reuse reply buffers.   (default None)
+
+      numworkers: the number of worker threads (if no scheduler is given).
+
+      maxpending: the most requests that may wait for a worker.   (default
+                  16 per worker)
+
+      maxconnections: the most connections that are open at once.
+
+      maxrequestsize: the largest request (in bytes).
+
+      idletimeout: close a connection after this many seconds without
+                   traffic (or a request with the workers).   (default
+                   None, never)
+
+      scheduler: the fairscheduler.FairScheduler to run requests on.   It may
+                 be shared with other servers.   (default None, create one
+                 with numworkers workers and no per-client limit beyond
+                 maxpending)
+
+      busyreply: the reply to a request the scheduler rejects (default
+                 None, close the connection instead)
+
+      metrics: a metricsregistry.MetricsRegistry to record traffic in
+               (default None)
+
+      logfunction: a function that is called with a string to log errors
+                   (default None, no logging).
+
+      deferredhandler: the requesthandler is (requeststring, remoteaddress,
+                       reply) and calls reply(replystring, error) once,
+                       from any thread, instead of returning the reply.
+                       error is an exception (or None).   The request counts
+                       against maxpending and the client's share of the
+                       scheduler until then, but its worker is free as soon
+                       as the handler returns.   If the handler raises
+                       without having replied, the connection is closed.
+                       (default False)
+
+    <Exceptions>
+      TypeError if the limits are not positive integers (or numbers for
+      idletimeout).
+
+      socket.error if the address cannot be used.
+
+    """
+    if scheduler is not None:
+      numworkers = scheduler.numworkers
+
+    if maxpending is None:
+      maxpending = numworkers * 16
+
+    for name, value in [('numworkers', numworkers), ('maxpending', maxpending), ('maxconnections', maxconnections), ('maxrequestsize', maxrequestsize)]:
+      if type(value) != int and type(value) != long:
+        raise TypeError(name+" must be an integer")
+      if value <= 0:
+        raise TypeError(name+" must be positive")
+
+    if idletimeout is not None:
+      if type(idletimeout) not in [int, long, float]:
+        raise TypeError("idletimeout must be a number")
+      if idletimeout <= 0:
+        raise TypeError("idletimeout must be positive")
+
+    self.numworkers = numworkers
+    self.maxpending = maxpending
+    self.maxconnections = maxconnections
+    self.maxrequestsize = maxrequestsize
+    self.idletimeout = idletimeout
+
+    self._requesthandler = requesthandler
+    self._deferredhandler = deferredhandler
+    self._releasereplyfunction = releasereply
+    if logfunction is None:
+      logfunction = lambda stringtolog: None
+    self._logfunction = logfunction
+
+    # our own map, so that several servers (and other asyncore users) can
+    # coexist
+    self._map = {}
+
+    asyncore.dispatcher.__init__(self, map=self._map)
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.set_reuse_addr()
+    self.bind(address)
+    self.listen(LISTEN_BACKLOG)
+
+    # requests that are with a worker (only the loop changes this) and the
+    # connections waiting for that to go below maxpending
+    self._pending = 0
+    self._stalledchannels = collections.deque()
+
+    # (channel, reply, errorstring) from the workers.   A deque is safe to
+    # append to and pop from in different threads.
+    self._completed = collections.deque()
+
+    # a worker writes a byte here to wake the loop up.   Neither end blocks:
+    # if the pipe is full, the loop has plenty of wakeups to process.
+    wakeupreadfd, self._wakeupwritefd = os.pipe()
+    _WakeupDispatcher(self, wakeupreadfd)
+    os.close(wakeupreadfd)
+    fcntl.fcntl(self._wakeupwritefd, fcntl.F_SETFL, fcntl.fcntl(self._wakeupwritefd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    self._stopped = threading.Event()
+
+    # we only stop a scheduler we created
+    self._ownscheduler = scheduler is None
+    if scheduler is None:
+      scheduler = fairscheduler.FairScheduler(numworkers, maxpending, maxpending)
+    self._scheduler = scheduler
+    self._busyreply = busyreply
+
+    self._metrics = metrics
+    if metrics is not None:
+      metrics.describe('uppir_bytes_received_total', 'counter', 'Bytes received from clients')
+      metrics.describe('uppir_bytes_sent_total', 'counter', 'Bytes sent to clients')
+      metrics.describe('uppir_send_seconds', 'histogram', 'Time from a reply being ready until it was sent')
+      metrics.describe('uppir_active_connections', 'gauge', 'Open client connections')
+      metrics.set_value_function('uppir_active_connections', self.get_connectioncount)
+
+
+
+  def readable(self):
+    # the listening socket (stop accepting when there are too many
+    # connections).   The map also holds us and the wakeup pipe.
+    return len(self._map) - 2 < self.maxconnections
+
+
+  def writable(self):
+    return False
+
+
+  def handle_accept(self):
+    # asyncore rebuilds the poll set on every pass, so take everything that
+    # is waiting (up to the limit) rather than one connection per pass
+    while self.readable():
+      try:
+        acceptedpair = self.accept()
+      except socket.error, e:
+        # out of descriptors, etc.   The connection stays queued in the
+        # kernel.
+        self._logfunction('accept failed: '+str(e))
+        return
+
+      if acceptedpair is None:
+        # nothing else is waiting
+        return
+
+      clientsocket, remoteaddress = acceptedpair
+      _SessionChannel(self, clientsocket, remoteaddress)
+
+
+  def handle_error(self):
+    # keep listening whatever happened
+    self._logfunction('error in the server: '+traceback.format_exc())
+
+
+
+  def _submit(self, channel, requeststring):
+    # Private helper (in the loop) that gives a request to the workers
+
+    def _request_done(result, error):
+      # in the worker, or the thread that gave a deferred reply (the
+      # run function already caught any error)
+      self._completed.append((channel, result[0], result[1]))
+      self._wake()
+
+    if self._deferredhandler:
+      runfunction = _run_deferred_request
+    else:
+      runfunction = _run_request
+
+    try:
+      self._scheduler.submit(channel.remoteaddress[0], runfunction, (self._requesthandler, requeststring, channel.remoteaddress), _request_done, self._deferredhandler)
+    except fairscheduler.SchedulerBusy, e:
+      if self._busyreply is None:
+        channel._drop(str(e))
+      else:
+        channel.handle_reply(self._busyreply, None)
+      return
+
+    self._pending = self._pending + 1
+
+
+
+  def _wake(self):
+    # Private helper that wakes up the loop (from any thread)
+    try:
+      os.write(self._wakeupwritefd, 'x')
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+
+
+  def _deliver_replies(self):
+    # Private helper (in the loop) that passes finished replies to their
+    # connections
+    while self._completed:
+      channel, reply, errorstring = self._completed.popleft()
+      self._pending = self._pending - 1
+      channel.handle_reply(reply, errorstring)
+
+    while self._stalledchannels and self._pending < self.maxpending:
+      channel = self._stalledchannels.popleft()
+      channel._stalled = False
+      channel._next_request()
+
+
+
+  def _release_reply(self, reply):
+    # Private helper.   The reply is no longer needed.
+    if self._releasereplyfunction is not None:
+      self._releasereplyfunction(reply)
+
+
+
+  def _close_idle_connections(self):
+    # Private helper (in the loop) that closes the connections that have
+    # been idle for longer than idletimeout
+    oldesttime = time.time() - self.idletimeout
+    for dispatcher in self._map.values():
+      if isinstance(dispatcher, _SessionChannel) and dispatcher.lastactivity < oldesttime and dispatcher.is_idle():
+        dispatcher.close()
+
+
+
+  def serve_forever(self, polltimeout=30.0):
+    """
+    <Purpose>
+      Runs the event loop until shutdown is called.
+
+    <Arguments>
+      polltimeout: the most seconds to wait in poll (shutdown wakes the loop
+                   up, so this rarely matters).
+
+    <Exceptions>
+      None
+
+    <Side Effects>
+      Closes every connection, the workers and the listening socket before
+      returning.
+
+    <Returns>
+      None
+    """
+    if self.idletimeout is not None:
+      # wake up often enough to close idle connections on time
+      polltimeout = min(polltimeout, self.idletimeout / 2.0)
+
+    lastidlecheck = time.time()
+
+    try:
+      while not self._stopped.is_set():
+        asyncore.poll2(polltimeout, self._map)
+
+        if self.idletimeout is not None and time.time() - lastidlecheck >= polltimeout:
+          lastidlecheck = time.time()
+          self._close_idle_connections()
+
+    finally:
+      if self._ownscheduler:
+        self._scheduler.shutdown()
+      for dispatcher in self._map.values():
+        dispatcher.close()
+      os.close(self._wakeupwritefd)
+
+
+
+  def shutdown(self):
+    """
+    <Purpose>
+      Stops serve_forever (it may be called from any thread).
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    self._stopped.set()
+    self._wake()
+
+
+
+  def get_connectioncount(self):
+    """
+    <Purpose>
+      Returns how many client connections are open.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      An integer.
+    """
+    return len(self._map) - 2
+
+
+
+  def set_maxrequestsize(self, maxrequestsize):
+    """
+    <Purpose>
+      Changes the largest request that is accepted (e.g. when a mirror starts
+      serving a release with more blocks).   Requests whose size was already
+      read are not affected.
+
+    <Arguments>
+      maxrequestsize: the largest request (in bytes).
+
+    <Exceptions>
+      TypeError if maxrequestsize is not a positive integer.
+
+    <Returns>
+      None
+    """
+    if type(maxrequestsize) != int and type(maxrequestsize) != long:
+      raise TypeError("maxrequestsize must be an integer")
+    if maxrequestsize <= 0:
+      raise TypeError("maxrequestsize must be positive")
+
+    # (the loop reads this attribute, so one assignment is enough)
+    self.maxrequestsize = maxrequestsize
@@ -0,0 +1,427 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  Saves a populated XORdatastore to a snapshot file so that a restarting
+  mirror can load it back instead of rereading and rehashing every file and
+  block (uppirlib.populate_xordatastore).
+
+  A snapshot is stamped (in a file next to it) with the manifest hash of its
+  release and the size and modification time of every file in the release.
+  It is only used as it is if all of those still match.   The release's
+  manifest is also kept next to it, so that when there is a new release (or
+  a file was changed in place), only the blocks that changed are reread and
+  rehashed (see uppirlib.update_xordatastore).   Pass reverify=True to
+  rebuild (and so recheck every hash) anyway.
+
+  The stamp does not protect against the snapshot itself being damaged on
+  disk.   Use reverify if that is a concern.
+
+"""
+
+import os
+
+import json
+
+# for populate_xordatastore
+import uppirlib
+
+
+# how much of the datastore is copied at a time when saving or loading
+_COPY_SIZE = 16 * 1024 * 1024
+
+
+
+def stamp_filename(filename):
+  """
+  <Purpose>
+    Returns the name of the stamp file of a snapshot (or datastore) file.
+
+  <Arguments>
+    filename: the snapshot file.
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A string.
+  """
+  return filename + '.stamp'
+
+
+
+def manifest_filename(filename):
+  """
+  <Purpose>
+    Returns the name of the file that keeps the manifest of the release in
+    a snapshot (or datastore) file.
+
+  <Arguments>
+    filename: the snapshot file.
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A string.
+  """
+  return filename + '.manifest'
+
+
+
+def create_stamp(manifestdict, rootdir="."):
+  """
+  <Purpose>
+    Describes a release as it is on disk now: the manifest hash and the size
+    and modification time of each of its files.
+
+  <Arguments>
+    manifestdict: a manifest dictionary.
+
+    rootdir: The location to look for the files mentioned in the manifest
+
+  <Exceptions>
+    OSError if a file is missing.
+
+  <Returns>
+    A dictionary that can be compared with another stamp.
+  """
+  filestamps = {}
+  for fileinfo in manifestdict['fileinfolist']:
+    filestat = os.stat(os.path.join(rootdir, fileinfo['filename']))
+    filestamps[fileinfo['filename']] = [filestat.st_size, filestat.st_mtime]
+
+  return {'manifesthash':manifestdict['manifesthash'], 'files':filestamps}
+
+
+
+def stamp_matches(filename, manifestdict, rootdir="."):
+  """
+  <Purpose>
+    Checks if the stamp next to filename describes this release as it is on
+    disk now.
+
+  <Arguments>
+    filename: the snapshot (or datastore) file.
+
+    manifestdict: a manifest dictionary.
+
+    rootdir: The location to look for the files mentioned in the manifest
+
+  <Exceptions>
+    None
+
+  <Returns>
+    True or False.   A missing or unreadable stamp is False.
+  """
+  try:
+    savedstamp = json.loads(open(stamp_filename(filename)).read())
+    currentstamp = create_stamp(manifestdict, rootdir)
+  except (IOError, OSError, ValueError):
+    return False
+
+  # (json makes the lists and strings unicode, which still compare equal)
+  return savedstamp == currentstamp
+
+
+
+def write_stamp(filename, stamp, manifestdict=None):
+  """
+  <Purpose>
+    Stamps filename as holding a release.
+
+  <Arguments>
+    filename: the snapshot (or datastore) file.
+
+    stamp: the release's stamp (from create_stamp, taken before the release
+           was read so that a file changed in the meantime is noticed).
+
+    manifestdict: the release's manifest, to keep so that the file can be
+                  updated to a later release (default None, don't keep it).
+
+  <Exceptions>
+    IOError / OSError if the stamp cannot be written.
+
+  <Side Effects>
+    Writes filename.stamp (and filename.manifest).
+
+  <Returns>
+    None
+  """
+  # the manifest goes first, so a stamp is never next to the wrong one
+  if manifestdict is not None:
+    _write_file(manifest_filename(filename), json.dumps(manifestdict))
+
+  _write_file(stamp_filename(filename), json.dumps(stamp))
+
+
+
+def _write_file(filename, data):
+  # Private helper.   Write then rename, so a crash never leaves half a file.
+  tempfilename = filename + '.tmp'
+  open(tempfilename, 'w').write(data)
+  os.rename(tempfilename, filename)
+
+
+
+def remove_stamp(filename):
+  """
+  <Purpose>
+    Removes the stamp (and kept manifest) of filename (if any), because the
+    file is about to change.
+
+  <Arguments>
+    filename: the snapshot (or datastore) file.
+
+  <Exceptions>
+    OSError if the stamp exists but cannot be removed.
+
+  <Returns>
+    None
+  """
+  for stampfilename in [stamp_filename(filename), manifest_filename(filename)]:
+    if os.path.exists(stampfilename):
+      os.remove(stampfilename)
+
+
+
+def get_stamped_manifest(filename):
+  """
+  <Purpose>
+    Returns the manifest of the release that a stamped file holds (whether
+    or not the release's files have changed since).
+
+  <Arguments>
+    filename: the snapshot (or datastore) file.
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A manifest dictionary, or None if the file is not stamped or its
+    manifest was not kept.
+  """
+  try:
+    savedstamp = json.loads(open(stamp_filename(filename)).read())
+    manifestdict = uppirlib.parse_manifest(open(manifest_filename(filename)).read())
+  except (IOError, OSError, ValueError, TypeError):
+    return None
+
+  if savedstamp['manifesthash'] != manifestdict['manifesthash']:
+    return None
+
+  return manifestdict
+
+
+
+def save_snapshot(xordatastore, filename, stamp, manifestdict=None):
+  """
+  <Purpose>
+    Writes the contents of a populated datastore to a snapshot file and
+    stamps it.
+
+  <Arguments>
+    xordatastore: the datastore.
+
+    filename: the snapshot file.
+
+    stamp: the stamp (from create_stamp) of the release the datastore was
+           populated from.
+
+    manifestdict: the release's manifest, to keep with the snapshot
+                  (default None).
+
+  <Exceptions>
+    IOError / OSError if the snapshot cannot be written.
+
+  <Side Effects>
+    Writes filename and filename.stamp (and filename.manifest).
+
+  <Returns>
+    None
+  """
+  remove_stamp(filename)
+
+  datastoresize = xordatastore.numberofblocks * xordatastore.sizeofblocks
+
+  # write it under a temporary name so a crash never leaves a partial file
+  # in place...
+  tempfilename = filename + '.tmp'
+  snapshotfo = open(tempfilename, 'wb')
+  try:
+    for offset in range(0, datastoresize, _COPY_SIZE):
+      snapshotfo.write(xordatastore.get_data(offset, min(_COPY_SIZE, datastoresize - offset)))
+    snapshotfo.flush()
+    os.fsync(snapshotfo.fileno())
+  finally:
+    snapshotfo.close()
+
+  # ... then move it into place and stamp it
+  os.rename(tempfilename, filename)
+  write_stamp(filename, stamp, manifestdict)
+
+
+
+def load_snapshot(manifestdict, xordatastore, filename, rootdir="."):
+  """
+  <Purpose>
+    Fills an empty datastore from a snapshot file, if its stamp matches the
+    release as it is on disk now.
+
+  <Arguments>
+    manifestdict: a manifest dictionary.
+
+    xordatastore: the (empty) datastore, with the release's block size and
+                  count.
+
+    filename: the snapshot file.
+
+    rootdir: The location to look for the files mentioned in the manifest
+
+  <Exceptions>
+    IOError if the snapshot cannot be read.
+
+  <Side Effects>
+    Writes to the datastore, unless False is returned.
+
+  <Returns>
+    True if the datastore was loaded, False if there is no usable snapshot.
+  """
+  if not stamp_matches(filename, manifestdict, rootdir):
+    return False
+
+  datastoresize = manifestdict['blockcount'] * manifestdict['blocksize']
+
+  if not os.path.exists(filename) or os.path.getsize(filename) != datastoresize:
+    return False
+
+  snapshotfo = open(filename, 'rb')
+  try:
+    for offset in range(0, datastoresize, _COPY_SIZE):
+      xordatastore.set_data(offset, snapshotfo.read(min(_COPY_SIZE, datastoresize - offset)))
+  finally:
+    snapshotfo.close()
+
+  return True
+
+
+
+def get_updatable_manifest(manifestdict, filename):
+  """
+  <Purpose>
+    Returns the manifest of the earlier release a stamped file holds, if the
+    file can be updated from it to this release (see
+    uppirlib.update_xordatastore).
+
+  <Arguments>
+    manifestdict: the manifest of the new release.
+
+    filename: the snapshot (or datastore) file.
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A manifest dictionary, or None if the file must be built instead.
+  """
+  oldmanifestdict = get_stamped_manifest(filename)
+  if oldmanifestdict is None:
+    return None
+
+  # the same release with a file changed in place is rebuilt, so that every
+  # file is checked again
+  if oldmanifestdict['manifesthash'] == manifestdict['manifesthash']:
+    return None
+
+  try:
+    uppirlib.find_changed_blocks(oldmanifestdict, manifestdict)
+  except ValueError:
+    return None
+
+  # (a file that was cut short, etc. is rebuilt)
+  oldfilesize = oldmanifestdict['blockcount'] * oldmanifestdict['blocksize']
+  if not os.path.exists(filename) or os.path.getsize(filename) != oldfilesize:
+    return None
+
+  return oldmanifestdict
+
+
+
+def _load_older_snapshot(manifestdict, xordatastore, filename):
+  # Private helper.   If the snapshot holds a release that this one can be
+  # updated from, copies the blocks the two releases have in common into the
+  # datastore and returns the old manifest.   Otherwise returns None.
+  oldmanifestdict = get_updatable_manifest(manifestdict, filename)
+  if oldmanifestdict is None:
+    return None
+
+  commonsize = min(oldmanifestdict['blockcount'], manifestdict['blockcount']) * manifestdict['blocksize']
+
+  snapshotfo = open(filename, 'rb')
+  try:
+    for offset in range(0, commonsize, _COPY_SIZE):
+      xordatastore.set_data(offset, snapshotfo.read(min(_COPY_SIZE, commonsize - offset)))
+  finally:
+    snapshotfo.close()
+
+  return oldmanifestdict
+
+
+
+def populate_xordatastore(manifestdict, xordatastore, filename, rootdir=".", reverify=False, progressfunction=None):
+  """
+  <Purpose>
+    Like uppirlib.populate_xordatastore, but loads the datastore from a
+    snapshot file when one matches and saves one when it had to be built.
+    A snapshot of an earlier release is loaded and then updated (only the
+    blocks that changed are read from the files and checked).
+
+  <Arguments>
+    manifestdict: a manifest dictionary.
+
+    xordatastore: the (empty) XOR datastore that we should populate.
+
+    filename: the snapshot file.
+
+    rootdir: The location to look for the files mentioned in the manifest
+
+    reverify: ignore any snapshot, so every file and block hash is checked
+              (default False).
+
+    progressfunction: see uppirlib.populate_xordatastore (default None).
+
+  <Exceptions>
+    The exceptions of uppirlib.populate_xordatastore (or
+    uppirlib.update_xordatastore) if the datastore is built (or updated).
+
+    IOError / OSError if the snapshot cannot be read or written.
+
+  <Side Effects>
+    May write filename, filename.stamp and filename.manifest.
+
+  <Returns>
+    'loaded' if the datastore was loaded from the snapshot, 'updated' if it
+    was updated from a snapshot of an earlier release or 'built' if it was
+    built.   The snapshot is saved unless it was 'loaded'.
+  """
+  if not reverify and load_snapshot(manifestdict, xordatastore, filename, rootdir):
+    return 'loaded'
+
+  # (stamped as the files were before they were read)
+  stamp = create_stamp(manifestdict, rootdir)
+
+  oldmanifestdict = None
+  if not reverify:
+    oldmanifestdict = _load_older_snapshot(manifestdict, xordatastore, filename)
+
+  if oldmanifestdict is not None:
+    uppirlib.update_xordatastore(oldmanifestdict, manifestdict, xordatastore, rootdir=rootdir, progressfunction=progressfunction)
+    populatestate = 'updated'
+  else:
+    uppirlib.populate_xordatastore(manifestdict, xordatastore, rootdir=rootdir, progressfunction=progressfunction)
+    populatestate = 'built'
+
+  save_snapshot(xordatastore, filename, stamp, manifestdict)
+
+  return populatestate
@@ -0,0 +1,73 @@
+# this is a few tests of the versioned holder.   If everything passes, there
+# is no output.
+
+import threading
+
+import versionedholder
+
+
+releasedvalues = []
+
+holder = versionedholder.VersionedHolder('first', releasedvalues.append)
+assert(holder.get_version() == 1)
+assert(holder.get_current() == 'first')
+
+version, value = holder.acquire()
+assert((version, value) == (1, 'first'))
+
+# a reader keeps the old version after a swap...
+assert(holder.swap('second') == 2)
+assert(holder.get_current() == 'second')
+assert(holder.get_held_versions() == 2)
+assert(releasedvalues == [])
+
+# ... while new readers get the new one ...
+newversion, newvalue = holder.acquire()
+assert((newversion, newvalue) == (2, 'second'))
+
+# ... and the old one is released when its last reader is done
+holder.release(version)
+assert(releasedvalues == ['first'])
+assert(holder.get_held_versions() == 1)
+
+# the current version is never released, even with no readers
+holder.release(newversion)
+assert(releasedvalues == ['first'])
+
+# a version nobody reads is released by the swap itself
+holder.swap('third')
+assert(releasedvalues == ['first', 'second'])
+
+try:
+  holder.release(2)
+except ValueError:
+  pass
+else:
+  print "Was allowed to release a version that was not acquired"
+
+
+# readers racing with swaps never see a released value
+releasedvalues = []
+holder = versionedholder.VersionedHolder(0, releasedvalues.append)
+errors = []
+
+def reader():
+  for iteration in range(2000):
+    version, value = holder.acquire()
+    try:
+      if value in releasedvalues:
+        errors.append(value)
+    finally:
+      holder.release(version)
+
+threadlist = [threading.Thread(target=reader) for number in range(4)]
+for thread in threadlist:
+  thread.start()
+for number in range(1, 200):
+  holder.swap(number)
+for thread in threadlist:
+  thread.join()
+
+assert(errors == [])
+assert(sorted(releasedvalues) == range(199))
+assert(holder.get_held_versions() == 1)
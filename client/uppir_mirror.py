@@ -30,15 +30,17 @@
 # This file is laid out in four main parts.   First, there are some helper
 # functions to advertise the mirror with the vendor.   The second section
 # includes the functionality to serve content via upPIR.   The third section
-# serves data via HTTP.   The final part contains the option
+# serves data via HTTP (and the metrics page).   The final part contains the option
 # parsing and main.   To get an overall feel for the code, it is recommended
 # to follow the execution from main on.
 #
 # EXTENSION POINTS:
 #
-# One can define new xordatastore types (although I need a more explicit plugin
-# module).   These could include memoization and other optimizations to 
-# further improve the speed of XOR processing.
+# One can define new xordatastore types (add them to xordatastorebackends).
+# These could include memoization and other optimizations to further improve
+# the speed of XOR processing.   memoizedxordatastore and
+# plannedxordatastore are examples that wrap any xordatastore (see 
+# --precomputegroupsize and --planqueries).
 #
 
 
@@ -48,8 +50,15 @@ import sys
 
 import optparse
 
-# Holds the mirror data and produces the XORed blocks
-import simplexordatastore as fastsimplexordatastore 
+# Finds / creates the datastore that holds the mirror data and produces the
+# XORed blocks
+import xordatastorebackends
+
+# Optionally precomputes subset XORs to speed up XOR processing
+import memoizedxordatastore
+
+# Optionally picks the cheapest way to answer each query
+import plannedxordatastore
 
 # helper functions that are shared
 import uppirlib
@@ -70,6 +79,24 @@ import getmyip
 # to handle upPIR protocol requests
 import SocketServer
 
+# for socket.timeout
+import socket
+
+# or to handle them with an event loop (--server async)
+import asyncsessionserver
+
+# shares the XOR workers fairly between clients
+import fairscheduler
+
+# latency histograms and counters for the metrics page
+import metricsregistry
+
+# to skip rehashing the release on restart (--snapshotfile)
+import datastoresnapshot
+
+# swaps in a new release while requests to the old one finish
+import versionedholder
+
 # to run in the background...
 import daemon
 
@@ -78,24 +105,151 @@ import daemon
 import time
 import traceback
 
-_logfo=None
+# writes the log from a background thread
+import batchedlog
+
+_logger=None
 
 def _log(stringtolog):
-  # helper function to log data
-  _logfo.write(str(time.time()) +" "+stringtolog+"\n")
-  _logfo.flush()
+  # helper function to log data.   Once the logger is started, this only
+  # queues the line (see batchedlog).
+  _logger.log(stringtolog)
+
+
+def _log_request(stringtolog):
+  # helper function to log a line about one request.   Only one in
+  # --logsample of these are kept.
+  _logger.log_request(stringtolog)
 
 
 
 # JAC: I don't normally like to use Python's socket servers because of the lack
 #      of control but I'll give it a try this time.   Passing arguments to
 #      requesthandlers is a PITA.   I'll use a messy global instead
-_global_myxordatastore = None
-_global_manifestdict = None
+#
+# the _MirrorReleases being served, each in a versionedholder.VersionedHolder
+# (so it can be swapped for a new release, see --manifestcheckinterval).
+# The first is the release from --manifestfile / --retrievemanifestfrom,
+# which requests that don't name a release are for.   Any others are from
+# --addrelease.
+_global_releaseholders = None
+_global_scheduler = None
+# the async server (if that is what we use), whose request size limit
+# depends on the release
+_global_asyncxorserver = None
+
+
+
+def _create_metrics():
+  # Private helper that describes the mirror's metrics.   Values that are
+  # kept elsewhere (the scheduler, etc.) are read when the page is rendered.
+  metrics = metricsregistry.MetricsRegistry()
+
+  metrics.describe('uppir_requests_total', 'counter', 'upPIR requests answered, by type')
+  metrics.describe('uppir_xor_blocks_total', 'counter', 'XOR blocks computed')
+  metrics.describe('uppir_request_parse_seconds', 'histogram', 'Time to parse and check a request')
+  metrics.describe('uppir_xor_seconds', 'histogram', 'Time to compute the XOR blocks of a request')
+  metrics.describe('uppir_send_seconds', 'histogram', 'Time from a reply being ready until it was sent')
+  metrics.describe('uppir_bytes_received_total', 'counter', 'Bytes received from clients')
+  metrics.describe('uppir_bytes_sent_total', 'counter', 'Bytes sent to clients')
+  metrics.describe('uppir_active_connections', 'gauge', 'Open client connections')
+  metrics.describe('uppir_http_bytes_sent_total', 'counter', 'File bytes sent to legacy HTTP clients')
+
+  metrics.describe('uppir_datastore_bytes', 'gauge', 'Size of the datastores of the releases being served')
+  metrics.set_value_function('uppir_datastore_bytes', lambda: _sum_over_releases(lambda holder: holder.get_current().get_datastore_bytes()))
+  metrics.describe('uppir_releases_served', 'gauge', 'Releases being served')
+  metrics.set_value_function('uppir_releases_served', lambda: len(_global_releaseholders or []))
+  metrics.describe('uppir_release_version', 'gauge', 'Releases built so far (one per release served until a new manifest is swapped in)')
+  metrics.set_value_function('uppir_release_version', lambda: _sum_over_releases(lambda holder: holder.get_version()))
+  metrics.describe('uppir_releases_held', 'gauge', 'Releases in memory (those being served and old ones still finishing requests)')
+  metrics.set_value_function('uppir_releases_held', lambda: _sum_over_releases(lambda holder: holder.get_held_versions()))
+  metrics.describe('uppir_process_resident_bytes', 'gauge', 'Resident memory of the mirror process')
+  metrics.set_value_function('uppir_process_resident_bytes', metricsregistry.get_resident_bytes)
+
+  for key, metrictype, helpstring in [('queued', 'gauge', 'Queries waiting for a worker'),
+      ('running', 'gauge', 'Queries being answered by a worker'),
+      ('deferred', 'gauge', 'Queries a worker handed to the coalescer that are not answered yet'),
+      ('clients', 'gauge', 'Clients with queries waiting or running'),
+      ('rejectedqueuefull', 'counter', 'Queries rejected because the queue was full'),
+      ('rejectedclientquota', 'counter', 'Queries rejected because the client was over its quota')]:
+    name = 'uppir_scheduler_'+key
+    if metrictype == 'counter':
+      name = name + '_total'
+    metrics.describe(name, metrictype, helpstring)
+    metrics.set_value_function(name, lambda key=key: _global_scheduler and _global_scheduler.get_metrics()[key])
+
+  for key, helpstring in [('batches', 'Passes over the datastore for coalesced queries'), ('queries', 'Queries answered in coalesced passes')]:
+    name = 'uppir_coalesced_'+key+'_total'
+    metrics.describe(name, 'counter', helpstring)
+    metrics.set_value_function(name, lambda key=key: _sum_over_releases(lambda holder: _get_coalescer_metric(holder, key)))
+
+  return metrics
+
+
+
+def _sum_over_releases(function):
+  # Private helper that adds up function(releaseholder) over the releases we
+  # serve.   Values of None are skipped and if all are (or there are no
+  # releases yet) this is None too.
+  if not _global_releaseholders:
+    return None
+
+  valuelist = []
+  for releaseholder in _global_releaseholders:
+    value = function(releaseholder)
+    if value is not None:
+      valuelist.append(value)
+
+  if not valuelist:
+    return None
+
+  return sum(valuelist)
+
+
+
+def _get_coalescer_metric(releaseholder, key):
+  # Private helper that reads a metric of a current release's coalescer
+  # (None if there isn't one).   Each release has its own, so these counts
+  # start again when a new release is swapped in.
+  coalescer = releaseholder.get_current().coalescer
+  if coalescer is None:
+    return None
+
+  return coalescer.get_metrics()[key]
+
+_global_metrics = _create_metrics()
 
 
 #################### Advertising ourself with the vendor ######################
 
+# the (count, sum) of uppir_xor_seconds when we last advertised, so the XOR
+# latency we report is for the queries since then
+_global_lastxorseconds = (0, 0.0)
+
+def _get_mirror_load():
+  # Private helper that returns our load figures for the mirrorinfo:
+  # 'queued' (queries waiting for a worker), 'running' (queries being
+  # answered, by a worker or the coalescer), 'xorlatency' (the mean seconds to XOR a query since we last
+  # advertised, 0.0 if there were none) and 'capacity' (the most queries we
+  # take at once before telling clients we are busy).   Clients can prefer
+  # mirrors with more spare capacity (see simplexorrequestor).
+  global _global_lastxorseconds
+
+  schedulermetrics = _global_scheduler.get_metrics()
+
+  xorcount, xorsum = _global_metrics.get_value('uppir_xor_seconds')
+  lastxorcount, lastxorsum = _global_lastxorseconds
+  _global_lastxorseconds = (xorcount, xorsum)
+
+  if xorcount > lastxorcount:
+    xorlatency = (xorsum - lastxorsum) / (xorcount - lastxorcount)
+  else:
+    xorlatency = 0.0
+
+  return {'queued':schedulermetrics['queued'], 'running':schedulermetrics['running'] + schedulermetrics['deferred'], 'xorlatency':xorlatency, 'capacity':_commandlineoptions.xorworkers + _commandlineoptions.maxqueued}
+
+
+
 def _send_mirrorinfo():
   # private function that sends our mirrorinfo to the vendor
 
@@ -104,9 +258,32 @@ def _send_mirrorinfo():
   # client.   The vendor should not need to be changed
   # at a minimum, the 'ip' and 'port' are required to provide the client with
   # information about how to contact the mirror.
-  mymirrorinfo = {'ip':_commandlineoptions.ip, 'port':_commandlineoptions.port}
-
-  uppirlib.transmit_mirrorinfo(mymirrorinfo, _global_manifestdict['vendorhostname'], _global_manifestdict['vendorport'])
+  # 'releases' lists the manifest hashes of the releases we serve (that the
+  # vendor is for), so clients can check we have theirs and name it in
+  # their requests.
+  # 'load' is how busy we are (see _get_mirror_load).   It is the same for
+  # every vendor, since all of our releases share the XOR workers.
+  # 'xorblocks' is the most blocks we answer in one XORBLOCKS request.
+  # Mirrors that don't list it only know XORBLOCK, so clients must not send
+  # them batches.
+  mirrorload = _get_mirror_load()
+
+  vendorreleasedict = {}
+  for releaseholder in _global_releaseholders:
+    manifestdict = releaseholder.get_current().manifestdict
+    vendorlocation = (manifestdict['vendorhostname'], manifestdict['vendorport'])
+    if vendorlocation not in vendorreleasedict:
+      vendorreleasedict[vendorlocation] = []
+    vendorreleasedict[vendorlocation].append(manifestdict['manifesthash'])
+
+  for (vendorhostname, vendorport), manifesthashlist in vendorreleasedict.items():
+    mymirrorinfo = {'ip':_commandlineoptions.ip, 'port':_commandlineoptions.port, 'releases':manifesthashlist, 'load':mirrorload, 'xorblocks':MAX_XORBLOCKS_BATCH}
+
+    # one vendor being down should not stop us advertising to the others
+    try:
+      uppirlib.transmit_mirrorinfo(mymirrorinfo, vendorhostname, vendorport)
+    except Exception, e:
+      _log('could not advertise to the vendor at '+str(vendorhostname)+':'+str(vendorport)+': '+str(e))
   
 
 
@@ -114,6 +291,485 @@ def _send_mirrorinfo():
 ############################### Serve via upPIR ###############################
 
 
+# The most answer buffers that are kept for reuse.   More requests than this
+# at once just allocate (and drop) extras.
+_RESULT_BUFFER_POOL_SIZE = 64
+
+# The most bitstrings in one XORBLOCKS request.   This bounds the memory one
+# request can use.
+MAX_XORBLOCKS_BATCH = 256
+
+class _ResultBufferPool:
+  # A bounded free-list of bytearrays that XOR answers are written into (with
+  # produce_xor_into), so answering a request allocates nothing.   
+  # SocketServer.ThreadingMixIn starts a new thread for every connection, so
+  # a per-thread pool would never be reused.   This one is shared instead.
+
+  def __init__(self, buffersize, maxbuffers):
+    self.buffersize = buffersize
+    self.maxbuffers = maxbuffers
+    self._freebuffers = []
+    self._lock = threading.Lock()
+
+
+  def get(self):
+    # returns a buffer of buffersize bytes (the contents are junk)
+    self._lock.acquire()
+    try:
+      if self._freebuffers:
+        return self._freebuffers.pop()
+    finally:
+      self._lock.release()
+
+    return bytearray(self.buffersize)
+
+
+  def put(self, resultbuffer):
+    # gives a buffer from get back to the pool.   (A buffer from another
+    # release's pool that is a different size is dropped.)
+    if len(resultbuffer) != self.buffersize:
+      return
+
+    self._lock.acquire()
+    try:
+      if len(self._freebuffers) < self.maxbuffers:
+        self._freebuffers.append(resultbuffer)
+    finally:
+      self._lock.release()
+
+
+
+
+class _CoalescingDispatcher:
+  # Collects the bitstrings of concurrent requests for up to window seconds
+  # (or until maxbatch are waiting) and answers them with one
+  # produce_xor_from_bitstrings call, so a busy mirror makes one pass over
+  # the datastore for many queries.   The XORs are done in the dispatcher's
+  # own thread, which calls each request back with its answer, so a request
+  # is delayed by at most the window (plus the time to XOR its batch).
+  #
+  # Nothing waits on the dispatcher: the scheduler worker that submits a
+  # request is free at once (the request is a deferred task, see
+  # fairscheduler).   If the workers waited, a batch could never hold more
+  # queries than there are workers.
+
+  def __init__(self, xordatastore, window, maxbatch):
+    self._xordatastore = xordatastore
+    self.window = window
+    self.maxbatch = maxbatch
+
+    # the waiting _CoalescedQuery objects, as (query, position) for each of
+    # their bitstrings (oldest first)
+    self._condition = threading.Condition()
+    self._waitingbitstrings = []
+    self._stopped = False
+
+    self._metricslock = threading.Lock()
+    self._batches = 0
+    self._queries = 0
+    self._largestbatch = 0
+    self._totalwait = 0.0
+    self._longestwait = 0.0
+
+    dispatcherthread = threading.Thread(target=self._dispatch_forever, name="XOR coalescer")
+    dispatcherthread.daemon = True
+    dispatcherthread.start()
+
+
+  def submit(self, bitstringlist, callback):
+    # queues the bitstrings and returns.   callback(xorblocklist, error) is
+    # called in the dispatcher's thread once they are all answered.
+    query = _CoalescedQuery(bitstringlist, callback)
+
+    self._condition.acquire()
+    try:
+      for position in range(len(bitstringlist)):
+        self._waitingbitstrings.append((query, position))
+      self._condition.notify()
+    finally:
+      self._condition.release()
+
+
+  def get_metrics(self):
+    # returns a dictionary of batch and wait time statistics (times in
+    # seconds)
+    self._metricslock.acquire()
+    try:
+      metrics = {'batches':self._batches, 'queries':self._queries,
+          'largestbatch':self._largestbatch, 'longestwait':self._longestwait,
+          'meanbatch':0.0, 'meanwait':0.0}
+      if self._batches:
+        metrics['meanbatch'] = self._queries / float(self._batches)
+        metrics['meanwait'] = self._totalwait / self._queries
+      return metrics
+    finally:
+      self._metricslock.release()
+
+
+  def stop(self):
+    # the dispatcher thread exits once nothing is waiting.   (This is for a
+    # release that is no longer used, so nothing new will arrive.)
+    self._condition.acquire()
+    try:
+      self._stopped = True
+      self._condition.notify()
+    finally:
+      self._condition.release()
+
+
+  def _next_batch(self):
+    # waits for the first bitstring and then until the window closes (or the
+    # batch is full) and returns the batch (or None once stopped)
+    self._condition.acquire()
+    try:
+      while not self._waitingbitstrings:
+        if self._stopped:
+          return None
+        self._condition.wait()
+
+      windowend = self._waitingbitstrings[0][0].arrivaltime + self.window
+      while len(self._waitingbitstrings) < self.maxbatch:
+        remainingtime = windowend - time.time()
+        if remainingtime <= 0:
+          break
+        self._condition.wait(remainingtime)
+
+      batch = self._waitingbitstrings[:self.maxbatch]
+      del self._waitingbitstrings[:self.maxbatch]
+      return batch
+    finally:
+      self._condition.release()
+
+
+  def _dispatch_forever(self):
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+
+      starttime = time.time()
+      try:
+        xorblocklist = self._xordatastore.produce_xor_from_bitstrings([query.bitstringlist[position] for query, position in batch])
+        error = None
+      except Exception, e:
+        # every query in the batch sees the error
+        xorblocklist = None
+        error = e
+
+      self._metricslock.acquire()
+      try:
+        self._batches = self._batches + 1
+        self._queries = self._queries + len(batch)
+        self._largestbatch = max(self._largestbatch, len(batch))
+        for query, position in batch:
+          self._totalwait = self._totalwait + starttime - query.arrivaltime
+          self._longestwait = max(self._longestwait, starttime - query.arrivaltime)
+      finally:
+        self._metricslock.release()
+
+      for batchposition in range(len(batch)):
+        query, position = batch[batchposition]
+        # (a callback that fails must not stop the dispatcher)
+        try:
+          if error is None:
+            query.set_xorblock(position, xorblocklist[batchposition])
+          else:
+            query.set_error(error)
+        except Exception, e:
+          _log('error answering a coalesced query: '+str(e)+"\n"+str(traceback.format_tb(sys.exc_info()[2])))
+
+
+
+class _CoalescedQuery:
+  # The bitstrings of one request waiting in a _CoalescingDispatcher and
+  # (later) their answers.   (A request's bitstrings may be split over two
+  # batches.)   Only the dispatcher's thread changes this once it is queued.
+
+  def __init__(self, bitstringlist, callback):
+    self.bitstringlist = bitstringlist
+    self.arrivaltime = time.time()
+    self._callback = callback
+    self._xorblocklist = [None] * len(bitstringlist)
+    self._remaining = len(bitstringlist)
+    self._error = None
+
+
+  def set_xorblock(self, position, xorblock):
+    self._xorblocklist[position] = xorblock
+    self._answered()
+
+
+  def set_error(self, error):
+    self._error = error
+    self._answered()
+
+
+  def _answered(self):
+    # calls back once every bitstring has an answer (or an error)
+    self._remaining = self._remaining - 1
+    if self._remaining > 0:
+      return
+
+    if self._error is not None:
+      self._callback(None, self._error)
+    else:
+      self._callback(self._xorblocklist, None)
+
+
+
+
+class _MirrorRelease:
+  # Everything the mirror needs to serve one release: its manifest, the
+  # datastore and what is built from them.   Requests get the current one
+  # from its holder in _global_releaseholders and give it back when they are
+  # done, so a new release can be swapped in while requests to the old one
+  # finish.
+
+  def __init__(self, releasesource, manifestdict, xordatastore):
+    # where new versions of this release come from (a _ReleaseSource)
+    self.releasesource = releasesource
+    self.manifestdict = manifestdict
+    self.xordatastore = xordatastore
+
+    self.resultbufferpool = _ResultBufferPool(xordatastore.sizeofblocks, _RESULT_BUFFER_POOL_SIZE)
+
+    # answer concurrent queries together if asked to...
+    self.coalescer = None
+    if _commandlineoptions.coalescewindow:
+      self.coalescer = _CoalescingDispatcher(xordatastore, _commandlineoptions.coalescewindow / 1000.0, _commandlineoptions.coalescebatch)
+
+    # find files by name without searching the list (for HTTP)...
+    self.fileindex = {}
+    for fileinfo in manifestdict['fileinfolist']:
+      self.fileindex[fileinfo['filename']] = fileinfo
+
+    # ... and send them without copying them if the datastore can
+    try:
+      xordatastore.get_data(0, xordatastore.sizeofblocks, copy=False)
+      self.datastoreviews = True
+    except TypeError:
+      self.datastoreviews = False
+
+
+  def get_datastore_bytes(self):
+    return self.xordatastore.numberofblocks * self.xordatastore.sizeofblocks
+
+
+  def close(self):
+    # Called once no request uses this release.   The datastore's memory is
+    # freed when the last reference to this goes away.
+    if self.coalescer is not None:
+      self.coalescer.stop()
+
+
+
+
+def _close_release(release):
+  # Private helper.   A release holder calls this once the last request to
+  # an old release is done.
+  release.close()
+  _log('released the datastore of the old release '+release.manifestdict['manifesthash'])
+
+
+
+
+def _process_uppir_request(requeststring, remoteip, remoteport, finish):
+  # Private helper that answers one upPIR request for either server (so it
+  # must be thread safe).   It is a deferred scheduler task (see
+  # fairscheduler): it calls finish(reply, error) once, possibly later from
+  # another thread (a coalesced query is answered by the coalescer).   It
+  # only raises if it has not called finish.   A bytearray reply is from a
+  # release's result buffer pool and must be given to _release_reply once
+  # it has been sent.
+
+  # which release is it for?   Requests that don't say are for the first.
+  manifesthash = None
+  if requeststring.startswith('RELEASE '):
+    manifesthash, space, requeststring = requeststring[len('RELEASE '):].partition(' ')
+    releaseholder = _find_releaseholder(manifesthash)
+    if releaseholder is None:
+      _log("UPPIR "+remoteip+" "+str(remoteport)+" Unknown release '"+manifesthash[:64]+"'")
+      _global_metrics.increment('uppir_requests_total', labels={'type':'unknownrelease'})
+      finish(uppirlib.UNKNOWN_RELEASE_REPLY, None)
+      return
+
+  else:
+    releaseholder = _global_releaseholders[0]
+
+  # the request is answered from the release that is current now, even if a
+  # new one is swapped in meanwhile.   It is given back once the reply is
+  # ready.
+  version, release = releaseholder.acquire()
+
+  def _answered(reply, error):
+    releaseholder.release(version)
+    finish(reply, error)
+
+  try:
+    if manifesthash is not None and release.manifestdict['manifesthash'] != manifesthash:
+      # it was just replaced
+      _global_metrics.increment('uppir_requests_total', labels={'type':'unknownrelease'})
+      _answered(uppirlib.UNKNOWN_RELEASE_REPLY, None)
+      return
+
+    _answer_uppir_request(release, requeststring, remoteip, remoteport, _answered)
+  except:
+    # (_answer_uppir_request only raises before it has answered)
+    releaseholder.release(version)
+    raise
+
+
+
+
+def _find_releaseholder(manifesthash):
+  # Private helper.   Returns the holder of the release with this manifest
+  # hash, or None if we don't serve it.
+  for releaseholder in _global_releaseholders:
+    if releaseholder.get_current().manifestdict['manifesthash'] == manifesthash:
+      return releaseholder
+
+  return None
+
+
+
+
+def _answer_uppir_request(release, requeststring, remoteip, remoteport, answered):
+  # Private helper for _process_uppir_request.   Calls answered(reply, error)
+  # once, later if the XORs are coalesced.   It only raises if it has not
+  # called answered.
+
+  parsestarttime = time.time()
+
+  expectedbitstringlength = uppirlib.compute_bitstring_length(release.xordatastore.numberofblocks)
+
+  # if it's a request for several XORBLOCKS.   (A XORBLOCK request whose
+  # bitstring starts with 'S' looks like this, but is one byte shorter than
+  # any XORBLOCKS request could be.)
+  if requeststring.startswith('XORBLOCKS') and len(requeststring) != len('XORBLOCK') + expectedbitstringlength:
+
+    bitstrings = requeststring[len('XORBLOCKS'):]
+
+    if len(bitstrings) == 0 or len(bitstrings) % expectedbitstringlength != 0 or len(bitstrings) / expectedbitstringlength > MAX_XORBLOCKS_BATCH:
+      # Invalid request length...
+      _log("UPPIR "+remoteip+" "+str(remoteport)+" Invalid XORBLOCKS request with length: "+str(len(bitstrings)))
+      _global_metrics.increment('uppir_requests_total', labels={'type':'invalid'})
+
+      answered('Invalid request length', None)
+
+      return
+
+    bitstringlist = []
+    for position in range(0, len(bitstrings), expectedbitstringlength):
+      bitstringlist.append(bitstrings[position:position+expectedbitstringlength])
+
+    xorstarttime = time.time()
+    _global_metrics.observe('uppir_request_parse_seconds', xorstarttime - parsestarttime)
+
+    def _xored(xorblocklist, error):
+      if error is not None:
+        answered(None, error)
+        return
+
+      _global_metrics.observe('uppir_xor_seconds', time.time() - xorstarttime)
+      _global_metrics.increment('uppir_requests_total', labels={'type':'xorblocks'})
+      _global_metrics.increment('uppir_xor_blocks_total', len(bitstringlist))
+
+      _log_request("UPPIR "+remoteip+" "+str(remoteport)+" GOOD "+str(len(bitstringlist))+" blocks")
+
+      answered(''.join(xorblocklist), None)
+
+    if release.coalescer is not None:
+      # together with other clients' queries...
+      release.coalescer.submit(bitstringlist, _xored)
+    else:
+      # ... or on their own (in one pass if the datastore can)
+      _xored(release.xordatastore.produce_xor_from_bitstrings(bitstringlist), None)
+
+    return
+
+  # if it's a request for a XORBLOCK
+  elif requeststring.startswith('XORBLOCK'):
+
+    bitstring = requeststring[len('XORBLOCK'):]
+
+    if len(bitstring) != expectedbitstringlength:
+      # Invalid request length...
+      _log("UPPIR "+remoteip+" "+str(remoteport)+" Invalid request with length: "+str(len(bitstring)))
+      _global_metrics.increment('uppir_requests_total', labels={'type':'invalid'})
+
+      answered('Invalid request length', None)
+
+      return
+
+    xorstarttime = time.time()
+    _global_metrics.observe('uppir_request_parse_seconds', xorstarttime - parsestarttime)
+
+    # the answer goes into a reused buffer
+    resultbuffer = release.resultbufferpool.get()
+
+    def _xored(xorblocklist, error):
+      if error is not None:
+        release.resultbufferpool.put(resultbuffer)
+        answered(None, error)
+        return
+
+      # (a coalesced answer is copied in)
+      if xorblocklist is not None:
+        memoryview(resultbuffer)[:len(xorblocklist[0])] = xorblocklist[0]
+
+      _global_metrics.observe('uppir_xor_seconds', time.time() - xorstarttime)
+      _global_metrics.increment('uppir_requests_total', labels={'type':'xorblock'})
+      _global_metrics.increment('uppir_xor_blocks_total')
+
+      _log_request("UPPIR "+remoteip+" "+str(remoteport)+" GOOD")
+
+      # done!
+      answered(resultbuffer, None)
+
+    if release.coalescer is not None:
+      release.coalescer.submit([bitstring], _xored)
+      return
+
+    try:
+      release.xordatastore.produce_xor_into(bitstring, resultbuffer)
+    except:
+      release.resultbufferpool.put(resultbuffer)
+      raise
+
+    _xored(None, None)
+    return
+
+  elif requeststring == 'HELLO':
+    # send a reply.
+    _log_request("UPPIR "+remoteip+" "+str(remoteport)+" HI!")
+    _global_metrics.increment('uppir_requests_total', labels={'type':'hello'})
+
+    # done!
+    answered("HI!", None)
+    return
+
+  else:
+    # we don't know what this is!   Log and tell the requestor
+    _log("UPPIR "+remoteip+" "+str(remoteport)+" Invalid request type starts:'"+requeststring[:5]+"'")
+    _global_metrics.increment('uppir_requests_total', labels={'type':'invalid'})
+
+    answered('Invalid request type', None)
+
+
+
+def _release_reply(reply):
+  # Private helper.   Gives the answer buffer of a sent reply back (to a
+  # current release with that block size, which may not be the one it came
+  # from).
+  if type(reply) == bytearray:
+    for releaseholder in _global_releaseholders:
+      resultbufferpool = releaseholder.get_current().resultbufferpool
+      if resultbufferpool.buffersize == len(reply):
+        resultbufferpool.put(reply)
+        return
+
+
+
 # I don't need to change this much, I think...
 class ThreadedXORServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer): 
   allow_reuse_address=True
@@ -123,62 +779,93 @@ class ThreadedXORRequestHandler(SocketServer.BaseRequestHandler):
 
   def handle(self):
 
-    # read the request from the socket...
-    requeststring = session.recvmessage(self.request)
-
     # for logging purposes, get the remote info
     remoteip, remoteport = self.request.getpeername()
 
-    # if it's a request for a XORBLOCK
-    if requeststring.startswith('XORBLOCK'):
+    # don't hold a thread forever for a client that went quiet
+    if _commandlineoptions.idletimeout:
+      self.request.settimeout(_commandlineoptions.idletimeout)
+
+    _global_metrics.increment('uppir_active_connections')
+    try:
+      self._handle_requests(remoteip, remoteport)
+    finally:
+      _global_metrics.increment('uppir_active_connections', -1)
 
-      bitstring = requeststring[len('XORBLOCK'):]
-  
-      expectedbitstringlength = uppirlib.compute_bitstring_length(_global_myxordatastore.numberofblocks)
 
-      if len(bitstring) != expectedbitstringlength:
-        # Invalid request length...
-        _log("UPPIR "+remoteip+" "+str(remoteport)+" Invalid request with length: "+str(len(bitstring)))
+  def _handle_requests(self, remoteip, remoteport):
 
-        session.sendmessage(self.request, 'Invalid request length')
+    # a client may send many requests on one connection
+    while True:
+      # read the request from the socket...
+      try:
+        requeststring = session.recvmessage(self.request)
+      except (session.SessionEOF, socket.timeout):
+        # the client is done (or idle)
         return
-  
-      # Now let's process this...
-      xoranswer = _global_myxordatastore.produce_xor_from_bitstring(bitstring)
+
+      _global_metrics.increment('uppir_bytes_received_total', len(str(len(requeststring))) + 1 + len(requeststring))
+
+      # a worker does the XORs (when it is this client's turn), or hands
+      # them to the coalescer and moves on...
+      try:
+        reply = _global_scheduler.run(remoteip, _process_uppir_request, (requeststring, remoteip, remoteport), deferred=True)
+      except fairscheduler.SchedulerBusy, e:
+        _log_request("UPPIR "+remoteip+" "+str(remoteport)+" BUSY "+str(e))
+        _global_metrics.increment('uppir_requests_total', labels={'type':'busy'})
+        reply = uppirlib.MIRROR_BUSY_REPLY
 
       # and send the reply.
-      session.sendmessage(self.request, xoranswer)
-      _log("UPPIR "+remoteip+" "+str(remoteport)+" GOOD")
+      sendstarttime = time.time()
+      try:
+        session.sendmessage(self.request, reply)
+      finally:
+        _release_reply(reply)
 
-      # done!
-      return
+      _global_metrics.observe('uppir_send_seconds', time.time() - sendstarttime)
+      _global_metrics.increment('uppir_bytes_sent_total', len(str(len(reply))) + 1 + len(reply))
 
-    elif requeststring == 'HELLO':
-      # send a reply.
-      session.sendmessage(self.request, "HI!")
-      _log("UPPIR "+remoteip+" "+str(remoteport)+" HI!")
 
-      # done!
-      return
 
-    else:
-      # we don't know what this is!   Log and tell the requestor
-      _log("UPPIR "+remoteip+" "+str(remoteport)+" Invalid request type starts:'"+requeststring[:5]+"'")
 
-      session.sendmessage(self.request, 'Invalid request type')
-      return
+def _async_request_handler(requeststring, remoteaddress, reply):
+  # Private helper (a deferred handler).   The async server passes the
+  # address as a tuple.
+  _process_uppir_request(requeststring, remoteaddress[0], remoteaddress[1], reply)
+
+
 
 
+def _get_maxrequestsize(xordatastore):
+  # Private helper.   The largest request is a full XORBLOCKS batch (the
+  # extra room is for a RELEASE prefix)...
+  return len('XORBLOCKS') + MAX_XORBLOCKS_BATCH * uppirlib.compute_bitstring_length(xordatastore.numberofblocks) + 1024
 
 
 
-def service_uppir_clients(myxordatastore, ip, port):
+
+def service_uppir_clients(ip, port):
+
+  global _global_asyncxorserver
 
   # this should be done before we are called
-  assert(_global_myxordatastore != None)
+  assert(_global_releaseholders != None)
+
+  if _commandlineoptions.server == 'async':
+    # the sockets are handled by an event loop and the XORs by a bounded
+    # pool of threads.
+    maxrequestsize = max([_get_maxrequestsize(releaseholder.get_current().xordatastore) for releaseholder in _global_releaseholders])
 
-  # create the handler / server
-  xorserver = ThreadedXORServer((ip, port), ThreadedXORRequestHandler)
+    filelimit = asyncsessionserver.raise_file_limit()
+    if filelimit is not None and filelimit < _commandlineoptions.maxconnections:
+      _log('only '+str(filelimit)+' files may be open, so fewer than '+str(_commandlineoptions.maxconnections)+' connections can be served')
+
+    xorserver = asyncsessionserver.SessionServer((ip, port), _async_request_handler, releasereply=_release_reply, maxconnections=_commandlineoptions.maxconnections, maxrequestsize=maxrequestsize, idletimeout=_commandlineoptions.idletimeout or None, scheduler=_global_scheduler, busyreply=uppirlib.MIRROR_BUSY_REPLY, metrics=_global_metrics, logfunction=_log, deferredhandler=True)
+    _global_asyncxorserver = xorserver
+
+  else:
+    # create the handler / server
+    xorserver = ThreadedXORServer((ip, port), ThreadedXORRequestHandler)
   
 
   # and serve forever!   This call will not return which is why we spawn a new
@@ -193,10 +880,70 @@ import BaseHTTPServer
 
 import urlparse
 
+# files are sent this much at a time, so a large file is never copied into
+# memory whole
+_HTTP_SEND_SIZE = 256 * 1024
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  # a thread per connection, so a slow client only holds up itself
+  allow_reuse_address = True
+  daemon_threads = True
+
+
+
+def _parse_range(rangeheader, filelength):
+  # Private helper.   Returns the (first, last) byte of a single range in a
+  # Range header, or None to send the whole file (no header, or one we don't
+  # handle like several ranges).   Raises ValueError if the range is past
+  # the end of the file.
+  if rangeheader is None or not rangeheader.startswith('bytes=') or ',' in rangeheader:
+    return None
+
+  firststring, dash, laststring = rangeheader[len('bytes='):].strip().partition('-')
+  if dash != '-' or not (firststring == '' or firststring.isdigit()) or not (laststring == '' or laststring.isdigit()):
+    return None
+
+  if firststring == '':
+    # the last N bytes
+    if laststring == '':
+      return None
+    if int(laststring) == 0 or filelength == 0:
+      raise ValueError("Empty suffix range")
+    return (max(filelength - int(laststring), 0), filelength - 1)
+
+  first = int(firststring)
+  if laststring == '':
+    last = filelength - 1
+  else:
+    last = int(laststring)
+    if last < first:
+      # not a valid range, so the header is ignored
+      return None
+    last = min(last, filelength - 1)
+
+  if first >= filelength:
+    raise ValueError("Range starts past the end of the file")
+
+  return (first, last)
+
+
+
 # handle a HTTP request
 class MyHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
+  # keep connections open for more requests
+  protocol_version = 'HTTP/1.1'
+
   def do_GET(self):
+    self._serve_file(sendbody=True)
+
+
+  def do_HEAD(self):
+    self._serve_file(sendbody=False)
+
+
+  def _serve_file(self, sendbody):
 
     # get the path part of the request.   Ignore the host name, etc.
     requestedfilename = urlparse.urlparse(self.path).path
@@ -205,38 +952,125 @@ class MyHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     if requestedfilename.startswith('/'):
       requestedfilename = requestedfilename[1:]
 
+    # files of the first release are at /filename, those of any release
+    # (including the first) at /manifesthash/filename
+    releaseholder = _global_releaseholders[0]
+    for thisreleaseholder in _global_releaseholders:
+      releaseprefix = thisreleaseholder.get_current().manifestdict['manifesthash']+'/'
+      if requestedfilename.startswith(releaseprefix):
+        releaseholder = thisreleaseholder
+        requestedfilename = requestedfilename[len(releaseprefix):]
+        break
+
+    # the file is sent from the release that is current now, even if a new
+    # one is swapped in before it is done
+    version, release = releaseholder.acquire()
+    try:
+      self._serve_file_from_release(release, requestedfilename, sendbody)
+    finally:
+      releaseholder.release(version)
+
+
+  def _serve_file_from_release(self, release, requestedfilename, sendbody):
+
     # let's look for the file...
-    for fileinfo in _global_manifestdict['fileinfolist']:
-      # great, let's serve it!
-      if requestedfilename == fileinfo['filename']:
-        # it's a good query!   Send 200!
-        self.send_response(200)
-        self.end_headers()
-
-        # and send the response!
-        filedata = _global_myxordatastore.get_data(fileinfo['offset'],fileinfo['length'])
-        self.wfile.write(filedata)
-        return
+    fileinfo = release.fileindex.get(requestedfilename)
+    if fileinfo is None:
+      # otherwise, it's unknown...
+      self._send_empty_response(404)
+      return
+
+    filelength = fileinfo['length']
+
+    try:
+      byterange = _parse_range(self.headers.getheader('Range'), filelength)
+    except ValueError:
+      self._send_empty_response(416, [('Content-Range', 'bytes */'+str(filelength))])
+      return
+
+    # it's a good query!   Send 200 (or 206 for part of it)!
+    if byterange is None:
+      first, last = 0, filelength - 1
+      self.send_response(200)
+    else:
+      first, last = byterange
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes '+str(first)+'-'+str(last)+'/'+str(filelength))
+
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Length', str(last - first + 1))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.send_header('ETag', '"'+fileinfo['hash']+'"')
+    self.end_headers()
+
+    if not sendbody:
+      return
+
+    # and send the response a piece at a time (straight from the datastore
+    # if it can give us a view)!
+    for position in range(first, last + 1, _HTTP_SEND_SIZE):
+      chunklength = min(_HTTP_SEND_SIZE, last + 1 - position)
+      if release.datastoreviews:
+        filechunk = release.xordatastore.get_data(fileinfo['offset'] + position, chunklength, copy=False)
+      else:
+        filechunk = release.xordatastore.get_data(fileinfo['offset'] + position, chunklength)
+      # (wfile would copy a view into a string)
+      self.connection.sendall(filechunk)
+
+    _global_metrics.increment('uppir_http_bytes_sent_total', last - first + 1)
+
+
+  def _send_empty_response(self, code, headers=[]):
+    # Private helper that sends a response with no body (unlike send_error,
+    # this keeps the connection open)
+    self.send_response(code)
+    for headername, headervalue in headers:
+      self.send_header(headername, headervalue)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
 
-    # otherwise, it's unknown...
-    self.send_error(404)
-    return
-    
   # log HTTP information
   def log_message(self,format, *args):
-    _log("HTTP "+self.client_address[0]+" "+str(self.client_address[1])+" "+(format % args))
+    _log_request("HTTP "+self.client_address[0]+" "+str(self.client_address[1])+" "+(format % args))
 
 
 
 
-def service_http_clients(myxordatastore, manifestdict, ip, port):
+# serve the metrics page
+class MetricsHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+
+    if urlparse.urlparse(self.path).path != '/metrics':
+      self.send_error(404)
+      return
+
+    metricsdata = _global_metrics.render()
+
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(metricsdata)))
+    self.end_headers()
+    self.wfile.write(metricsdata)
+
+  # log HTTP information
+  def log_message(self,format, *args):
+    _log_request("METRICS "+self.client_address[0]+" "+str(self.client_address[1])+" "+(format % args))
+
+
+
+
+def service_http_clients(ip, port):
   # time to serve HTTP clients...
   
-  # this must have already been set
-  assert(_global_myxordatastore != None)
-  assert(_global_manifestdict != None)
+  # this must have already been set (the releases have the file indexes)
+  assert(_global_releaseholders != None)
+
+  # a client that goes quiet on a kept open connection gives up its thread
+  MyHTTPRequestHandler.timeout = _commandlineoptions.idletimeout or None
 
-  httpserver = BaseHTTPServer.HTTPServer((ip, port), MyHTTPRequestHandler)
+  httpserver = ThreadedHTTPServer((ip, port), MyHTTPRequestHandler)
 
   # and serve forever!   Just like with upPIR, this doesn't return so we need a
   # new thread...
@@ -245,6 +1079,16 @@ def service_http_clients(myxordatastore, manifestdict, ip, port):
 
 
 
+def service_metrics_clients(ip, port):
+  # serve the metrics page (for a local monitoring agent)...
+  metricsserver = ThreadedHTTPServer((ip, port), MetricsHTTPRequestHandler)
+
+  # another thread that never returns...
+  threading.Thread(target=metricsserver.serve_forever, name="metrics server").start()
+
+
+
+
 
 ########################### Option parsing and main ###########################
 _commandlineoptions = None
@@ -269,7 +1113,7 @@ def parse_options():
     None
   """
   global _commandlineoptions
-  global _logfo
+  global _logger
 
   # should be true unless we're initing twice...
   assert(_commandlineoptions==None)
@@ -300,6 +1144,14 @@ def parse_options():
         type="string", default="manifest.dat",
         help="The manifest file to use (default manifest.dat).")
 
+  parser.add_option("","--addrelease", dest="addreleases", action="append",
+        type="string", nargs=2, metavar="MANIFESTFILE MIRRORROOT", default=[],
+        help="Also serve the release in MANIFESTFILE (whose files are under MIRRORROOT).   Clients name it by its manifest hash.   May be given several times.   Its --datastorefile and --snapshotfile have .1, .2, etc. added (default None, serve one release).")
+
+  parser.add_option("","--manifestcheckinterval", dest="manifestcheckinterval",
+        type="int", metavar="seconds", default=0,
+        help="Check the manifest (from the vendor with --retrievemanifestfrom, otherwise the manifest file) this often.   A new release is built in the background and then served instead of the old one, without a restart (default 0, never check).")
+
   parser.add_option("","--foreground", dest="daemonize", action="store_false",
         default=True,
         help="Do not detach from the terminal and run in the background")
@@ -308,9 +1160,110 @@ def parse_options():
         type="string", default="mirror.log",
         help="The file to write log data to (default mirror.log).")
 
+  parser.add_option("","--logmaxbytes", dest="logmaxbytes",
+        type="int", metavar="bytes", default=0,
+        help="Start a new log file once it is this big (default 0, never).")
+
+  parser.add_option("","--logrotateinterval", dest="logrotateinterval",
+        type="int", metavar="seconds", default=0,
+        help="Start a new log file this often (default 0, never).")
+
+  parser.add_option("","--logbackups", dest="logbackups",
+        type="int", metavar="N", default=5,
+        help="Keep this many old log files (default 5).")
+
+  parser.add_option("","--logsample", dest="logsample",
+        type="int", metavar="N", default=1,
+        help="Log only one in N lines about single requests (default 1, log every request).")
+
   parser.add_option("","--announcedelay", dest="mirrorlistadvertisedelay",
         type="int", default=60,
-        help="How many seconds should I wait between vendor notifications? (default 60).")
+        help="How many seconds should I wait between vendor notifications?   The load figures we send are for this interval (default 60).")
+
+  parser.add_option("","--datastore", dest="datastore",
+        type="string", metavar="backend", default="auto",
+        help="The datastore backend: python, c, numpy, mmap (needs --datastorefile) or auto.   auto times the available backends on a sample of the release and uses the fastest (default auto).")
+
+  parser.add_option("","--xorthreads", dest="xorthreads",
+        type="int", metavar="N", default=1,
+        help="Split each query over up to N threads (c backend only, default 1).")
+
+  parser.add_option("","--precomputegroupsize", dest="precomputegroupsize",
+        type="int", default=0,
+        help="Precompute the XOR of every subset of this many consecutive blocks (1, 2, 4 or 8).   Uses 2^k/k times the memory of the release.   Cannot be used with --shards.   (default 0, no precomputation)")
+
+  parser.add_option("","--datastorefile", dest="datastorefile",
+        type="string", metavar="file", default="",
+        help="Serve from this packed datastore file (mmap'd read-only).   It is built from the mirror root if it does not hold this release.   Requires NumPy (default None, copy the files into RAM).")
+
+  parser.add_option("","--madvise", dest="madvise",
+        type="string", metavar="hint", default="",
+        help="madvise hint for the datastore file: normal, random, sequential or willneed (default None).")
+
+  parser.add_option("","--mlock", dest="mlock", action="store_true",
+        default=False,
+        help="Lock the datastore file into RAM (default False).")
+
+  parser.add_option("","--prefault", dest="prefault", action="store_true",
+        default=False,
+        help="Read the whole datastore file in before serving clients (default False).")
+
+  parser.add_option("","--snapshotfile", dest="snapshotfile",
+        type="string", metavar="file", default="",
+        help="Save the populated datastore to this file and load it from there on restart if the release and its files (by size and modification time) have not changed.   For a new release, only the blocks that changed are read (default None, always read and hash the files).")
+
+  parser.add_option("","--reverify", dest="reverify", action="store_true",
+        default=False,
+        help="Ignore a saved --snapshotfile or --datastorefile and reread and rehash every file (default False).")
+
+  parser.add_option("","--shards", dest="shards",
+        type="int", metavar="N", default=0,
+        help="Split the XOR work over N worker processes that share the datastore.   Requires NumPy (default 0, XOR in this process).")
+
+  parser.add_option("","--server", dest="server",
+        type="string", metavar="type", default="threaded",
+        help="How to serve upPIR clients: threaded (a thread per connection) or async (an event loop with --xorworkers threads for the XORs) (default threaded).")
+
+  parser.add_option("","--xorworkers", dest="xorworkers",
+        type="int", metavar="N", default=4,
+        help="The number of threads that answer queries.   Clients (by IP address) take turns using them (default 4).")
+
+  parser.add_option("","--maxqueued", dest="maxqueued",
+        type="int", metavar="N", default=256,
+        help="The most queries that may wait for a worker.   Clients are told to retry when it is full (default 256).")
+
+  parser.add_option("","--clientquota", dest="clientquota",
+        type="int", metavar="N", default=16,
+        help="The most queries one client IP address may have waiting or running.   Clients are told to retry beyond this (default 16).")
+
+  parser.add_option("","--maxconnections", dest="maxconnections",
+        type="int", metavar="N", default=20000,
+        help="The most client connections that are open at once with --server async (default 20000).")
+
+  parser.add_option("","--idletimeout", dest="idletimeout",
+        type="int", metavar="seconds", default=60,
+        help="Close a client connection that has sent nothing for this long (default 60, 0 to never close it).")
+
+  parser.add_option("","--coalescewindow", dest="coalescewindow",
+        type="float", metavar="ms", default=0,
+        help="Collect concurrent queries for up to this many milliseconds and answer them in one pass over the datastore (default 0, answer each query on its own).")
+
+  parser.add_option("","--coalescebatch", dest="coalescebatch",
+        type="int", metavar="N", default=64,
+        help="Answer collected queries as soon as this many are waiting (default 64).")
+
+  parser.add_option("","--metricsport", dest="metricsport",
+        type="int", metavar="portnum", default=0,
+        help="Serve request latencies, throughput and other metrics at http://<metricsip>:portnum/metrics (default 0, do not serve them).")
+
+  parser.add_option("","--metricsip", dest="metricsip",
+        type="string", metavar="IP", default="127.0.0.1",
+        help="Listen for metrics requests on this IP address (default 127.0.0.1, this machine only).")
+
+  parser.add_option("","--planqueries", dest="planqueries", action="store_true",
+        default=False,
+        help="Skip all zero blocks and answer queries that select most blocks from the XOR of all blocks (default False).")
+
 
 
   # let's parse the args
@@ -330,37 +1283,368 @@ def parse_options():
     print "Mirror advertise delay must be positive"
     sys.exit(1)
 
+  if _commandlineoptions.precomputegroupsize not in [0, 1, 2, 4, 8]:
+    print "Precompute group size must be 0, 1, 2, 4 or 8"
+    sys.exit(1)
+
+  if _commandlineoptions.madvise not in ['', 'normal', 'random', 'sequential', 'willneed']:
+    print "Unknown madvise hint, try one of: normal, random, sequential, willneed"
+    sys.exit(1)
+
+  if _commandlineoptions.datastore not in xordatastorebackends.BACKEND_NAMES + ['auto']:
+    print "Unknown datastore backend, try one of: "+", ".join(xordatastorebackends.BACKEND_NAMES + ['auto'])
+    sys.exit(1)
+
+  if _commandlineoptions.datastore == 'mmap' and not _commandlineoptions.datastorefile:
+    print "The mmap datastore backend needs --datastorefile"
+    sys.exit(1)
+
+  if _commandlineoptions.datastorefile and _commandlineoptions.datastore not in ['auto', 'mmap']:
+    print "--datastorefile can only be used with the mmap datastore backend"
+    sys.exit(1)
+
+  if _commandlineoptions.shards and _commandlineoptions.datastore != 'auto':
+    print "--shards cannot be used with --datastore"
+    sys.exit(1)
+
+  if _commandlineoptions.xorthreads <= 0:
+    print "Number of XOR threads must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.shards < 0:
+    print "Number of shards must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.shards and _commandlineoptions.datastorefile:
+    print "--shards cannot be used with --datastorefile"
+    sys.exit(1)
+
+  if _commandlineoptions.shards and _commandlineoptions.precomputegroupsize:
+    print "--precomputegroupsize cannot be used with --shards (the table would be built and used in this process, not in the workers)"
+    sys.exit(1)
+
+  if _commandlineoptions.manifestcheckinterval < 0:
+    print "Manifest check interval must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.manifestcheckinterval and _commandlineoptions.shards:
+    print "--manifestcheckinterval cannot be used with --shards (the workers are forked before serving starts)"
+    sys.exit(1)
+
+  if _commandlineoptions.snapshotfile and _commandlineoptions.datastorefile:
+    print "--snapshotfile cannot be used with --datastorefile (which is already kept on disk)"
+    sys.exit(1)
+
+  if _commandlineoptions.server not in ['threaded', 'async']:
+    print "Unknown server type, try one of: threaded, async"
+    sys.exit(1)
+
+  if _commandlineoptions.xorworkers <= 0:
+    print "Number of XOR workers must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.maxqueued <= 0:
+    print "Maximum number of queued queries must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.clientquota <= 0:
+    print "Client quota must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.maxconnections <= 0:
+    print "Maximum number of connections must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.idletimeout < 0:
+    print "Idle timeout must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.coalescewindow < 0:
+    print "Coalescing window must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.coalescebatch <= 0:
+    print "Coalescing batch size must be positive"
+    sys.exit(1)
+
+  if _commandlineoptions.metricsport < 0 or _commandlineoptions.metricsport > 65535:
+    print "Specified metrics port number out of range"
+    sys.exit(1)
+
   if remainingargs:
     print "Unknown options",remainingargs
     sys.exit(1)
 
+  if _commandlineoptions.logmaxbytes < 0 or _commandlineoptions.logrotateinterval < 0 or _commandlineoptions.logbackups < 0:
+    print "Log rotation settings must not be negative"
+    sys.exit(1)
+
+  if _commandlineoptions.logsample <= 0:
+    print "Log sample rate must be positive"
+    sys.exit(1)
+
   # try to open the log file...
-  _logfo = open(_commandlineoptions.logfilename, 'a')
+  _logger = batchedlog.BatchedLogger(_commandlineoptions.logfilename, maxbytes=_commandlineoptions.logmaxbytes, rotateinterval=_commandlineoptions.logrotateinterval, backupcount=_commandlineoptions.logbackups, samplerate=_commandlineoptions.logsample)
 
 
-def main():
-  global _global_myxordatastore
-  global _global_manifestdict
+def _log_hash_progress(blocksdone, blockcount, bytespersecond):
+  # Private helper that logs how far checking the block hashes has got
+  _log('checked '+str(blocksdone)+' of '+str(blockcount)+' block hashes ('+str(round(bytespersecond / (1024*1024), 1))+' MB/s)')
+
+
+
+class _ReleaseSource:
+  # Where a release we serve comes from: its manifest (a file, or a vendor
+  # to retrieve it from) and the directory its files are under.   The files
+  # we keep for it (--datastorefile, --snapshotfile) have filesuffix added,
+  # so that several releases don't share them.
+
+  def __init__(self, manifestfilename, retrievemanifestfrom, mirrorroot, filesuffix):
+    self.manifestfilename = manifestfilename
+    self.retrievemanifestfrom = retrievemanifestfrom
+    self.mirrorroot = mirrorroot
+    self.filesuffix = filesuffix
+
+
+  def get_datastorefilename(self):
+    return _commandlineoptions.datastorefile + self.filesuffix
+
+
+  def get_snapshotfilename(self):
+    return _commandlineoptions.snapshotfile + self.filesuffix
+
+
+
+def _get_releasesources():
+  # Private helper that returns a _ReleaseSource for each release we were
+  # asked to serve.   The first is from --manifestfile /
+  # --retrievemanifestfrom and --mirrorroot.
+  releasesourcelist = [_ReleaseSource(_commandlineoptions.manifestfilename, _commandlineoptions.retrievemanifestfrom, _commandlineoptions.mirrorroot, '')]
+
+  for releasenumber in range(len(_commandlineoptions.addreleases)):
+    manifestfilename, mirrorroot = _commandlineoptions.addreleases[releasenumber]
+    releasesourcelist.append(_ReleaseSource(manifestfilename, '', mirrorroot, '.'+str(releasenumber + 1)))
+
+  return releasesourcelist
+
+
+
+# the blocks a new release shares with the old one are copied this much at
+# a time
+_RELEASE_COPY_SIZE = 16 * 1024 * 1024
+
+def _update_from_release(oldrelease, manifestdict, myxordatastore):
+  # Private helper.   Fills the datastore from the release being replaced:
+  # the blocks the two have in common are copied and only the ones that
+  # changed are read from the files (and checked).   Returns False (having
+  # done nothing) if the releases can't be compared.
+  try:
+    changedblocklist = uppirlib.find_changed_blocks(oldrelease.manifestdict, manifestdict)
+  except ValueError:
+    return False
+
+  commonsize = min(oldrelease.manifestdict['blockcount'], manifestdict['blockcount']) * manifestdict['blocksize']
+  for offset in range(0, commonsize, _RELEASE_COPY_SIZE):
+    myxordatastore.set_data(offset, oldrelease.xordatastore.get_data(offset, min(_RELEASE_COPY_SIZE, commonsize - offset)))
+
+  uppirlib.update_xordatastore(oldrelease.manifestdict, manifestdict, myxordatastore, rootdir = oldrelease.releasesource.mirrorroot, progressfunction = _log_hash_progress)
+  _log('updated '+str(len(changedblocklist))+' of '+str(manifestdict['blockcount'])+' blocks from release '+oldrelease.manifestdict['manifesthash'])
+  return True
+
+
+
+def _populate_xordatastore(releasesource, manifestdict, myxordatastore, oldrelease=None):
+  # Private helper that fills the datastore, from the snapshot if asked to
+  # keep one.   Otherwise, a new release (oldrelease is the one it replaces)
+  # is updated from the old one.
+  if not _commandlineoptions.snapshotfile:
+    if oldrelease is not None and not _commandlineoptions.reverify:
+      if _update_from_release(oldrelease, manifestdict, myxordatastore):
+        return
+
+    uppirlib.populate_xordatastore(manifestdict, myxordatastore, rootdir = releasesource.mirrorroot, progressfunction = _log_hash_progress)
+    return
+
+  snapshotfilename = releasesource.get_snapshotfilename()
+
+  populatestarttime = time.time()
+  populatestate = datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, rootdir = releasesource.mirrorroot, reverify = _commandlineoptions.reverify, progressfunction = _log_hash_progress)
+  if populatestate == 'built':
+    _log('verified the release and saved snapshot '+snapshotfilename+' in '+str(round(time.time() - populatestarttime, 2))+'s')
+  elif populatestate == 'updated':
+    _log('updated snapshot '+snapshotfilename+' from an earlier release in '+str(round(time.time() - populatestarttime, 2))+'s')
+  else:
+    _log('loaded snapshot '+snapshotfilename+' in '+str(round(time.time() - populatestarttime, 2))+'s')
+
+
+
+def _read_manifest(releasesource):
+  # Private helper that gets a release's manifest (from the vendor or the
+  # manifest file).   Returns the raw manifest data and the manifest
+  # dictionary.
 
-  
   # If we were asked to retrieve the mainfest file, do so...
-  if _commandlineoptions.retrievemanifestfrom:
+  if releasesource.retrievemanifestfrom:
     # We need to download this file...
-    rawmanifestdata = uppirlib.retrieve_rawmanifest(_commandlineoptions.retrievemanifestfrom)
+    rawmanifestdata = uppirlib.retrieve_rawmanifest(releasesource.retrievemanifestfrom)
 
-    # ...make sure it is valid...
-    manifestdict = uppirlib.parse_manifest(rawmanifestdata)
-    
-    # ...and write it out if it's okay
-    open(_commandlineoptions.manifestfilename, "w").write(rawmanifestdata)
+  else:
+    # Simply read it in from disk
+    rawmanifestdata = open(releasesource.manifestfilename).read()
+
+  # ...make sure it is valid...
+  manifestdict = uppirlib.parse_manifest(rawmanifestdata)
+
+  return rawmanifestdata, manifestdict
+
+
+
+def _create_xordatastore(releasesource, manifestdict, oldrelease=None):
+  # Private helper that builds the datastore for a release (as the options
+  # say) and returns it.   This may take a long time.   (With --shards it
+  # forks, so it must happen before any threads start.)   oldrelease is the
+  # release this one replaces (if any), which is still being served.
+
+  if _commandlineoptions.datastorefile:
+    # map the packed datastore file (building it if it isn't for this
+    # release).   These need NumPy, so only import them if asked to...
+    import mmapxordatastore
+    import numpyxordatastore
+
+    datastorefilename = releasesource.get_datastorefilename()
+    # the old release still has the file mapped, so it must not change under
+    # it (a copy is updated instead)
+    myxordatastore, datastorestate = mmapxordatastore.open_datastore_file(manifestdict, datastorefilename, rootdir = releasesource.mirrorroot, reverify = _commandlineoptions.reverify, progressfunction = _log_hash_progress, inplace = oldrelease is None)
+    _log(datastorestate+' datastore file '+datastorefilename)
+
+    if _commandlineoptions.madvise:
+      myxordatastore.advise(_commandlineoptions.madvise)
+
+    if _commandlineoptions.mlock:
+      try:
+        myxordatastore.lock()
+      except OSError, e:
+        _log('could not lock the datastore file in memory: '+str(e))
 
+    if _commandlineoptions.prefault:
+      myxordatastore.prefault()
+
+    # anything we build from it (like a precomputed table) lives in RAM
+    xordatastoremodule = numpyxordatastore
+
+  elif _commandlineoptions.shards:
+    # This forks the workers, so it must happen before any threads start
+    import shardedxordatastore
+    import numpyxordatastore
+
+    myxordatastore = shardedxordatastore.XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'], _commandlineoptions.shards)
+
+    _populate_xordatastore(releasesource, manifestdict, myxordatastore)
+    _log('XORing with '+str(myxordatastore.numshards)+' worker processes')
+
+    # a precomputed table (if any) is XORed in this process
+    xordatastoremodule = numpyxordatastore
 
   else:
-    # Simply read it in from disk
+    if _commandlineoptions.datastore == 'auto':
+      # try the backends on a release sized sample and use the fastest
+      calibration = xordatastorebackends.calibrate_backends(manifestdict['blocksize'], manifestdict['blockcount'], xorthreads=_commandlineoptions.xorthreads)
+      backendname = calibration[0][0]
+      _log('datastore calibration: '+', '.join([name+' '+str(round(bytespersecond / (1024*1024), 1))+' MB/s' for name, bytespersecond in calibration]))
+
+    else:
+      backendname = _commandlineoptions.datastore
+
+    myxordatastore = xordatastorebackends.create_xordatastore(backendname, manifestdict['blocksize'], manifestdict['blockcount'], _commandlineoptions.xorthreads)
+    _log('using the '+backendname+' datastore backend')
+
+    # now let's put the content in the datastore in preparation to serve it
+    _populate_xordatastore(releasesource, manifestdict, myxordatastore, oldrelease)
+
+    xordatastoremodule = xordatastorebackends.get_backend_module(backendname)
+
+  # trade memory for XOR speed if asked to...
+  if _commandlineoptions.precomputegroupsize:
+    myxordatastore = memoizedxordatastore.MemoizedXORDatastore(myxordatastore, xordatastoremodule, _commandlineoptions.precomputegroupsize)
+    myxordatastore.precompute()
+    _log('precomputed subset XORs for groups of '+str(_commandlineoptions.precomputegroupsize)+' blocks')
+
+  # pick the cheapest way to answer each query...
+  if _commandlineoptions.planqueries:
+    myxordatastore = plannedxordatastore.PlannedXORDatastore(myxordatastore, xordatastoremodule)
+    myxordatastore.analyze()
+    _log('query planner found '+str(myxordatastore.numberofblocks - myxordatastore.numberofnonzeroblocks)+' all zero blocks of '+str(myxordatastore.numberofblocks))
+
+  return myxordatastore
+
+
+
+def _check_for_new_release(releaseholder):
+  # Private helper for _watch_manifest.   If the release has a new manifest,
+  # builds it (while the old one is served) and swaps it in.   Requests
+  # that already have the old release finish with it (see versionedholder).
+  releasesource = releaseholder.get_current().releasesource
+
+  rawmanifestdata, manifestdict = _read_manifest(releasesource)
+
+  if _find_releaseholder(manifestdict['manifesthash']) is not None:
+    # it's the one we serve (or, oddly, another release we serve)
+    return
+
+  _log('found release '+manifestdict['manifesthash']+', building its datastore')
+  buildstarttime = time.time()
+  # (the current release can't be swapped out by anyone else meanwhile)
+  newrelease = _MirrorRelease(releasesource, manifestdict, _create_xordatastore(releasesource, manifestdict, releaseholder.get_current()))
+
+  # a bigger release may need larger requests...
+  if _global_asyncxorserver is not None:
+    _global_asyncxorserver.set_maxrequestsize(max(_global_asyncxorserver.maxrequestsize, _get_maxrequestsize(newrelease.xordatastore)))
+
+  oldmanifesthash = releaseholder.get_current().manifestdict['manifesthash']
+  version = releaseholder.swap(newrelease)
+  _log('serving release '+manifestdict['manifesthash']+' instead of '+oldmanifesthash+' (built in '+str(round(time.time() - buildstarttime, 2))+'s, version '+str(version)+')')
+
+  # keep the manifest we serve, like at startup
+  if releasesource.retrievemanifestfrom:
+    open(releasesource.manifestfilename, "w").write(rawmanifestdata)
+
 
-    rawmanifestdata = open(_commandlineoptions.manifestfilename).read()
 
-    manifestdict = uppirlib.parse_manifest(rawmanifestdata)
+def _watch_manifest():
+  # Private helper that a thread runs with --manifestcheckinterval
+
+  while True:
+    time.sleep(_commandlineoptions.manifestcheckinterval)
+
+    for releaseholder in _global_releaseholders:
+      try:
+        _check_for_new_release(releaseholder)
+      except Exception, e:
+        # the vendor is down, the mirror root doesn't match the new manifest
+        # yet, etc.   Keep serving the old release and try again later.
+        _log('could not switch to a new release: '+str(e)+"\n"+str(traceback.format_tb(sys.exc_info()[2])))
+
+
+
+def main():
+  global _global_releaseholders
+  global _global_scheduler
+
+  releasesourcelist = _get_releasesources()
+
+  manifestdictlist = []
+  for releasesource in releasesourcelist:
+    rawmanifestdata, manifestdict = _read_manifest(releasesource)
+
+    # ...and write it out if it's okay
+    if releasesource.retrievemanifestfrom:
+      open(releasesource.manifestfilename, "w").write(rawmanifestdata)
+
+    # releases are told apart by their manifest hash
+    if manifestdict['manifesthash'] in [otherdict['manifesthash'] for otherdict in manifestdictlist]:
+      raise ValueError("The release in "+releasesource.manifestfilename+" is given more than once")
+
+    manifestdictlist.append(manifestdict)
   
   # We should detach here.   I don't do it earlier so that error
   # messages are written to the terminal...   I don't do it later so that any
@@ -368,30 +1652,50 @@ def main():
   if _commandlineoptions.daemonize:
     daemon.daemonize()
 
+  # build every datastore before any threads start (see --shards)
+  xordatastorelist = []
+  for releasesource, manifestdict in zip(releasesourcelist, manifestdictlist):
+    xordatastorelist.append(_create_xordatastore(releasesource, manifestdict))
 
+  # from here on the log is written in the background.   (Any forking is
+  # done, see --shards.)
+  _logger.start()
 
-  myxordatastore = fastsimplexordatastore.XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'])
-
-  # now let's put the content in the datastore in preparation to serve it
-  uppirlib.populate_xordatastore(manifestdict, myxordatastore, rootdir = _commandlineoptions.mirrorroot)
-    
   # we're now ready to handle clients!
   _log('ready to start servers!')
 
   # an ugly hack, but Python's request handlers don't have an easy way to
   # pass arguments
-  _global_myxordatastore = myxordatastore
-  _global_manifestdict = manifestdict
+  _global_releaseholders = []
+  for releasesource, manifestdict, myxordatastore in zip(releasesourcelist, manifestdictlist, xordatastorelist):
+    _global_releaseholders.append(versionedholder.VersionedHolder(_MirrorRelease(releasesource, manifestdict, myxordatastore), _close_release))
+    _log('serving release '+manifestdict['manifesthash'])
+
+  # (don't keep the first versions alive once they are swapped out)
+  del xordatastorelist, myxordatastore
+
+  # a bounded set of workers answers the queries...
+  _global_scheduler = fairscheduler.FairScheduler(_commandlineoptions.xorworkers, _commandlineoptions.maxqueued, _commandlineoptions.clientquota)
  
   # first, let's fire up the upPIR server
-  service_uppir_clients(myxordatastore, _commandlineoptions.ip, _commandlineoptions.port)
+  service_uppir_clients(_commandlineoptions.ip, _commandlineoptions.port)
 
   # If I should serve legacy clients via HTTP, let's start that up...
   if _commandlineoptions.http:
-    service_http_clients(myxordatastore, manifestdict, _commandlineoptions.ip, _commandlineoptions.httpport)
+    service_http_clients(_commandlineoptions.ip, _commandlineoptions.httpport)
+
+  # and the metrics page if asked to...
+  if _commandlineoptions.metricsport:
+    service_metrics_clients(_commandlineoptions.metricsip, _commandlineoptions.metricsport)
 
   _log('servers started!')
 
+  # and swap in new releases as they are published if asked to...
+  if _commandlineoptions.manifestcheckinterval:
+    watcherthread = threading.Thread(target=_watch_manifest, name="manifest watcher")
+    watcherthread.daemon = True
+    watcherthread.start()
+
   # let's send the mirror information periodically...
   # we should log any errors...
   while True:
@@ -400,6 +1704,28 @@ def main():
     except Exception, e:
       _log(str(e)+"\n"+str(traceback.format_tb(sys.exc_info()[2])))
 
+    for releaseholder in _global_releaseholders:
+      release = releaseholder.get_current()
+
+      if len(_global_releaseholders) > 1:
+        releasename = ' ('+release.manifestdict['manifesthash']+')'
+      else:
+        releasename = ''
+
+      if _commandlineoptions.planqueries:
+        pathcounts = release.xordatastore.get_pathcounts()
+        _log('query plans'+releasename+': '+' '.join([path+'='+str(pathcounts[path]) for path in plannedxordatastore.PLAN_PATHS]))
+
+      if release.coalescer is not None:
+        metrics = release.coalescer.get_metrics()
+        _log('coalescing'+releasename+': batches='+str(metrics['batches'])+' queries='+str(metrics['queries'])+' meanbatch='+str(round(metrics['meanbatch'], 1))+' largestbatch='+str(metrics['largestbatch'])+' meanwait='+str(round(metrics['meanwait'] * 1000, 2))+'ms longestwait='+str(round(metrics['longestwait'] * 1000, 2))+'ms')
+
+      # (don't keep an old release alive while we sleep)
+      del release
+
+    metrics = _global_scheduler.get_metrics()
+    _log('scheduler: queued='+str(metrics['queued'])+' running='+str(metrics['running'])+' deferred='+str(metrics['deferred'])+' clients='+str(metrics['clients'])+' completed='+str(metrics['completed'])+' rejectedqueuefull='+str(metrics['rejectedqueuefull'])+' rejectedclientquota='+str(metrics['rejectedclientquota']))
+
     time.sleep(_commandlineoptions.mirrorlistadvertisedelay)
 
 
@@ -414,5 +1740,6 @@ if __name__ == '__main__':
     # this mess prints a not-so-nice traceback, but it does contain all 
     # relevant info
     _log(str(e)+"\n"+str(traceback.format_tb(sys.exc_info()[2])))
+    _logger.close()
     sys.exit(1)
 
@@ -0,0 +1,247 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  Holds the current version of something that is swapped while it is in use
+  (like the release a mirror serves).   A reader acquires the current version
+  and releases it when it is done.   swap makes a new version current at
+  once, but the old one stays usable by the readers that already have it.
+  Once the last of them releases it, the holder drops it and calls the
+  release function (which can free its resources).
+
+"""
+
+import threading
+
+
+
+class VersionedHolder:
+  """
+  <Purpose>
+    Holds a value that can be swapped for a new version while readers still
+    use the old one.   All methods are thread safe.
+
+  <Side Effects>
+    None.
+
+  <Example Use>
+    holder = VersionedHolder(oldrelease, close_release)
+
+    version, release = holder.acquire()
+    try:
+      ...   # use release
+    finally:
+      holder.release(version)
+
+    # new readers get newrelease.   close_release(oldrelease) is called once
+    # the readers of oldrelease are done
+    holder.swap(newrelease)
+
+  """
+
+  def __init__(self, value, releasefunction=None):
+    """
+    <Purpose>
+      Holds value as version 1.
+
+    <Arguments>
+      value: the first version.
+
+      releasefunction: called with each old value once it is swapped out and
+                       no reader has it (default None).   It is not called
+                       with the lock held, so it may be slow.
+
+    <Exceptions>
+      None
+
+    """
+    self._releasefunction = releasefunction
+
+    self._lock = threading.Lock()
+
+    self._currentversion = 1
+    # version -> value and version -> readers, for the current version and
+    # any old ones that are still in use
+    self._values = {1:value}
+    self._readercounts = {1:0}
+
+
+
+  def acquire(self):
+    """
+    <Purpose>
+      Gets the current version for a reader.   It must be given back with
+      release.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      A tuple (version, value).
+    """
+    self._lock.acquire()
+    try:
+      version = self._currentversion
+      self._readercounts[version] = self._readercounts[version] + 1
+      return (version, self._values[version])
+    finally:
+      self._lock.release()
+
+
+
+  def release(self, version):
+    """
+    <Purpose>
+      Tells the holder that a reader is done with a version (from acquire).
+
+    <Arguments>
+      version: the version number acquire returned.
+
+    <Exceptions>
+      ValueError if that version is not held by any reader.
+
+    <Side Effects>
+      May call the release function (if this was the last reader of an old
+      version).
+
+    <Returns>
+      None
+    """
+    self._lock.acquire()
+    try:
+      if self._readercounts.get(version, 0) <= 0:
+        raise ValueError("Version "+str(version)+" is not acquired")
+
+      self._readercounts[version] = self._readercounts[version] - 1
+      oldvalue = self._drop_if_unused(version)
+    finally:
+      self._lock.release()
+
+    self._call_release_function(oldvalue)
+
+
+
+  def swap(self, newvalue):
+    """
+    <Purpose>
+      Makes newvalue the current version.   Readers that have the old version
+      keep it until they release it.
+
+    <Arguments>
+      newvalue: the new version.
+
+    <Exceptions>
+      None
+
+    <Side Effects>
+      May call the release function (if nothing was reading the old version).
+
+    <Returns>
+      The new version number.
+    """
+    self._lock.acquire()
+    try:
+      oldversion = self._currentversion
+      self._currentversion = oldversion + 1
+      self._values[self._currentversion] = newvalue
+      self._readercounts[self._currentversion] = 0
+
+      oldvalue = self._drop_if_unused(oldversion)
+      newversion = self._currentversion
+    finally:
+      self._lock.release()
+
+    self._call_release_function(oldvalue)
+
+    return newversion
+
+
+
+  def get_current(self):
+    """
+    <Purpose>
+      Returns the current value without acquiring it (for things like
+      statistics, where it does not matter if it is swapped out meanwhile).
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      The current value.
+    """
+    self._lock.acquire()
+    try:
+      return self._values[self._currentversion]
+    finally:
+      self._lock.release()
+
+
+
+  def get_version(self):
+    """
+    <Purpose>
+      Returns the current version number.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      An integer (1 for the first version).
+    """
+    self._lock.acquire()
+    try:
+      return self._currentversion
+    finally:
+      self._lock.release()
+
+
+
+  def get_held_versions(self):
+    """
+    <Purpose>
+      Returns how many versions are held: the current one and any old ones
+      that readers still have.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      An integer.
+    """
+    self._lock.acquire()
+    try:
+      return len(self._values)
+    finally:
+      self._lock.release()
+
+
+
+  def _drop_if_unused(self, version):
+    # Private helper (with the lock held).   Forgets an old version nobody is
+    # reading and returns its value (for the release function), otherwise
+    # None.
+    if version == self._currentversion or self._readercounts[version] > 0:
+      return None
+
+    del self._readercounts[version]
+    return self._values.pop(version)
+
+
+
+  def _call_release_function(self, oldvalue):
+    # Private helper (without the lock held)
+    if oldvalue is not None and self._releasefunction is not None:
+      self._releasefunction(oldvalue)
@@ -6,17 +6,17 @@
   May 25th, 2011
 
 <Description>
-  A wrapper for a C-based datastore.   This uses objects, etc. to make 
-  the C interface more Pythonic...
+  A wrapper for a C-based datastore.   The datastore is a type from the C
+  extension, so this mostly adds the module level helpers.
 
   This is really just a version of the Python datastore with the Python code 
-  replaced with the C extension.   I left in all of the error checking.
+  replaced with the C extension.   The C code does all of the same error 
+  checking.
   
 
 """
 
 import fastsimplexordatastore_c
-import math
 
 
 def do_xor(string_a, string_b):
@@ -29,188 +29,110 @@ def do_xor(string_a, string_b):
   return fastsimplexordatastore_c.do_xor(string_a,string_b)
 
 
-class XORDatastore:
-  """
-  <Purpose>
-    Class that has information for an XORdatastore.   This data structure can
-    quickly XOR blocks of data that it stores.   The real work is done in a
-    C extension
-
-  <Side Effects>
-    None.
 
+def self_test():
   """
+  <Purpose>
+    Checks every XOR kernel this CPU supports (and the code that skips over
+    unselected blocks) against the plain C code.
 
-  # this is the private, internal storage area for data...
-  ds = None
-
-  # these are public so that a caller can read information about a created
-  # datastore.   They should not be changed.   
-  numberofblocks = None
-  sizeofblocks = None
- 
-  def __init__(self, block_size, num_blocks):  # allocate
-    """
-    <Purpose>
-      Allocate a place to store data for efficient XOR.   
-
-    <Arguments>
-      block_size: the size of each block.   This must be a positive int / long.
-                  The value must be a multiple of 64
-      
-      num_blocks: the number of blocks.   This must be a positive integer
-
-    <Exceptions>
-      TypeError is raised if invalid parameters are given.
-
-    """
-
-    if type(block_size) != int and type(block_size) != long:
-      raise TypeError("Block size must be an integer")
-
-    if block_size <= 0:
-      raise TypeError("Block size must be positive")
-
-    if block_size %64 != 0:
-      raise TypeError("Block size must be a multiple of 64")
-
-    if type(num_blocks) != int and type(num_blocks) != long:
-      raise TypeError("Number of blocks must be an integer")
-
-    if num_blocks <= 0:
-      raise TypeError("Number of blocks must be positive")
-
-
-    self.numberofblocks = num_blocks
-    self.sizeofblocks = block_size
-
-    self.ds = fastsimplexordatastore_c.Allocate(block_size, num_blocks)
-    
-
-  def produce_xor_from_bitstring(self, bitstring):
-    """
-    <Purpose>
-      Returns an XORed block from an XORdatastore.   It will always return
-      a string of the size of the datastore blocks
-
-    <Arguments>
-      bitstring: a string of bits that indicates what to XOR.   The length
-                 of this string must be ceil(numberofblocks / 8.0).   Extra
-                 bits are ignored (e.g. if are 10 blocks, the last
-                 six bits are ignored).
-      
-    <Exceptions>
-      TypeError is raised if the bitstring is invalid
-
-    <Returns>
-      The XORed block.
-
-    """
-    if type(bitstring) != str:
-      raise TypeError("bitstring must be a string")
-
-    if len(bitstring) != math.ceil(self.numberofblocks/8.0):
-      raise TypeError("bitstring is not of the correct length")
-
-
-    return fastsimplexordatastore_c.Produce_Xor_From_Bitstring(self.ds, bitstring)
-      
-
-
-
-  def set_data(self, offset, data_to_add):
-    """
-    <Purpose>
-      Sets the raw data in an XORdatastore.   It ignores block layout, etc.
-
-    <Arguments>
-      offset: this is a non-negative integer that must be less than the 
-              numberofblocks * blocksize.   
-      
-      data_to_add: the string that should be added.   offset + len(data_to_add)
-                must be less than the numberofblocks * blocksize.
-      
-    <Exceptions>
-      TypeError if the arguments are the wrong type or have invalid values.
-
-    <Returns>
-      None
+  <Arguments>
+    None
 
-    """
-    if type(offset) != int and type(offset) != long:
-      raise TypeError("Offset must be an integer")
+  <Exceptions>
+    None
 
-    if offset < 0:
-      raise TypeError("Offset must be non-negative")
+  <Returns>
+    A list of (name, passed) tuples.   The names are the kernel names plus
+    'bitscan'.
+  """
+  return fastsimplexordatastore_c.Self_Test()
 
-    if type(data_to_add) != str:
-      raise TypeError("Data_to_add to XORdatastore must be a string.")
 
-    if offset + len(data_to_add) > self.numberofblocks * self.sizeofblocks:
-      raise TypeError("Offset + added data overflows the XORdatastore")
 
-    return fastsimplexordatastore_c.SetData(self.ds, offset, data_to_add)
-    
+def get_xor_kernels():
+  """
+  <Purpose>
+    Returns the XOR kernels this CPU supports, fastest first.   The fastest
+    one is used unless set_xor_kernel is called.
 
+  <Arguments>
+    None
 
+  <Exceptions>
+    None
 
+  <Returns>
+    A list of names, e.g. ['avx512', 'avx2', 'sse2', 'scalar']
+  """
+  return fastsimplexordatastore_c.Get_Xor_Kernels()
 
 
 
-  def get_data(self, offset, quantity):
-    """
-    <Purpose>
-      Returns raw data from an XORdatastore.   It ignores block layout, etc.
+def get_xor_kernel():
+  """
+  <Purpose>
+    Returns the name of the XOR kernel in use.
 
-    <Arguments>
-      offset: this is a non-negative integer that must be less than the 
-              numberofblocks * blocksize.   
-      
-      quantity: quantity must be a positive integer.   offset + quantity 
-                must be less than the numberofblocks * blocksize.
-      
-    <Exceptions>
-      TypeError if the arguments are the wrong type or have invalid values.
+  <Arguments>
+    None
 
-    <Returns>
-      A string containing the data.
+  <Exceptions>
+    None
 
-    """
-    if type(offset) != int and type(offset) != long:
-      raise TypeError("Offset must be an integer")
+  <Returns>
+    The kernel name (see get_xor_kernels)
+  """
+  return fastsimplexordatastore_c.Get_Xor_Kernel()
 
-    if offset < 0:
-      raise TypeError("Offset must be non-negative")
 
-    if type(quantity) != int and type(quantity) != long:
-      raise TypeError("Quantity must be an integer")
 
-    if quantity <= 0:
-      raise TypeError("Quantity must be positive")
+def set_xor_kernel(kernelname):
+  """
+  <Purpose>
+    Selects the XOR kernel used by every datastore in this process.
 
-    if offset + quantity > self.numberofblocks * self.sizeofblocks:
-      raise TypeError("Quantity + offset is larger than XORdatastore")
+  <Arguments>
+    kernelname: one of the names from get_xor_kernels
 
-    return fastsimplexordatastore_c.GetData(self.ds, offset, quantity)
+  <Exceptions>
+    ValueError if the kernel is unknown or this CPU does not support it.
 
+  <Returns>
+    None
+  """
+  if type(kernelname) != str:
+    raise TypeError("Kernel name must be a string")
 
+  fastsimplexordatastore_c.Set_Xor_Kernel(kernelname)
 
 
+class XORDatastore(fastsimplexordatastore_c.XORDatastore):
+  """
+  <Purpose>
+    Class that has information for an XORdatastore.   This data structure can
+    quickly XOR blocks of data that it stores.   The real work (and all of 
+    the error checking) is done in the C extension type, so there is no 
+    Python code on the query path.
 
-  def __del__(self):   # deallocate
-    """
-    <Purpose>
-      Deallocate the XORdatastore
+    XORDatastore(block_size, num_blocks, numthreads=1)
 
-    <Arguments>
-      None
+      block_size must be a positive multiple of 64 and num_blocks must be 
+      positive.   A produce_xor_from_bitstring call is split over up to 
+      numthreads native threads (small datastores use fewer).   The GIL is 
+      released during the XOR either way, so concurrent calls also run in 
+      parallel.   numthreads can be changed at any time.
 
-    <Exceptions>
-      None
+    The methods are the same as the Python datastore (including 
+    produce_xor_into, which does no allocation at all).   get_data also takes
+    copy=False to return a memoryview of the datastore instead of a string.
+    The datastore itself supports the buffer protocol (e.g. memoryview(ds)),
+    and is freed when the last reference (including any memoryview) is gone.
 
-    """
-    # if there is an error, this might be an uninitialized object...
-    if self.ds != None:
-      fastsimplexordatastore_c.Deallocate(self.ds)
+  <Side Effects>
+    None.
 
+  <Exceptions>
+    TypeError is raised if invalid parameters are given.
 
+  """
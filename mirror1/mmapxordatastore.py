@@ -0,0 +1,438 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  An XORdatastore backed by one packed, block aligned file that is mmap'd.
+  The file is built once from the manifest (see open_datastore_file).   After
+  that a mirror maps it read-only on startup instead of copying every file
+  into RAM, so restarts are near-instant and several mirror processes on one
+  host share the same pages in the page cache.   For a new release, only the
+  blocks that changed are rewritten.
+
+  The XOR work is done by NumPy (this is the NumPy datastore with different
+  storage).   Pages are faulted in as they are used.   advise, lock and
+  prefault can be used to change that.
+
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import mmap
+
+try:
+  # for reflink copies (see _copy_file)
+  import fcntl
+except ImportError:
+  # (Windows) every copy is a full copy
+  fcntl = None
+
+# for madvise / mlock (the mmap module in Python 2 has neither)
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+import numpyxordatastore
+
+# helper functions that are shared
+import uppirlib
+
+# the stamp that says which release (and files) a datastore file holds
+import datastoresnapshot
+
+
+# The madvise advice values.   These are the same on Linux and the BSDs.
+_madvise_advice = {'normal':0, 'random':1, 'sequential':2, 'willneed':3,
+                   'dontneed':4}
+
+try:
+  _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+  # No libc to call.   advise / lock will report that they did nothing.
+  _libc = None
+
+# Linux's FICLONE ioctl, which makes a copy of a file that shares its blocks
+# until either is written (a reflink).   This needs a filesystem that
+# supports it (btrfs, XFS, ...).
+_FICLONE = 0x40049409
+
+
+
+class XORDatastore(numpyxordatastore.XORDatastore):
+  """
+  <Purpose>
+    Class that has information for an XORdatastore.   The data lives in a
+    memory mapped file.   A read-only datastore raises TypeError on set_data.
+
+  <Side Effects>
+    Maps the datastore file into memory.
+
+  <Example Use>
+    # build the file once...
+    myxordatastore = XORDatastore(1024, 16, 'release.xordatastore',
+        readonly=False)
+    # ... populate myxordatastore ...
+    myxordatastore.flush()
+
+    # ... and later (or in another process) just map it
+    myxordatastore = XORDatastore(1024, 16, 'release.xordatastore')
+    myxordatastore.advise('random')
+
+  """
+
+  # the mmap object and whether it is read-only
+  _mmap = None
+  readonly = None
+  filename = None
+
+  def __init__(self, block_size, num_blocks, filename, readonly=True):  # allocate
+    """
+    <Purpose>
+      Map a datastore file.
+
+    <Arguments>
+      block_size: the size of each block.   This must be a positive int / long.
+                  The value must be a multiple of 64
+
+      num_blocks: the number of blocks.   This must be a positive integer
+
+      filename: the datastore file.   If readonly, the file must already
+                exist and be exactly block_size * num_blocks bytes.
+                Otherwise it is created (or resized) as needed.   Any new
+                space is all zeros.
+
+      readonly: map the file read-only (the default).
+
+    <Exceptions>
+      TypeError is raised if invalid parameters are given.
+
+      ValueError is raised if a read-only file has the wrong size.
+
+      IOError / OSError if the file cannot be opened or mapped.
+
+    """
+
+    if type(block_size) != int and type(block_size) != long:
+      raise TypeError("Block size must be an integer")
+
+    if block_size <= 0:
+      raise TypeError("Block size must be positive")
+
+    if block_size %64 != 0:
+      raise TypeError("Block size must be a multiple of 64")
+
+    if type(num_blocks) != int and type(num_blocks) != long:
+      raise TypeError("Number of blocks must be an integer")
+
+    if num_blocks <= 0:
+      raise TypeError("Number of blocks must be positive")
+
+    if type(filename) != str and type(filename) != unicode:
+      raise TypeError("Filename must be a string")
+
+
+    self.numberofblocks = num_blocks
+    self.sizeofblocks = block_size
+    self.filename = filename
+    self.readonly = readonly
+
+    datastoresize = num_blocks * block_size
+
+    if readonly:
+      datastorefo = open(filename, 'rb')
+      if os.fstat(datastorefo.fileno()).st_size != datastoresize:
+        datastorefo.close()
+        raise ValueError("Datastore file '"+filename+"' is not "+str(datastoresize)+" bytes")
+
+      self._mmap = mmap.mmap(datastorefo.fileno(), datastoresize, access=mmap.ACCESS_READ)
+
+    else:
+      if os.path.exists(filename):
+        datastorefo = open(filename, 'r+b')
+      else:
+        datastorefo = open(filename, 'w+b')
+
+      # this leaves a sparse file of zeros (our padding for 'gaps')
+      datastorefo.truncate(datastoresize)
+
+      self._mmap = mmap.mmap(datastorefo.fileno(), datastoresize, access=mmap.ACCESS_WRITE)
+
+    # the mapping stays valid after the file is closed
+    datastorefo.close()
+
+    # a read-only mapping gives read-only arrays
+    self._bytes = np.frombuffer(self._mmap, dtype=np.uint8)
+    self._blocks = self._bytes.view(np.uint64).reshape(num_blocks, block_size / 8)
+
+
+
+  def set_data(self, offset, data_to_add):
+    """
+    <Purpose>
+      Sets the raw data in an XORdatastore.   It ignores block layout, etc.
+      This is only allowed on a datastore that is not read-only.
+
+    <Arguments>
+      See the XORdatastore documentation.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values
+      or the datastore is read-only.
+
+    <Returns>
+      None
+
+    """
+    if self.readonly:
+      raise TypeError("XORdatastore file '"+self.filename+"' is read-only")
+
+    return numpyxordatastore.XORDatastore.set_data(self, offset, data_to_add)
+
+
+
+  def flush(self):
+    """
+    <Purpose>
+      Writes any changes back to the datastore file.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+
+    """
+    if not self.readonly:
+      self._mmap.flush()
+
+
+
+  def advise(self, advice):
+    """
+    <Purpose>
+      Gives the kernel a hint (madvise) about how the datastore will be used.
+      'random' suits a mirror that answers queries, 'sequential' suits a
+      full scan (hashing) and 'willneed' starts reading the file in.
+
+    <Arguments>
+      advice: one of 'normal', 'random', 'sequential', 'willneed' or
+              'dontneed'.
+
+    <Exceptions>
+      TypeError if the advice is unknown.
+
+    <Returns>
+      True if the hint was given, False if this platform does not support it.
+
+    """
+    if advice not in _madvise_advice:
+      raise TypeError("Unknown advice '"+str(advice)+"'")
+
+    if _libc is None or not hasattr(_libc, 'madvise'):
+      return False
+
+    return _libc.madvise(ctypes.c_void_p(self._bytes.ctypes.data), ctypes.c_size_t(len(self._bytes)), _madvise_advice[advice]) == 0
+
+
+
+  def lock(self):
+    """
+    <Purpose>
+      Locks the datastore into RAM (mlock), so it is never paged out.   This
+      also faults in all of the pages.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      OSError if the lock fails (often because of RLIMIT_MEMLOCK).
+
+    <Returns>
+      True if the datastore was locked, False if this platform does not
+      support it.
+
+    """
+    if _libc is None or not hasattr(_libc, 'mlock'):
+      return False
+
+    if _libc.mlock(ctypes.c_void_p(self._bytes.ctypes.data), ctypes.c_size_t(len(self._bytes))) != 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, "mlock failed: "+os.strerror(errno))
+
+    return True
+
+
+
+  def prefault(self):
+    """
+    <Purpose>
+      Reads one byte from every page so the whole datastore is in the page
+      cache before the first query arrives.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+
+    """
+    self._bytes[::mmap.PAGESIZE].max()
+
+
+
+  def __del__(self):   # deallocate
+    """
+    <Purpose>
+      Deallocate the XORdatastore
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    """
+    # The mapping is released when the arrays that use it go away.   Closing
+    # it here could leave them pointing at unmapped memory.
+    pass
+
+
+
+
+def _copy_file(sourcefilename, destfilename):
+  # Private helper that copies a datastore file.   A reflink is tried first,
+  # which takes about the same time for any size of file.   Otherwise every
+  # byte is copied.   Returns True if it was a reflink.
+
+  if fcntl is not None and sys.platform.startswith('linux'):
+    sourcefo = open(sourcefilename, 'rb')
+    try:
+      destfo = open(destfilename, 'wb')
+      try:
+        try:
+          fcntl.ioctl(destfo.fileno(), _FICLONE, sourcefo.fileno())
+          return True
+        except (IOError, OSError):
+          # not supported here (ext4, tmpfs, another filesystem, ...)
+          pass
+      finally:
+        destfo.close()
+    finally:
+      sourcefo.close()
+
+  shutil.copyfile(sourcefilename, destfilename)
+  return False
+
+
+
+
+def open_datastore_file(manifestdict, filename, rootdir=".", reverify=False, progressfunction=None, inplace=True):
+  """
+  <Purpose>
+    Returns a read-only, mmap'd XORdatastore for a release.   If the file
+    does not already hold this release (as shown by the stamp next to it,
+    see datastoresnapshot), it is updated or built from the files in rootdir
+    first.   A file that holds an earlier release (with the same block size)
+    is updated: only the blocks that changed are read, checked and written,
+    so only their pages are touched.
+
+  <Arguments>
+    manifestdict: a manifest dictionary.
+
+    filename: the datastore file.
+
+    rootdir: The location to look for the files mentioned in the manifest
+
+    reverify: rebuild the file (checking every file and block hash) even if
+              it is stamped with this release (default False).
+
+    progressfunction: see uppirlib.populate_xordatastore (default None).
+
+    inplace: update the file itself (default True).   If False, a copy is
+             updated and then moved into place, so a process that has the
+             old file mapped keeps seeing the earlier release.   The copy is
+             a reflink where the filesystem supports it (btrfs, XFS, ...).
+             Elsewhere (ext4, for example) it is a full copy, which costs
+             time and disk space in proportion to the datastore (not the
+             change), about a second per GiB if the file is cached.
+
+  <Exceptions>
+    The exceptions of uppirlib.populate_xordatastore (or
+    uppirlib.update_xordatastore) if the file must be built (or updated).
+
+    IOError / OSError if the file cannot be written or mapped.
+
+  <Side Effects>
+    May write filename, filename.stamp and filename.manifest.
+
+  <Returns>
+    A tuple (xordatastore, state) where state is 'mapped' if the file already
+    held this release, 'updated' if it was updated from an earlier release or
+    'built' if it had to be (re)built.
+  """
+
+  if not reverify and os.path.exists(filename) and datastoresnapshot.stamp_matches(filename, manifestdict, rootdir):
+    try:
+      return (XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'], filename), 'mapped')
+    except ValueError:
+      # wrong size.   Rebuild it.
+      pass
+
+  oldmanifestdict = None
+  if not reverify:
+    oldmanifestdict = datastoresnapshot.get_updatable_manifest(manifestdict, filename)
+
+  # the old stamp no longer describes the file
+  datastoresnapshot.remove_stamp(filename)
+
+  # (stamped as the files were before they were read)
+  stamp = datastoresnapshot.create_stamp(manifestdict, rootdir)
+
+  # unless it is updated in place, the file is written under a temporary
+  # name so a crash never leaves a partial file that looks complete...
+  tempfilename = filename + '.tmp'
+  if os.path.exists(tempfilename):
+    os.remove(tempfilename)
+
+  if oldmanifestdict is not None:
+    if inplace:
+      tempfilename = filename
+    else:
+      _copy_file(filename, tempfilename)
+
+    # (this grows or shrinks the file to the new release's size)
+    newxordatastore = XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'], tempfilename, readonly=False)
+    newxordatastore.advise('random')
+
+    # this checks the hashes of the blocks that changed
+    uppirlib.update_xordatastore(oldmanifestdict, manifestdict, newxordatastore, rootdir=rootdir, progressfunction=progressfunction)
+    state = 'updated'
+
+  else:
+    newxordatastore = XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'], tempfilename, readonly=False)
+    newxordatastore.advise('sequential')
+
+    # this also checks the file and block hashes
+    uppirlib.populate_xordatastore(manifestdict, newxordatastore, rootdir=rootdir, progressfunction=progressfunction)
+    state = 'built'
+
+  newxordatastore.flush()
+  del newxordatastore
+
+  # ... then move it into place and stamp it
+  if tempfilename != filename:
+    os.rename(tempfilename, filename)
+  datastoresnapshot.write_stamp(filename, stamp, manifestdict)
+
+  return (XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'], filename), state)
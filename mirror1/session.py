@@ -9,6 +9,11 @@
 # Note that the client will block while sending a message, and the receiver 
 # will block while recieving a message.   
 #
+# A connection may carry any number of messages.   A side that is done
+# sending calls sendclose.   recvmessage raises SessionEOF when it reads the
+# -1 size or if the connection closes at a message boundary.   A connection
+# that closes partway through a message is also SessionEOF.
+#
 # While it should be possible to reuse the connectionbased socket for other 
 # tasks so long as it does not overlap with the time periods when messages are 
 # being sent, this is inadvisable.
@@ -27,6 +32,10 @@ def recvmessage(socketobj):
   for junkcount in range(sessionmaxdigits):
     currentbyte = socketobj.recv(1)
 
+    # the other side closed the connection
+    if currentbyte == '':
+      raise SessionEOF, "Connection Closed"
+
     if currentbyte == '\n':
       break
     
@@ -62,13 +71,15 @@ def recvmessage(socketobj):
 
   return data
 
-# a private helper function
+# a private helper function.   data can be a string or any buffer (e.g. a 
+# bytearray).   The unsent part is a memoryview slice, so it is never copied.
 def _sendhelper(socketobj,data):
+  dataview = memoryview(data)
   sentlength = 0
   # if I'm still missing some, continue to send (I could have used sendall
   # instead but this isn't supported in repy currently)
-  while sentlength < len(data):
-    thissent = socketobj.send(data[sentlength:])
+  while sentlength < len(dataview):
+    thissent = socketobj.send(dataview[sentlength:])
     sentlength = sentlength + thissent
 
 
@@ -82,3 +93,9 @@ def sendmessage(socketobj,data):
 
 
 
+# tell the other side that we will not send any more messages
+def sendclose(socketobj):
+  _sendhelper(socketobj,'-1\n')
+
+
+
@@ -0,0 +1,303 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  An XORdatastore that spreads the XOR work over several processes, so one
+  mirror can use every core without depending on how threads share the
+  GIL.
+
+  The datastore lives in one anonymous shared memory mapping.   The block
+  range is split into shards and a multiprocessing pool (forked when the
+  datastore is created, so every worker sees the same memory) XORs one
+  shard of each query.   The parent XORs the partial blocks together.
+
+  The XOR code is the NumPy datastore's.   A worker gets only its part of the
+  bitstring and returns one block, so each query sends (bitstring size +
+  block size) per shard between processes.
+
+"""
+
+import math
+
+import mmap
+
+import multiprocessing
+
+import numpy as np
+
+import numpyxordatastore
+
+
+# The datastores that workers can use, by token.   A worker is forked after
+# its datastore is added here, so it finds the datastore (and the shared
+# mapping) without anything being pickled.
+_shareddatastores = {}
+_nexttoken = 0
+
+
+
+def _xor_shard(shardargs):
+  # Private helper that runs in a worker.   XORs the blocks in
+  # [firstblock, lastblock) that each (shard sized) bitstring selects and
+  # returns the concatenated partial blocks.
+  token, firstblock, lastblock, bitstringlist = shardargs
+
+  xordatastore = _shareddatastores[token]
+  shardblocks = xordatastore._blocks[firstblock:lastblock]
+
+  selectedbits = np.unpackbits(np.frombuffer(''.join(bitstringlist), dtype=np.uint8))
+  selectedbits = selectedbits.reshape(len(bitstringlist), -1)[:, :lastblock - firstblock]
+
+  partialblocks = np.zeros((len(bitstringlist), xordatastore.sizeofblocks / 8), dtype=np.uint64)
+
+  rowsperchunk = max(1, numpyxordatastore._XOR_CHUNK_BYTES / xordatastore.sizeofblocks)
+
+  for querynumber in range(len(bitstringlist)):
+    selectedblocks = np.flatnonzero(selectedbits[querynumber])
+
+    for start in range(0, len(selectedblocks), rowsperchunk):
+      selectedrows = shardblocks[selectedblocks[start:start+rowsperchunk]]
+      partialblocks[querynumber] ^= np.bitwise_xor.reduce(selectedrows, axis=0)
+
+  return partialblocks.tobytes()
+
+
+
+
+class XORDatastore(numpyxordatastore.XORDatastore):
+  """
+  <Purpose>
+    Class that has information for an XORdatastore.   The data is in shared
+    memory and queries are split over a pool of worker processes.
+
+  <Side Effects>
+    Starts numshards worker processes.   Create the datastore before
+    starting any threads (forking a threaded process is not safe).
+
+  <Example Use>
+    myxordatastore = XORDatastore(1024, 16, 4)
+    # ... populate myxordatastore ...
+
+    # this uses four processes
+    myxordatastore.produce_xor_from_bitstring(bitstring)
+
+    myxordatastore.close()
+
+  """
+
+  # the number of shards (and worker processes)
+  numshards = None
+
+  _mmap = None
+  _pool = None
+  _token = None
+
+  def __init__(self, block_size, num_blocks, numshards=None):  # allocate
+    """
+    <Purpose>
+      Allocate a place to store data for efficient XOR and start the
+      workers.
+
+    <Arguments>
+      block_size: the size of each block.   This must be a positive int / long.
+                  The value must be a multiple of 64
+
+      num_blocks: the number of blocks.   This must be a positive integer
+
+      numshards: the number of shards / worker processes.   The default is
+                 the number of CPUs.   A datastore with fewer than
+                 8 * numshards blocks uses fewer shards.
+
+    <Exceptions>
+      TypeError is raised if invalid parameters are given.
+
+    """
+    global _nexttoken
+
+    if type(block_size) != int and type(block_size) != long:
+      raise TypeError("Block size must be an integer")
+
+    if block_size <= 0:
+      raise TypeError("Block size must be positive")
+
+    if block_size %64 != 0:
+      raise TypeError("Block size must be a multiple of 64")
+
+    if type(num_blocks) != int and type(num_blocks) != long:
+      raise TypeError("Number of blocks must be an integer")
+
+    if num_blocks <= 0:
+      raise TypeError("Number of blocks must be positive")
+
+    if numshards is None:
+      numshards = multiprocessing.cpu_count()
+
+    if type(numshards) != int:
+      raise TypeError("Number of shards must be an integer")
+
+    if numshards <= 0:
+      raise TypeError("Number of shards must be positive")
+
+
+    self.numberofblocks = num_blocks
+    self.sizeofblocks = block_size
+
+    # anonymous mappings are shared with child processes (and start zeroed,
+    # which gives us the padding for any 'gaps' in the data)
+    self._mmap = mmap.mmap(-1, num_blocks * block_size)
+    self._bytes = np.frombuffer(self._mmap, dtype=np.uint8)
+    self._blocks = self._bytes.view(np.uint64).reshape(num_blocks, block_size / 8)
+
+    # shards start on a byte of the bitstring
+    blockspershard = int(math.ceil(num_blocks / float(numshards) / 8)) * 8
+    self._shardranges = []
+    for firstblock in range(0, num_blocks, blockspershard):
+      self._shardranges.append((firstblock, min(firstblock + blockspershard, num_blocks)))
+
+    self.numshards = len(self._shardranges)
+
+    self._token = _nexttoken
+    _nexttoken = _nexttoken + 1
+    _shareddatastores[self._token] = self
+
+    # the workers are forked here and see the datastore from now on
+    self._pool = multiprocessing.Pool(self.numshards)
+
+
+
+  def _produce_partial_blocks(self, bitstringlist):
+    # Private helper that has every shard XOR its part of every query and
+    # returns the combined blocks as a numqueries x (sizeofblocks / 8) array.
+
+    shardargslist = []
+    for firstblock, lastblock in self._shardranges:
+      shardbitstringlist = [bitstring[firstblock / 8:(lastblock + 7) / 8] for bitstring in bitstringlist]
+      shardargslist.append((self._token, firstblock, lastblock, shardbitstringlist))
+
+    resultblocks = np.zeros((len(bitstringlist), self.sizeofblocks / 8), dtype=np.uint64)
+
+    for partialblocks in self._pool.map(_xor_shard, shardargslist):
+      resultblocks ^= np.frombuffer(partialblocks, dtype=np.uint64).reshape(len(bitstringlist), -1)
+
+    return resultblocks
+
+
+
+  def _check_bitstring(self, bitstring):
+    # Private helper that checks a bitstring the same way the datastores do
+
+    if type(bitstring) != str:
+      raise TypeError("bitstring must be a string")
+
+    if len(bitstring) != math.ceil(self.numberofblocks/8.0):
+      raise TypeError("bitstring is not of the correct length")
+
+
+
+  def produce_xor_from_bitstring(self, bitstring):
+    """
+    <Purpose>
+      Returns an XORed block from an XORdatastore.   See the XORdatastore
+      documentation.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.
+
+    <Exceptions>
+      TypeError is raised if the bitstring is invalid
+
+    <Returns>
+      The XORed block.
+
+    """
+    self._check_bitstring(bitstring)
+
+    return self._produce_partial_blocks([bitstring])[0].tobytes()
+
+
+
+  def produce_xor_into(self, bitstring, out_buffer):
+    """
+    <Purpose>
+      Writes an XORed block into out_buffer.   See the XORdatastore
+      documentation.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.
+
+      out_buffer: a writable buffer of at least sizeofblocks bytes.
+
+    <Exceptions>
+      TypeError is raised if the bitstring or out_buffer is invalid
+
+    <Returns>
+      None
+
+    """
+    outview = memoryview(out_buffer)
+
+    if outview.readonly:
+      raise TypeError("out_buffer must be writable")
+
+    if len(outview) * outview.itemsize < self.sizeofblocks:
+      raise TypeError("out_buffer is smaller than a block")
+
+    self._check_bitstring(bitstring)
+
+    np.asarray(outview).reshape(-1).view(np.uint8)[:self.sizeofblocks] = self._produce_partial_blocks([bitstring])[0].view(np.uint8)
+
+
+
+  def produce_xor_from_bitstrings(self, bitstringlist):
+    """
+    <Purpose>
+      Returns the XORed blocks for several bitstrings.   Each worker handles
+      its shard of every query in one task.
+
+    <Arguments>
+      bitstringlist: a list of bitstrings.
+
+    <Exceptions>
+      TypeError is raised if the list or any of the bitstrings are invalid
+
+    <Returns>
+      A list with the XORed block for each bitstring (in the same order).
+
+    """
+    if type(bitstringlist) != list:
+      raise TypeError("bitstringlist must be a list")
+
+    for bitstring in bitstringlist:
+      self._check_bitstring(bitstring)
+
+    if not bitstringlist:
+      return []
+
+    return [resultblock.tobytes() for resultblock in self._produce_partial_blocks(bitstringlist)]
+
+
+
+  def close(self):
+    """
+    <Purpose>
+      Stops the worker processes.   The datastore can't answer queries
+      afterwards (but get_data / set_data still work).
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+
+    """
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool.join()
+      self._pool = None
+
+    if self._token in _shareddatastores:
+      del _shareddatastores[self._token]
@@ -0,0 +1,267 @@
+# this is a few tests of the event loop session server.   If everything
+# passes, there is no output.
+
+import socket
+
+import threading
+
+import time
+
+import session
+
+import uppirlib
+
+import asyncsessionserver
+
+import fairscheduler
+
+import metricsregistry
+
+
+releasedreplies = []
+
+def handle_request(requeststring, remoteaddress):
+  if requeststring == 'fail':
+    raise ValueError("asked to fail")
+
+  if requeststring == 'slow':
+    time.sleep(0.2)
+
+  # a reusable buffer, like the mirror's answers
+  return bytearray('You said: '+requeststring)
+
+def release_reply(reply):
+  releasedreplies.append(reply)
+
+
+myserver = asyncsessionserver.SessionServer(('127.0.0.1', 0), handle_request, releasereply=release_reply, numworkers=2, maxrequestsize=100000, idletimeout=0.5)
+serverport = myserver.socket.getsockname()[1]
+
+serverthread = threading.Thread(target=myserver.serve_forever)
+serverthread.start()
+
+try:
+  def connect():
+    s = socket.socket()
+    s.connect(('127.0.0.1', serverport))
+    return s
+
+  def get_response(requeststring):
+    s = connect()
+    session.sendmessage(s, requeststring)
+    return session.recvmessage(s)
+
+  assert(get_response('HELLO') == 'You said: HELLO')
+  assert(get_response('') == 'You said: ')
+  assert(get_response('x'*50000) == 'You said: '+'x'*50000)
+
+  # many connections at once (more than the workers), slow and fast
+  sockets = []
+  for number in range(50):
+    s = connect()
+    if number % 10 == 0:
+      session.sendmessage(s, 'slow')
+    else:
+      session.sendmessage(s, str(number))
+    sockets.append(s)
+
+  for number, s in enumerate(sockets):
+    if number % 10 == 0:
+      assert(session.recvmessage(s) == 'You said: slow')
+    else:
+      assert(session.recvmessage(s) == 'You said: '+str(number))
+    s.close()
+
+  # a connection carries many requests, and a -1 closes it
+  s = connect()
+  for number in range(5):
+    session.sendmessage(s, str(number))
+    assert(session.recvmessage(s) == 'You said: '+str(number))
+  session.sendclose(s)
+  assert(s.recv(1) == '')
+
+  # pipelined requests (more than are read ahead) come back in order, even
+  # when an early one is slow.   The -1 waits for all of the replies.
+  s = connect()
+  session.sendmessage(s, 'slow')
+  for number in range(asyncsessionserver.MAX_PIPELINED_REQUESTS * 2):
+    session.sendmessage(s, str(number))
+  session.sendclose(s)
+  assert(session.recvmessage(s) == 'You said: slow')
+  for number in range(asyncsessionserver.MAX_PIPELINED_REQUESTS * 2):
+    assert(session.recvmessage(s) == 'You said: '+str(number))
+  try:
+    session.recvmessage(s)
+  except session.SessionEOF:
+    pass
+  else:
+    print "the server did not close the connection after -1"
+
+  # the same through a SessionConnection
+  serverlocation = '127.0.0.1:'+str(serverport)
+  connection = uppirlib.SessionConnection(serverlocation, 1)
+  assert(connection.query('HELLO') == 'You said: HELLO')
+  for number in range(10):
+    connection.send_request(str(number))
+  for number in range(10):
+    assert(connection.get_reply() == 'You said: '+str(number))
+
+  try:
+    connection.get_reply()
+  except ValueError:
+    pass
+  else:
+    print "get_reply without a request worked"
+
+  # an idle connection is closed by the server and query reconnects
+  time.sleep(1.5)
+  assert(myserver.get_connectioncount() == 0)
+  assert(connection.query('HELLO') == 'You said: HELLO')
+  connection.close()
+
+  # a new connection that fails is not retried
+  try:
+    uppirlib.SessionConnection('127.0.0.1:1', 1)
+  except socket.error:
+    pass
+  else:
+    print "connected to a closed port"
+
+  # a failing request or a bad message just closes the connection...
+  s = connect()
+  session.sendmessage(s, 'fail')
+  assert(s.recv(1) == '')
+
+  s = connect()
+  s.sendall('abc\n')
+  assert(s.recv(1) == '')
+
+  s = connect()
+  s.sendall('100001\n')
+  assert(s.recv(1) == '')
+
+  # ... and a client that leaves early is fine
+  s = connect()
+  session.sendmessage(s, 'slow')
+  s.close()
+  time.sleep(0.3)
+
+  # ... and the server still works
+  assert(get_response('HELLO') == 'You said: HELLO')
+
+  # every reply was given back (the last just after it was sent)
+  time.sleep(0.2)
+  assert(len(releasedreplies) == 3 + 50 + 5 + 1 + asyncsessionserver.MAX_PIPELINED_REQUESTS * 2 + 1 + 10 + 1 + 1 + 1)
+
+  assert(myserver.get_connectioncount() == 0)
+
+  # the request size limit can be raised while serving
+  myserver.set_maxrequestsize(200000)
+  assert(get_response('x'*150000) == 'You said: '+'x'*150000)
+
+  try:
+    myserver.set_maxrequestsize(0)
+  except TypeError:
+    pass
+  else:
+    print "maxrequestsize=0 was allowed"
+
+  # bad limits
+  try:
+    asyncsessionserver.SessionServer(('127.0.0.1', 0), handle_request, numworkers=0)
+  except TypeError:
+    pass
+  else:
+    print "numworkers=0 was allowed"
+
+finally:
+  myserver.shutdown()
+  serverthread.join()
+
+
+
+# with a shared scheduler, a client over its share is told it is busy
+myscheduler = fairscheduler.FairScheduler(1, 10, 1)
+mymetrics = metricsregistry.MetricsRegistry()
+myserver = asyncsessionserver.SessionServer(('127.0.0.1', 0), handle_request, scheduler=myscheduler, busyreply='busy', metrics=mymetrics)
+serverport = myserver.socket.getsockname()[1]
+
+serverthread = threading.Thread(target=myserver.serve_forever)
+serverthread.start()
+
+try:
+  slowsocket = socket.socket()
+  slowsocket.connect(('127.0.0.1', serverport))
+  session.sendmessage(slowsocket, 'slow')
+  time.sleep(0.05)
+
+  s = socket.socket()
+  s.connect(('127.0.0.1', serverport))
+  session.sendmessage(s, 'HELLO')
+  assert(session.recvmessage(s) == 'busy')
+
+  assert(session.recvmessage(slowsocket) == 'You said: slow')
+
+  # and once the slow one is done, it works again
+  session.sendmessage(s, 'HELLO')
+  assert(session.recvmessage(s) == 'You said: HELLO')
+
+  assert(myscheduler.get_metrics()['rejectedclientquota'] == 1)
+
+  # the traffic was recorded (the last reply just after it was sent)
+  time.sleep(0.2)
+  assert(mymetrics.get_value('uppir_bytes_received_total') == len('4\nslow') + 2 * len('5\nHELLO'))
+  assert(mymetrics.get_value('uppir_bytes_sent_total') == len('4\nbusy') + len('14\nYou said: slow') + len('15\nYou said: HELLO'))
+  assert(mymetrics.get_value('uppir_send_seconds')[0] == 3)
+  assert('uppir_active_connections 2' in mymetrics.render().splitlines())
+
+finally:
+  myserver.shutdown()
+  serverthread.join()
+
+myscheduler.shutdown()
+
+
+
+# a deferred handler replies from another thread and does not hold a worker
+# meanwhile, so one worker serves several slow requests at once
+def handle_deferred_request(requeststring, remoteaddress, reply):
+  if requeststring == 'fail':
+    raise ValueError("asked to fail")
+  if requeststring == 'failater':
+    reply(None, ValueError("asked to fail later"))
+    return
+  threading.Timer(0.3, reply, ('Later: '+requeststring, None)).start()
+
+myserver = asyncsessionserver.SessionServer(('127.0.0.1', 0), handle_deferred_request, numworkers=1, deferredhandler=True)
+serverport = myserver.socket.getsockname()[1]
+
+serverthread = threading.Thread(target=myserver.serve_forever)
+serverthread.start()
+
+try:
+  starttime = time.time()
+  sockets = []
+  for number in range(5):
+    s = socket.socket()
+    s.connect(('127.0.0.1', serverport))
+    session.sendmessage(s, str(number))
+    sockets.append(s)
+
+  for number, s in enumerate(sockets):
+    assert(session.recvmessage(s) == 'Later: '+str(number))
+    s.close()
+  assert(time.time() - starttime < 1.0)
+
+  # a handler that raises, or replies with an error, closes the connection
+  for requeststring in ['fail', 'failater']:
+    s = socket.socket()
+    s.connect(('127.0.0.1', serverport))
+    session.sendmessage(s, requeststring)
+    assert(s.recv(1) == '')
+    s.close()
+
+finally:
+  myserver.shutdown()
+  serverthread.join()
+
@@ -0,0 +1,65 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import random
+
+import memoizedxordatastore
+
+import simplexordatastore
+
+size = 64
+
+for blockcount in [1, 7, 16, 21]:
+  myxordatastore = simplexordatastore.XORDatastore(size, blockcount)
+  myxordatastore.set_data(0, "".join(chr(random.randrange(0, 256)) for i in xrange(size*blockcount)))
+
+  bitstringlist = [chr(0)*((blockcount+7)/8), chr(255)*((blockcount+7)/8)]
+  for iteration in range(5):
+    bitstringlist.append("".join(chr(random.randrange(0, 256)) for i in xrange((blockcount+7)/8)))
+
+  expectedlist = myxordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+  for groupsize in [1, 2, 4, 8]:
+    memoizeddatastore = memoizedxordatastore.MemoizedXORDatastore(myxordatastore, simplexordatastore, groupsize)
+
+    # before precompute, the wrapped datastore answers...
+    assert(memoizeddatastore.produce_xor_from_bitstring(bitstringlist[2]) == expectedlist[2])
+
+    memoizeddatastore.precompute()
+
+    # ... and afterwards the table must give the same answers
+    for bitstring, expected in zip(bitstringlist, expectedlist):
+      assert(memoizeddatastore.produce_xor_from_bitstring(bitstring) == expected)
+
+    assert(memoizeddatastore.produce_xor_from_bitstrings(bitstringlist) == expectedlist)
+
+    outbuffer = bytearray(size)
+    for bitstring, expected in zip(bitstringlist, expectedlist):
+      memoizeddatastore.produce_xor_into(bitstring, outbuffer)
+      assert(str(outbuffer) == expected)
+
+    assert(memoizeddatastore.get_data(0, 3) == myxordatastore.get_data(0, 3))
+
+    try:
+      memoizeddatastore.produce_xor_from_bitstring(chr(0)*((blockcount+7)/8 + 1))
+    except TypeError:
+      pass
+    else:
+      print "didn't detect incorrect (long) bitstring length"
+
+
+
+# set_data must throw the table away
+myxordatastore = simplexordatastore.XORDatastore(size, 8)
+memoizeddatastore = memoizedxordatastore.MemoizedXORDatastore(myxordatastore, simplexordatastore, 4)
+memoizeddatastore.precompute()
+
+memoizeddatastore.set_data(0, 'A' * size)
+assert(memoizeddatastore.produce_xor_from_bitstring(chr(128))[0] == 'A')
+
+
+try:
+  memoizedxordatastore.MemoizedXORDatastore(myxordatastore, simplexordatastore, 3)
+except TypeError:
+  pass
+else:
+  print "Was allowed to use a group size of 3"
@@ -0,0 +1,165 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import os
+import random
+import shutil
+import tempfile
+
+import mmapxordatastore
+
+import numpyxordatastore
+
+import uppirlib
+
+tempdir = tempfile.mkdtemp()
+
+try:
+  datastorefilename = os.path.join(tempdir, 'test.xordatastore')
+
+  size = 64
+  blockcount = 21
+
+  writablexordatastore = mmapxordatastore.XORDatastore(size, blockcount, datastorefilename, readonly=False)
+  numpyds = numpyxordatastore.XORDatastore(size, blockcount)
+
+  randomdata = "".join(chr(random.randrange(0, 256)) for i in xrange(size*blockcount - 10))
+  writablexordatastore.set_data(5, randomdata)
+  numpyds.set_data(5, randomdata)
+  writablexordatastore.flush()
+  del writablexordatastore
+
+  # the file is block aligned and the gaps are zeros
+  assert(os.path.getsize(datastorefilename) == size*blockcount)
+  assert(open(datastorefilename, 'rb').read() == chr(0)*5 + randomdata + chr(0)*5)
+
+  letterxordatastore = mmapxordatastore.XORDatastore(size, blockcount, datastorefilename)
+
+  assert(letterxordatastore.get_data(5, 10) == randomdata[:10])
+
+  for iteration in range(5):
+    bitstring = "".join(chr(random.randrange(0, 256)) for i in xrange((blockcount+7)/8))
+    assert(letterxordatastore.produce_xor_from_bitstring(bitstring) == numpyds.produce_xor_from_bitstring(bitstring))
+
+  # these are hints, so they only need to not fail
+  letterxordatastore.advise('random')
+  letterxordatastore.prefault()
+
+  try:
+    letterxordatastore.advise('fast')
+  except TypeError:
+    pass
+  else:
+    print "Was allowed to give unknown advice"
+
+  try:
+    letterxordatastore.set_data(0, "hi")
+  except TypeError:
+    pass
+  else:
+    print "Was allowed to write to a read-only datastore"
+
+  try:
+    mmapxordatastore.XORDatastore(size, blockcount + 1, datastorefilename)
+  except ValueError:
+    pass
+  else:
+    print "Was allowed to map a file of the wrong size"
+
+
+
+  # now build a datastore file from a manifest...
+  releasedir = os.path.join(tempdir, 'release')
+  os.mkdir(releasedir)
+  open(os.path.join(releasedir, 'file1'), 'w').write('A' * 100)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 200)
+
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+
+  releasefilename = os.path.join(tempdir, 'release.xordatastore')
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'built')
+  assert(myxordatastore.readonly)
+
+  def check_datastore(myxordatastore):
+    for fileinfo in manifestdict['fileinfolist']:
+      assert(myxordatastore.get_data(fileinfo['offset'], fileinfo['length']) == open(os.path.join(releasedir, fileinfo['filename'])).read())
+
+  check_datastore(myxordatastore)
+
+  # ... which is reused the next time ...
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'mapped')
+
+  # ... unless asked to check it again ...
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir, reverify=True)
+  assert(state == 'built')
+
+  # ... or a file changed ...
+  os.utime(os.path.join(releasedir, 'file1'), (0, 0))
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'built')
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'mapped')
+
+  # ... or it is for a new release, which is updated in place.   Only the
+  # blocks that changed are read (so damaging file1 where its blocks did not
+  # change does not matter).
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 190 + 'C' * 10)
+  oldmanifestdict = manifestdict
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+
+  changedblocklist = uppirlib.find_changed_blocks(oldmanifestdict, manifestdict)
+  for fileinfo in manifestdict['fileinfolist']:
+    if fileinfo['filename'] == 'file1':
+      file1offset = fileinfo['offset']
+  for position in range(100):
+    if (file1offset + position) / 64 not in changedblocklist:
+      break
+  file1fo = open(os.path.join(releasedir, 'file1'), 'r+')
+  file1fo.seek(position)
+  file1fo.write('X')
+  file1fo.close()
+
+  oldinode = os.stat(releasefilename).st_ino
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'updated')
+  assert(os.stat(releasefilename).st_ino == oldinode)
+  assert(myxordatastore.get_data(file1offset, 100) == 'A' * 100)
+  open(os.path.join(releasedir, 'file1'), 'w').write('A' * 100)
+  check_datastore(myxordatastore)
+
+  # a copy is updated instead if the old file is still in use (this release
+  # is bigger)
+  oldxordatastore = myxordatastore
+  oldcontents = oldxordatastore.get_data(0, manifestdict['blockcount'] * 64)
+  open(os.path.join(releasedir, 'file3'), 'w').write('D' * 300)
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir, inplace=False)
+  assert(state == 'updated')
+  check_datastore(myxordatastore)
+  assert(oldxordatastore.get_data(0, len(oldcontents)) == oldcontents)
+
+  # (that copy is a reflink or a full copy, depending on the filesystem)
+  mmapxordatastore._copy_file(releasefilename, releasefilename + '.copy')
+  assert(open(releasefilename + '.copy', 'rb').read() == open(releasefilename, 'rb').read())
+  os.remove(releasefilename + '.copy')
+
+  # a changed block that does not match its hash is an error
+  open(os.path.join(releasedir, 'file3'), 'w').write('F' * 100)
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+  open(os.path.join(releasedir, 'file3'), 'w').write('G' * 100)
+  try:
+    mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  except uppirlib.IncorrectFileContents:
+    pass
+  else:
+    print "An update with a bad block worked"
+
+  # a different block size means a rebuild
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=128, vendorhostname='localhost')
+  myxordatastore, state = mmapxordatastore.open_datastore_file(manifestdict, releasefilename, releasedir)
+  assert(state == 'built')
+  check_datastore(myxordatastore)
+
+finally:
+  shutil.rmtree(tempdir)
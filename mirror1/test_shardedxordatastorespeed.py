@@ -0,0 +1,44 @@
+# let's print out how the sharded datastore scales with the number of shards
+# (worker processes)...
+
+# for timing...
+import time
+
+import os
+
+import multiprocessing
+
+import shardedxordatastore
+
+blocksize = 64*1024
+numblocks = 1024
+
+ITERATIONS = 10
+
+shardcountstotest = [1]
+while shardcountstotest[-1] < multiprocessing.cpu_count():
+  shardcountstotest.append(min(shardcountstotest[-1] * 2, multiprocessing.cpu_count()))
+
+print "CPUs:",multiprocessing.cpu_count(),"Blocksize:",blocksize,"blockcount:",numblocks
+
+randomdata = os.urandom(blocksize * numblocks)
+bitstringlist = [os.urandom(numblocks / 8) for iteration in range(ITERATIONS)]
+
+for numshards in shardcountstotest:
+  thisxordatastore = shardedxordatastore.XORDatastore(blocksize, numblocks, numshards)
+  thisxordatastore.set_data(0, randomdata)
+
+  # one at a time...
+  start = time.time()
+  for bitstring in bitstringlist:
+    thisxordatastore.produce_xor_from_bitstring(bitstring)
+  singletime = (time.time() - start) / ITERATIONS
+
+  # ... and all at once
+  start = time.time()
+  thisxordatastore.produce_xor_from_bitstrings(bitstringlist)
+  batchtime = (time.time() - start) / ITERATIONS
+
+  print "shards:",numshards,"per query:",singletime,"batched per query:",batchtime,"MB/s:",blocksize * numblocks / singletime / 1024 / 1024
+
+  thisxordatastore.close()
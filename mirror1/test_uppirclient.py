@@ -0,0 +1,121 @@
+# this tests the client's batched requests against mirrors that only know
+# XORBLOCK and close the connection after every reply (as the first mirrors
+# did).   If everything passes, there is no output.
+
+import sys
+import threading
+import StringIO
+import SocketServer
+
+import session
+
+import uppirlib
+
+import simplexordatastore
+
+import simplexorrequestor
+
+import uppir_client
+
+
+BLOCKSIZE = 64
+BLOCKCOUNT = 64
+
+xordatastore = simplexordatastore.XORDatastore(BLOCKSIZE, BLOCKCOUNT)
+for blocknumber in range(BLOCKCOUNT):
+  xordatastore.set_data(blocknumber * BLOCKSIZE, chr(blocknumber) * BLOCKSIZE)
+
+bitstringlength = uppirlib.compute_bitstring_length(BLOCKCOUNT)
+
+# the requests the old mirrors were sent
+requeststrings = []
+
+class OneShotRequestHandler(SocketServer.BaseRequestHandler):
+  # answers one request the way the first mirrors did, then hangs up
+
+  def handle(self):
+    requeststring = session.recvmessage(self.request)
+    requeststrings.append(requeststring)
+
+    if requeststring.startswith('XORBLOCK'):
+      bitstring = requeststring[len('XORBLOCK'):]
+      if len(bitstring) != bitstringlength:
+        session.sendmessage(self.request, 'Invalid request length')
+        return
+
+      session.sendmessage(self.request, xordatastore.produce_xor_from_bitstring(bitstring))
+
+    else:
+      session.sendmessage(self.request, 'Invalid request type')
+
+
+class OneShotServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+
+serverlist = []
+for number in range(2):
+  server = OneShotServer(('127.0.0.1', 0), OneShotRequestHandler)
+  threading.Thread(target=server.serve_forever).start()
+  serverlist.append(server)
+
+try:
+  serverport = serverlist[0].socket.getsockname()[1]
+
+  bitstringlist = [chr(128) + chr(0) * (bitstringlength - 1), chr(64) + chr(0) * (bitstringlength - 1), chr(192) + chr(0) * (bitstringlength - 1)]
+  expectedlist = [chr(0) * BLOCKSIZE, chr(1) * BLOCKSIZE, chr(1) * BLOCKSIZE]
+
+  # a batch sent anyway is retried one block at a time (with or without a
+  # connection of our own)
+  assert(uppirlib.retrieve_xorblocks_from_mirror('127.0.0.1', serverport, bitstringlist) == expectedlist)
+
+  connection = uppirlib.SessionConnection('127.0.0.1:'+str(serverport), serverport)
+  assert(uppirlib.retrieve_xorblocks_from_mirror('127.0.0.1', serverport, bitstringlist, connection) == expectedlist)
+  assert(uppirlib.retrieve_xorblocks_from_mirror('127.0.0.1', serverport, bitstringlist, connection) == expectedlist)
+  connection.close()
+
+  # bitstrings that really are the wrong length are still an error
+  try:
+    uppirlib.retrieve_xorblocks_from_mirror('127.0.0.1', serverport, [chr(0), chr(0)])
+  except ValueError:
+    pass
+  else:
+    print "Did not detect bitstrings of the wrong length"
+
+
+  # the client (with its default batch size) gets every block from mirrors
+  # that don't advertise XORBLOCKS, without sending them any batches
+  del requeststrings[:]
+
+  sys.argv = ['uppir_client.py', 'file1']
+  uppir_client.parse_options()
+  assert(uppir_client._commandlineoptions.batchsize > 1)
+
+  # (don't report the blocks to a vendor)
+  uppir_client.RANDOM_THRESHOLD = 1.0
+
+  mirrorinfolist = [{'ip':'127.0.0.1', 'port':server.socket.getsockname()[1]} for server in serverlist]
+  blocklist = range(0, BLOCKCOUNT, 3)
+  manifestdict = {'blockcount':BLOCKCOUNT, 'hashalgorithm':'noop', 'blockhashlist':['']*BLOCKCOUNT}
+  rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, blocklist, manifestdict, 2)
+
+  # (it writes its progress to stdout)
+  realstdout = sys.stdout
+  sys.stdout = StringIO.StringIO()
+  try:
+    uppir_client._request_helper(rxgobj)
+  finally:
+    sys.stdout = realstdout
+
+  for blocknumber in blocklist:
+    assert(rxgobj.return_block(blocknumber) == chr(blocknumber) * BLOCKSIZE)
+
+  for requeststring in requeststrings:
+    assert(not requeststring.startswith('XORBLOCKS'))
+  assert(len(requeststrings) == 2 * len(blocklist))
+
+finally:
+  for server in serverlist:
+    server.shutdown()
+    server.server_close()
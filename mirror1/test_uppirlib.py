@@ -0,0 +1,165 @@
+# this is a few tests of the block hashing in uppirlib.   If everything
+# passes, there is no output.
+
+import os
+import random
+import shutil
+import tempfile
+
+import uppirlib
+
+import simplexordatastore
+
+import fastsimplexordatastore
+
+import numpyxordatastore
+
+
+blocksize = 4096
+blockcount = 300
+
+randomdata = "".join(chr(random.randrange(0, 256)) for i in xrange(blocksize*blockcount - 100))
+
+expectedhashlist = []
+for blocknum in range(blockcount):
+  expectedhashlist.append(uppirlib.find_hash((randomdata + chr(0)*100)[blocknum*blocksize:(blocknum+1)*blocksize], 'sha1-hex'))
+
+# the datastores that give copies and those that give views agree...
+for xordatastoremodule in [simplexordatastore, fastsimplexordatastore, numpyxordatastore]:
+  myxordatastore = xordatastoremodule.XORDatastore(blocksize, blockcount)
+  myxordatastore.set_data(0, randomdata)
+
+  # ... however many threads hash
+  for hashthreads in [1, 3, 8]:
+    progresslist = []
+    def record_progress(blocksdone, totalblocks, bytespersecond):
+      progresslist.append((blocksdone, totalblocks))
+
+    assert(uppirlib._compute_block_hashlist(myxordatastore, blockcount, blocksize, 'sha1-hex', hashthreads, record_progress) == expectedhashlist)
+    assert(progresslist[-1] == (blockcount, blockcount))
+
+  assert(uppirlib._compute_block_hashlist(myxordatastore, blockcount, blocksize, 'noop') == [''] * blockcount)
+
+
+# an error in a hashing thread is raised
+try:
+  uppirlib._compute_block_hashlist(myxordatastore, blockcount, blocksize, 'nothash-hex', 4)
+except TypeError:
+  pass
+else:
+  print "a bad hash algorithm was allowed"
+
+try:
+  uppirlib._compute_block_hashlist(myxordatastore, blockcount, blocksize, 'sha1-hex', 0)
+except TypeError:
+  pass
+else:
+  print "no hashing threads was allowed"
+
+
+# find_hash takes buffers too
+assert(uppirlib.find_hash(memoryview('hello'), 'sha1-hex') == uppirlib.find_hash('hello', 'sha1-hex'))
+assert(len(uppirlib.find_hash('hello', 'sha256-raw')) == 32)
+
+
+# requests for a release other than a mirror's first are prefixed
+assert(uppirlib.get_release_prefix(None) == '')
+assert(uppirlib.get_release_prefix('42ab') == 'RELEASE 42ab ')
+
+for badhash in ['', 'a b', 42]:
+  try:
+    uppirlib.get_release_prefix(badhash)
+  except TypeError:
+    pass
+  else:
+    print "a bad manifest hash was allowed: "+repr(badhash)
+
+
+# mirrors advertise their load with all of these as finite numbers that are
+# not negative
+uppirlib.check_mirror_load({'queued':0, 'running':2, 'xorlatency':0.01, 'capacity':260})
+
+for badload in [None, {}, {'queued':0, 'running':2, 'xorlatency':0.01}, {'queued':-1, 'running':2, 'xorlatency':0.01, 'capacity':260}, {'queued':'0', 'running':2, 'xorlatency':0.01, 'capacity':260}, {'queued':0, 'running':2, 'xorlatency':0.01, 'capacity':float('inf')}, {'queued':0, 'running':2, 'xorlatency':float('nan'), 'capacity':260}]:
+  try:
+    uppirlib.check_mirror_load(badload)
+  except TypeError:
+    pass
+  else:
+    print "a bad mirror load was allowed: "+repr(badload)
+
+
+
+# a datastore is updated to a new release by rewriting only the blocks that
+# changed
+class RecordingDatastore(simplexordatastore.XORDatastore):
+  def set_data(self, offset, data):
+    writelist.append((offset, len(data)))
+    simplexordatastore.XORDatastore.set_data(self, offset, data)
+
+def new_release_manifest(blocksize=64):
+  return uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=blocksize, vendorhostname='localhost')
+
+def populated_datastore(manifestdict):
+  myxordatastore = RecordingDatastore(manifestdict['blocksize'], manifestdict['blockcount'])
+  uppirlib.populate_xordatastore(manifestdict, myxordatastore, rootdir=releasedir)
+  return myxordatastore
+
+tempdir = tempfile.mkdtemp()
+try:
+  releasedir = os.path.join(tempdir, 'release')
+  os.mkdir(releasedir)
+  open(os.path.join(releasedir, 'file1'), 'w').write('A' * 1000)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 1000)
+  oldmanifestdict = new_release_manifest()
+
+  writelist = []
+  myxordatastore = populated_datastore(oldmanifestdict)
+
+  # one byte in file2 changes one block
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 500 + 'C' + 'B' * 499)
+  newmanifestdict = new_release_manifest()
+  changedblocklist = uppirlib.find_changed_blocks(oldmanifestdict, newmanifestdict)
+  assert(len(changedblocklist) == 1)
+
+  writelist = []
+  progresslist = []
+  def record_progress(blocksdone, totalblocks, bytespersecond):
+    progresslist.append((blocksdone, totalblocks))
+
+  assert(uppirlib.update_xordatastore(oldmanifestdict, newmanifestdict, myxordatastore, releasedir, record_progress) == 1)
+  assert(writelist == [(changedblocklist[0] * 64, 64)])
+  assert(progresslist[-1] == (1, 1))
+  assert(uppirlib._compute_block_hashlist(myxordatastore, newmanifestdict['blockcount'], 64, 'sha1-hex') == newmanifestdict['blockhashlist'])
+
+  # a bigger release adds blocks at the end (which are written together)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 500 + 'C' + 'B' * 1499)
+  biggermanifestdict = new_release_manifest()
+  biggerxordatastore = RecordingDatastore(64, biggermanifestdict['blockcount'])
+  biggerxordatastore.set_data(0, myxordatastore.get_data(0, newmanifestdict['blockcount'] * 64))
+
+  writelist = []
+  assert(uppirlib.update_xordatastore(newmanifestdict, biggermanifestdict, biggerxordatastore, releasedir) == len(uppirlib.find_changed_blocks(newmanifestdict, biggermanifestdict)))
+  assert(len(writelist) < len(uppirlib.find_changed_blocks(newmanifestdict, biggermanifestdict)))
+  assert(uppirlib._compute_block_hashlist(biggerxordatastore, biggermanifestdict['blockcount'], 64, 'sha1-hex') == biggermanifestdict['blockhashlist'])
+
+  # a changed block is checked before it is written (the damage is in an
+  # added block)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 500 + 'C' + 'B' * 1498 + 'D')
+  writelist = []
+  try:
+    uppirlib.update_xordatastore(newmanifestdict, biggermanifestdict, RecordingDatastore(64, biggermanifestdict['blockcount']), releasedir)
+  except uppirlib.IncorrectFileContents:
+    pass
+  else:
+    print "an update with a bad block worked"
+
+  # releases with different block sizes can't be compared
+  try:
+    uppirlib.find_changed_blocks(oldmanifestdict, new_release_manifest(128))
+  except ValueError:
+    pass
+  else:
+    print "releases with different block sizes were compared"
+
+finally:
+  shutil.rmtree(tempdir)
@@ -0,0 +1,138 @@
+# this is a test of a mirror that coalesces queries, answering them through
+# the scheduler as it does when serving.   (It runs the mirror's servers in
+# this process, unlike test_uppirmirror.py.)   If everything passes, there
+# is no output.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+
+import session
+
+import uppirlib
+
+import fairscheduler
+
+import versionedholder
+
+import simplexordatastore
+
+import asyncsessionserver
+
+import uppir_mirror
+
+
+XORWORKERS = 2
+CLIENTS = 16
+QUERIESPERCLIENT = 5
+
+tempdir = tempfile.mkdtemp()
+
+try:
+  releasedir = os.path.join(tempdir, 'release')
+  os.mkdir(releasedir)
+  for number in range(4):
+    open(os.path.join(releasedir, 'file'+str(number)), 'w').write(os.urandom(1000 + number * 300))
+
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+  bitstringlength = uppirlib.compute_bitstring_length(manifestdict['blockcount'])
+
+  # (the window is long, so every client's query is in before it closes)
+  sys.argv = ['uppir_mirror.py', '--logfile='+os.path.join(tempdir, 'mirror.log'), '--xorworkers='+str(XORWORKERS), '--clientquota=64', '--coalescewindow=200', '--coalescebatch=64']
+  uppir_mirror.parse_options()
+
+  xordatastore = simplexordatastore.XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'])
+  uppirlib.populate_xordatastore(manifestdict, xordatastore, rootdir=releasedir)
+
+  # (while starting, before any release is loaded, the metrics are still
+  # valid)
+  uppir_mirror._global_releaseholders = []
+  assert('uppir_releases_served 0\n' in uppir_mirror._global_metrics.render())
+
+  uppir_mirror._global_scheduler = fairscheduler.FairScheduler(XORWORKERS, 256, 64)
+  uppir_mirror._global_releaseholders = [versionedholder.VersionedHolder(uppir_mirror._MirrorRelease(None, manifestdict, xordatastore), uppir_mirror._close_release)]
+
+  assert('uppir_releases_served 1\n' in uppir_mirror._global_metrics.render())
+
+  def get_coalescer():
+    return uppir_mirror._global_releaseholders[0].get_current().coalescer
+
+  def run_clients(serverport):
+    # CLIENTS connections at once, each sending its queries one after the
+    # other.   Returns the wrong answers and how many bitstrings were sent.
+    errors = []
+    bitstringcounts = []
+
+    def client():
+      connection = uppirlib.SessionConnection('127.0.0.1:'+str(serverport), 10)
+      try:
+        for number in range(QUERIESPERCLIENT):
+          bitstring = os.urandom(bitstringlength)
+          if random.random() < 0.5:
+            reply = connection.query('XORBLOCK'+bitstring)
+            expected = xordatastore.produce_xor_from_bitstring(bitstring)
+            bitstringcounts.append(1)
+          else:
+            reply = connection.query('XORBLOCKS'+bitstring+bitstring)
+            expected = xordatastore.produce_xor_from_bitstring(bitstring) * 2
+            bitstringcounts.append(2)
+          if reply != expected:
+            errors.append(reply)
+      finally:
+        connection.close()
+
+    threadlist = [threading.Thread(target=client) for number in range(CLIENTS)]
+    for thread in threadlist:
+      thread.start()
+    for thread in threadlist:
+      thread.join()
+
+    return errors, sum(bitstringcounts)
+
+
+  # through the async server (the default)...
+  xorserver = asyncsessionserver.SessionServer(('127.0.0.1', 0), uppir_mirror._async_request_handler, releasereply=uppir_mirror._release_reply, scheduler=uppir_mirror._global_scheduler, busyreply=uppirlib.MIRROR_BUSY_REPLY, deferredhandler=True)
+  serverthread = threading.Thread(target=xorserver.serve_forever)
+  serverthread.start()
+  try:
+    errors, bitstringcount = run_clients(xorserver.socket.getsockname()[1])
+    assert(errors == [])
+  finally:
+    xorserver.shutdown()
+    serverthread.join()
+
+  # ... the queries of more clients than there are workers were answered
+  # together (the workers do not wait for the batches)
+  metrics = get_coalescer().get_metrics()
+  assert(metrics['queries'] == bitstringcount)
+  assert(metrics['largestbatch'] > XORWORKERS)
+  assert(metrics['meanbatch'] > XORWORKERS)
+
+  # and through the threaded server (ThreadedXORRequestHandler)...
+  xorserver = uppir_mirror.ThreadedXORServer(('127.0.0.1', 0), uppir_mirror.ThreadedXORRequestHandler)
+  serverthread = threading.Thread(target=xorserver.serve_forever)
+  serverthread.start()
+  try:
+    errors, bitstringcount = run_clients(xorserver.socket.getsockname()[1])
+    assert(errors == [])
+  finally:
+    xorserver.shutdown()
+    xorserver.server_close()
+    serverthread.join()
+
+  # ... the same is true (the coalescer is shared, so only count the new
+  # batches)
+  newmetrics = get_coalescer().get_metrics()
+  assert(newmetrics['queries'] - metrics['queries'] == bitstringcount)
+  assert(bitstringcount / float(newmetrics['batches'] - metrics['batches']) > XORWORKERS)
+
+  # and nothing is left with the scheduler or holding the release
+  schedulermetrics = uppir_mirror._global_scheduler.get_metrics()
+  assert(schedulermetrics['running'] == 0 and schedulermetrics['deferred'] == 0 and schedulermetrics['clients'] == 0)
+  assert(uppir_mirror._global_releaseholders[0].get_held_versions() == 1)
+
+finally:
+  shutil.rmtree(tempdir)
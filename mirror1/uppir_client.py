@@ -45,7 +45,8 @@
 # The XORRequestor interface is used to address these issues.   A programmer
 # The programmer defines an object that is provided the manifest,
 # mirrorlist, and blocks to retrieve.   The XORRequestor object must support
-# several methods: get_next_xorrequest(), notify_failure(xorrequest),
+# several methods: get_next_xorrequests(maxrequests) (and
+# get_next_xorrequest()), notify_failure(xorrequest),
 # notify_success(xorrequest, xordata), and return_block(blocknum).   The
 # request_blocks_from_mirrors function in this file will use threads to call
 # these methods to determine what to retrieve.   The notify_* routines are
@@ -75,6 +76,9 @@ import uppirlib
 # used to issue requests in parallel
 import threading
 
+# to back off from a busy mirror
+import time
+
 
 # I really should have a way to do this based upon command line options
 import simplexorrequestor
@@ -88,23 +92,88 @@ import os.path
 # for testing set this to 0
 RANDOM_THRESHOLD = 0.8
 
+# how often to retry a mirror that says it is busy (waiting twice as long
+# each time, starting at BUSY_RETRY_DELAY seconds) before giving up on it
+BUSY_RETRIES = 6
+BUSY_RETRY_DELAY = 0.05
+
+
+def _retrieve_xorblocks(mirrorip, mirrorport, bitstringlist, connection, manifesthash, maxbatch):
+  # Private helper that requests the blocks, at most maxbatch per request,
+  # retrying while the mirror is busy.   Raises MirrorBusy if it stays busy.
+  retrydelay = BUSY_RETRY_DELAY
+  for retry in range(BUSY_RETRIES + 1):
+    try:
+      xorblocklist = []
+      for position in range(0, len(bitstringlist), maxbatch):
+        thesebitstrings = bitstringlist[position:position+maxbatch]
+        if len(thesebitstrings) == 1:
+          xorblocklist.append(uppirlib.retrieve_xorblock_from_mirror(mirrorip, mirrorport, thesebitstrings[0], connection, manifesthash))
+        else:
+          xorblocklist.extend(uppirlib.retrieve_xorblocks_from_mirror(mirrorip, mirrorport, thesebitstrings, connection, manifesthash))
+      return xorblocklist
+
+    except uppirlib.MirrorBusy:
+      if retry == BUSY_RETRIES:
+        raise
+
+      sys.stdout.write('B')
+      sys.stdout.flush()
+      # back off (with a little jitter so clients don't retry in lockstep)
+      time.sleep(retrydelay * random.uniform(1, 1.5))
+      retrydelay = retrydelay * 2
+
+
+
 def _request_helper(rxgobj):
   # Private helper to get requests.   Multiple threads will execute this...
 
-  thisrequest = rxgobj.get_next_xorrequest()
+  # this thread's connections to the mirrors, by (ip, port).   They are
+  # reused for every block from the mirror.
+  connectiondict = {}
+
+  # up to this many blocks are requested from a mirror at once
+  thesexorrequests = rxgobj.get_next_xorrequests(_commandlineoptions.batchsize)
 
   # go until there are no more requests
-  while thisrequest != ():
-    mirrorip = thisrequest[0]['ip']
-    mirrorport = thisrequest[0]['port']
-    bitstring = thisrequest[2]
+  while thesexorrequests != []:
+    mirrorip = thesexorrequests[0][0]['ip']
+    mirrorport = thesexorrequests[0][0]['port']
+    bitstringlist = [thisrequest[2] for thisrequest in thesexorrequests]
+
+    # a mirror that serves several releases is told which one we want
+    manifesthash = None
+    if 'releases' in thesexorrequests[0][0]:
+      manifesthash = rxgobj.manifestdict['manifesthash']
+
+    # a mirror that doesn't advertise XORBLOCKS (an older one) is asked for
+    # one block per request
+    maxbatch = 1
+    if 'xorblocks' in thesexorrequests[0][0] and type(thesexorrequests[0][0]['xorblocks']) in [int, long] and thesexorrequests[0][0]['xorblocks'] > 0:
+      maxbatch = thesexorrequests[0][0]['xorblocks']
+
     try:
-      # request the XOR block...
-      xorblock = uppirlib.retrieve_xorblock_from_mirror(mirrorip, mirrorport, bitstring)
+      if (mirrorip, mirrorport) not in connectiondict:
+        connectiondict[(mirrorip, mirrorport)] = uppirlib.SessionConnection(mirrorip, mirrorport)
+
+      # request the XOR blocks...
+      xorblocklist = _retrieve_xorblocks(mirrorip, mirrorport, bitstringlist, connectiondict[(mirrorip, mirrorport)], manifesthash, maxbatch)
+
+    except (uppirlib.MirrorBusy, uppirlib.UnknownRelease):
+      # it is up, but too busy to serve us (or has just stopped serving this
+      # release).   Use another mirror.
+      rxgobj.notify_failure(thesexorrequests[0])
+      sys.stdout.write('F')
+      sys.stdout.flush()
 
     except Exception, e:
+      # don't reuse a connection that failed
+      if (mirrorip, mirrorport) in connectiondict:
+        connectiondict.pop((mirrorip, mirrorport)).close()
+
       if 'socked' in str(e):
-        rxgobj.notify_failure(thisrequest)
+        # the whole batch failed
+        rxgobj.notify_failure(thesexorrequests[0])
         sys.stdout.write('F')
         sys.stdout.flush()
       else:
@@ -112,22 +181,26 @@ def _request_helper(rxgobj):
         raise
 
     else:
-      # we retrieved it successfully...
-      rxgobj.notify_success(thisrequest, xorblock)
-      sys.stdout.write('.')
-      sys.stdout.flush()
+      # we retrieved them successfully...
+      for thisrequest, xorblock in zip(thesexorrequests, xorblocklist):
+        rxgobj.notify_success(thisrequest, xorblock)
+        sys.stdout.write('.')
+        sys.stdout.flush()
 
-      if random.random() >= RANDOM_THRESHOLD:
-        testmirrorinfo = {}
-        testmirrorinfo['ip'] = mirrorip
-        testmirrorinfo['port'] = mirrorport
-        testmirrorinfo['data'] = base64.b64encode(xorblock)
-        testmirrorinfo['chunklist'] = base64.b64encode(bitstring)
-        msg = uppirlib.request_mirror_test(testmirrorinfo, _commandlineoptions.retrievemanifestfrom)
-        print msg
+        if random.random() >= RANDOM_THRESHOLD:
+          testmirrorinfo = {}
+          testmirrorinfo['ip'] = mirrorip
+          testmirrorinfo['port'] = mirrorport
+          testmirrorinfo['data'] = base64.b64encode(xorblock)
+          testmirrorinfo['chunklist'] = base64.b64encode(thisrequest[2])
+          msg = uppirlib.request_mirror_test(testmirrorinfo, _commandlineoptions.retrievemanifestfrom)
+          print msg
 
-    # regardless of failure or success, get another request...
-    thisrequest = rxgobj.get_next_xorrequest()
+    # regardless of failure or success, get more requests...
+    thesexorrequests = rxgobj.get_next_xorrequests(_commandlineoptions.batchsize)
+
+  for connection in connectiondict.values():
+    connection.close()
 
   # and that's it!
   return
@@ -158,9 +231,13 @@ def request_blocks_from_mirrors(requestedblocklist, manifestdict):
   mirrorinfolist = uppirlib.retrieve_mirrorinfolist(manifestdict['vendorhostname'], manifestdict['vendorport'])
   print "Mirrors: ",mirrorinfolist
 
+  # ...that serve our release.   (Mirrors that don't list their releases
+  # serve only the vendor's current one.)
+  mirrorinfolist = [mirrorinfo for mirrorinfo in mirrorinfolist if 'releases' not in mirrorinfo or manifestdict['manifesthash'] in mirrorinfo['releases']]
+
 
   # let's set up a requestor object...
-  rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors)
+  rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, requestedblocklist, manifestdict, _commandlineoptions.numberofmirrors, weightbyload=_commandlineoptions.weightbyload)
 
   # let's fire up the requested number of threads.   Our thread will also
   # participate
@@ -292,6 +369,14 @@ def parse_options():
         type="int", default=None,
         help="How many threads should concurrently contact mirrors? (default numberofmirrors)")
 
+  parser.add_option("","--batchsize", dest="batchsize",
+        type="int", default=16,
+        help="How many blocks to request from a mirror at once (at most 256, default 16).   Mirrors that don't support batches get one message per block.")
+
+  parser.add_option("","--weightbyload", dest="weightbyload",
+        action="store_true", default=False,
+        help="Prefer mirrors that advertise more spare capacity when choosing them at random (default False, choose uniformly)")
+
 
 
   # let's parse the args
@@ -309,6 +394,10 @@ def parse_options():
     sys.exit(1)
 
 
+  if _commandlineoptions.batchsize < 1 or _commandlineoptions.batchsize > 256:
+    print "Batch size must be between 1 and 256"
+    sys.exit(1)
+
   if len(remainingargs) == 0:
     print "Must specify some files to retrieve!"
     sys.exit(1)
@@ -26,8 +26,11 @@ if sys.version_info[1] == 5:
     sys.exit(1)
 
 
+# -pthread because a query can be split over several threads
 fastsimpledatastore_c = Extension("fastsimplexordatastore_c",
-    sources=["fastsimplexordatastore.c"])
+    sources=["fastsimplexordatastore.c"],
+    extra_compile_args=["-pthread"],
+    extra_link_args=["-pthread"])
 
 setup(	name="upPIR",
     version="0.0-prealpha",
@@ -184,6 +184,85 @@ class XORDatastore:
 
     # let's return the result!
     return currentblock
+
+
+
+  def produce_xor_into(self, bitstring, out_buffer):
+    """
+    <Purpose>
+      Like produce_xor_from_bitstring, but the XORed block is written into
+      a buffer that the caller supplies (and can reuse) instead of being
+      returned.
+
+    <Arguments>
+      bitstring: See produce_xor_from_bitstring.
+
+      out_buffer: a writable buffer (e.g. a bytearray or memoryview) of at
+                  least sizeofblocks bytes.   The first sizeofblocks bytes
+                  are overwritten.
+
+    <Exceptions>
+      TypeError is raised if the bitstring or out_buffer is invalid
+
+    <Returns>
+      None
+
+    """
+    outview = memoryview(out_buffer)
+
+    if outview.readonly:
+      raise TypeError("out_buffer must be writable")
+
+    if len(outview) * outview.itemsize < self.sizeofblocks:
+      raise TypeError("out_buffer is smaller than a block")
+
+    # This datastore builds the answer as a string anyways...
+    outview[:self.sizeofblocks] = self.produce_xor_from_bitstring(bitstring)
+
+
+
+  def produce_xor_from_bitstrings(self, bitstringlist):
+    """
+    <Purpose>
+      Returns the XORed blocks for several bitstrings.   The datastore is
+      only walked once, with each block applied to every query that selects
+      it.
+
+    <Arguments>
+      bitstringlist: a list of bitstrings.   Each one must be valid for
+                     produce_xor_from_bitstring.
+
+    <Exceptions>
+      TypeError is raised if the list or any of the bitstrings are invalid
+
+    <Returns>
+      A list with the XORed block for each bitstring (in the same order).
+
+    """
+    if type(bitstringlist) != list:
+      raise TypeError("bitstringlist must be a list")
+
+    for bitstring in bitstringlist:
+      if type(bitstring) != str:
+        raise TypeError("bitstring must be a string")
+
+      if len(bitstring) != math.ceil(self.numberofblocks/8.0):
+        raise TypeError("bitstring is not of the correct length")
+
+    # start with an empty string of the right size for each query...
+    currentblocklist = [chr(0) * self.sizeofblocks] * len(bitstringlist)
+
+    for currentblocknumber in range(self.numberofblocks):
+
+      bytenumber = currentblocknumber / 8
+      bitvalue = 2**(7-(currentblocknumber % 8))
+
+      # ... and XOR this block into every query that selects it
+      for querynumber in range(len(bitstringlist)):
+        if ord(bitstringlist[querynumber][bytenumber]) & bitvalue:
+          currentblocklist[querynumber] = do_xor(currentblocklist[querynumber], self._blocks[currentblocknumber])
+
+    return currentblocklist
       
 
 
@@ -0,0 +1,104 @@
+# this is a few tests of the batched logger.   If everything passes, there is
+# no output.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import batchedlog
+
+tempdir = tempfile.mkdtemp()
+
+try:
+  logfilename = os.path.join(tempdir, 'test.log')
+
+  def read_lines(filename):
+    return [line.split(' ', 1)[1] for line in open(filename).read().splitlines()]
+
+  # before start, lines are written at once
+  logger = batchedlog.BatchedLogger(logfilename, flushinterval=0.05)
+  logger.log('first')
+  assert(read_lines(logfilename) == ['first'])
+
+  # after, they are written in the background
+  logger.start()
+  for number in range(100):
+    logger.log('line '+str(number))
+  time.sleep(0.3)
+  assert(read_lines(logfilename) == ['first'] + ['line '+str(number) for number in range(100)])
+
+  # each line has a time stamp
+  assert(abs(float(open(logfilename).readline().split()[0]) - time.time()) < 10)
+
+  # many threads at once lose nothing
+  def worker(threadnumber):
+    for number in range(1000):
+      logger.log('thread '+str(threadnumber))
+
+  threadlist = [threading.Thread(target=worker, args=(threadnumber,)) for threadnumber in range(4)]
+  for thread in threadlist:
+    thread.start()
+  for thread in threadlist:
+    thread.join()
+
+  logger.close()
+  assert(len(read_lines(logfilename)) == 101 + 4000)
+
+
+  # request lines are sampled
+  sampledfilename = os.path.join(tempdir, 'sampled.log')
+  logger = batchedlog.BatchedLogger(sampledfilename, samplerate=10)
+  logger.start()
+  for number in range(100):
+    logger.log_request('request '+str(number))
+  logger.log('not sampled')
+  logger.close()
+  assert(read_lines(sampledfilename) == ['request '+str(number) for number in range(0, 100, 10)] + ['not sampled'])
+
+
+  # the file is rotated by size...
+  rotatedfilename = os.path.join(tempdir, 'rotated.log')
+  logger = batchedlog.BatchedLogger(rotatedfilename, maxbytes=100, backupcount=2)
+  for number in range(4):
+    logger.log('x' * 100)
+  logger.close()
+  assert(os.path.exists(rotatedfilename+'.1'))
+  assert(os.path.exists(rotatedfilename+'.2'))
+  assert(not os.path.exists(rotatedfilename+'.3'))
+  assert(len(read_lines(rotatedfilename)) == 1)
+
+  # ... or by age
+  agedfilename = os.path.join(tempdir, 'aged.log')
+  logger = batchedlog.BatchedLogger(agedfilename, rotateinterval=0.1, flushinterval=0.05)
+  logger.start()
+  logger.log('old')
+  time.sleep(0.3)
+  logger.log('new')
+  logger.close()
+  assert(read_lines(agedfilename+'.1') == ['old'])
+
+
+  # a full queue drops lines (and says so) rather than waiting
+  droppedfilename = os.path.join(tempdir, 'dropped.log')
+  logger = batchedlog.BatchedLogger(droppedfilename, maxqueued=10, flushinterval=10)
+  logger.start()
+  for number in range(15):
+    logger.log('line')
+  logger.close()
+  lines = read_lines(droppedfilename)
+  assert(lines[:10] == ['line'] * 10)
+  assert(lines[10].startswith('dropped 5 log lines'))
+
+
+  for badargs in [{'samplerate':0}, {'maxbytes':-1}, {'flushinterval':0}, {'maxqueued':'10'}]:
+    try:
+      batchedlog.BatchedLogger(os.path.join(tempdir, 'bad.log'), **badargs)
+    except TypeError:
+      pass
+    else:
+      print "bad settings were allowed: "+str(badargs)
+
+finally:
+  shutil.rmtree(tempdir)
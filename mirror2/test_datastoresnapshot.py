@@ -0,0 +1,124 @@
+# this is a few tests of datastore snapshots.   If everything passes, there is
+# no output.
+
+import os
+import shutil
+import tempfile
+
+import datastoresnapshot
+
+import simplexordatastore
+
+import uppirlib
+
+tempdir = tempfile.mkdtemp()
+
+try:
+  releasedir = os.path.join(tempdir, 'release')
+  os.mkdir(releasedir)
+  open(os.path.join(releasedir, 'file1'), 'w').write('A' * 100)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 200)
+  # (a whole number of seconds, so it can be put back exactly)
+  os.utime(os.path.join(releasedir, 'file2'), (1000000000, 1000000000))
+
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+
+  snapshotfilename = os.path.join(tempdir, 'release.snapshot')
+
+  def new_datastore():
+    return simplexordatastore.XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'])
+
+  def check_datastore(myxordatastore):
+    for fileinfo in manifestdict['fileinfolist']:
+      assert(myxordatastore.get_data(fileinfo['offset'], fileinfo['length']) == open(os.path.join(releasedir, fileinfo['filename'])).read())
+
+  # the first time it is built and saved...
+  myxordatastore = new_datastore()
+  assert(datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, releasedir) == 'built')
+  check_datastore(myxordatastore)
+  assert(os.path.getsize(snapshotfilename) == manifestdict['blockcount'] * manifestdict['blocksize'])
+  assert(datastoresnapshot.stamp_matches(snapshotfilename, manifestdict, releasedir))
+
+  # ... then it is loaded (even if the files would not pass the hash check,
+  # which shows they were not read)...
+  myxordatastore = new_datastore()
+  assert(datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, releasedir) == 'loaded')
+  check_datastore(myxordatastore)
+
+  open(os.path.join(releasedir, 'file2'), 'w').write('C' * 200)
+  os.utime(os.path.join(releasedir, 'file2'), (1000000000, 1000000000))
+
+  myxordatastore = new_datastore()
+  assert(datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, releasedir) == 'loaded')
+  assert(myxordatastore.get_data(manifestdict['fileinfolist'][1]['offset'], 1) in 'AB')
+
+  # ... unless asked to reverify
+  try:
+    datastoresnapshot.populate_xordatastore(manifestdict, new_datastore(), snapshotfilename, releasedir, reverify=True)
+  except uppirlib.IncorrectFileContents:
+    pass
+  else:
+    print "reverify did not check the files"
+
+  # a changed modification time means a rebuild
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 200)
+  os.utime(os.path.join(releasedir, 'file2'), (0, 0))
+  assert(not datastoresnapshot.stamp_matches(snapshotfilename, manifestdict, releasedir))
+  myxordatastore = new_datastore()
+  assert(datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, releasedir) == 'built')
+  check_datastore(myxordatastore)
+
+  # as does a different release
+  realmanifesthash = manifestdict['manifesthash']
+  manifestdict['manifesthash'] = 'somethingelse'
+  assert(not datastoresnapshot.load_snapshot(manifestdict, new_datastore(), snapshotfilename, releasedir))
+  manifestdict['manifesthash'] = realmanifesthash
+
+  # but a snapshot of an earlier release is updated: only the blocks that
+  # changed are read (so damaging file1 where its blocks did not change does
+  # not matter)
+  open(os.path.join(releasedir, 'file2'), 'w').write('B' * 190 + 'D' * 10)
+  oldmanifestdict = manifestdict
+  manifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=64, vendorhostname='localhost')
+  assert(datastoresnapshot.get_updatable_manifest(manifestdict, snapshotfilename) == oldmanifestdict)
+
+  changedblocklist = uppirlib.find_changed_blocks(oldmanifestdict, manifestdict)
+  assert(0 < len(changedblocklist) < manifestdict['blockcount'])
+  for fileinfo in manifestdict['fileinfolist']:
+    if fileinfo['filename'] == 'file1':
+      file1offset = fileinfo['offset']
+  for position in range(100):
+    if (file1offset + position) / 64 not in changedblocklist:
+      break
+  file1fo = open(os.path.join(releasedir, 'file1'), 'r+')
+  file1fo.seek(position)
+  file1fo.write('X')
+  file1fo.close()
+
+  myxordatastore = new_datastore()
+  assert(datastoresnapshot.populate_xordatastore(manifestdict, myxordatastore, snapshotfilename, releasedir) == 'updated')
+  assert(myxordatastore.get_data(file1offset, 100) == 'A' * 100)
+  open(os.path.join(releasedir, 'file1'), 'w').write('A' * 100)
+  check_datastore(myxordatastore)
+
+  # ... and saved with the new release
+  assert(os.path.getsize(snapshotfilename) == manifestdict['blockcount'] * manifestdict['blocksize'])
+  assert(datastoresnapshot.get_stamped_manifest(snapshotfilename) == manifestdict)
+  assert(open(snapshotfilename, 'rb').read() == myxordatastore.get_data(0, os.path.getsize(snapshotfilename)))
+
+  # a release with a different block size can't be updated from it
+  othermanifestdict = uppirlib.create_manifest(rootdir=releasedir, hashalgorithm='sha1-hex', block_size=128, vendorhostname='localhost')
+  assert(datastoresnapshot.get_updatable_manifest(othermanifestdict, snapshotfilename) is None)
+
+  # or a missing or damaged snapshot
+  assert(not datastoresnapshot.load_snapshot(manifestdict, new_datastore(), os.path.join(tempdir, 'missing'), releasedir))
+
+  datastoresnapshot.save_snapshot(myxordatastore, snapshotfilename, datastoresnapshot.create_stamp(manifestdict, releasedir))
+  open(snapshotfilename, 'a').write('extra')
+  assert(not datastoresnapshot.load_snapshot(manifestdict, new_datastore(), snapshotfilename, releasedir))
+
+  open(datastoresnapshot.stamp_filename(snapshotfilename), 'w').write('not json')
+  assert(not datastoresnapshot.stamp_matches(snapshotfilename, manifestdict, releasedir))
+
+finally:
+  shutil.rmtree(tempdir)
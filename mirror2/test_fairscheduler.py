@@ -0,0 +1,173 @@
+# this is a few tests of the fair-share scheduler.   If everything passes,
+# there is no output.
+
+import threading
+
+import time
+
+import fairscheduler
+
+
+scheduler = fairscheduler.FairScheduler(1, 10, 4)
+
+# a task's result (or error) comes back
+assert(scheduler.run('a', lambda x, y: x + y, (1, 2)) == 3)
+
+try:
+  scheduler.run('a', lambda: 1 / 0)
+except ZeroDivisionError:
+  pass
+else:
+  print "the task's error was not raised"
+
+
+# hold the only worker so that tasks queue up
+release = threading.Event()
+scheduler.submit('blocker', release.wait)
+time.sleep(0.1)
+
+order = []
+orderlock = threading.Lock()
+
+def record(name):
+  orderlock.acquire()
+  order.append(name)
+  orderlock.release()
+
+# a greedy client up to its quota...
+for number in range(4):
+  scheduler.submit('greedy', record, ('greedy',))
+
+# ... gets told to retry
+try:
+  scheduler.submit('greedy', record, ('greedy',))
+except fairscheduler.SchedulerBusy:
+  pass
+else:
+  print "the client quota was not enforced"
+
+# other clients still get in
+for number in range(2):
+  scheduler.submit('polite1', record, ('polite1',))
+  scheduler.submit('polite2', record, ('polite2',))
+
+metrics = scheduler.get_metrics()
+assert(metrics['queued'] == 8)
+assert(metrics['running'] == 1)
+assert(metrics['clients'] == 4)
+assert(metrics['rejectedclientquota'] == 1)
+
+# until the queue is full
+scheduler.submit('polite3', record, ('polite3',))
+scheduler.submit('polite3', record, ('polite3',))
+try:
+  scheduler.submit('polite4', record, ('polite4',))
+except fairscheduler.SchedulerBusy:
+  pass
+else:
+  print "the queue limit was not enforced"
+
+assert(scheduler.get_metrics()['rejectedqueuefull'] == 1)
+
+release.set()
+while scheduler.get_metrics()['completed'] < 13:
+  time.sleep(0.01)
+
+# the clients took turns rather than the greedy one going first
+assert(order[:4] == ['greedy', 'polite1', 'polite2', 'polite3'])
+assert(order[4:8] == ['greedy', 'polite1', 'polite2', 'polite3'])
+assert(order[8:] == ['greedy', 'greedy'])
+
+metrics = scheduler.get_metrics()
+assert(metrics['queued'] == 0 and metrics['running'] == 0 and metrics['clients'] == 0)
+
+scheduler.shutdown()
+
+
+# many threads at once
+scheduler = fairscheduler.FairScheduler(4, 1000, 1000)
+results = []
+def worker(number):
+  results.append(scheduler.run(number % 5, lambda x: x * 2, (number,)))
+
+threadlist = [threading.Thread(target=worker, args=(number,)) for number in range(100)]
+for thread in threadlist:
+  thread.start()
+for thread in threadlist:
+  thread.join()
+
+assert(sorted(results) == [number * 2 for number in range(100)])
+scheduler.shutdown()
+
+
+# deferred tasks free their worker at once but keep their client's share
+# until they finish
+scheduler = fairscheduler.FairScheduler(1, 10, 2)
+finishlist = []
+def defer(value, finish):
+  finishlist.append((value, finish))
+
+results = []
+def wait_for(value):
+  results.append(scheduler.run('a', defer, (value,), deferred=True))
+
+threadlist = [threading.Thread(target=wait_for, args=(value,)) for value in ['x', 'y']]
+for thread in threadlist:
+  thread.start()
+while len(finishlist) < 2:
+  time.sleep(0.01)
+
+# (both got the one worker, one after the other)
+metrics = scheduler.get_metrics()
+assert(metrics['running'] == 0 and metrics['deferred'] == 2 and metrics['clients'] == 1)
+
+try:
+  scheduler.submit('a', defer, ('z',), deferred=True)
+except fairscheduler.SchedulerBusy:
+  pass
+else:
+  print "deferred tasks did not count against the client quota"
+
+# the worker is free for other clients meanwhile
+assert(scheduler.run('b', lambda: 'b') == 'b')
+
+for value, finish in finishlist:
+  finish(value.upper(), None)
+for thread in threadlist:
+  thread.join()
+assert(sorted(results) == ['X', 'Y'])
+
+try:
+  finishlist[0][1]('again', None)
+except ValueError:
+  pass
+else:
+  print "a deferred task was finished twice"
+
+# a task may finish before it returns, or fail
+assert(scheduler.run('a', lambda finish: finish(42, None), deferred=True) == 42)
+try:
+  scheduler.run('a', lambda finish: 1 / 0, deferred=True)
+except ZeroDivisionError:
+  pass
+else:
+  print "the deferred task's error was not raised"
+
+try:
+  scheduler.run('a', lambda finish: finish(None, KeyError('k')), deferred=True)
+except KeyError:
+  pass
+else:
+  print "the error a deferred task finished with was not raised"
+
+metrics = scheduler.get_metrics()
+assert(metrics['running'] == 0 and metrics['deferred'] == 0 and metrics['clients'] == 0)
+scheduler.shutdown()
+
+
+try:
+  fairscheduler.FairScheduler(0, 1, 1)
+except TypeError:
+  pass
+else:
+  print "no workers was allowed"
@@ -85,6 +85,163 @@ for blockcount in [9,15,16]:
     print "didn't detect incorrect (long) bitstring length"
 
 
+# produce_xor_from_bitstrings must give the same answers as asking one at a time
+letterxordatastore = fastsimplexordatastore.XORDatastore(size, 16)
+
+startpos = 0
+for char in range(ord("A"), ord("Q")):
+  letterxordatastore.set_data(startpos, chr(char) * size)
+  startpos = startpos + size
+
+bitstringlist = [chr(int('10100000', 2)) + chr(int('00000001',2)), chr(0)*2, chr(255)*2, chr(int('01000000', 2)) + chr(0)]
+xorresultlist = letterxordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+assert(len(xorresultlist) == len(bitstringlist))
+for bitstring, xorresult in zip(bitstringlist, xorresultlist):
+  assert(xorresult == letterxordatastore.produce_xor_from_bitstring(bitstring))
+
+assert(xorresultlist[0][0] == 'R')
+assert(letterxordatastore.produce_xor_from_bitstrings([]) == [])
+
+try:
+  letterxordatastore.produce_xor_from_bitstrings([chr(0)*2, chr(0)*3])
+except TypeError:
+  pass
+else:
+  print "didn't detect incorrect bitstring length in a list"
+
+
+# produce_xor_into writes the same answer into a caller's buffer
+outbuffer = bytearray('Z' * (size + 10))
+for bitstring in bitstringlist:
+  assert(letterxordatastore.produce_xor_into(bitstring, outbuffer) == None)
+  assert(str(outbuffer[:size]) == letterxordatastore.produce_xor_from_bitstring(bitstring))
+  # ... and leaves the rest alone
+  assert(str(outbuffer[size:]) == 'Z' * 10)
+
+# the buffer doesn't have to be aligned
+outview = memoryview(outbuffer)[3:3+size]
+letterxordatastore.produce_xor_into(bitstringlist[0], outview)
+assert(outview.tobytes() == xorresultlist[0])
+
+for badbuffer in ['X' * size, bytearray(size - 1), None]:
+  try:
+    letterxordatastore.produce_xor_into(bitstringlist[0], badbuffer)
+  except TypeError:
+    pass
+  else:
+    print "Was allowed to produce_xor_into a bad buffer"
+
+
+# do_xor must handle strings with NUL bytes in them (and of any alignment)
+assert(fastsimplexordatastore.do_xor('A\0' * 20, 'C\0' * 20) == chr(2) + '\0' + (chr(2) + '\0') * 19)
+assert(fastsimplexordatastore.do_xor('AB', 'CC') == chr(2) + chr(1))
+
+
+# splitting a query over several threads must not change the answer
+import os
+import threading
+
+size = 64*1024
+blockcount = 100
+randomdata = os.urandom(size*blockcount)
+
+singlexordatastore = fastsimplexordatastore.XORDatastore(size, blockcount)
+threadedxordatastore = fastsimplexordatastore.XORDatastore(size, blockcount, numthreads=4)
+singlexordatastore.set_data(0, randomdata)
+threadedxordatastore.set_data(0, randomdata)
+
+bitstringlist = [os.urandom(13) for iteration in range(5)] + [chr(255)*13, chr(0)*13]
+for bitstring in bitstringlist:
+  assert(singlexordatastore.produce_xor_from_bitstring(bitstring) == threadedxordatastore.produce_xor_from_bitstring(bitstring))
 
+# ... and concurrent calls (which run without the GIL) must not interfere
+resultdict = {}
+def _query(querynumber):
+  resultdict[querynumber] = threadedxordatastore.produce_xor_from_bitstring(bitstringlist[querynumber])
 
+threadlist = [threading.Thread(target=_query, args=[querynumber]) for querynumber in range(len(bitstringlist))]
+for thread in threadlist:
+  thread.start()
+for thread in threadlist:
+  thread.join()
+
+for querynumber in range(len(bitstringlist)):
+  assert(resultdict[querynumber] == singlexordatastore.produce_xor_from_bitstring(bitstringlist[querynumber]))
+
+try:
+  fastsimplexordatastore.XORDatastore(size, blockcount, numthreads=0)
+except TypeError:
+  pass
+else:
+  print "Was allowed to use 0 threads"
+
+
+# every XOR kernel this CPU has must agree with the plain C code...
+for kernelname, passed in fastsimplexordatastore.self_test():
+  assert(passed), kernelname
+
+# ... and give the same answers (sparse, dense and odd sized queries)
+import simplexordatastore
+kernellist = fastsimplexordatastore.get_xor_kernels()
+assert(fastsimplexordatastore.get_xor_kernel() == kernellist[0])
+assert('scalar' in kernellist)
+
+size = 192
+blockcount = 300
+randomdata = os.urandom(size*blockcount)
+pythonxordatastore = simplexordatastore.XORDatastore(size, blockcount)
+pythonxordatastore.set_data(0, randomdata)
+kernelxordatastore = fastsimplexordatastore.XORDatastore(size, blockcount)
+kernelxordatastore.set_data(0, randomdata)
+
+bitstringlist = [os.urandom(38) for iteration in range(5)]
+bitstringlist += [chr(0)*37 + chr(1), chr(128) + chr(0)*37, chr(0)*20 + chr(16) + chr(0)*17, chr(255)*38]
+expectedlist = [pythonxordatastore.produce_xor_from_bitstring(bitstring) for bitstring in bitstringlist]
+
+for kernelname in kernellist:
+  fastsimplexordatastore.set_xor_kernel(kernelname)
+  assert(fastsimplexordatastore.get_xor_kernel() == kernelname)
+  for bitstring, expected in zip(bitstringlist, expectedlist):
+    assert(kernelxordatastore.produce_xor_from_bitstring(bitstring) == expected), kernelname
+  assert(kernelxordatastore.produce_xor_from_bitstrings(bitstringlist) == expectedlist), kernelname
+
+fastsimplexordatastore.set_xor_kernel(kernellist[0])
+
+try:
+  fastsimplexordatastore.set_xor_kernel('nosuchkernel')
+except ValueError:
+  pass
+else:
+  print "Was allowed to use an unknown XOR kernel"
+
+
+# the datastore is a buffer.   A memoryview (from get_data or directly) sees
+# the datastore without a copy and keeps it alive.
+viewxordatastore = fastsimplexordatastore.XORDatastore(64, 4)
+viewxordatastore.set_data(64, 'B' * 64)
+
+blockview = viewxordatastore.get_data(64, 64, copy=False)
+assert(type(blockview) == memoryview)
+assert(blockview.tobytes() == 'B' * 64)
+
+viewxordatastore.set_data(64, 'C')
+assert(blockview[0] == 'C')
+
+wholeview = memoryview(viewxordatastore)
+assert(len(wholeview) == 256)
+assert(wholeview[65] == 'B')
+
+del viewxordatastore
+assert(blockview.tobytes() == 'C' + 'B' * 63)
+
+try:
+  fastsimplexordatastore.XORDatastore(64, 4).get_data(250, 10, copy=False)
+except TypeError:
+  pass
+else:
+  print "Was allowed to view past the end of the datastore"
 
+# there is no limit on the number of datastores
+datastorelist = [fastsimplexordatastore.XORDatastore(64, 1) for count in range(100)]
+assert(datastorelist[99].numberofblocks == 1 and datastorelist[99].sizeofblocks == 64)
@@ -0,0 +1,160 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import numpyxordatastore
+
+size = 64
+letterxordatastore = numpyxordatastore.XORDatastore(size, 16)
+
+startpos = 0
+for char in range(ord("A"), ord("Q")):
+  # put 1K of those chars in...
+  letterxordatastore.set_data(startpos, chr(char) * size) 
+  startpos = startpos + size
+
+# can read data out...
+assert(letterxordatastore.get_data(size, 1) == 'B')
+
+# let's create a bitstring that uses A, C, and P.   
+bitstring = chr(int('10100000', 2)) + chr(int('00000001',2))
+xorresult = letterxordatastore.produce_xor_from_bitstring(bitstring)
+
+assert(xorresult[0] == 'R')
+
+letterxordatastore.set_data(10,"Hello there")
+
+mystring = letterxordatastore.get_data(9,13)
+
+assert(mystring == 'AHello thereA')
+
+
+letterxordatastore.set_data(1,"Hello there"*size)
+
+mystring = letterxordatastore.get_data(size*2 - (size*2 %11) + 1,11)
+
+assert(mystring == "Hello there")
+
+# let's try to read the last bytes of data
+mystring = letterxordatastore.get_data(size*15,size)
+
+# a view sees the datastore without a copy
+blockview = letterxordatastore.get_data(size, size, copy=False)
+assert(type(blockview) == memoryview)
+assert(blockview.tobytes() == letterxordatastore.get_data(size, size))
+letterxordatastore.set_data(size, 'Z')
+assert(blockview[0] == 'Z')
+
+
+
+try:
+  letterxordatastore = numpyxordatastore.XORDatastore(127, 16)
+except TypeError:
+  pass
+else:
+  print "Was allowed to use a block size that isn't a multiple of 64"
+
+try:
+  letterxordatastore.set_data(size*16, "hi")
+except TypeError:
+  pass
+else:
+  print "Was allowed to write past the end of the datastore"
+
+
+try:
+  letterxordatastore.set_data(size*16, 1)
+except TypeError:
+  pass
+else:
+  print "Was allowed to read past the end of the datastore"
+
+
+for blockcount in [9,15,16]:
+  letterxordatastore = numpyxordatastore.XORDatastore(size, blockcount)
+
+  # is a 0 block the right size?
+  assert( len(letterxordatastore.produce_xor_from_bitstring(chr(0)*2)) == size )
+
+
+
+  try:
+    letterxordatastore.produce_xor_from_bitstring(chr(0)*1)
+  except TypeError:
+    pass
+  else:
+    print "didn't detect incorrect (short) bitstring length"
+
+
+  try:
+    letterxordatastore.produce_xor_from_bitstring(chr(0)*3)
+  except TypeError:
+    pass
+  else:
+    print "didn't detect incorrect (long) bitstring length"
+
+
+
+
+
+# the answers must match the Python datastore for random data / bitstrings
+import random
+import simplexordatastore
+
+for blockcount in [1, 9, 64, 100]:
+  numpyds = numpyxordatastore.XORDatastore(size, blockcount)
+  pythonds = simplexordatastore.XORDatastore(size, blockcount)
+
+  randomdata = "".join(chr(random.randrange(0, 256)) for i in xrange(size*blockcount))
+  numpyds.set_data(0, randomdata)
+  pythonds.set_data(0, randomdata)
+
+  for iteration in range(5):
+    bitstring = "".join(chr(random.randrange(0, 256)) for i in xrange((blockcount+7)/8))
+    assert(numpyds.produce_xor_from_bitstring(bitstring) == pythonds.produce_xor_from_bitstring(bitstring))
+
+
+# produce_xor_from_bitstrings must give the same answers as asking one at a time
+letterxordatastore = numpyxordatastore.XORDatastore(size, 16)
+
+startpos = 0
+for char in range(ord("A"), ord("Q")):
+  letterxordatastore.set_data(startpos, chr(char) * size)
+  startpos = startpos + size
+
+bitstringlist = [chr(int('10100000', 2)) + chr(int('00000001',2)), chr(0)*2, chr(255)*2, chr(int('01000000', 2)) + chr(0)]
+xorresultlist = letterxordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+assert(len(xorresultlist) == len(bitstringlist))
+for bitstring, xorresult in zip(bitstringlist, xorresultlist):
+  assert(xorresult == letterxordatastore.produce_xor_from_bitstring(bitstring))
+
+assert(xorresultlist[0][0] == 'R')
+assert(letterxordatastore.produce_xor_from_bitstrings([]) == [])
+
+try:
+  letterxordatastore.produce_xor_from_bitstrings([chr(0)*2, chr(0)*3])
+except TypeError:
+  pass
+else:
+  print "didn't detect incorrect bitstring length in a list"
+
+
+# produce_xor_into writes the same answer into a caller's buffer
+outbuffer = bytearray('Z' * (size + 10))
+for bitstring in bitstringlist:
+  assert(letterxordatastore.produce_xor_into(bitstring, outbuffer) == None)
+  assert(str(outbuffer[:size]) == letterxordatastore.produce_xor_from_bitstring(bitstring))
+  # ... and leaves the rest alone
+  assert(str(outbuffer[size:]) == 'Z' * 10)
+
+# the buffer doesn't have to be aligned
+outview = memoryview(outbuffer)[3:3+size]
+letterxordatastore.produce_xor_into(bitstringlist[0], outview)
+assert(outview.tobytes() == xorresultlist[0])
+
+for badbuffer in ['X' * size, bytearray(size - 1), None]:
+  try:
+    letterxordatastore.produce_xor_into(bitstringlist[0], badbuffer)
+  except TypeError:
+    pass
+  else:
+    print "Was allowed to produce_xor_into a bad buffer"
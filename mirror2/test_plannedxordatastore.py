@@ -0,0 +1,77 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import random
+
+import plannedxordatastore
+
+import simplexordatastore
+
+size = 64
+
+for blockcount in [1, 7, 16, 21]:
+  myxordatastore = simplexordatastore.XORDatastore(size, blockcount)
+  myxordatastore.set_data(0, "".join(chr(random.randrange(0, 256)) for i in xrange(size*blockcount)))
+
+  # leave some gaps (all zero blocks) like the padding between files
+  for blocknumber in range(0, blockcount, 3):
+    myxordatastore.set_data(blocknumber * size, chr(0) * size)
+
+  bitstringlength = (blockcount+7)/8
+  bitstringlist = [chr(0)*bitstringlength, chr(255)*bitstringlength, chr(128) + chr(0)*(bitstringlength-1), chr(64) + chr(0)*(bitstringlength-1)]
+  for iteration in range(10):
+    bitstringlist.append("".join(chr(random.randrange(0, 256)) for i in xrange(bitstringlength)))
+
+  expectedlist = myxordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+  planneddatastore = plannedxordatastore.PlannedXORDatastore(myxordatastore, simplexordatastore)
+
+  # before analyze, the wrapped datastore answers...
+  assert(planneddatastore.produce_xor_from_bitstring(bitstringlist[4]) == expectedlist[4])
+  assert(planneddatastore.get_pathcounts()['unplanned'] == 1)
+
+  planneddatastore.analyze()
+  assert(planneddatastore.numberofnonzeroblocks == blockcount - len(range(0, blockcount, 3)))
+
+  # ... and afterwards the plans must give the same answers
+  for bitstring, expected in zip(bitstringlist, expectedlist):
+    assert(planneddatastore.produce_xor_from_bitstring(bitstring) == expected)
+
+  assert(planneddatastore.produce_xor_from_bitstrings(bitstringlist) == expectedlist)
+
+  outbuffer = bytearray(size)
+  for bitstring, expected in zip(bitstringlist, expectedlist):
+    planneddatastore.produce_xor_into(bitstring, outbuffer)
+    assert(str(outbuffer) == expected)
+
+  pathcounts = planneddatastore.get_pathcounts()
+  assert(sum(pathcounts.values()) == 1 + 3 * len(bitstringlist))
+  # block 0 is all zeros, so the third query selects nothing
+  assert(pathcounts['empty'] >= 6)
+
+  try:
+    planneddatastore.produce_xor_from_bitstring(chr(0)*(bitstringlength + 1))
+  except TypeError:
+    pass
+  else:
+    print "didn't detect incorrect (long) bitstring length"
+
+
+# the paths are picked by how many non-zero blocks are selected
+myxordatastore = simplexordatastore.XORDatastore(size, 8)
+for blocknumber in range(8):
+  myxordatastore.set_data(blocknumber * size, chr(blocknumber + 1) * size)
+
+planneddatastore = plannedxordatastore.PlannedXORDatastore(myxordatastore, simplexordatastore)
+planneddatastore.analyze()
+
+assert(planneddatastore.produce_xor_from_bitstring(chr(0)) == chr(0) * size)
+assert(planneddatastore.produce_xor_from_bitstring(chr(2)) == chr(7) * size)
+assert(planneddatastore.produce_xor_from_bitstring(chr(3)) == chr(7 ^ 8) * size)
+assert(planneddatastore.produce_xor_from_bitstring(chr(254)) == chr(1^2^3^4^5^6^7) * size)
+
+assert(planneddatastore.get_pathcounts() == {'unplanned':0, 'empty':1, 'single':1, 'direct':1, 'complement':1})
+
+# set_data must throw the analysis away
+planneddatastore.set_data(0, 'A' * size)
+assert(planneddatastore.produce_xor_from_bitstring(chr(128))[0] == 'A')
+assert(planneddatastore.get_pathcounts()['unplanned'] == 1)
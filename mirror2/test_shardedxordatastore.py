@@ -0,0 +1,72 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import random
+
+import shardedxordatastore
+
+import simplexordatastore
+
+size = 64
+letterxordatastore = shardedxordatastore.XORDatastore(size, 16, 2)
+
+startpos = 0
+for char in range(ord("A"), ord("Q")):
+  # set after the workers started, so they must see it through shared memory
+  letterxordatastore.set_data(startpos, chr(char) * size)
+  startpos = startpos + size
+
+# can read data out...
+assert(letterxordatastore.get_data(size, 1) == 'B')
+
+# let's create a bitstring that uses A, C, and P (in different shards).
+bitstring = chr(int('10100000', 2)) + chr(int('00000001',2))
+xorresult = letterxordatastore.produce_xor_from_bitstring(bitstring)
+
+assert(xorresult == 'R' * size)
+
+outbuffer = bytearray(size)
+letterxordatastore.produce_xor_into(bitstring, outbuffer)
+assert(str(outbuffer) == xorresult)
+
+assert(letterxordatastore.numshards == 2)
+letterxordatastore.close()
+
+
+try:
+  shardedxordatastore.XORDatastore(size, 16, 0)
+except TypeError:
+  pass
+else:
+  print "Was allowed to use 0 shards"
+
+
+# the answers must match the Python datastore for random data / bitstrings,
+# including shards that don't hold a multiple of 8 blocks
+for blockcount, numshards in [(1, 1), (9, 2), (21, 3), (100, 4)]:
+  shardedds = shardedxordatastore.XORDatastore(size, blockcount, numshards)
+  pythonds = simplexordatastore.XORDatastore(size, blockcount)
+
+  randomdata = "".join(chr(random.randrange(0, 256)) for i in xrange(size*blockcount))
+  shardedds.set_data(0, randomdata)
+  pythonds.set_data(0, randomdata)
+
+  bitstringlist = [chr(255)*((blockcount+7)/8), chr(0)*((blockcount+7)/8)]
+  for iteration in range(5):
+    bitstringlist.append("".join(chr(random.randrange(0, 256)) for i in xrange((blockcount+7)/8)))
+
+  expectedlist = pythonds.produce_xor_from_bitstrings(bitstringlist)
+
+  for bitstring, expected in zip(bitstringlist, expectedlist):
+    assert(shardedds.produce_xor_from_bitstring(bitstring) == expected)
+
+  assert(shardedds.produce_xor_from_bitstrings(bitstringlist) == expectedlist)
+  assert(shardedds.produce_xor_from_bitstrings([]) == [])
+
+  try:
+    shardedds.produce_xor_from_bitstring(chr(0)*((blockcount+7)/8 + 1))
+  except TypeError:
+    pass
+  else:
+    print "didn't detect incorrect (long) bitstring length"
+
+  shardedds.close()
@@ -75,3 +75,117 @@ except simplexorrequestor.InsufficientMirrors:
 else:
   print "Should be notified of insufficient mirrors!"
 
+
+
+
+
+# Now in batches.   The whole batch is for one mirror, and that mirror is busy
+# until every request in it has come back.
+mirrorinfolist = [{'name':'mirror1'}, {'name':'mirror2'}, {'name':'mirror3'}]
+blocklist = [1, 2, 3]
+
+rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, blocklist, manifestdict, 2)
+
+batch1 = rxgobj.get_next_xorrequests(2)
+assert(len(batch1) == 2)
+assert(batch1[0][0] == batch1[1][0])
+assert([request[1] for request in batch1] == [1, 2])
+
+batch2 = rxgobj.get_next_xorrequests(5)
+assert(len(batch2) == 3)
+assert(batch2[0][0] != batch1[0][0])
+
+# a failed batch moves to the spare mirror
+rxgobj.notify_failure(batch2[0])
+batch3 = rxgobj.get_next_xorrequests(5)
+assert(len(batch3) == 3)
+assert(batch3[0][0] != batch2[0][0] and batch3[0][0] != batch1[0][0])
+
+rxgobj.notify_success(batch1[0], chr(1))
+for request, xorblock in zip(batch3, [chr(2), chr(4), chr(8)]):
+  rxgobj.notify_success(request, xorblock)
+
+# the first mirror still has batch1[1] outstanding...
+rxgobj.notify_success(batch1[1], chr(16))
+
+# ... and then block 3
+batch4 = rxgobj.get_next_xorrequests(5)
+assert([request[1] for request in batch4] == [3])
+rxgobj.notify_success(batch4[0], chr(32))
+
+assert(rxgobj.get_next_xorrequests(5) == [])
+assert(rxgobj.get_next_xorrequest() == ())
+
+assert(rxgobj.return_block(1) == chr(1 ^ 2))
+assert(rxgobj.return_block(2) == chr(16 ^ 4))
+assert(rxgobj.return_block(3) == chr(32 ^ 8))
+
+try:
+  rxgobj.get_next_xorrequests(0)
+except TypeError:
+  pass
+else:
+  print "maxrequests 0 was allowed"
+
+
+
+
+
+# Mirrors can be chosen weighted by the spare capacity they advertise.
+def mirror_with_load(name, queued, running, capacity):
+  return {'name':name, 'load':{'queued':queued, 'running':running, 'xorlatency':0.01, 'capacity':capacity}}
+
+assert(simplexorrequestor.get_spare_capacity(mirror_with_load('m', 10, 4, 260)) == 246)
+assert(simplexorrequestor.get_spare_capacity(mirror_with_load('m', 300, 4, 260)) == 0)
+assert(simplexorrequestor.get_spare_capacity({'name':'m'}) == None)
+assert(simplexorrequestor.get_spare_capacity({'name':'m', 'load':{'queued':-1}}) == None)
+
+idlemirror = mirror_with_load('idle', 0, 0, 260)
+busymirror = mirror_with_load('busy', 256, 4, 260)
+mirrorinfolist = [idlemirror, busymirror, mirror_with_load('half', 128, 4, 260), {'name':'old'}]
+blocklist = [12, 34]
+
+chosencounts = {}
+for attempt in range(400):
+  rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, blocklist, manifestdict, 2, weightbyload=True)
+
+  # as many distinct mirrors as the privacy threshold are still used...
+  chosenlist = [requestinfo['mirrorinfo']['name'] for requestinfo in rxgobj.activemirrorinfolist]
+  assert(len(set(chosenlist)) == 2)
+  # ... and every mirror is kept, the rest as spares
+  assert(sorted([mirrorinfo['name'] for mirrorinfo in rxgobj.fullmirrorinfolist]) == ['busy', 'half', 'idle', 'old'])
+
+  for name in chosenlist:
+    chosencounts[name] = chosencounts.get(name, 0) + 1
+
+# the idle mirror is chosen far more often than the full one
+assert(chosencounts['idle'] > 270)
+assert(chosencounts.get('busy', 0) < 40)
+
+# a mirror that claims more capacity than the rest by far (or an infinite
+# amount, which is ignored) is not chosen every time
+assert(simplexorrequestor.get_spare_capacity(mirror_with_load('m', 0, 0, float('inf'))) == None)
+assert(simplexorrequestor.get_spare_capacity(mirror_with_load('m', 0, 0, float('nan'))) == None)
+
+for greedycapacity in [10**12, float('inf')]:
+  mirrorinfolist = [mirror_with_load('greedy', 0, 0, greedycapacity)]
+  for number in range(4):
+    mirrorinfolist.append(mirror_with_load('idle'+str(number), 0, 0, 260))
+
+  greedycount = 0
+  for attempt in range(400):
+    rxgobj = simplexorrequestor.RandomXORRequestor(mirrorinfolist, blocklist, manifestdict, 2, weightbyload=True)
+    if 'greedy' in [requestinfo['mirrorinfo']['name'] for requestinfo in rxgobj.activemirrorinfolist]:
+      greedycount = greedycount + 1
+
+  # (uncapped it would be chosen every time.   Capped at 4 times the median
+  # it is chosen about 80% of the time, or 40% if ignored.)
+  assert(greedycount < 360)
+
+# it still needs enough mirrors
+try:
+  simplexorrequestor.RandomXORRequestor([idlemirror], blocklist, manifestdict, 2, weightbyload=True)
+except simplexorrequestor.InsufficientMirrors:
+  pass
+else:
+  print "Should be notified of insufficient mirrors when weighting by load!"
@@ -0,0 +1,39 @@
+# this is a bunch of macro tests.   If everything passes, there is no output.
+
+import xordatastorebackends
+
+import simplexordatastore
+
+# the Python datastore is always there
+availablebackends = xordatastorebackends.get_available_backends()
+assert('python' in availablebackends)
+assert('mmap' not in availablebackends)
+assert(xordatastorebackends.get_backend_module('python') is simplexordatastore)
+
+# every available backend gives the same answers
+bitstring = chr(int('10100000', 2)) + chr(int('00000001',2))
+for backendname in availablebackends:
+  letterxordatastore = xordatastorebackends.create_xordatastore(backendname, 64, 16)
+
+  startpos = 0
+  for char in range(ord("A"), ord("Q")):
+    letterxordatastore.set_data(startpos, chr(char) * 64)
+    startpos = startpos + 64
+
+  assert(letterxordatastore.produce_xor_from_bitstring(bitstring) == 'R' * 64), backendname
+
+# calibration measures each backend (fastest first)
+xordatastorebackends.CALIBRATION_SECONDS = 0.01
+calibration = xordatastorebackends.calibrate_backends(1024, 100)
+assert(sorted([backendname for backendname, bytespersecond in calibration]) == sorted(availablebackends))
+assert(calibration[0][1] >= calibration[-1][1] > 0)
+
+assert(xordatastorebackends.calibrate_backends(1024, 100, ['python'])[0][0] == 'python')
+
+for badbackend in ['mmap', 'nosuchbackend']:
+  try:
+    xordatastorebackends.create_xordatastore(badbackend, 64, 16)
+  except ValueError:
+    pass
+  else:
+    print "Was allowed to create a "+badbackend+" datastore"
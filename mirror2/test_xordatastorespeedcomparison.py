@@ -17,7 +17,7 @@ def random_bytes(size):
   return "".join(chr(random.randrange(0, 256)) for i in xrange(size))
 
 
-xordatastoremodules = ['fastsimplexordatastore', 'simplexordatastore']
+xordatastoremodules = ['fastsimplexordatastore', 'numpyxordatastore', 'simplexordatastore']
 
 blocksizestotest = [1024, 1024*4, 1024*16, 1024*64, 1024*256, 1024*1024, 1024*1024*4, 1024*1024*16]
 numblockstotest = [16, 64, 256, 1024, 4*1024, 16*1024, 64*1024]
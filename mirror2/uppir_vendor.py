@@ -92,12 +92,21 @@ import simplexordatastore as fastsimplexordatastore
 import time
 import traceback
 
-_logfo=None
+# writes the log from a background thread
+import batchedlog
+
+_logger=None
 
 def _log(stringtolog):
-  # helper function to log data
-  _logfo.write(str(time.time()) +" "+stringtolog+"\n")
-  _logfo.flush()
+  # helper function to log data.   Once the logger is started, this only
+  # queues the line (see batchedlog).
+  _logger.log(stringtolog)
+
+
+def _log_request(stringtolog):
+  # helper function to log a line about one request.   Only one in
+  # --logsample of these are kept.
+  _logger.log_request(stringtolog)
 
 
 
@@ -233,7 +242,7 @@ class ThreadedVendorRequestHandler(SocketServer.BaseRequestHandler):
     if requeststring == 'GET MANIFEST':
 
       session.sendmessage(self.request, _global_rawmanifestdata)
-      _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" manifest request")
+      _log_request("UPPIRVendor "+remoteip+" "+str(remoteport)+" manifest request")
 
       # done!
       return
@@ -245,7 +254,7 @@ class ThreadedVendorRequestHandler(SocketServer.BaseRequestHandler):
 
       # reply with the mirror list
       session.sendmessage(self.request, _global_rawmirrorlist)
-      _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorlist request")
+      _log_request("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorlist request")
 
       # done!
       return
@@ -293,6 +302,15 @@ class ThreadedVendorRequestHandler(SocketServer.BaseRequestHandler):
         _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorinfo has an invalid format")
         return
 
+      # are its load figures (if any) usable by clients?
+      if 'load' in mirrorinfodict:
+        try:
+          uppirlib.check_mirror_load(mirrorinfodict['load'])
+        except TypeError, e:
+          session.sendmessage(self.request, "Error, mirrorinfo has an invalid load.")
+          _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorinfo has an invalid load: "+str(e))
+          return
+
       # is it a dictionary and does it have the required keys?
       if mirrorinfodict['ip'] != remoteip:
         session.sendmessage(self.request, "Error, must provide mirrorinfo from the mirror's IP")
@@ -304,7 +322,7 @@ class ThreadedVendorRequestHandler(SocketServer.BaseRequestHandler):
 
       # and notify the user
       session.sendmessage(self.request, 'OK')
-      _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorinfo update "+str(len(mirrorrawdata)))
+      _log_request("UPPIRVendor "+remoteip+" "+str(remoteport)+" mirrorinfo update "+str(len(mirrorrawdata)))
 
       # done!
       return
@@ -313,7 +331,7 @@ class ThreadedVendorRequestHandler(SocketServer.BaseRequestHandler):
     elif requeststring == 'HELLO':
       # send a reply.
       session.sendmessage(self.request, "VENDORHI!")
-      _log("UPPIRVendor "+remoteip+" "+str(remoteport)+" VENDORHI!")
+      _log_request("UPPIRVendor "+remoteip+" "+str(remoteport)+" VENDORHI!")
 
       # done!
       return
@@ -369,7 +387,7 @@ def parse_options():
     None
   """
   global _commandlineoptions
-  global _logfo
+  global _logger
 
   # should be true unless we're initing twice...
   assert(_commandlineoptions==None)
@@ -395,6 +413,22 @@ def parse_options():
         type="string", default="vendor.log",
         help="The file to write log data to (default vendor.log).")
 
+  parser.add_option("","--logmaxbytes", dest="logmaxbytes",
+        type="int", metavar="bytes", default=0,
+        help="Start a new log file once it is this big (default 0, never).")
+
+  parser.add_option("","--logrotateinterval", dest="logrotateinterval",
+        type="int", metavar="seconds", default=0,
+        help="Start a new log file this often (default 0, never).")
+
+  parser.add_option("","--logbackups", dest="logbackups",
+        type="int", metavar="N", default=5,
+        help="Keep this many old log files (default 5).")
+
+  parser.add_option("","--logsample", dest="logsample",
+        type="int", metavar="N", default=1,
+        help="Log only one in N lines about single requests (default 1, log every request).")
+
   parser.add_option("","--maxmirrorinfo", dest="maxmirrorinfo",
         type="int", default=10240,
         help="The maximum amount of serialized data a mirror can add to the mirror list (default 10K)")
@@ -421,8 +455,16 @@ def parse_options():
 
   _commandlineoptions.rootdir = remainingargs[0]
 
+  if _commandlineoptions.logmaxbytes < 0 or _commandlineoptions.logrotateinterval < 0 or _commandlineoptions.logbackups < 0:
+    print "Log rotation settings must not be negative"
+    sys.exit(1)
+
+  if _commandlineoptions.logsample <= 0:
+    print "Log sample rate must be positive"
+    sys.exit(1)
+
   # try to open the log file...
-  _logfo = open(_commandlineoptions.logfilename, 'a')
+  _logger = batchedlog.BatchedLogger(_commandlineoptions.logfilename, maxbytes=_commandlineoptions.logmaxbytes, rotateinterval=_commandlineoptions.logrotateinterval, backupcount=_commandlineoptions.logbackups, samplerate=_commandlineoptions.logsample)
 
 
 
@@ -451,6 +493,9 @@ def main():
   if _commandlineoptions.daemonize:
     daemon.daemonize()
 
+  # from here on the log is written in the background
+  _logger.start()
+
   # we're now ready to handle clients!
   _log('ready to start servers!')
 
@@ -473,5 +518,6 @@ if __name__ == '__main__':
     # this mess prints a not-so-nice traceback, but it does contain all
     # relevant info
     _log(str(traceback.format_tb(sys.exc_info()[2])))
+    _logger.close()
     sys.exit(1)
 
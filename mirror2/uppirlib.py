@@ -48,6 +48,14 @@ else:
 
 import hashlib
 
+# to hash blocks in parallel
+import threading
+
+import time
+
+# to find the files a block is made of (update_xordatastore)
+import bisect
+
 
 # Exceptions...
 
@@ -57,6 +65,87 @@ class FileNotFound(Exception):
 class IncorrectFileContents(Exception):
   """The contents of the file do not match the manifest"""
 
+class MirrorBusy(Exception):
+  """The mirror is overloaded and asked us to retry later"""
+
+class UnknownRelease(Exception):
+  """The mirror does not serve the release we asked for"""
+
+
+# a mirror that is over its load (or our share of it) replies with this
+# instead of XOR blocks.   (It is never a multiple of 64 bytes long, so it
+# can't be mistaken for blocks.)
+MIRROR_BUSY_REPLY = 'Mirror busy, retry'
+
+# a mirror that serves several releases replies with this to a request for
+# one it does not serve (any more).   (Like MIRROR_BUSY_REPLY, it can't be
+# mistaken for blocks.)
+UNKNOWN_RELEASE_REPLY = 'Unknown release'
+
+
+
+def get_release_prefix(manifesthash):
+  """
+  <Purpose>
+    Returns what goes before a mirror request to say which release it is
+    for.   A mirror that serves several releases advertises them (as
+    'releases' in its mirrorinfo).   A request without a prefix is for the
+    mirror's first release.
+
+  <Arguments>
+    manifesthash: the release's manifest hash, or None for no prefix.
+
+  <Exceptions>
+    TypeError if manifesthash is not a string or contains a space.
+
+  <Returns>
+    A string, e.g. 'RELEASE 42a... XORBLOCK...' starts with
+    get_release_prefix('42a...').
+  """
+  if manifesthash is None:
+    return ''
+
+  if type(manifesthash) not in [str, unicode] or ' ' in manifesthash or manifesthash == '':
+    raise TypeError("manifesthash must be a string without spaces")
+
+  return 'RELEASE '+str(manifesthash)+' '
+
+
+
+# the load figures a mirror may advertise (as 'load' in its mirrorinfo):
+# queries waiting for a worker, queries being answered, the mean seconds a
+# query took to XOR lately and the most queries it takes at once
+MIRROR_LOAD_KEYS = ['queued', 'running', 'xorlatency', 'capacity']
+
+def check_mirror_load(mirrorload):
+  """
+  <Purpose>
+    Checks the load figures from a mirrorinfo (see MIRROR_LOAD_KEYS).
+
+  <Arguments>
+    mirrorload: the 'load' of a mirrorinfo dictionary.
+
+  <Exceptions>
+    TypeError if it is not a dictionary with each of MIRROR_LOAD_KEYS as a
+    finite number that is not negative.
+
+  <Returns>
+    None
+  """
+  if type(mirrorload) != dict:
+    raise TypeError("Mirror load must be a dict")
+
+  for key in MIRROR_LOAD_KEYS:
+    if key not in mirrorload:
+      raise TypeError("Mirror load is missing '"+key+"'")
+    if type(mirrorload[key]) not in [int, long, float]:
+      raise TypeError("Mirror load '"+key+"' must be a number")
+    # (JSON lets a mirror send Infinity and NaN)
+    if math.isinf(mirrorload[key]) or math.isnan(mirrorload[key]):
+      raise TypeError("Mirror load '"+key+"' must be finite")
+    if mirrorload[key] < 0:
+      raise TypeError("Mirror load '"+key+"' must not be negative")
+
 
 
 # these keys must exist in a manifest dictionary.
@@ -106,12 +195,56 @@ _supported_hashalgorithms = ['md5', 'sha1', 'sha224', 'sha256', 'sha384',
 
 _supported_hashencodings = ['hex','raw']
 
+# files are read (and hashed) this much at a time
+_FILE_READ_SIZE = 4 * 1024 * 1024
+
+# the hashing threads take this many blocks at a time
+_HASH_CHUNK_BLOCKS = 64
+
+# how often (in seconds) block hashing reports its progress
+HASH_PROGRESS_INTERVAL = 5.0
+
+
+
+def get_cpu_count():
+  """
+  <Purpose>
+    Returns how many CPUs this machine has.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A positive integer (1 if it is not known).
+  """
+  try:
+    import multiprocessing
+    return multiprocessing.cpu_count()
+  except (ImportError, NotImplementedError):
+    return 1
+
+
+
 def find_hash(contents, algorithm):
-  # Helper function for hashing...
+  # Helper function for hashing...   contents may be a string or another
+  # buffer (like a memoryview).
+  hashobj = _new_hash(algorithm)
+  if hashobj is not None:
+    hashobj.update(contents)
+  return _finish_hash(hashobj, algorithm)
+
+
+
+def _new_hash(algorithm):
+  # Private helper that returns a hashlib object to update (or None for
+  # noop)
 
   # first, if it's a noop, do nothing.   THIS IS FOR TESTING ONLY
   if algorithm == 'noop':
-    return ''
+    return None
 
   # accept things like: "sha1", "sha256-raw", etc.
   # before the '-' is one of the types known to hashlib.   After is
@@ -129,9 +262,18 @@ def find_hash(contents, algorithm):
     raise TypeError("Do not understand hash algorithm: '"+algorithm+"'")
 
 
-  hashobj = hashlib.new(hashalgorithmname)
+  return hashlib.new(hashalgorithmname)
+
+
 
-  hashobj.update(contents)
+def _finish_hash(hashobj, algorithm):
+  # Private helper that returns the encoded digest of a _new_hash object
+  if algorithm == 'noop':
+    return ''
+
+  hashencoding = 'hex'
+  if '-' in algorithm:
+    hashencoding = algorithm.split('-')[1]
 
   if hashencoding == 'raw':
     return hashobj.digest()
@@ -239,7 +381,7 @@ def request_mirror_test(testinfo, vendorlocation, defaultvendorport=62293):
 
 
 
-def retrieve_xorblock_from_mirror(mirrorip, mirrorport,bitstring):
+def retrieve_xorblock_from_mirror(mirrorip, mirrorport,bitstring, connection=None, manifesthash=None):
   """
   <Purpose>
     Retrieves a block from a mirror.
@@ -252,10 +394,20 @@ def retrieve_xorblock_from_mirror(mirrorip, mirrorport,bitstring):
     bitstring: a bit string that contains an appropriately sized request that
                specifies which blocks to combine.
 
+    connection: a SessionConnection to the mirror to send the request on
+                (default None, use a new connection just for this request)
+
+    manifesthash: the release to request the block from, for a mirror that
+                  serves several (default None, the mirror's first release)
+
   <Exceptions>
     TypeError if the arguments are the wrong types.  ValueError if the
     bitstring is the wrong size
 
+    MirrorBusy if the mirror asks us to retry later.
+
+    UnknownRelease if the mirror does not serve that release.
+
     various socket errors if the connection fails.
 
   <Side Effects>
@@ -266,16 +418,123 @@ def retrieve_xorblock_from_mirror(mirrorip, mirrorport,bitstring):
     to use parse_manifest to ensure this data is correct.
   """
 
-  response = _remote_query_helper(mirrorip, "XORBLOCK"+bitstring,mirrorport)
+  requeststring = get_release_prefix(manifesthash)+"XORBLOCK"+bitstring
+
+  if connection is None:
+    response = _remote_query_helper(mirrorip, requeststring, mirrorport)
+  else:
+    response = connection.query(requeststring)
+
   if response == 'Invalid request length':
     raise ValueError(response)
 
+  if response == MIRROR_BUSY_REPLY:
+    raise MirrorBusy(response)
+
+  if response == UNKNOWN_RELEASE_REPLY:
+    raise UnknownRelease(response)
+
   return response
 
 
 
 
 
+def retrieve_xorblocks_from_mirror(mirrorip, mirrorport, bitstringlist, connection=None, manifesthash=None):
+  """
+  <Purpose>
+    Retrieves several blocks from a mirror with one XORBLOCKS request.   A
+    mirror that does not know XORBLOCKS is sent one XORBLOCK request per
+    block instead, which costs a round trip (and, for an older mirror, a
+    new connection) for each.   So only batch for mirrors that advertise
+    'xorblocks' in their mirrorinfo.
+
+  <Arguments>
+    mirrorip: the mirror's IP address or hostname
+
+    mirrorport: the mirror's port number
+
+    bitstringlist: a non-empty list of bit strings (all the same size) like
+                   those for retrieve_xorblock_from_mirror.   A mirror
+                   accepts at most 256 in one request.
+
+    connection: a SessionConnection to the mirror to send the request on
+                (default None, use a new connection just for this request)
+
+    manifesthash: the release to request the blocks from, for a mirror that
+                  serves several (default None, the mirror's first release)
+
+  <Exceptions>
+    TypeError if the arguments are the wrong types.  ValueError if the
+    bitstrings are the wrong size or the reply is malformed.
+
+    MirrorBusy if the mirror asks us to retry later.
+
+    UnknownRelease if the mirror does not serve that release.
+
+    various socket errors if the connection fails.
+
+  <Side Effects>
+    Contacts the mirror and retrieves data from it
+
+  <Returns>
+    A list with the XORed block for each bitstring (in the same order).
+  """
+  if type(bitstringlist) != list or len(bitstringlist) == 0:
+    raise TypeError("bitstringlist must be a non-empty list")
+
+  for bitstring in bitstringlist:
+    if type(bitstring) != str or len(bitstring) != len(bitstringlist[0]):
+      raise TypeError("bitstrings must be strings of the same length")
+
+  releaseprefix = get_release_prefix(manifesthash)
+
+  if connection is None:
+    thisconnection = SessionConnection(mirrorip, mirrorport)
+  else:
+    thisconnection = connection
+
+  try:
+    response = thisconnection.query(releaseprefix+"XORBLOCKS"+''.join(bitstringlist))
+
+    # an older mirror does not know XORBLOCKS.   It reads it as an XORBLOCK
+    # request with a bitstring of the wrong length (or, for a mirror that
+    # checks the type first, as an unknown request type).   Ask for the
+    # blocks one at a time instead.   (This also tells us if the bitstrings
+    # really are the wrong length.)   Older mirrors close the connection
+    # after every reply, which query handles by reconnecting.
+    if response in ['Invalid request length', 'Invalid request type']:
+      xorblocklist = []
+      for bitstring in bitstringlist:
+        xorblocklist.append(retrieve_xorblock_from_mirror(mirrorip, mirrorport, bitstring, thisconnection, manifesthash))
+
+      return xorblocklist
+
+  finally:
+    if connection is None:
+      thisconnection.close()
+
+  if response == MIRROR_BUSY_REPLY:
+    raise MirrorBusy(response)
+
+  if response == UNKNOWN_RELEASE_REPLY:
+    raise UnknownRelease(response)
+
+  if len(response) == 0 or len(response) % len(bitstringlist) != 0:
+    raise ValueError("Malformed XORBLOCKS reply of length "+str(len(response)))
+
+  blocksize = len(response) / len(bitstringlist)
+
+  xorblocklist = []
+  for position in range(0, len(response), blocksize):
+    xorblocklist.append(response[position:position+blocksize])
+
+  return xorblocklist
+
+
+
+
+
 def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
   """
   <Purpose>
@@ -323,10 +582,8 @@ def retrieve_mirrorinfolist(vendorlocation, defaultvendorport=62293):
 
 
 
-def _remote_query_helper(serverlocation, command, defaultserverport):
-  # private function that contains the guts of server communication.   It
-  # issues a single query and then closes the connection.   This is used
-  # both to talk to the vendor and also to talk to mirrors
+def _parse_serverlocation(serverlocation, defaultserverport):
+  # private function that splits "host[:port]" into (host, port)
   if type(serverlocation) != str and type(serverlocation) != unicode:
     raise TypeError("Server location must be a string, not "+str(type(serverlocation)))
 
@@ -349,6 +606,17 @@ def _remote_query_helper(serverlocation, command, defaultserverport):
 
   serverhostname = splitlocationlist[0]
 
+  return (serverhostname, serverport)
+
+
+
+
+def _remote_query_helper(serverlocation, command, defaultserverport):
+  # private function that contains the guts of server communication.   It
+  # issues a single query and then closes the connection.   This is used
+  # both to talk to the vendor and also to talk to mirrors
+  serverhostname, serverport = _parse_serverlocation(serverlocation, defaultserverport)
+
 
   # now we actually download the information...
 
@@ -369,6 +637,205 @@ def _remote_query_helper(serverlocation, command, defaultserverport):
 
 
 
+class SessionConnection:
+  """
+  <Purpose>
+    A connection to a mirror (or vendor) that carries many requests, so a
+    client does not pay for a new TCP connection per block.   Requests may
+    be pipelined: send several with send_request and then read the replies
+    (in the same order) with get_reply.
+
+    A connection may only be used by one thread at a time.
+
+  <Side Effects>
+    Keeps a socket open until close is called.
+
+  <Example Use>
+    connection = SessionConnection('127.0.0.1:62294', 62294)
+
+    print connection.query('HELLO')
+
+    # pipelined...
+    connection.send_request('XORBLOCK'+bitstring1)
+    connection.send_request('XORBLOCK'+bitstring2)
+    xorblock1 = connection.get_reply()
+    xorblock2 = connection.get_reply()
+
+    connection.close()
+
+  """
+
+  # these are public so that a caller can read where we are connected.
+  # They should not be changed.
+  serverhostname = None
+  serverport = None
+
+  def __init__(self, serverlocation, defaultserverport):
+    """
+    <Purpose>
+      Connects to a server.
+
+    <Arguments>
+      serverlocation: A string that contains the server location.   This can
+                      be of the form "IP:port", "hostname:port", "IP", or
+                      "hostname"
+
+      defaultserverport: the port to use if the serverlocation does not
+                         include one.
+
+    <Exceptions>
+      TypeError if the serverlocation is the wrong type or malformed.
+
+      various socket errors if the connection fails.
+
+    """
+    self.serverhostname, self.serverport = _parse_serverlocation(serverlocation, defaultserverport)
+
+    self._socket = None
+    self._connect()
+
+
+
+  def _connect(self):
+    # Private helper that opens a fresh connection
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._socket.connect((self.serverhostname, self.serverport))
+
+    # requests sent without their reply read yet, and the replies read on
+    # this socket
+    self._outstandingrequests = 0
+    self._repliesreceived = 0
+
+
+
+  def send_request(self, command):
+    """
+    <Purpose>
+      Sends a request without waiting for the reply.
+
+    <Arguments>
+      command: the request string.
+
+    <Exceptions>
+      ValueError if the connection is closed.
+
+      various socket errors if the connection fails.
+
+    <Returns>
+      None
+    """
+    if self._socket is None:
+      raise ValueError("The connection is closed")
+
+    session.sendmessage(self._socket, command)
+    self._outstandingrequests = self._outstandingrequests + 1
+
+
+
+  def get_reply(self):
+    """
+    <Purpose>
+      Reads the reply to the oldest request that has not been answered.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      ValueError if there is no request to answer (or the connection is
+      closed).
+
+      SessionEOF if the server closed the connection.
+
+      various socket errors if the connection fails.
+
+    <Returns>
+      The reply string.
+    """
+    if self._socket is None:
+      raise ValueError("The connection is closed")
+
+    if self._outstandingrequests == 0:
+      raise ValueError("No request is waiting for a reply")
+
+    reply = session.recvmessage(self._socket)
+    self._outstandingrequests = self._outstandingrequests - 1
+    self._repliesreceived = self._repliesreceived + 1
+
+    return reply
+
+
+
+  def query(self, command):
+    """
+    <Purpose>
+      Sends a request and returns its reply.   If a connection that has
+      been used before turns out to be closed (e.g. the server dropped it
+      for being idle), the request is retried once on a new connection.
+
+    <Arguments>
+      command: the request string.   It must be safe to send twice.
+
+    <Exceptions>
+      ValueError if requests are still waiting for replies (or the
+      connection is closed).
+
+      SessionEOF if the server closed the connection.
+
+      various socket errors if the connection fails.
+
+    <Returns>
+      The reply string.
+    """
+    if self._outstandingrequests != 0:
+      raise ValueError("Read the replies to the pipelined requests first")
+
+    try:
+      self.send_request(command)
+      return self.get_reply()
+
+    except (socket.error, session.SessionEOF):
+      if self._repliesreceived == 0:
+        raise
+
+    # the server closed our old connection.   Try once more.
+    self._socket.close()
+    self._connect()
+
+    self.send_request(command)
+    return self.get_reply()
+
+
+
+  def close(self):
+    """
+    <Purpose>
+      Tells the server we are done and closes the connection.   Any
+      unanswered requests are abandoned.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    if self._socket is None:
+      return
+
+    try:
+      session.sendclose(self._socket)
+    except socket.error:
+      # it is closed anyways
+      pass
+
+    self._socket.close()
+    self._socket = None
+
+
+
+
 
 
 
@@ -405,7 +872,7 @@ def parse_manifest(rawmanifestdata):
 
 
 
-def populate_xordatastore(manifestdict, xordatastore, rootdir="."):
+def populate_xordatastore(manifestdict, xordatastore, rootdir=".", hashthreads=None, progressfunction=None):
   """
   <Purpose>
     Adds the files listed in the manifestdict to the datastore
@@ -417,6 +884,13 @@ def populate_xordatastore(manifestdict, xordatastore, rootdir="."):
 
     rootdir: The location to look for the files mentioned in the manifest
 
+    hashthreads: the number of threads that check the block hashes (default
+                 None, one per CPU).
+
+    progressfunction: a function that is called with (blocksdone,
+                      blockcount, bytespersecond) as the block hashes are
+                      checked (default None).
+
   <Exceptions>
     TypeError if the manifest is corrupt or the rootdir is the wrong type.
 
@@ -440,7 +914,7 @@ def populate_xordatastore(manifestdict, xordatastore, rootdir="."):
 
   _add_data_to_datastore(xordatastore,manifestdict['fileinfolist'],rootdir, manifestdict['hashalgorithm'])
 
-  hashlist = _compute_block_hashlist(xordatastore, manifestdict['blockcount'], manifestdict['blocksize'], manifestdict['hashalgorithm'])
+  hashlist = _compute_block_hashlist(xordatastore, manifestdict['blockcount'], manifestdict['blocksize'], manifestdict['hashalgorithm'], hashthreads, progressfunction)
 
   for blocknum in range(manifestdict['blockcount']):
 
@@ -450,6 +924,30 @@ def populate_xordatastore(manifestdict, xordatastore, rootdir="."):
   # We're done!
 
 
+def _check_release_file(thisfiledict, rootdir):
+  # Private helper that returns the path of a file in the manifest, once it
+  # is known to exist (under the rootdir) and have the right size.
+
+  thisrelativefilename = thisfiledict['filename']
+
+  thisfilename = os.path.join(rootdir, thisrelativefilename)
+
+  if not os.path.exists(thisfilename):
+    raise FileNotFound("File '"+thisrelativefilename+"' listed in manifest cannot be found in manifest root: '"+rootdir+"'.")
+
+  # can't go above the root!
+  # JAC: I would use relpath, but it's 2.6 and on
+  if not os.path.normpath(os.path.abspath(thisfilename)).startswith(os.path.abspath(rootdir)):
+    raise TypeError("File in manifest cannot go back from the root dir!!!")
+
+  # let's see if this has the right size
+  if os.path.getsize(thisfilename) != thisfiledict['length']:
+    raise IncorrectFileContents("File '"+thisrelativefilename+"' has the wrong size")
+
+  return thisfilename
+
+
+
 def _add_data_to_datastore(xordatastore, fileinfolist, rootdir, hashalgorithm):
   # Private helper to populate the datastore
 
@@ -461,47 +959,278 @@ def _add_data_to_datastore(xordatastore, fileinfolist, rootdir, hashalgorithm):
     thisoffset = thisfiledict['offset']
     thisfilelength = thisfiledict['length']
 
+    # read in the files and populate the xordatastore
+    thisfilename = _check_release_file(thisfiledict, rootdir)
+
+    # stream it into the datastore (so a large file is never all in memory)
+    # and hash it as we go...
+    hashobj = _new_hash(hashalgorithm)
+    thisfileobj = open(thisfilename, 'rb')
+    try:
+      for position in range(0, thisfilelength, _FILE_READ_SIZE):
+        thisfilechunk = thisfileobj.read(min(_FILE_READ_SIZE, thisfilelength - position))
+        if hashobj is not None:
+          hashobj.update(thisfilechunk)
+        xordatastore.set_data(thisoffset + position, thisfilechunk)
+    finally:
+      thisfileobj.close()
 
-    thisfilename = os.path.join(rootdir, thisrelativefilename)
+    # let's see if this has the right hash
+    if thisfilehash != _finish_hash(hashobj, hashalgorithm):
+      raise IncorrectFileContents("File '"+thisrelativefilename+"' has the wrong hash")
 
-    # read in the files and populate the xordatastore
-    if not os.path.exists(thisfilename):
-      raise FileNotFound("File '"+thisrelativefilename+"' listed in manifest cannot be found in manifest root: '"+rootdir+"'.")
 
-    # can't go above the root!
-    # JAC: I would use relpath, but it's 2.6 and on
-    if not os.path.normpath(os.path.abspath(thisfilename)).startswith(os.path.abspath(rootdir)):
-      raise TypeError("File in manifest cannot go back from the root dir!!!")
 
-    # get the relevant data
-    thisfilecontents = open(thisfilename).read()
+def find_changed_blocks(oldmanifestdict, newmanifestdict):
+  """
+  <Purpose>
+    Works out which blocks of a new release are not the same as in an old
+    release (by comparing the block hashes), so that a datastore with the
+    old release in it can be updated (update_xordatastore) rather than
+    rebuilt.
 
-    # let's see if this has the right size
-    if len(thisfilecontents) != thisfilelength:
-      raise IncorrectFileContents("File '"+thisrelativefilename+"' has the wrong size")
+  <Arguments>
+    oldmanifestdict: the manifest dictionary of the old release.
 
-    # let's see if this has the right hash
-    if thisfilehash != find_hash(thisfilecontents, hashalgorithm):
-      raise IncorrectFileContents("File '"+thisrelativefilename+"' has the wrong hash")
+    newmanifestdict: the manifest dictionary of the new release.
+
+  <Exceptions>
+    ValueError if the releases can't be compared this way (they have
+    different block sizes or hash algorithms, or the noop hash).
+
+  <Side Effects>
+    None
+
+  <Returns>
+    A sorted list of the numbers of the blocks of the new release that must
+    be rewritten (those that changed or are past the end of the old
+    release).
+  """
+  if oldmanifestdict['blocksize'] != newmanifestdict['blocksize']:
+    raise ValueError("The releases have different block sizes")
+
+  if oldmanifestdict['hashalgorithm'] != newmanifestdict['hashalgorithm']:
+    raise ValueError("The releases use different hash algorithms")
+
+  # (every block has the same 'hash')
+  if newmanifestdict['hashalgorithm'] == 'noop':
+    raise ValueError("Blocks can't be compared with the noop hash")
+
+  oldblockhashlist = oldmanifestdict['blockhashlist']
+  newblockhashlist = newmanifestdict['blockhashlist']
+
+  changedblocklist = []
+  for blocknum in range(newmanifestdict['blockcount']):
+    if blocknum >= oldmanifestdict['blockcount'] or oldblockhashlist[blocknum] != newblockhashlist[blocknum]:
+      changedblocklist.append(blocknum)
+
+  return changedblocklist
+
+
+
+def update_xordatastore(oldmanifestdict, newmanifestdict, xordatastore, rootdir=".", progressfunction=None):
+  """
+  <Purpose>
+    Changes a datastore that holds an old release into one that holds a new
+    release, by rewriting only the blocks that changed (find_changed_blocks).
+    The new blocks are read from the files in the rootdir and their hashes
+    are checked.   The other blocks are not read or written, so e.g. the
+    pages of a memory mapped datastore that hold them are not touched.
+
+  <Arguments>
+    oldmanifestdict: the manifest dictionary of the release in the datastore.
+
+    newmanifestdict: the manifest dictionary of the new release.
+
+    xordatastore: a datastore with the new release's block size and count,
+                  that has the old release's blocks in it (at least those
+                  that are in both releases).
+
+    rootdir: The location to look for the files mentioned in the new
+             manifest
+
+    progressfunction: a function that is called with (blocksdone,
+                      blockcount, bytespersecond) for the blocks being
+                      rewritten (default None).
+
+  <Exceptions>
+    ValueError if the releases can't be compared (see find_changed_blocks).
+
+    TypeError if a file in the manifest is outside the rootdir.
+
+    FileNotFound if a file that a changed block is made from is missing.
+
+    IncorrectFileContents if such a file has the wrong size or a rewritten
+                          block has the wrong hash.   (The datastore is
+                          then partly updated.)
+
+  <Side Effects>
+    Writes to the datastore.
+
+  <Returns>
+    The number of blocks that were rewritten.
+  """
+  if type(rootdir) != str and type(rootdir) != unicode:
+    raise TypeError("Mirror root must be a string")
+
+  changedblocklist = find_changed_blocks(oldmanifestdict, newmanifestdict)
+
+  blocksize = newmanifestdict['blocksize']
+  hashalgorithm = newmanifestdict['hashalgorithm']
+  blockhashlist = newmanifestdict['blockhashlist']
+
+  # the files in the order they are in the datastore, so the ones a block is
+  # made of can be found with bisect
+  fileinfolist = sorted(newmanifestdict['fileinfolist'], key=lambda fileinfo: fileinfo['offset'])
+  fileoffsetlist = [fileinfo['offset'] for fileinfo in fileinfolist]
+
+  # runs of consecutive changed blocks are read and written together (up to
+  # _FILE_READ_SIZE at a time)
+  maxrunblocks = max(1, _FILE_READ_SIZE / blocksize)
+  runlist = []
+  for blocknum in changedblocklist:
+    if runlist and runlist[-1][1] == blocknum and runlist[-1][1] - runlist[-1][0] < maxrunblocks:
+      runlist[-1][1] = blocknum + 1
+    else:
+      runlist.append([blocknum, blocknum + 1])
+
+  starttime = time.time()
+  lastprogresstime = starttime
+  blocksdone = 0
+
+  for firstblock, endblock in runlist:
+    runstart = firstblock * blocksize
+    runend = endblock * blocksize
+
+    # anything no file covers is zeros...
+    runbuffer = bytearray(runend - runstart)
+
+    # ... and the rest is read from the files that overlap the run
+    fileindex = max(bisect.bisect_right(fileoffsetlist, runstart) - 1, 0)
+    while fileindex < len(fileinfolist) and fileinfolist[fileindex]['offset'] < runend:
+      thisfiledict = fileinfolist[fileindex]
+      fileindex = fileindex + 1
+
+      overlapstart = max(runstart, thisfiledict['offset'])
+      overlapend = min(runend, thisfiledict['offset'] + thisfiledict['length'])
+      if overlapstart >= overlapend:
+        continue
+
+      thisfileobj = open(_check_release_file(thisfiledict, rootdir), 'rb')
+      try:
+        thisfileobj.seek(overlapstart - thisfiledict['offset'])
+        runbuffer[overlapstart - runstart:overlapend - runstart] = thisfileobj.read(overlapend - overlapstart)
+      finally:
+        thisfileobj.close()
+
+    # check the blocks before anything is written
+    runview = memoryview(runbuffer)
+    for blocknum in range(firstblock, endblock):
+      blockposition = (blocknum - firstblock) * blocksize
+      if find_hash(runview[blockposition:blockposition + blocksize], hashalgorithm) != blockhashlist[blocknum]:
+        raise IncorrectFileContents("Block '"+str(blocknum)+"' has the wrong hash (the files do not match the manifest)")
+
+    xordatastore.set_data(runstart, str(runbuffer))
+
+    blocksdone = blocksdone + endblock - firstblock
+
+    if progressfunction is not None and time.time() - lastprogresstime >= HASH_PROGRESS_INTERVAL:
+      lastprogresstime = time.time()
+      progressfunction(blocksdone, len(changedblocklist), blocksdone * blocksize / max(lastprogresstime - starttime, 0.000001))
+
+  if progressfunction is not None:
+    progressfunction(blocksdone, len(changedblocklist), blocksdone * blocksize / max(time.time() - starttime, 0.000001))
+
+  return len(changedblocklist)
 
 
-    # and add it to the datastore
-    xordatastore.set_data(thisoffset, thisfilecontents)
 
+def _get_block_reader(xordatastore, blockcount, blocksize):
+  # Private helper.   Returns a function that gives block n of the datastore.
+  # If the datastore can give a view of itself (get_data with copy=False),
+  # blocks are slices of that view rather than copies.
+  try:
+    datastoreview = xordatastore.get_data(0, blockcount * blocksize, copy=False)
+  except TypeError:
+    # this datastore only gives copies
+    return lambda blocknum: xordatastore.get_data(blocksize*blocknum, blocksize)
+
+  return lambda blocknum: datastoreview[blocksize*blocknum:blocksize*(blocknum+1)]
+
+
+
+def _compute_block_hashlist(xordatastore, blockcount, blocksize, hashalgorithm, hashthreads=None, progressfunction=None):
+  # private helper, used both the compute and check hashes.   hashlib
+  # releases the GIL while it hashes a large buffer, so hashthreads threads
+  # (default one per CPU) really do hash at once.   They take
+  # _HASH_CHUNK_BLOCKS blocks at a time.   progressfunction (if given) is
+  # called with (blocksdone, blockcount, bytespersecond) every
+  # HASH_PROGRESS_INTERVAL seconds and at the end.
+
+  if hashthreads is None:
+    hashthreads = get_cpu_count()
+
+  if type(hashthreads) != int or hashthreads <= 0:
+    raise TypeError("Number of hash threads must be a positive integer")
+
+  currenthashlist = [None] * blockcount
+
+  if blockcount == 0:
+    return currenthashlist
 
+  getblock = _get_block_reader(xordatastore, blockcount, blocksize)
 
-def _compute_block_hashlist(xordatastore, blockcount, blocksize, hashalgorithm):
-  # private helper, used both the compute and check hashes
+  # [next block to hand out, blocks done] and the first error (if any)
+  hashstate = [0, 0]
+  hasherrors = []
+  hashlock = threading.Lock()
 
-  currenthashlist = []
+  def _hash_blocks():
+    while True:
+      hashlock.acquire()
+      try:
+        firstblock = hashstate[0]
+        hashstate[0] = hashstate[0] + _HASH_CHUNK_BLOCKS
+      finally:
+        hashlock.release()
 
-  # Now I'll check the blocks have the right hash...
-  for blocknum in range(blockcount):
-    # read the block ...
-    thisblock = xordatastore.get_data(blocksize*blocknum, blocksize)
+      if firstblock >= blockcount or hasherrors:
+        return
 
-    # ... and check its hash
-    currenthashlist.append(find_hash(thisblock, hashalgorithm))
+      lastblock = min(firstblock + _HASH_CHUNK_BLOCKS, blockcount)
+      try:
+        for blocknum in range(firstblock, lastblock):
+          currenthashlist[blocknum] = find_hash(getblock(blocknum), hashalgorithm)
+      except Exception:
+        hasherrors.append(sys.exc_info())
+        return
+
+      hashlock.acquire()
+      try:
+        hashstate[1] = hashstate[1] + lastblock - firstblock
+      finally:
+        hashlock.release()
+
+  starttime = time.time()
+
+  hashthreadlist = []
+  for threadnumber in range(min(hashthreads, blockcount)):
+    hashthread = threading.Thread(target=_hash_blocks, name="block hasher "+str(threadnumber))
+    hashthread.daemon = True
+    hashthread.start()
+    hashthreadlist.append(hashthread)
+
+  for hashthread in hashthreadlist:
+    while hashthread.is_alive():
+      hashthread.join(HASH_PROGRESS_INTERVAL)
+      if hashthread.is_alive() and progressfunction is not None:
+        progressfunction(hashstate[1], blockcount, hashstate[1] * blocksize / max(time.time() - starttime, 0.000001))
+
+  if hasherrors:
+    raise hasherrors[0][0], hasherrors[0][1], hasherrors[0][2]
+
+  if progressfunction is not None:
+    progressfunction(blockcount, blockcount, blockcount * blocksize / max(time.time() - starttime, 0.000001))
 
   return currenthashlist
 
@@ -754,7 +1483,7 @@ def flip_bitstring_bit(bitstring, bitnum):
 
 
 
-def create_manifest(rootdir=".", hashalgorithm="sha1-base64", block_size=1024*1024, offset_assignment_function=nogaps_offset_assignment_function, vendorhostname=None, vendorport=62293):
+def create_manifest(rootdir=".", hashalgorithm="sha1-base64", block_size=1024*1024, offset_assignment_function=nogaps_offset_assignment_function, vendorhostname=None, vendorport=62293, hashthreads=None, progressfunction=None):
   """
   <Purpose>
     Create a manifest  (and an xordatastore ?)
@@ -768,6 +1497,9 @@ def create_manifest(rootdir=".", hashalgorithm="sha1-base64", block_size=1024*10
 
     offset_assignment_function: specifies how to lay out the files in blocks.
 
+    hashthreads, progressfunction: how the block hashes are computed (see
+                                   populate_xordatastore).
+
   <Exceptions>
     TypeError if the arguments are corrupt or of the wrong type
 
@@ -846,8 +1578,12 @@ def create_manifest(rootdir=".", hashalgorithm="sha1-base64", block_size=1024*10
   manifestdict['blockcount'] = int(math.ceil(nextfreeoffset * 1.0 / manifestdict['blocksize']))
 
 
-  # TODO: Improve this.  It really shouldn't use a datastore...
-  import simplexordatastore as fastsimplexordatastore
+  # TODO: Improve this.  It really shouldn't use a datastore...   The C
+  # datastore (if it is built) lets the blocks be hashed without copies.
+  try:
+    import fastsimplexordatastore
+  except ImportError:
+    import simplexordatastore as fastsimplexordatastore
 
   xordatastore = fastsimplexordatastore.XORDatastore(manifestdict['blocksize'], manifestdict['blockcount'])
 
@@ -855,7 +1591,7 @@ def create_manifest(rootdir=".", hashalgorithm="sha1-base64", block_size=1024*10
   _add_data_to_datastore(xordatastore, manifestdict['fileinfolist'], rootdir, manifestdict['hashalgorithm'])
 
   # and it is time to get the blockhashlist...
-  manifestdict['blockhashlist'] = _compute_block_hashlist(xordatastore, manifestdict['blockcount'], manifestdict['blocksize'], manifestdict['hashalgorithm'])
+  manifestdict['blockhashlist'] = _compute_block_hashlist(xordatastore, manifestdict['blockcount'], manifestdict['blocksize'], manifestdict['hashalgorithm'], hashthreads, progressfunction)
 
   # let's generate the manifest's hash
   rawmanifest = json.dumps(manifestdict)
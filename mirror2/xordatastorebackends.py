@@ -0,0 +1,187 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  A registry of the XORdatastore backends.   A backend is a module with an
+  XORDatastore class and do_xor:
+
+    c:       fastsimplexordatastore (needs the C extension to be built)
+    numpy:   numpyxordatastore (needs NumPy)
+    python:  simplexordatastore (always available, but slow)
+
+  'mmap' (mmapxordatastore) is also a backend name, but it maps a datastore
+  file rather than allocating memory, so it is not created or calibrated
+  here.
+
+  calibrate_backends times each available backend on a sample of a release
+  so that a mirror can pick the fastest one.
+
+"""
+
+import os
+
+import time
+
+
+# backend name -> module name.   In order of preference when several are
+# equally fast.
+_BACKEND_MODULES = [('c', 'fastsimplexordatastore'),
+                    ('numpy', 'numpyxordatastore'),
+                    ('python', 'simplexordatastore')]
+
+# every name a user may ask for
+BACKEND_NAMES = ['python', 'c', 'numpy', 'mmap']
+
+# the most data calibrate_backends puts in a sample datastore
+CALIBRATION_SAMPLE_BYTES = 16*1024*1024
+
+# calibrate_backends keeps querying a backend for at least this long (but
+# always does at least one query)
+CALIBRATION_SECONDS = 0.25
+
+
+
+def get_backend_module(backendname):
+  """
+  <Purpose>
+    Returns the module for a backend.
+
+  <Arguments>
+    backendname: one of BACKEND_NAMES
+
+  <Exceptions>
+    ValueError if the backend name is unknown.
+
+    ImportError if the backend is not available here.
+
+  <Returns>
+    The module.
+  """
+  if backendname == 'mmap':
+    import mmapxordatastore
+    return mmapxordatastore
+
+  for name, modulename in _BACKEND_MODULES:
+    if name == backendname:
+      return __import__(modulename)
+
+  raise ValueError("Unknown datastore backend '"+str(backendname)+"'")
+
+
+
+def get_available_backends():
+  """
+  <Purpose>
+    Returns the backends that can be used here (not including 'mmap').
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A list of backend names in order of preference.
+  """
+  availablebackends = []
+  for name, modulename in _BACKEND_MODULES:
+    try:
+      get_backend_module(name)
+    except ImportError:
+      continue
+    availablebackends.append(name)
+
+  return availablebackends
+
+
+
+def create_xordatastore(backendname, blocksize, blockcount, xorthreads=1):
+  """
+  <Purpose>
+    Creates an (empty) XORdatastore with a backend.
+
+  <Arguments>
+    backendname: one of the names from get_available_backends
+
+    blocksize, blockcount: the datastore size (see the XORdatastore
+                           documentation)
+
+    xorthreads: the number of threads a single query may use.   Only the
+                'c' backend uses this.
+
+  <Exceptions>
+    ValueError / ImportError as for get_backend_module.   The backend's
+    exceptions if the sizes are invalid.
+
+  <Returns>
+    The XORdatastore.
+  """
+  if backendname == 'mmap':
+    raise ValueError("The mmap backend maps a datastore file (see mmapxordatastore.open_datastore_file)")
+
+  backendmodule = get_backend_module(backendname)
+
+  if backendname == 'c':
+    return backendmodule.XORDatastore(blocksize, blockcount, numthreads=xorthreads)
+
+  return backendmodule.XORDatastore(blocksize, blockcount)
+
+
+
+def calibrate_backends(blocksize, blockcount, backendnames=None, xorthreads=1):
+  """
+  <Purpose>
+    Measures how fast each backend answers random queries for a release of
+    this size.   The sample datastore is the release size, but is capped
+    at CALIBRATION_SAMPLE_BYTES.
+
+  <Arguments>
+    blocksize, blockcount: the size of the release
+
+    backendnames: the backends to try (default: get_available_backends())
+
+    xorthreads: see create_xordatastore
+
+  <Exceptions>
+    None
+
+  <Side Effects>
+    Takes about CALIBRATION_SECONDS per backend (longer for a slow backend
+    on a large sample).
+
+  <Returns>
+    A list of (backendname, bytes XORed per second), fastest first.
+  """
+  if backendnames is None:
+    backendnames = get_available_backends()
+
+  sampleblockcount = max(1, min(blockcount, CALIBRATION_SAMPLE_BYTES / blocksize))
+  sampledata = os.urandom(blocksize * sampleblockcount)
+  bitstringlength = (sampleblockcount + 7) / 8
+
+  results = []
+  for backendname in backendnames:
+    sampledatastore = create_xordatastore(backendname, blocksize, sampleblockcount, xorthreads)
+    sampledatastore.set_data(0, sampledata)
+
+    # a random query selects about half the blocks, just like a real one
+    bitstring = os.urandom(bitstringlength)
+
+    queries = 0
+    start = time.time()
+    while True:
+      sampledatastore.produce_xor_from_bitstring(bitstring)
+      queries = queries + 1
+      elapsed = time.time() - start
+      if elapsed >= CALIBRATION_SECONDS:
+        break
+
+    results.append((backendname, blocksize * sampleblockcount * queries / elapsed))
+
+    del sampledatastore
+
+  # sort is stable, so ties keep the order of preference
+  results.sort(key=lambda result: -result[1])
+
+  return results
@@ -0,0 +1,320 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  A log file that serving threads can write to without waiting on disk I/O.
+  log appends the line to a queue (a deque append, which needs no lock) and
+  returns.   A background thread writes whatever is queued every
+  flushinterval seconds with one write and one flush.
+
+  The file can be rotated when it gets too big (maxbytes) or too old
+  (rotateinterval).   The old files are kept as filename.1 (the newest) to
+  filename.<backupcount>.
+
+  Lines for individual requests can be sampled: log_request keeps one line
+  in every samplerate.   If the writer falls behind by maxqueued lines, new
+  lines are dropped (and how many is logged) rather than using more memory
+  or blocking the caller.
+
+  Until start is called, lines are written as they are logged (so a program
+  can log before it forks, see daemon.py, and only start the thread after).
+
+"""
+
+import os
+
+import collections
+
+import itertools
+
+import threading
+
+import time
+
+
+
+class BatchedLogger:
+  """
+  <Purpose>
+    Writes timestamped lines to a log file from a background thread.
+
+  <Side Effects>
+    Opens the log file.   start starts a (daemon) thread.
+
+  <Example Use>
+    logger = BatchedLogger('mirror.log', maxbytes=100*1024*1024)
+    logger.start()
+
+    logger.log('ready to start servers!')
+
+    # only one in 100 of these is written
+    logger.log_request('UPPIR 10.0.0.1 4000 GOOD')
+
+    logger.close()
+
+  """
+
+  # these are public so that a caller can read the settings.   They should
+  # not be changed.
+  filename = None
+  maxbytes = None
+  rotateinterval = None
+  backupcount = None
+  samplerate = None
+  flushinterval = None
+  maxqueued = None
+
+  def __init__(self, filename, maxbytes=0, rotateinterval=0, backupcount=5, samplerate=1, flushinterval=0.5, maxqueued=100000):
+    """
+    <Purpose>
+      Opens the log file (for appending).
+
+    <Arguments>
+      filename: the log file.
+
+      maxbytes: rotate the file once it is this big (default 0, never).
+
+      rotateinterval: rotate the file after this many seconds (default 0,
+                      never).
+
+      backupcount: how many rotated files to keep (default 5).
+
+      samplerate: log_request writes one line in this many (default 1, all
+                  of them).
+
+      flushinterval: how often (in seconds) queued lines are written
+                     (default 0.5).
+
+      maxqueued: the most lines that may wait to be written (default
+                 100000).
+
+    <Exceptions>
+      TypeError if a setting has the wrong type or value.
+
+      IOError if the file cannot be opened.
+
+    """
+    for name, value in [('maxbytes', maxbytes), ('rotateinterval', rotateinterval), ('backupcount', backupcount)]:
+      if type(value) not in [int, long, float]:
+        raise TypeError(name+" must be a number")
+      if value < 0:
+        raise TypeError(name+" must not be negative")
+
+    for name, value in [('samplerate', samplerate), ('maxqueued', maxqueued)]:
+      if type(value) != int and type(value) != long:
+        raise TypeError(name+" must be an integer")
+      if value <= 0:
+        raise TypeError(name+" must be positive")
+
+    if type(flushinterval) not in [int, long, float] or flushinterval <= 0:
+      raise TypeError("flushinterval must be a positive number")
+
+    self.filename = filename
+    self.maxbytes = maxbytes
+    self.rotateinterval = rotateinterval
+    self.backupcount = backupcount
+    self.samplerate = samplerate
+    self.flushinterval = flushinterval
+    self.maxqueued = maxqueued
+
+    # (time, line) waiting to be written
+    self._queue = collections.deque()
+
+    # next() on this is atomic, so sampling needs no lock
+    self._requestcounter = itertools.count()
+
+    # lines that were dropped because the queue was full.   (This is only
+    # changed by callers of log and may undercount if several race.)
+    self._dropped = 0
+
+    # held while writing or rotating the file
+    self._writelock = threading.Lock()
+
+    self._logfo = open(filename, 'a')
+    # (so tell gives the size of a file we are appending to)
+    self._logfo.seek(0, os.SEEK_END)
+    self._opentime = time.time()
+
+    self._writerthread = None
+    self._stopped = threading.Event()
+
+
+
+  def start(self):
+    """
+    <Purpose>
+      Starts the background writer.   Before this, lines are written as they
+      are logged.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    if self._writerthread is not None:
+      return
+
+    self._writerthread = threading.Thread(target=self._write_forever, name="log writer")
+    self._writerthread.daemon = True
+    self._writerthread.start()
+
+
+
+  def log(self, stringtolog):
+    """
+    <Purpose>
+      Logs a line.   This never waits for the disk once start is called.
+
+    <Arguments>
+      stringtolog: the line (without a newline).
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    if len(self._queue) >= self.maxqueued:
+      self._dropped = self._dropped + 1
+      return
+
+    self._queue.append((time.time(), stringtolog))
+
+    if self._writerthread is None:
+      self.flush()
+
+
+
+  def log_request(self, stringtolog):
+    """
+    <Purpose>
+      Logs a line about a single request, sampled to one in samplerate.
+
+    <Arguments>
+      stringtolog: the line (without a newline).
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    if self.samplerate == 1 or self._requestcounter.next() % self.samplerate == 0:
+      self.log(stringtolog)
+
+
+
+  def flush(self):
+    """
+    <Purpose>
+      Writes everything that is queued now (in the calling thread).
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      IOError if the file cannot be written.
+
+    <Returns>
+      None
+    """
+    self._writelock.acquire()
+    try:
+      self._write_queued()
+    finally:
+      self._writelock.release()
+
+
+
+  def _write_queued(self):
+    # Private helper (with the write lock held) that writes the queued lines
+    # and rotates the file if it is time
+    outputlines = []
+    while self._queue:
+      logtime, stringtolog = self._queue.popleft()
+      outputlines.append(str(logtime)+" "+stringtolog+"\n")
+
+    if self._dropped:
+      droppedcount = self._dropped
+      self._dropped = self._dropped - droppedcount
+      outputlines.append(str(time.time())+" dropped "+str(droppedcount)+" log lines (the log writer fell behind)\n")
+
+    if not outputlines:
+      return
+
+    # a new file is started before writing, once the current one is full or
+    # old (but never empty, so quiet periods don't push out the backups)
+    if self._logfo.tell() > 0:
+      if self.maxbytes and self._logfo.tell() >= self.maxbytes:
+        self._rotate()
+      elif self.rotateinterval and time.time() - self._opentime >= self.rotateinterval:
+        self._rotate()
+
+    self._logfo.write(''.join(outputlines))
+    self._logfo.flush()
+
+
+
+  def _rotate(self):
+    # Private helper (with the write lock held).   filename becomes
+    # filename.1, filename.1 becomes filename.2, etc. and a new file is
+    # started.
+    self._logfo.close()
+
+    if self.backupcount == 0:
+      os.remove(self.filename)
+
+    else:
+      for backupnumber in range(int(self.backupcount) - 1, 0, -1):
+        olderfilename = self.filename+'.'+str(backupnumber)
+        if os.path.exists(olderfilename):
+          os.rename(olderfilename, self.filename+'.'+str(backupnumber + 1))
+      os.rename(self.filename, self.filename+'.1')
+
+    self._logfo = open(self.filename, 'a')
+    self._opentime = time.time()
+
+
+
+  def _write_forever(self):
+    # Private helper that the writer thread runs
+    while not self._stopped.is_set():
+      self._stopped.wait(self.flushinterval)
+      try:
+        self.flush()
+      except (IOError, OSError):
+        # the disk is full, etc.   There is nowhere to log this.   Those
+        # lines are lost, but later ones may still be written.
+        pass
+
+
+
+  def close(self):
+    """
+    <Purpose>
+      Stops the writer, writes anything still queued and closes the file.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      IOError if the file cannot be written.
+
+    <Returns>
+      None
+    """
+    self._stopped.set()
+    if self._writerthread is not None and self._writerthread is not threading.current_thread():
+      self._writerthread.join()
+
+    self._writelock.acquire()
+    try:
+      self._write_queued()
+      self._logfo.close()
+    finally:
+      self._writelock.release()
@@ -0,0 +1,405 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  A fair-share scheduler for work from many clients.   A fixed number of
+  worker threads take tasks from per-client queues in round robin order, so
+  each client with waiting work gets an equal share of the workers no matter
+  how many requests it sends.
+
+  Queues are bounded.   A task is rejected with SchedulerBusy if maxqueued
+  tasks are already waiting, or if its client already has maxperclient
+  tasks waiting or running.   The caller should tell the client to retry
+  later.
+
+  A task may be deferred: it hands its work to something else (like a
+  coalescer that answers many tasks in one pass) and finishes later, from
+  another thread.   Its worker is free as soon as the task function
+  returns, but it counts against its client's share until it finishes.
+
+  get_metrics reports the queue depth and how many tasks were rejected.
+
+"""
+
+import collections
+
+import threading
+
+
+class SchedulerBusy(Exception):
+  """The scheduler (or the client's share of it) is full.   Retry later."""
+
+
+
+
+class FairScheduler:
+  """
+  <Purpose>
+    Runs tasks on a bounded pool of worker threads, sharing the workers
+    fairly between clients.
+
+  <Side Effects>
+    Starts numworkers (daemon) threads.
+
+  <Example Use>
+    scheduler = FairScheduler(4, 256, 16)
+
+    # blocks until a worker has run it
+    result = scheduler.run('10.0.0.1', somefunction, (arg1, arg2))
+
+    # or returns at once and calls back (in the worker thread)
+    scheduler.submit('10.0.0.1', somefunction, (arg1, arg2), callback)
+
+    # somefunction(arg1, arg2, finish) gets the task's work going and
+    # returns.   Whatever does the work calls finish(result, error) later.
+    result = scheduler.run('10.0.0.1', somefunction, (arg1, arg2), deferred=True)
+
+  """
+
+  # these are public so that a caller can read the limits.   They should not
+  # be changed.
+  numworkers = None
+  maxqueued = None
+  maxperclient = None
+
+  def __init__(self, numworkers, maxqueued, maxperclient):
+    """
+    <Purpose>
+      Creates the queues and starts the workers.
+
+    <Arguments>
+      numworkers: the number of worker threads.
+
+      maxqueued: the most tasks that may wait for a worker (from all
+                 clients).
+
+      maxperclient: the most tasks one client may have waiting or running.
+
+    <Exceptions>
+      TypeError if the arguments are not positive integers.
+
+    """
+    for name, value in [('numworkers', numworkers), ('maxqueued', maxqueued), ('maxperclient', maxperclient)]:
+      if type(value) != int and type(value) != long:
+        raise TypeError(name+" must be an integer")
+      if value <= 0:
+        raise TypeError(name+" must be positive")
+
+    self.numworkers = numworkers
+    self.maxqueued = maxqueued
+    self.maxperclient = maxperclient
+
+    self._condition = threading.Condition()
+
+    # clientkey -> deque of (function, args, callback)
+    self._clientqueues = {}
+
+    # the clients with waiting tasks, in the order they will be served
+    self._readyclients = collections.deque()
+
+    # clientkey -> tasks waiting or running
+    self._clientload = {}
+
+    self._queued = 0
+    self._running = 0
+    self._deferred = 0
+    self._completed = 0
+    self._rejectedqueuefull = 0
+    self._rejectedclientquota = 0
+
+    self._stopped = False
+
+    self._workerthreads = []
+    for workernumber in range(numworkers):
+      workerthread = threading.Thread(target=self._work_forever, name="scheduler worker "+str(workernumber))
+      workerthread.daemon = True
+      workerthread.start()
+      self._workerthreads.append(workerthread)
+
+
+
+  def submit(self, clientkey, function, args=(), callback=None, deferred=False):
+    """
+    <Purpose>
+      Queues function(*args) for a worker.
+
+    <Arguments>
+      clientkey: who the task is for (e.g. the client's IP address).   Tasks
+                 are shared fairly between keys.
+
+      function, args: the task.
+
+      callback: a function (result, error) that is called in the worker
+                thread once the task is done.   error is the exception the
+                task raised (and result is None) or None.   (default None)
+
+      deferred: the task finishes later (default False).   The worker calls
+                function(*args + (finish,)) and the task is done once
+                finish(result, error) is called (once, from any thread).
+                If the function raises without having called finish, the
+                task is done with that error.   The callback is called in
+                the thread that finishes the task.
+
+    <Exceptions>
+      SchedulerBusy if the queue or the client's share is full.
+
+    <Returns>
+      None
+    """
+    self._condition.acquire()
+    try:
+      if self._queued >= self.maxqueued:
+        self._rejectedqueuefull = self._rejectedqueuefull + 1
+        raise SchedulerBusy("The queue is full")
+
+      if self._clientload.get(clientkey, 0) >= self.maxperclient:
+        self._rejectedclientquota = self._rejectedclientquota + 1
+        raise SchedulerBusy("Too many requests from "+str(clientkey))
+
+      if clientkey not in self._clientqueues:
+        self._clientqueues[clientkey] = collections.deque()
+        self._readyclients.append(clientkey)
+
+      self._clientqueues[clientkey].append((function, args, callback, deferred))
+      self._clientload[clientkey] = self._clientload.get(clientkey, 0) + 1
+      self._queued = self._queued + 1
+
+      self._condition.notify()
+
+    finally:
+      self._condition.release()
+
+
+
+  def run(self, clientkey, function, args=(), deferred=False):
+    """
+    <Purpose>
+      Queues function(*args) and waits for a worker to run it.
+
+    <Arguments>
+      See submit.
+
+    <Exceptions>
+      SchedulerBusy if the queue or the client's share is full.
+
+      Whatever the function raises.
+
+    <Returns>
+      What the function returns.
+    """
+    done = threading.Event()
+    outcome = []
+
+    def _task_done(result, error):
+      outcome.append((result, error))
+      done.set()
+
+    self.submit(clientkey, function, args, _task_done, deferred)
+
+    done.wait()
+
+    result, error = outcome[0]
+    if error is not None:
+      raise error
+
+    return result
+
+
+
+  def _next_task(self):
+    # Private helper.   Waits for a task and takes it from the next client's
+    # queue.   Returns (clientkey, task) or None if the scheduler stopped.
+    self._condition.acquire()
+    try:
+      while not self._readyclients and not self._stopped:
+        self._condition.wait()
+
+      if self._stopped:
+        return None
+
+      clientkey = self._readyclients.popleft()
+      clientqueue = self._clientqueues[clientkey]
+      task = clientqueue.popleft()
+
+      # this client goes to the back of the line
+      if clientqueue:
+        self._readyclients.append(clientkey)
+      else:
+        del self._clientqueues[clientkey]
+
+      self._queued = self._queued - 1
+      self._running = self._running + 1
+
+      return (clientkey, task)
+
+    finally:
+      self._condition.release()
+
+
+
+  def _work_forever(self):
+    # Private helper that each worker thread runs
+    while True:
+      nexttask = self._next_task()
+      if nexttask is None:
+        return
+
+      clientkey, (function, args, callback, deferred) = nexttask
+
+      if deferred:
+        self._run_deferred(clientkey, function, args, callback)
+        continue
+
+      try:
+        result = function(*args)
+        error = None
+      except Exception, e:
+        result = None
+        error = e
+
+      self._condition.acquire()
+      try:
+        self._running = self._running - 1
+        self._task_finished(clientkey)
+      finally:
+        self._condition.release()
+
+      if callback is not None:
+        callback(result, error)
+
+
+
+  def _run_deferred(self, clientkey, function, args, callback):
+    # Private helper (in a worker) that starts a deferred task.   The worker
+    # is done with it once the function returns.
+    finished = []
+
+    def _finish(result, error):
+      self._condition.acquire()
+      try:
+        if finished:
+          raise ValueError("The task is already finished")
+        finished.append(True)
+
+        if functionreturned:
+          self._deferred = self._deferred - 1
+        else:
+          self._running = self._running - 1
+        self._task_finished(clientkey)
+      finally:
+        self._condition.release()
+
+      if callback is not None:
+        callback(result, error)
+
+    # (set, with the lock held, once the function has returned, so _finish
+    # knows whether the task still counts as running)
+    functionreturned = False
+
+    try:
+      function(*(tuple(args) + (_finish,)))
+      error = None
+    except Exception, e:
+      error = e
+
+    self._condition.acquire()
+    try:
+      functionreturned = True
+      if not finished:
+        self._running = self._running - 1
+        self._deferred = self._deferred + 1
+    finally:
+      self._condition.release()
+
+    if error is not None:
+      try:
+        _finish(None, error)
+      except ValueError:
+        # it was finished before the function raised
+        pass
+
+
+
+  def _task_finished(self, clientkey):
+    # Private helper (with the lock held) that frees the task's place in its
+    # client's share
+    self._completed = self._completed + 1
+    self._clientload[clientkey] = self._clientload[clientkey] - 1
+    if self._clientload[clientkey] == 0:
+      del self._clientload[clientkey]
+
+
+
+  def get_queued(self):
+    """
+    <Purpose>
+      Returns how many tasks are waiting for a worker.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      An integer.
+    """
+    return self._queued
+
+
+
+  def get_metrics(self):
+    """
+    <Purpose>
+      Returns the scheduler's state and counters.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      A dictionary with 'queued' (tasks waiting), 'running', 'deferred'
+      (tasks that left their worker but are not finished), 'clients'
+      (clients with tasks waiting, running or deferred), 'completed',
+      'rejectedqueuefull' and 'rejectedclientquota'.
+    """
+    self._condition.acquire()
+    try:
+      return {'queued':self._queued, 'running':self._running,
+          'deferred':self._deferred,
+          'clients':len(self._clientload), 'completed':self._completed,
+          'rejectedqueuefull':self._rejectedqueuefull,
+          'rejectedclientquota':self._rejectedclientquota}
+    finally:
+      self._condition.release()
+
+
+
+  def shutdown(self):
+    """
+    <Purpose>
+      Stops the workers once they finish their current tasks.   Tasks that
+      are still queued are dropped (their callbacks are never called).
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      None
+    """
+    self._condition.acquire()
+    try:
+      self._stopped = True
+      self._condition.notifyAll()
+    finally:
+      self._condition.release()
+
+    for workerthread in self._workerthreads:
+      if workerthread is not threading.current_thread():
+        workerthread.join()
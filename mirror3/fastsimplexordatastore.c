@@ -4,26 +4,15 @@
  */
 
 #include "Python.h"
+#include "structmember.h"
 #include "fastsimplexordatastore.h"
 
-/* I've decided not to mess with making this a Python object.   
- * Undoubtably I could do so, but it is harder to understand and verify
- * it doesn't have some sort of bug.   I'll make the C <-> Python portion
- * straightforward and have an intermediate module that makes this
- * more Pythonic.
+/* A datastore is a Python type (fastsimplexordatastore_c.XORDatastore) that
+ * owns its (aligned) memory and exposes it with the buffer protocol.   The 
+ * Python module fastsimplexordatastore adds the module level helpers.
  */
 
 
-// This should be *waaaay* more than we would ever need
-#define STARTING_XORDATASTORE_TABLESIZE 16
-
-static int xordatastorestablesize = STARTING_XORDATASTORE_TABLESIZE;
-static int xordatastoreinited = 0;
-
-static XORDatastore xordatastoretable[STARTING_XORDATASTORE_TABLESIZE];
-
-
-
 // Helper
 static inline void XOR_fullblocks(uint64_t *dest, uint64_t *data, long count) {
   register long i;
@@ -46,6 +35,165 @@ static inline void XOR_byteblocks(char *dest, const char *data, long count) {
 
 
 
+// SIMD versions of XOR_fullblocks.   They are compiled for their instruction
+// set with GCC / clang's target attribute and are only called if the CPU 
+// supports them (see select_xor_kernel).   dest and data only need to be 
+// DWORD aligned.   Whatever doesn't fill a full vector is done by 
+// XOR_fullblocks.
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define HAVE_X86_XOR_KERNELS
+#include <immintrin.h>
+
+__attribute__((target("sse2")))
+static void XOR_fullblocks_sse2(uint64_t *dest, uint64_t *data, long count) {
+  long i;
+  for (i=0; i+2<=count; i+=2) {
+    __m128i d = _mm_loadu_si128((__m128i *) (dest+i));
+    _mm_storeu_si128((__m128i *) (dest+i), _mm_xor_si128(d, _mm_loadu_si128((__m128i *) (data+i))));
+  }
+  XOR_fullblocks(dest+i, data+i, count-i);
+}
+
+__attribute__((target("avx2")))
+static void XOR_fullblocks_avx2(uint64_t *dest, uint64_t *data, long count) {
+  long i;
+  for (i=0; i+8<=count; i+=8) {
+    __m256i d0 = _mm256_loadu_si256((__m256i *) (dest+i));
+    __m256i d1 = _mm256_loadu_si256((__m256i *) (dest+i+4));
+    d0 = _mm256_xor_si256(d0, _mm256_loadu_si256((__m256i *) (data+i)));
+    d1 = _mm256_xor_si256(d1, _mm256_loadu_si256((__m256i *) (data+i+4)));
+    _mm256_storeu_si256((__m256i *) (dest+i), d0);
+    _mm256_storeu_si256((__m256i *) (dest+i+4), d1);
+  }
+  XOR_fullblocks(dest+i, data+i, count-i);
+}
+
+__attribute__((target("avx512f")))
+static void XOR_fullblocks_avx512(uint64_t *dest, uint64_t *data, long count) {
+  long i;
+  for (i=0; i+16<=count; i+=16) {
+    __m512i d0 = _mm512_loadu_si512((void *) (dest+i));
+    __m512i d1 = _mm512_loadu_si512((void *) (dest+i+8));
+    d0 = _mm512_xor_si512(d0, _mm512_loadu_si512((void *) (data+i)));
+    d1 = _mm512_xor_si512(d1, _mm512_loadu_si512((void *) (data+i+8)));
+    _mm512_storeu_si512((void *) (dest+i), d0);
+    _mm512_storeu_si512((void *) (dest+i+8), d1);
+  }
+  XOR_fullblocks(dest+i, data+i, count-i);
+}
+#endif
+
+
+// Fastest first.   The scalar kernel must be last.
+static xor_kernel xor_kernels[] = {
+#ifdef HAVE_X86_XOR_KERNELS
+  {"avx512", XOR_fullblocks_avx512},
+  {"avx2", XOR_fullblocks_avx2},
+  {"sse2", XOR_fullblocks_sse2},
+#endif
+  {"scalar", XOR_fullblocks},
+};
+
+#define NUM_XOR_KERNELS ((int) (sizeof(xor_kernels) / sizeof(xor_kernel)))
+
+// The kernel used for all datastore XORs.   Set by select_xor_kernel when 
+// the module is loaded.
+static xor_kernel *current_xor_kernel = &xor_kernels[NUM_XOR_KERNELS - 1];
+
+
+// Can this CPU run the kernel?
+static int is_xor_kernel_supported(xor_kernel *kernel) {
+#ifdef HAVE_X86_XOR_KERNELS
+  if (strcmp(kernel->name, "avx512") == 0) {
+    return __builtin_cpu_supports("avx512f");
+  }
+  if (strcmp(kernel->name, "avx2") == 0) {
+    return __builtin_cpu_supports("avx2");
+  }
+  if (strcmp(kernel->name, "sse2") == 0) {
+    return __builtin_cpu_supports("sse2");
+  }
+#endif
+  return 1;
+}
+
+
+// Picks the fastest kernel this CPU supports
+static void select_xor_kernel(void) {
+  int i;
+#ifdef HAVE_X86_XOR_KERNELS
+  __builtin_cpu_init();
+#endif
+  for (i=0; i<NUM_XOR_KERNELS; i++) {
+    if (is_xor_kernel_supported(&xor_kernels[i])) {
+      current_xor_kernel = &xor_kernels[i];
+      return;
+    }
+  }
+}
+
+
+
+// The next selected (set) block in [block, end_block) of a bitstring, or 
+// end_block if there are none.   Rather than testing one bit at a time, this
+// looks at 64 blocks at once and jumps to the first set bit with count 
+// leading zeros (the bitstring is MSB first).   bit_string_bytes is the 
+// number of bytes in bit_string that may be read.
+static inline long next_selected_block(const unsigned char *bit_string, long bit_string_bytes, long block, long end_block) {
+  long word_start, byte_pos;
+  uint64_t bits;
+  int i;
+
+  while (block < end_block) {
+    word_start = block - (block % 64);
+    byte_pos = word_start / 8;
+
+    // load the 64 bits of this word, MSB first...
+    bits = 0;
+    if (byte_pos + 8 <= bit_string_bytes) {
+      for (i=0; i<8; i++) {
+        bits = (bits << 8) | bit_string[byte_pos + i];
+      }
+    }
+    else {
+      for (i=0; i<8; i++) {
+        bits <<= 8;
+        if (byte_pos + i < bit_string_bytes) {
+          bits |= bit_string[byte_pos + i];
+        }
+      }
+    }
+
+    // ... ignore the blocks before this one ...
+    bits &= (~(uint64_t) 0) >> (block - word_start);
+
+    if (bits) {
+      block = word_start + __builtin_clzll(bits);
+      return (block < end_block) ? block : end_block;
+    }
+
+    // ... or go on to the next word
+    block = word_start + 64;
+  }
+  return end_block;
+}
+
+
+// How much of the next selected block to prefetch while XORing the current
+// one.   The hardware prefetcher picks up the rest once we're streaming it.
+#define PREFETCH_BYTES 512
+
+static inline void prefetch_block(const char *block, long block_size) {
+  long offset;
+  long limit = (block_size < PREFETCH_BYTES) ? block_size : PREFETCH_BYTES;
+  for (offset = 0; offset < limit; offset += 64) {
+    __builtin_prefetch(block + offset, 0, 0);
+  }
+}
+
+
+
+
 // Moves ptr to the next DWORD aligned address.   If ptr is DWORD aligned,
 // return ptr.
 static inline char *dword_align(char *ptr) {
@@ -53,163 +201,536 @@ static inline char *dword_align(char *ptr) {
 }
 
 
-// A helper function that checks to see if the table entry is used or free
-static int is_table_entry_used(int i) {
-  return (xordatastoretable[i].raw_datastore != NULL);
+
+// This function needs to be fast.   It XORs the selected blocks in 
+// [start_block, end_block) into resultbuffer.   It does not touch any Python
+// objects, so it is run with Python's GIL released.
+
+static void bitstring_xor_worker(XORDatastoreObject *ds, char *bit_string, long start_block, long end_block, uint64_t *resultbuffer) {
+  long block_size = ds->sizeofablock;
+  char *datastorebase = (char *) ds->datastore;
+
+  long dwords_per_block = block_size / sizeof(uint64_t);
+  long bit_string_bytes = (end_block + 7) / 8;
+  xor_kernel_function xor_function = current_xor_kernel->function;
+  long block, next_block;
+
+  block = next_selected_block((unsigned char *) bit_string, bit_string_bytes, start_block, end_block);
+
+  while (block < end_block) {
+    // find the next block and start loading it while we XOR this one
+    next_block = next_selected_block((unsigned char *) bit_string, bit_string_bytes, block + 1, end_block);
+    if (next_block < end_block) {
+      prefetch_block(datastorebase + next_block * block_size, block_size);
+    }
+
+    xor_function(resultbuffer, (uint64_t *) (datastorebase + block * block_size), dwords_per_block);
+
+    block = next_block;
+  }
 }
 
 
 
+// A thread only gets part of a query if it will XOR at least this many bytes
+// of the datastore.   Below that, starting the thread costs more than it saves.
+#define MIN_BYTES_PER_XOR_THREAD (1024*1024)
 
-// This allocates memory and stores the size / num_blocks for 
-// error checking later
-static datastore_descriptor allocate(long block_size, long num_blocks)  {
+// The arguments for one thread of a parallel query
+typedef struct {
+  XORDatastoreObject *ds;
+  char *bit_string;
+  long start_block;
+  long end_block;
+  uint64_t *resultbuffer;
+} xor_thread_args;
+
+
+static void *bitstring_xor_thread(void *arg) {
+  xor_thread_args *threadargs = (xor_thread_args *) arg;
+  bitstring_xor_worker(threadargs->ds, threadargs->bit_string, threadargs->start_block, threadargs->end_block, threadargs->resultbuffer);
+  return NULL;
+}
+
+
+
+// Splits the blocks into num_threads ranges and XORs each range in its own
+// thread into its own partial result.   The partial results are XORed into
+// resultbuffer at the end.   The calling thread does the first range.   If a
+// thread can't be started, its range is done by the calling thread.
+// Returns 0 on success and -1 if memory for the partial results couldn't be
+// allocated (nothing is done in that case).
+
+static int parallel_bitstring_xor_worker(XORDatastoreObject *ds, char *bit_string, int num_threads, uint64_t *resultbuffer) {
+  long block_size = ds->sizeofablock;
+  long num_blocks = ds->numberofblocks;
+  long dwords_per_block = block_size / sizeof(uint64_t);
+  long max_threads = (num_blocks * block_size) / MIN_BYTES_PER_XOR_THREAD;
+  long blocks_per_thread;
+  char *raw_partialbuffers;
+  uint64_t *partialbuffers;
+  xor_thread_args *threadargs;
+  pthread_t *threads;
+  int *started;
   int i;
 
-  // If it isn't inited, let's fill in the table with empty entries
-  if (!xordatastoreinited) {
-    // start the table as entry
-    for (i=0; i<STARTING_XORDATASTORE_TABLESIZE; i++) {
-      xordatastoretable[i].numberofblocks = 0;
-      xordatastoretable[i].sizeofablock = 0;
-      xordatastoretable[i].raw_datastore = NULL;
-      xordatastoretable[i].datastore = NULL;
+  if (num_threads > max_threads) {
+    num_threads = max_threads;
+  }
+  if (num_threads > num_blocks) {
+    num_threads = num_blocks;
+  }
+
+  // not worth it...
+  if (num_threads <= 1) {
+    bitstring_xor_worker(ds, bit_string, 0, num_blocks, resultbuffer);
+    return 0;
+  }
+
+  blocks_per_thread = (num_blocks + num_threads - 1) / num_threads;
+
+  // the first range goes straight into resultbuffer, the others get their
+  // own partial result
+  raw_partialbuffers = calloc((num_threads - 1) * block_size + sizeof(uint64_t), 1);
+  threadargs = malloc(num_threads * sizeof(xor_thread_args));
+  threads = malloc(num_threads * sizeof(pthread_t));
+  started = calloc(num_threads, sizeof(int));
+
+  if (raw_partialbuffers == NULL || threadargs == NULL || threads == NULL || started == NULL) {
+    free(raw_partialbuffers);
+    free(threadargs);
+    free(threads);
+    free(started);
+    return -1;
+  }
+
+  partialbuffers = (uint64_t *) dword_align(raw_partialbuffers);
+
+  for (i=0; i<num_threads; i++) {
+    threadargs[i].ds = ds;
+    threadargs[i].bit_string = bit_string;
+    threadargs[i].start_block = i * blocks_per_thread;
+    threadargs[i].end_block = (i + 1) * blocks_per_thread;
+    if (threadargs[i].end_block > num_blocks) {
+      threadargs[i].end_block = num_blocks;
+    }
+    if (i == 0) {
+      threadargs[i].resultbuffer = resultbuffer;
     }
-    // We've initted now!
-    xordatastoreinited = 1;
-  }
-
-  for (i=0; i<xordatastorestablesize; i++) {
-    // Look for an empty entry
-    if (!is_table_entry_used(i)) {
-      xordatastoretable[i].numberofblocks = num_blocks;
-      xordatastoretable[i].sizeofablock = block_size;
-
-      // I allocate a little bit extra so that I can DWORD align it
-      xordatastoretable[i].raw_datastore = malloc(num_blocks * block_size + sizeof(uint64_t));
-      // Zero it out
-      bzero(xordatastoretable[i].raw_datastore, num_blocks * block_size + sizeof(uint64_t));
-      
-      // and align it...
-      xordatastoretable[i].datastore = (uint64_t *) dword_align(xordatastoretable[i].raw_datastore);
-      return i;
+    else {
+      threadargs[i].resultbuffer = partialbuffers + (i - 1) * dwords_per_block;
+      started[i] = (pthread_create(&threads[i], NULL, bitstring_xor_thread, &threadargs[i]) == 0);
     }
   }
 
-  // The table is full!   I really should expand it...
-  printf("Internal Error: I need to expand the table size (unimplemented)\n");
-  return -1;
-} 
+  // our share of the work...
+  bitstring_xor_worker(ds, bit_string, threadargs[0].start_block, threadargs[0].end_block, resultbuffer);
+
+  for (i=1; i<num_threads; i++) {
+    if (started[i]) {
+      pthread_join(threads[i], NULL);
+    }
+    else {
+      bitstring_xor_worker(ds, bit_string, threadargs[i].start_block, threadargs[i].end_block, threadargs[i].resultbuffer);
+    }
+    current_xor_kernel->function(resultbuffer, threadargs[i].resultbuffer, dwords_per_block);
+  }
+
+  free(raw_partialbuffers);
+  free(threadargs);
+  free(threads);
+  free(started);
+  return 0;
+}
+
+
+
+
+
+
+
+
+// The multi-query kernel works on tiles of the datastore that are this many
+// bytes.   Every pending query is applied to a tile before moving to the next
+// one, so a tile should comfortably fit in the CPU's cache.
+#define XOR_TILE_BYTES (256*1024)
+
+// Like bitstring_xor_worker, but for many bitstrings at once.   The datastore
+// is read from memory once for all of the queries instead of once per query.
+// If a block is larger than a tile, the blocks are split into column ranges
+// so that the tile still fits in cache.
+
+static void multi_bitstring_xor_worker(XORDatastoreObject *ds, char **bit_strings, long num_bit_strings, uint64_t *resultbuffers) {
+  long block_size = ds->sizeofablock;
+  long num_blocks = ds->numberofblocks;
+  char *datastorebase = (char *) ds->datastore;
+
+  long dwords_per_block = block_size / sizeof(uint64_t);
+  long dwords_per_column = XOR_TILE_BYTES / sizeof(uint64_t);
+  long blocks_per_tile;
+  long column, column_length, tile_start, tile_end, query, block;
+  long bit_string_bytes = (num_blocks + 7) / 8;
+  xor_kernel_function xor_function = current_xor_kernel->function;
+  char *bit_string;
+  uint64_t *dest;
+
+  if (dwords_per_column > dwords_per_block) {
+    dwords_per_column = dwords_per_block;
+  }
+
+  blocks_per_tile = XOR_TILE_BYTES / (dwords_per_column * sizeof(uint64_t));
+  if (blocks_per_tile < 1) {
+    blocks_per_tile = 1;
+  }
+
+  for (column = 0; column < dwords_per_block; column += dwords_per_column) {
+    column_length = dwords_per_block - column;
+    if (column_length > dwords_per_column) {
+      column_length = dwords_per_column;
+    }
+
+    for (tile_start = 0; tile_start < num_blocks; tile_start += blocks_per_tile) {
+      tile_end = tile_start + blocks_per_tile;
+      if (tile_end > num_blocks) {
+        tile_end = num_blocks;
+      }
+
+      // apply every query to this tile...
+      for (query = 0; query < num_bit_strings; query++) {
+        bit_string = bit_strings[query];
+        dest = resultbuffers + query * dwords_per_block + column;
+
+        block = next_selected_block((unsigned char *) bit_string, bit_string_bytes, tile_start, tile_end);
+        while (block < tile_end) {
+          xor_function(dest, ((uint64_t *) (datastorebase + block * block_size)) + column, column_length);
+          block = next_selected_block((unsigned char *) bit_string, bit_string_bytes, block + 1, tile_end);
+        }
+      }
+    }
+  }
+}
+
+
+
+
+
+
+
+// The datastore is aligned to this many bytes (a cache line, which is also
+// the widest vector the XOR kernels use).
+#define DATASTORE_ALIGNMENT 64
+
+
+// Helper that reads a Python int / long argument.   Raises TypeError with 
+// message if obj isn't an integer.   Returns -1 on error.
+static int get_integer_argument(PyObject *obj, const char *message, long long *value) {
+  if (!PyInt_Check(obj) && !PyLong_Check(obj)) {
+    PyErr_SetString(PyExc_TypeError, message);
+    return -1;
+  }
+
+  *value = PyLong_AsLongLong(obj);
+  if (*value == -1 && PyErr_Occurred()) {
+    return -1;
+  }
+  return 0;
+}
+
+
+// Helper that checks a bitstring the same way the Python datastore does
+static int check_bitstring(XORDatastoreObject *ds, PyObject *bitstring) {
+  if (!PyString_Check(bitstring)) {
+    PyErr_SetString(PyExc_TypeError, "bitstring must be a string");
+    return -1;
+  }
+
+  if (PyString_GET_SIZE(bitstring) != (ds->numberofblocks + 7) / 8) {
+    PyErr_SetString(PyExc_TypeError, "bitstring is not of the correct length");
+    return -1;
+  }
+  return 0;
+}
 
 
 
-// Python wrapper...
-static PyObject *Allocate(PyObject *module, PyObject *args) {
-  long blocksize, numblocks;
 
-  if (!PyArg_ParseTuple(args, "ll", &blocksize,&numblocks)) {
+// Allocates the (zeroed, aligned) datastore.   This is done in __new__ 
+// rather than __init__ so a datastore can never be resized under someone
+// using its buffer.
+static PyObject *XORDatastore_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  static char *kwlist[] = {"block_size", "num_blocks", "numthreads", NULL};
+  PyObject *blocksizeobj, *numblocksobj;
+  long long block_size, num_blocks;
+  int num_threads = 1;
+  XORDatastoreObject *self;
+  void *datastore;
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|i", kwlist, &blocksizeobj, &numblocksobj, &num_threads)) {
     // Incorrect args...
     return NULL;
   }
 
+  if (get_integer_argument(blocksizeobj, "Block size must be an integer", &block_size) < 0) {
+    return NULL;
+  }
+  if (block_size <= 0) {
+    PyErr_SetString(PyExc_TypeError, "Block size must be positive");
+    return NULL;
+  }
   // This needs to be 64 byte aligned...
-  if (blocksize % 64) {
-    PyErr_SetString(PyExc_ValueError, "Block size must be a multiple of 64");
+  if (block_size % 64) {
+    PyErr_SetString(PyExc_TypeError, "Block size must be a multiple of 64");
     return NULL;
   }
 
+  if (get_integer_argument(numblocksobj, "Number of blocks must be an integer", &num_blocks) < 0) {
+    return NULL;
+  }
+  if (num_blocks <= 0) {
+    PyErr_SetString(PyExc_TypeError, "Number of blocks must be positive");
+    return NULL;
+  }
 
-  return Py_BuildValue("i",allocate(blocksize, numblocks));
+  if (num_threads <= 0) {
+    PyErr_SetString(PyExc_TypeError, "Number of threads must be positive");
+    return NULL;
+  }
 
-}
+  if (num_blocks > PY_SSIZE_T_MAX / block_size) {
+    return PyErr_NoMemory();
+  }
+
+  if (posix_memalign(&datastore, DATASTORE_ALIGNMENT, block_size * num_blocks) != 0) {
+    return PyErr_NoMemory();
+  }
+  // Zero it out (the padding for any 'gaps' in the data)
+  memset(datastore, 0, block_size * num_blocks);
+
+  self = (XORDatastoreObject *) type->tp_alloc(type, 0);
+  if (self == NULL) {
+    free(datastore);
+    return NULL;
+  }
 
+  self->numberofblocks = num_blocks;
+  self->sizeofablock = block_size;
+  self->numthreads = num_threads;
+  self->datastore = (uint64_t *) datastore;
 
+  return (PyObject *) self;
+}
 
 
+// Everything was done in __new__.   This only has to accept the same 
+// arguments.
+static int XORDatastore_init(PyObject *self, PyObject *args, PyObject *kwds) {
+  return 0;
+}
+
 
+static void XORDatastore_dealloc(XORDatastoreObject *self) {
+  if (self->weakreflist != NULL) {
+    PyObject_ClearWeakRefs((PyObject *) self);
+  }
+  // Any buffer (memoryview) holds a reference to us, so nobody can still be
+  // using the memory.
+  free(self->datastore);
+  Py_TYPE(self)->tp_free((PyObject *) self);
+}
 
 
 
 
-// This function needs to be fast.   It is a good candidate for releasing 
-// Python's GIL
+// Does XORs given a bit string.   This is the common case and so should be 
+// optimized.   The GIL is released while the XOR is computed, so other 
+// Python threads (like other mirror requests) can run.   If numthreads > 1 
+// a single query is split over that many threads.
 
-static void bitstring_xor_worker(int ds, char *bit_string, long bit_string_length, uint64_t *resultbuffer) {
-  long remaininglength = bit_string_length * 8;  // convert bytes to bits
-  char *current_bit_string_pos;
-  current_bit_string_pos = bit_string;
-  long long offset = 0;
-  int block_size = xordatastoretable[ds].sizeofablock;
-  char *datastorebase;
-  datastorebase = (char *) xordatastoretable[ds].datastore;
+static PyObject *XORDatastore_produce_xor_from_bitstring(XORDatastoreObject *self, PyObject *bitstring) {
+  PyObject *resultstr;
+  char *bitstringbuffer;
+  uint64_t *resultbuffer;
+  int num_threads = self->numthreads;
+  int result;
 
-  int dwords_per_block = block_size / sizeof(uint64_t);
+  if (check_bitstring(self, bitstring) < 0) {
+    return NULL;
+  }
+  bitstringbuffer = PyString_AS_STRING(bitstring);
 
-  int bit = 128;
+  // Let's prepare a place to put this (zeroed out).   A string's data is 
+  // only 4 byte aligned, so the XOR is done in our own buffer.
+  if (posix_memalign((void **) &resultbuffer, DATASTORE_ALIGNMENT, self->sizeofablock) != 0) {
+    return PyErr_NoMemory();
+  }
+  memset(resultbuffer, 0, self->sizeofablock);
 
+  // Let's actually calculate this!   The caller holds a reference to the 
+  // bitstring until we return.
+  Py_BEGIN_ALLOW_THREADS
+  result = parallel_bitstring_xor_worker(self, bitstringbuffer, num_threads, resultbuffer);
+  Py_END_ALLOW_THREADS
 
-  while (remaininglength >0) {
-    if ((*current_bit_string_pos) & bit) {
-      XOR_fullblocks(resultbuffer, (uint64_t *) (datastorebase+offset), dwords_per_block);
-    }
-    offset += block_size;
-    bit /= 2;
-    remaininglength -=1;
-    if (bit == 0) {
-      bit = 128;
-      current_bit_string_pos++;
-    }
+  if (result < 0) {
+    free(resultbuffer);
+    return PyErr_NoMemory();
   }
-}
 
+  // okay, let's put it in a string
+  resultstr = PyString_FromStringAndSize((char *) resultbuffer, self->sizeofablock);
 
+  free(resultbuffer);
 
+  return resultstr;
+} 
 
-// Does XORs given a bit string.   This is the common case and so should be 
-// optimized.
 
-// Python Wrapper object
-static PyObject *Produce_Xor_From_Bitstring(PyObject *module, PyObject *args) {
-  datastore_descriptor ds;
-  int bitstringlength;
+
+
+// Like produce_xor_from_bitstring, but the answer goes into a writable buffer
+// that the caller supplies (and can reuse), so nothing is allocated.   If 
+// that memory isn't DWORD aligned, an aligned scratch buffer is used.
+
+static PyObject *XORDatastore_produce_xor_into(XORDatastoreObject *self, PyObject *args) {
+  PyObject *bitstring, *out;
+  Py_buffer outview;
   char *bitstringbuffer;
-  char *raw_resultbuffer;
   uint64_t *resultbuffer;
+  int num_threads = self->numthreads;
+  int aligned;
+  int result = 0;
 
-  if (!PyArg_ParseTuple(args, "is#", &ds, &bitstringbuffer, &bitstringlength)) {
+  if (!PyArg_ParseTuple(args, "OO", &bitstring, &out)) {
     // Incorrect args...
     return NULL;
   }
 
-  // Is the ds valid?
-  if (!is_table_entry_used(ds)) {
-    PyErr_SetString(PyExc_ValueError, "Bad index for Produce_Xor_From_Bitstring");
+  if (check_bitstring(self, bitstring) < 0) {
     return NULL;
   }
+  bitstringbuffer = PyString_AS_STRING(bitstring);
 
-  // Let's prepare a place to put this...
-  raw_resultbuffer = malloc(xordatastoretable[ds].sizeofablock+sizeof(uint64_t));
-  // ...and zero it out...
-  bzero(raw_resultbuffer, xordatastoretable[ds].sizeofablock+sizeof(uint64_t));
+  // This also stops a bytearray from being resized while we use it
+  if (PyObject_GetBuffer(out, &outview, PyBUF_WRITABLE) < 0) {
+    PyErr_Clear();
+    PyErr_SetString(PyExc_TypeError, "out_buffer must be a writable buffer");
+    return NULL;
+  }
 
-  // ... now let's get a DWORD aligned offset
-  resultbuffer = (uint64_t *) dword_align(raw_resultbuffer);
+  if (outview.len < self->sizeofablock) {
+    PyBuffer_Release(&outview);
+    PyErr_SetString(PyExc_TypeError, "out_buffer is smaller than a block");
+    return NULL;
+  }
 
-  // Let's actually calculate this!
-  bitstring_xor_worker(ds, bitstringbuffer, bitstringlength, resultbuffer);
+  aligned = (((long) outview.buf) % sizeof(uint64_t)) == 0;
 
+  Py_BEGIN_ALLOW_THREADS
+  if (aligned) {
+    resultbuffer = (uint64_t *) outview.buf;
+  }
+  else if (posix_memalign((void **) &resultbuffer, DATASTORE_ALIGNMENT, self->sizeofablock) != 0) {
+    resultbuffer = NULL;
+    result = -1;
+  }
 
+  if (result == 0) {
+    memset(resultbuffer, 0, self->sizeofablock);
+    result = parallel_bitstring_xor_worker(self, bitstringbuffer, num_threads, resultbuffer);
 
-  // okay, let's put it in a buffer
-  PyObject *return_str_obj = Py_BuildValue("s#",(char *)resultbuffer,xordatastoretable[ds].sizeofablock);
+    if (!aligned) {
+      memcpy(outview.buf, resultbuffer, self->sizeofablock);
+      free(resultbuffer);
+    }
+  }
+  Py_END_ALLOW_THREADS
 
-  // clear the buffer
-  free(raw_resultbuffer);
+  PyBuffer_Release(&outview);
 
-  return return_str_obj;
-} 
+  if (result < 0) {
+    return PyErr_NoMemory();
+  }
+
+  Py_RETURN_NONE;
+}
+
+
+
+
+// Takes a list of bitstrings and returns a list of XORed blocks.   See
+// multi_bitstring_xor_worker.
+
+static PyObject *XORDatastore_produce_xor_from_bitstrings(XORDatastoreObject *self, PyObject *bitstringlist) {
+  PyObject *resultlist;
+  PyObject *resultstr;
+  Py_ssize_t num_bit_strings, i;
+  char **bitstringbuffers;
+  uint64_t *resultbuffers;
+  long block_size = self->sizeofablock;
+
+  if (!PyList_Check(bitstringlist)) {
+    PyErr_SetString(PyExc_TypeError, "bitstringlist must be a list");
+    return NULL;
+  }
+
+  // hold on to the list's contents while the GIL is released...
+  bitstringlist = PyList_GetSlice(bitstringlist, 0, PyList_GET_SIZE(bitstringlist));
+  if (bitstringlist == NULL) {
+    return NULL;
+  }
+  num_bit_strings = PyList_GET_SIZE(bitstringlist);
+
+  // Let's find all of the bitstrings (and check them)
+  bitstringbuffers = malloc(sizeof(char *) * (num_bit_strings + 1));
+  if (bitstringbuffers == NULL) {
+    Py_DECREF(bitstringlist);
+    return PyErr_NoMemory();
+  }
 
+  for (i=0; i<num_bit_strings; i++) {
+    if (check_bitstring(self, PyList_GET_ITEM(bitstringlist, i)) < 0) {
+      free(bitstringbuffers);
+      Py_DECREF(bitstringlist);
+      return NULL;
+    }
+    bitstringbuffers[i] = PyString_AS_STRING(PyList_GET_ITEM(bitstringlist, i));
+  }
 
+  // Let's prepare a place to put the results and zero it out...
+  if (posix_memalign((void **) &resultbuffers, DATASTORE_ALIGNMENT, num_bit_strings * block_size + 1) != 0) {
+    free(bitstringbuffers);
+    Py_DECREF(bitstringlist);
+    return PyErr_NoMemory();
+  }
+  memset(resultbuffers, 0, num_bit_strings * block_size);
+
+  // Let's actually calculate this (without the GIL)!
+  Py_BEGIN_ALLOW_THREADS
+  multi_bitstring_xor_worker(self, bitstringbuffers, num_bit_strings, resultbuffers);
+  Py_END_ALLOW_THREADS
+
+  free(bitstringbuffers);
+  Py_DECREF(bitstringlist);
+
+  // okay, let's put them in a list of strings
+  resultlist = PyList_New(num_bit_strings);
+  if (resultlist != NULL) {
+    for (i=0; i<num_bit_strings; i++) {
+      resultstr = PyString_FromStringAndSize(((char *)resultbuffers) + i * block_size, block_size);
+      if (resultstr == NULL) {
+        Py_DECREF(resultlist);
+        resultlist = NULL;
+        break;
+      }
+      PyList_SET_ITEM(resultlist, i, resultstr);
+    }
+  }
+
+  // clear the buffer
+  free(resultbuffers);
+
+  return resultlist;
+}
 
 
 
@@ -217,111 +738,236 @@ static PyObject *Produce_Xor_From_Bitstring(PyObject *module, PyObject *args) {
 // This is used to populate the datastore.   It can also be used to add 
 // memoization data.
 
-// Python wrapper (only)...
-static PyObject *SetData(PyObject *module, PyObject *args) {
+static PyObject *XORDatastore_set_data(XORDatastoreObject *self, PyObject *args) {
+  PyObject *offsetobj, *data;
   long long offset;
-  datastore_descriptor ds;
-  char *stringbuffer;
-  int quantity; // BUG: This probably should be a larger type.   
-
 
-  if (!PyArg_ParseTuple(args, "iLs#", &ds, &offset, &stringbuffer, &quantity)) {
+  if (!PyArg_ParseTuple(args, "OO", &offsetobj, &data)) {
     // Incorrect args...
     return NULL;
   }
 
-  // Is the ds valid?
-  if (!is_table_entry_used(ds)) {
-    PyErr_SetString(PyExc_ValueError, "Bad index for SetData");
+  if (get_integer_argument(offsetobj, "Offset must be an integer", &offset) < 0) {
+    return NULL;
+  }
+  if (offset < 0) {
+    PyErr_SetString(PyExc_TypeError, "Offset must be non-negative");
     return NULL;
   }
 
-  // Is this outside of the bounds...
-  if (offset + quantity > xordatastoretable[ds].numberofblocks * xordatastoretable[ds].sizeofablock) {
-    PyErr_SetString(PyExc_ValueError, "SetData out of bounds");
+  if (!PyString_Check(data)) {
+    PyErr_SetString(PyExc_TypeError, "Data_to_add to XORdatastore must be a string.");
     return NULL;
   }
 
-  memcpy(((char *)xordatastoretable[ds].datastore)+offset, stringbuffer, quantity);
+  // Is this outside of the bounds...
+  if (offset + PyString_GET_SIZE(data) > (long long) self->numberofblocks * self->sizeofablock) {
+    PyErr_SetString(PyExc_TypeError, "Offset + added data overflows the XORdatastore");
+    return NULL;
+  }
 
-  return Py_BuildValue("");
+  memcpy(((char *)self->datastore)+offset, PyString_AS_STRING(data), PyString_GET_SIZE(data));
 
+  Py_RETURN_NONE;
 }
 
 
 
 
-
 // Returns the data stored at an offset.   Note that we move away from 
-// blocks here.   We might as well do the math in Python.   We use this to do 
-// integrity checking and serve legacy clients.   It is not needed for the 
-// usual mirror actions.
-
-// Python wrapper (only)...
-static PyObject *GetData(PyObject *module, PyObject *args) {
+// blocks here.   We use this to do integrity checking and serve legacy 
+// clients.   It is not needed for the usual mirror actions.   With copy=False
+// the answer is a memoryview of the datastore instead of a string.
+
+static PyObject *XORDatastore_get_data(XORDatastoreObject *self, PyObject *args, PyObject *kwds) {
+  static char *kwlist[] = {"offset", "quantity", "copy", NULL};
+  PyObject *offsetobj, *quantityobj;
+  PyObject *copyobj = Py_True;
+  PyObject *wholeview, *view;
   long long offset, quantity;
-  datastore_descriptor ds;
+  int copy;
 
-  if (!PyArg_ParseTuple(args, "iLL", &ds, &offset, &quantity)) {
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|O", kwlist, &offsetobj, &quantityobj, &copyobj)) {
     // Incorrect args...
     return NULL;
   }
 
-  // Is the ds valid?
-  if (!is_table_entry_used(ds)) {
-    PyErr_SetString(PyExc_ValueError, "Bad index for GetData");
+  if (get_integer_argument(offsetobj, "Offset must be an integer", &offset) < 0) {
+    return NULL;
+  }
+  if (offset < 0) {
+    PyErr_SetString(PyExc_TypeError, "Offset must be non-negative");
+    return NULL;
+  }
+
+  if (get_integer_argument(quantityobj, "Quantity must be an integer", &quantity) < 0) {
+    return NULL;
+  }
+  if (quantity <= 0) {
+    PyErr_SetString(PyExc_TypeError, "Quantity must be positive");
     return NULL;
   }
 
   // Is this outside of the bounds...
-  if (offset + quantity > xordatastoretable[ds].numberofblocks * xordatastoretable[ds].sizeofablock) {
-    PyErr_SetString(PyExc_ValueError, "GetData out of bounds");
+  if (offset + quantity > (long long) self->numberofblocks * self->sizeofablock) {
+    PyErr_SetString(PyExc_TypeError, "Quantity + offset is larger than XORdatastore");
     return NULL;
   }
 
-  return Py_BuildValue("s#", ((char *)xordatastoretable[ds].datastore)+offset, quantity);
+  copy = PyObject_IsTrue(copyobj);
+  if (copy < 0) {
+    return NULL;
+  }
+
+  if (copy) {
+    return PyString_FromStringAndSize(((char *)self->datastore)+offset, quantity);
+  }
 
+  // The view keeps the datastore alive for as long as it is used
+  wholeview = PyMemoryView_FromObject((PyObject *) self);
+  if (wholeview == NULL) {
+    return NULL;
+  }
+  view = PySequence_GetSlice(wholeview, offset, offset + quantity);
+  Py_DECREF(wholeview);
+  return view;
 }
 
 
 
 
-// Cleans up the datastore.   I don't know when or why this would be used, but
-// it is included for completeness.
-static void deallocate(datastore_descriptor ds){
-  if (!is_table_entry_used(ds)) {
-    printf("Error, double deallocate on %d.   Ignoring.\n",ds);
+// The buffer protocol.   This gives memoryview / NumPy / file.write direct
+// (read-write) access to the datastore without copying it.
+
+static int XORDatastore_getbuffer(XORDatastoreObject *self, Py_buffer *view, int flags) {
+  return PyBuffer_FillInfo(view, (PyObject *) self, self->datastore, (Py_ssize_t) self->numberofblocks * self->sizeofablock, 0, flags);
+}
+
+
+// The old style buffer interface (used by "s#", buffer(), etc.)
+static Py_ssize_t XORDatastore_getreadbuffer(XORDatastoreObject *self, Py_ssize_t segment, void **ptrptr) {
+  if (segment != 0) {
+    PyErr_SetString(PyExc_SystemError, "accessing non-existent XORDatastore segment");
+    return -1;
   }
-  else {
-    free(xordatastoretable[ds].raw_datastore);
-    xordatastoretable[ds].numberofblocks = 0;
-    xordatastoretable[ds].sizeofablock = 0;
-    xordatastoretable[ds].raw_datastore = NULL;
-    xordatastoretable[ds].datastore = NULL;
+  *ptrptr = self->datastore;
+  return (Py_ssize_t) self->numberofblocks * self->sizeofablock;
+}
+
+
+static Py_ssize_t XORDatastore_getsegcount(XORDatastoreObject *self, Py_ssize_t *lenp) {
+  if (lenp != NULL) {
+    *lenp = (Py_ssize_t) self->numberofblocks * self->sizeofablock;
   }
-} 
+  return 1;
+}
+
 
+static PyBufferProcs XORDatastore_as_buffer = {
+  (readbufferproc) XORDatastore_getreadbuffer,
+  (writebufferproc) XORDatastore_getreadbuffer,
+  (segcountproc) XORDatastore_getsegcount,
+  NULL,
+  (getbufferproc) XORDatastore_getbuffer,
+  NULL,
+};
 
 
-// Python wrapper...
-static PyObject *Deallocate(PyObject *module, PyObject *args) {
-  datastore_descriptor ds;
 
-  if (!PyArg_ParseTuple(args, "i", &ds)) {
-    // Incorrect args...
-    return NULL;
-  }
 
-  deallocate(ds);
+// numthreads can be changed at any time (it is read once per query)
+static PyObject *XORDatastore_get_numthreads(XORDatastoreObject *self, void *closure) {
+  return PyInt_FromLong(self->numthreads);
+}
+
 
-  return Py_BuildValue("");
+static int XORDatastore_set_numthreads(XORDatastoreObject *self, PyObject *value, void *closure) {
+  long num_threads;
 
+  if (value == NULL || !PyInt_Check(value)) {
+    PyErr_SetString(PyExc_TypeError, "Number of threads must be an integer");
+    return -1;
+  }
+
+  num_threads = PyInt_AS_LONG(value);
+  if (num_threads <= 0 || num_threads > INT_MAX) {
+    PyErr_SetString(PyExc_TypeError, "Number of threads must be positive");
+    return -1;
+  }
+
+  self->numthreads = (int) num_threads;
+  return 0;
 }
 
 
+static PyMemberDef XORDatastore_members[] = {
+  {"numberofblocks", T_LONG, offsetof(XORDatastoreObject, numberofblocks), READONLY, "The number of blocks."},
+  {"sizeofblocks", T_LONG, offsetof(XORDatastoreObject, sizeofablock), READONLY, "The size of each block (in bytes)."},
+  {NULL}
+};
+
+
+static PyGetSetDef XORDatastore_getset[] = {
+  {"numthreads", (getter) XORDatastore_get_numthreads, (setter) XORDatastore_set_numthreads, "The number of threads a single produce_xor_from_bitstring call may use.", NULL},
+  {NULL}
+};
+
+
+static PyMethodDef XORDatastore_methods[] = {
+  {"produce_xor_from_bitstring", (PyCFunction) XORDatastore_produce_xor_from_bitstring, METH_O, "Returns the XOR of the blocks a bitstring selects."},
+  {"produce_xor_into", (PyCFunction) XORDatastore_produce_xor_into, METH_VARARGS, "Writes the XOR of the blocks a bitstring selects into a writable buffer."},
+  {"produce_xor_from_bitstrings", (PyCFunction) XORDatastore_produce_xor_from_bitstrings, METH_O, "Returns the XORed blocks for a list of bitstrings (in one pass over the datastore)."},
+  {"set_data", (PyCFunction) XORDatastore_set_data, METH_VARARGS, "Puts data into the datastore."},
+  {"get_data", (PyCFunction) XORDatastore_get_data, METH_VARARGS | METH_KEYWORDS, "Reads data out of the datastore (a memoryview if copy=False)."},
+  {NULL}
+};
+
+
+static PyTypeObject XORDatastoreType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  "fastsimplexordatastore_c.XORDatastore",  // tp_name
+  sizeof(XORDatastoreObject),               // tp_basicsize
+  0,                                        // tp_itemsize
+  (destructor) XORDatastore_dealloc,        // tp_dealloc
+  0,                                        // tp_print
+  0,                                        // tp_getattr
+  0,                                        // tp_setattr
+  0,                                        // tp_compare
+  0,                                        // tp_repr
+  0,                                        // tp_as_number
+  0,                                        // tp_as_sequence
+  0,                                        // tp_as_mapping
+  0,                                        // tp_hash
+  0,                                        // tp_call
+  0,                                        // tp_str
+  0,                                        // tp_getattro
+  0,                                        // tp_setattro
+  &XORDatastore_as_buffer,                  // tp_as_buffer
+  Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_NEWBUFFER, // tp_flags
+  "XORDatastore(block_size, num_blocks, numthreads=1)\n\nA datastore that can quickly XOR the blocks it stores.",  // tp_doc
+  0,                                        // tp_traverse
+  0,                                        // tp_clear
+  0,                                        // tp_richcompare
+  offsetof(XORDatastoreObject, weakreflist), // tp_weaklistoffset
+  0,                                        // tp_iter
+  0,                                        // tp_iternext
+  XORDatastore_methods,                     // tp_methods
+  XORDatastore_members,                     // tp_members
+  XORDatastore_getset,                      // tp_getset
+  0,                                        // tp_base
+  0,                                        // tp_dict
+  0,                                        // tp_descr_get
+  0,                                        // tp_descr_set
+  0,                                        // tp_dictoffset
+  (initproc) XORDatastore_init,             // tp_init
+  0,                                        // tp_alloc
+  XORDatastore_new,                         // tp_new
+};
+
+
+
 
 
-// I just have this around for testing
 static char *slow_XOR(char *dest, const char *data, long stringlength) {
   XOR_byteblocks(dest,data,stringlength);
   return dest;
@@ -339,10 +985,10 @@ static char *fast_XOR(char *dest, const char *data, long stringlength) {
     return slow_XOR(dest,data,stringlength);
   }
 
-  // I would guess these should be similarly DWORD aligned...
-  if (((long) dest) % sizeof(uint64_t) == ((long) data) % sizeof(uint64_t)) {
-    printf("Error, assumed that dest and data are identically DWORD aligned!\n");
-    return NULL;
+  // The DWORD XOR only works if dest and data are identically DWORD aligned.
+  // If not, fall back to the char-based XOR.
+  if (((long) dest) % sizeof(uint64_t) != ((long) data) % sizeof(uint64_t)) {
+    return slow_XOR(dest,data,stringlength);
   }
 
 
@@ -358,7 +1004,7 @@ static char *fast_XOR(char *dest, const char *data, long stringlength) {
   // The middle will be done with full sized blocks...
   fulllengthblocks = (stringlength-leadingmisalignedbytes) / sizeof(uint64_t);
 
-  XOR_fullblocks((uint64_t *) (dest+leadingmisalignedbytes), (uint64_t *) (data + leadingmisalignedbytes), fulllengthblocks);
+  current_xor_kernel->function((uint64_t *) (dest+leadingmisalignedbytes), (uint64_t *) (data + leadingmisalignedbytes), fulllengthblocks);
 
 
 
@@ -375,13 +1021,18 @@ static char *fast_XOR(char *dest, const char *data, long stringlength) {
 // the client to compute the result and XOR bitstrings
 static PyObject *do_xor(PyObject *module, PyObject *args) {
   const char *str1, *str2;
-  long length;
+  int length, length2;
   char *destbuffer;
   char *useddestbuffer;
 
 
-  // Parse the calling arguments
-  if (!PyArg_ParseTuple(args, "ssl", &str1,&str2, &length)) {
+  // Parse the calling arguments.   The strings may contain NUL bytes...
+  if (!PyArg_ParseTuple(args, "s#s#", &str1, &length, &str2, &length2)) {
+    return NULL;
+  }
+
+  if (length != length2) {
+    PyErr_SetString(PyExc_ValueError, "do_xor requires strings of the same length");
     return NULL;
   }
 
@@ -415,19 +1066,214 @@ static PyObject *do_xor(PyObject *module, PyObject *args) {
 
 
 
+// Fills a buffer with pseudo-random bytes (for the self test)
+static void fill_test_buffer(unsigned char *buffer, long length, uint64_t *seed) {
+  long i;
+  for (i=0; i<length; i++) {
+    *seed = *seed * 6364136223846793005ULL + 1442695040888963407ULL;
+    buffer[i] = (unsigned char) (*seed >> 56);
+  }
+}
+
+
+// Checks one kernel against the scalar code over many lengths and 
+// (DWORD aligned) offsets.   Returns 1 if they always agree.
+#define SELF_TEST_DWORDS 300
+
+static int self_test_kernel(xor_kernel *kernel) {
+  uint64_t data[SELF_TEST_DWORDS], expected[SELF_TEST_DWORDS], actual[SELF_TEST_DWORDS];
+  uint64_t seed = 12345;
+  long count, offset;
+
+  for (count = 0; count <= 70; count++) {
+    for (offset = 0; offset < 9; offset++) {
+      fill_test_buffer((unsigned char *) data, sizeof(data), &seed);
+      fill_test_buffer((unsigned char *) expected, sizeof(expected), &seed);
+      memcpy(actual, expected, sizeof(actual));
+
+      XOR_fullblocks(expected + offset, data + offset + 1, count);
+      kernel->function(actual + offset, data + offset + 1, count);
+
+      if (memcmp(expected, actual, sizeof(actual)) != 0) {
+        return 0;
+      }
+    }
+  }
+
+  // ... and one long run
+  XOR_fullblocks(expected, data, SELF_TEST_DWORDS);
+  kernel->function(actual, data, SELF_TEST_DWORDS);
+  return memcmp(expected, actual, sizeof(actual)) == 0;
+}
+
+
+// Checks next_selected_block against testing one bit at a time.   Returns 1 
+// if they agree.
+static int self_test_bit_scan(void) {
+  unsigned char bit_string[40];
+  uint64_t seed = 54321;
+  long bit_string_bytes, end_block, block, expected;
+  int round, density;
+
+  for (round = 0; round < 200; round++) {
+    fill_test_buffer(bit_string, sizeof(bit_string), &seed);
+
+    // make the bits sparser in some rounds so there are long runs of zeros
+    for (density = 0; density < round % 4; density++) {
+      unsigned char mask[sizeof(bit_string)];
+      long i;
+      fill_test_buffer(mask, sizeof(mask), &seed);
+      for (i=0; i < (long) sizeof(bit_string); i++) {
+        bit_string[i] &= mask[i];
+      }
+    }
+
+    end_block = 1 + round % (sizeof(bit_string) * 8);
+    bit_string_bytes = (end_block + 7) / 8;
+
+    for (block = 0; block <= end_block; block++) {
+      for (expected = block; expected < end_block; expected++) {
+        if (bit_string[expected / 8] & (128 >> (expected % 8))) {
+          break;
+        }
+      }
+      if (next_selected_block(bit_string, bit_string_bytes, block, end_block) != expected) {
+        return 0;
+      }
+    }
+  }
+  return 1;
+}
+
+
+static PyObject *Self_Test(PyObject *module, PyObject *args) {
+  PyObject *results, *result;
+  int i;
+
+  if (!PyArg_ParseTuple(args, "")) {
+    return NULL;
+  }
+
+  results = PyList_New(0);
+  if (results == NULL) {
+    return NULL;
+  }
+
+  // Every kernel this CPU can run...
+  for (i=0; i<NUM_XOR_KERNELS; i++) {
+    if (is_xor_kernel_supported(&xor_kernels[i])) {
+      result = Py_BuildValue("(sO)", xor_kernels[i].name, self_test_kernel(&xor_kernels[i]) ? Py_True : Py_False);
+      if (result == NULL || PyList_Append(results, result) != 0) {
+        Py_XDECREF(result);
+        Py_DECREF(results);
+        return NULL;
+      }
+      Py_DECREF(result);
+    }
+  }
+
+  // ... and the set bit scan
+  result = Py_BuildValue("(sO)", "bitscan", self_test_bit_scan() ? Py_True : Py_False);
+  if (result == NULL || PyList_Append(results, result) != 0) {
+    Py_XDECREF(result);
+    Py_DECREF(results);
+    return NULL;
+  }
+  Py_DECREF(result);
+
+  return results;
+}
+
+
+static PyObject *Get_Xor_Kernels(PyObject *module, PyObject *args) {
+  PyObject *names, *name;
+  int i;
+
+  if (!PyArg_ParseTuple(args, "")) {
+    return NULL;
+  }
+
+  names = PyList_New(0);
+  if (names == NULL) {
+    return NULL;
+  }
+
+  for (i=0; i<NUM_XOR_KERNELS; i++) {
+    if (is_xor_kernel_supported(&xor_kernels[i])) {
+      name = PyString_FromString(xor_kernels[i].name);
+      if (name == NULL || PyList_Append(names, name) != 0) {
+        Py_XDECREF(name);
+        Py_DECREF(names);
+        return NULL;
+      }
+      Py_DECREF(name);
+    }
+  }
+
+  return names;
+}
+
+
+static PyObject *Get_Xor_Kernel(PyObject *module, PyObject *args) {
+  if (!PyArg_ParseTuple(args, "")) {
+    return NULL;
+  }
+
+  return PyString_FromString(current_xor_kernel->name);
+}
+
+
+static PyObject *Set_Xor_Kernel(PyObject *module, PyObject *args) {
+  const char *name;
+  int i;
+
+  if (!PyArg_ParseTuple(args, "s", &name)) {
+    return NULL;
+  }
+
+  for (i=0; i<NUM_XOR_KERNELS; i++) {
+    if (strcmp(xor_kernels[i].name, name) == 0) {
+      if (!is_xor_kernel_supported(&xor_kernels[i])) {
+        PyErr_SetString(PyExc_ValueError, "This CPU does not support that XOR kernel");
+        return NULL;
+      }
+      current_xor_kernel = &xor_kernels[i];
+      Py_RETURN_NONE;
+    }
+  }
+
+  PyErr_SetString(PyExc_ValueError, "Unknown XOR kernel");
+  return NULL;
+}
+
+
+
 static PyMethodDef MyFastSimpleXORDatastoreMethods [] = {
-  {"Allocate", Allocate, METH_VARARGS, "Allocate a datastore."},
-  {"Deallocate", Deallocate, METH_VARARGS, "Deallocate a datastore."},
-  {"GetData", GetData, METH_VARARGS, "Reads data out of a datastore."},
-  {"SetData", SetData, METH_VARARGS, "Puts data into the datastore."},
-  {"Produce_Xor_From_Bitstring", Produce_Xor_From_Bitstring, METH_VARARGS, "Extract XOR from datastore."},
   {"do_xor", do_xor, METH_VARARGS, "does the XOR of two equal length strings."},
+  {"Self_Test", Self_Test, METH_VARARGS, "Checks the XOR kernels and set bit scan against the scalar code."},
+  {"Get_Xor_Kernels", Get_Xor_Kernels, METH_VARARGS, "Lists the XOR kernels this CPU supports (fastest first)."},
+  {"Get_Xor_Kernel", Get_Xor_Kernel, METH_VARARGS, "Returns the name of the XOR kernel in use."},
+  {"Set_Xor_Kernel", Set_Xor_Kernel, METH_VARARGS, "Selects the XOR kernel to use."},
   {NULL, NULL, 0, NULL}
 };
 
 
 PyMODINIT_FUNC initfastsimplexordatastore_c(void) {
-  Py_InitModule("fastsimplexordatastore_c", MyFastSimpleXORDatastoreMethods);
+  PyObject *module;
+
+  if (PyType_Ready(&XORDatastoreType) < 0) {
+    return;
+  }
+
+  module = Py_InitModule("fastsimplexordatastore_c", MyFastSimpleXORDatastoreMethods);
+  if (module == NULL) {
+    return;
+  }
+
+  Py_INCREF(&XORDatastoreType);
+  PyModule_AddObject(module, "XORDatastore", (PyObject *) &XORDatastoreType);
+
+  select_xor_kernel();
 }
 
 
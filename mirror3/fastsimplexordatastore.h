@@ -7,30 +7,62 @@
 #include "Python.h"
 // Needed for uint64_t on some versions of Python / GCC
 #include <stdint.h>
+// Used to split a query over several threads
+#include <pthread.h>
 
-typedef int datastore_descriptor;
-
+// A fastsimplexordatastore_c.XORDatastore
 typedef struct {
+  PyObject_HEAD
   long numberofblocks;      // Blocks in the datastore
   long sizeofablock;        // Bytes in a block.   
-  char *raw_datastore;  // This points to what malloc returns...
-  uint64_t *datastore;      // This is the DWORD aligned start to the datastore
-} XORDatastore;
+  uint64_t *datastore;      // The (cache line aligned) datastore
+  int numthreads;           // Threads a single query may use
+  PyObject *weakreflist;
+} XORDatastoreObject;
+
+// An XOR_fullblocks implementation (scalar or SIMD)
+typedef void (*xor_kernel_function)(uint64_t *dest, uint64_t *data, long count);
+
+typedef struct {
+  const char *name;           // "avx512", "avx2", "sse2" or "scalar"
+  xor_kernel_function function;
+} xor_kernel;
 
 // Define all of the functions...
 
 static inline void XOR_fullblocks(uint64_t *dest, uint64_t *data, long count);
 static inline void XOR_byteblocks(char *dest, const char *data, long count);
+static int is_xor_kernel_supported(xor_kernel *kernel);
+static void select_xor_kernel(void);
+static inline long next_selected_block(const unsigned char *bit_string, long bit_string_bytes, long block, long end_block);
+static inline void prefetch_block(const char *block, long block_size);
 static inline char *dword_align(char *ptr);
-static int is_table_entry_used(int i);
-static datastore_descriptor allocate(long block_size, long num_blocks);
-static PyObject *Allocate(PyObject *module, PyObject *args);
-static void bitstring_xor_worker(int ds, char *bit_string, long bit_string_length, uint64_t *resultbuffer);
-static PyObject *Produce_Xor_From_Bitstring(PyObject *module, PyObject *args);
-static PyObject *SetData(PyObject *module, PyObject *args);
-static PyObject *GetData(PyObject *module, PyObject *args);
-static void deallocate(datastore_descriptor ds);
-static PyObject *Deallocate(PyObject *module, PyObject *args);
+static void bitstring_xor_worker(XORDatastoreObject *ds, char *bit_string, long start_block, long end_block, uint64_t *resultbuffer);
+static void *bitstring_xor_thread(void *arg);
+static int parallel_bitstring_xor_worker(XORDatastoreObject *ds, char *bit_string, int num_threads, uint64_t *resultbuffer);
+static void multi_bitstring_xor_worker(XORDatastoreObject *ds, char **bit_strings, long num_bit_strings, uint64_t *resultbuffers);
+static int get_integer_argument(PyObject *obj, const char *message, long long *value);
+static int check_bitstring(XORDatastoreObject *ds, PyObject *bitstring);
+static PyObject *XORDatastore_new(PyTypeObject *type, PyObject *args, PyObject *kwds);
+static int XORDatastore_init(PyObject *self, PyObject *args, PyObject *kwds);
+static void XORDatastore_dealloc(XORDatastoreObject *self);
+static PyObject *XORDatastore_produce_xor_from_bitstring(XORDatastoreObject *self, PyObject *bitstring);
+static PyObject *XORDatastore_produce_xor_into(XORDatastoreObject *self, PyObject *args);
+static PyObject *XORDatastore_produce_xor_from_bitstrings(XORDatastoreObject *self, PyObject *bitstringlist);
+static PyObject *XORDatastore_set_data(XORDatastoreObject *self, PyObject *args);
+static PyObject *XORDatastore_get_data(XORDatastoreObject *self, PyObject *args, PyObject *kwds);
+static int XORDatastore_getbuffer(XORDatastoreObject *self, Py_buffer *view, int flags);
+static Py_ssize_t XORDatastore_getreadbuffer(XORDatastoreObject *self, Py_ssize_t segment, void **ptrptr);
+static Py_ssize_t XORDatastore_getsegcount(XORDatastoreObject *self, Py_ssize_t *lenp);
+static PyObject *XORDatastore_get_numthreads(XORDatastoreObject *self, void *closure);
+static int XORDatastore_set_numthreads(XORDatastoreObject *self, PyObject *value, void *closure);
 static char *slow_XOR(char *dest, const char *data, long stringlength);
 static char *fast_XOR(char *dest, const char *data, long stringlength);
 static PyObject *do_xor(PyObject *module, PyObject *args);
+static void fill_test_buffer(unsigned char *buffer, long length, uint64_t *seed);
+static int self_test_kernel(xor_kernel *kernel);
+static int self_test_bit_scan(void);
+static PyObject *Self_Test(PyObject *module, PyObject *args);
+static PyObject *Get_Xor_Kernels(PyObject *module, PyObject *args);
+static PyObject *Get_Xor_Kernel(PyObject *module, PyObject *args);
+static PyObject *Set_Xor_Kernel(PyObject *module, PyObject *args);
@@ -0,0 +1,318 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  Memoization for an XORdatastore (the "Four Russians" trick).   The blocks
+  are split into groups of k consecutive blocks and the XOR of every subset
+  of each group is precomputed.   A query then needs one lookup per group
+  instead of up to k block XORs.
+
+  The precomputed subsets are kept in a second XORdatastore of the same
+  type (the 'table') with 2^k blocks per group.   Entry s of group g is the
+  XOR of the blocks in g that s selects, using the same MSB first bit order
+  as a bitstring.   A bitstring for the original datastore is translated
+  into a bitstring for the table that selects one entry per group, so the
+  backend's own (fast) XOR code does the work.
+
+  k must be 1, 2, 4 or 8 so that a group never spans two bytes of a
+  bitstring.   The table uses 2^k / k times the memory of the original
+  datastore (2x for k=1 or 2, 4x for k=4 and 32x for k=8).
+
+"""
+
+import math
+
+
+class MemoizedXORDatastore:
+  """
+  <Purpose>
+    Wraps a populated XORdatastore and answers queries from a table of
+    precomputed subset XORs.   It has the same interface as an XORdatastore.
+
+  <Side Effects>
+    None.
+
+  <Example Use>
+    myxordatastore = simplexordatastore.XORDatastore(1024, 16)
+    # ... populate myxordatastore ...
+
+    memoizedxordatastore = MemoizedXORDatastore(myxordatastore,
+        simplexordatastore, 4)
+    memoizedxordatastore.precompute()
+
+    # this uses the table.   The answer is the same as from myxordatastore
+    memoizedxordatastore.produce_xor_from_bitstring(bitstring)
+
+  """
+
+  # these are public so that a caller can read information about a created
+  # datastore.   They should not be changed.
+  numberofblocks = None
+  sizeofblocks = None
+  groupsize = None
+
+  def __init__(self, xordatastore, xordatastoremodule, groupsize):
+    """
+    <Purpose>
+      Set up memoization for an XORdatastore.   The table is not built until
+      precompute is called.
+
+    <Arguments>
+      xordatastore: the XORdatastore to wrap.
+
+      xordatastoremodule: the module that xordatastore came from.   It is
+                          used to allocate the table and for do_xor.
+
+      groupsize: the number of blocks per group (k).   This must be 1, 2, 4
+                 or 8.
+
+    <Exceptions>
+      TypeError is raised if invalid parameters are given.
+
+    """
+
+    if type(groupsize) != int and type(groupsize) != long:
+      raise TypeError("Group size must be an integer")
+
+    if groupsize not in [1, 2, 4, 8]:
+      raise TypeError("Group size must be 1, 2, 4 or 8")
+
+    self._xordatastore = xordatastore
+    self._xordatastoremodule = xordatastoremodule
+    self._table = None
+
+    self.numberofblocks = xordatastore.numberofblocks
+    self.sizeofblocks = xordatastore.sizeofblocks
+    self.groupsize = groupsize
+
+    self._numberofgroups = int(math.ceil(self.numberofblocks / float(groupsize)))
+    self._numberoftableblocks = self._numberofgroups * 2**groupsize
+
+    # clears the extra bits at the end of the last byte of a bitstring
+    self._lastbytemask = (0xff << (8 * int(math.ceil(self.numberofblocks/8.0)) - self.numberofblocks)) & 0xff
+
+    # for every byte value, the bytes of the table bitstring that it selects.
+    # A byte of the bitstring holds 8 / k groups, which select one entry each
+    # out of 8 / k * 2^k table blocks, so this is always whole bytes.   Empty
+    # subsets are left out since they are all zeros.
+    groupsperbyte = 8 / groupsize
+    self._bytetranslation = []
+    for bytevalue in range(256):
+      tablebytes = bytearray(groupsperbyte * 2**groupsize / 8)
+      for groupinbyte in range(groupsperbyte):
+        subset = (bytevalue >> (8 - groupsize * (groupinbyte + 1))) & (2**groupsize - 1)
+        if subset:
+          tableblock = (groupinbyte << groupsize) + subset
+          tablebytes[tableblock / 8] |= 128 >> (tableblock % 8)
+      self._bytetranslation.append(str(tablebytes))
+
+    self._tablebitstringlength = int(math.ceil(self._numberoftableblocks / 8.0))
+
+
+
+  def precompute(self):
+    """
+    <Purpose>
+      Builds the table of subset XORs from the current datastore contents.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Side Effects>
+      Allocates the table (2^k / k times the size of the datastore).
+
+    <Returns>
+      None
+
+    """
+    # drop the old table first so that we don't hold two of them
+    self._table = None
+
+    table = self._xordatastoremodule.XORDatastore(self.sizeofblocks, self._numberoftableblocks)
+
+    zeroblock = chr(0) * self.sizeofblocks
+
+    for groupnumber in range(self._numberofgroups):
+      firstblock = groupnumber * self.groupsize
+
+      groupblocks = []
+      for blocknumber in range(firstblock, firstblock + self.groupsize):
+        # the last group may run past the end.   Those bits are never set.
+        if blocknumber < self.numberofblocks:
+          groupblocks.append(self._xordatastore.get_data(blocknumber * self.sizeofblocks, self.sizeofblocks))
+        else:
+          groupblocks.append(zeroblock)
+
+      # each entry is an earlier entry XORed with one more block.   The
+      # lowest set bit of the subset is the last block in it.
+      entries = [zeroblock]
+      for subset in range(1, 2**self.groupsize):
+        lowestbit = subset & -subset
+        blockingroup = self.groupsize - lowestbit.bit_length()
+        entries.append(self._xordatastoremodule.do_xor(entries[subset ^ lowestbit], groupblocks[blockingroup]))
+
+      table.set_data((groupnumber << self.groupsize) * self.sizeofblocks, ''.join(entries))
+
+    self._table = table
+
+
+
+  def _translate_bitstring(self, bitstring):
+    # Private helper that turns a bitstring for the datastore into one for
+    # the table.
+
+    bitstringbytes = bytearray(bitstring)
+
+    # drop the extra bits at the end
+    bitstringbytes[-1] &= self._lastbytemask
+
+    # one lookup per byte.   The bytes past the last group (from the padding
+    # bits) are all zeros.
+    return ''.join(map(self._bytetranslation.__getitem__, bitstringbytes))[:self._tablebitstringlength]
+
+
+
+  def _check_bitstring(self, bitstring):
+    # Private helper that checks a bitstring the same way the datastores do
+
+    if type(bitstring) != str:
+      raise TypeError("bitstring must be a string")
+
+    if len(bitstring) != math.ceil(self.numberofblocks/8.0):
+      raise TypeError("bitstring is not of the correct length")
+
+
+
+  def produce_xor_from_bitstring(self, bitstring):
+    """
+    <Purpose>
+      Returns an XORed block.   If the table has been built, the answer comes
+      from it.   Otherwise the wrapped XORdatastore is used.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.   See the
+                 XORdatastore documentation.
+
+    <Exceptions>
+      TypeError is raised if the bitstring is invalid
+
+    <Returns>
+      The XORed block.
+
+    """
+    # read this once.   precompute or set_data may change it while we run.
+    table = self._table
+
+    if table is None:
+      return self._xordatastore.produce_xor_from_bitstring(bitstring)
+
+    self._check_bitstring(bitstring)
+
+    return table.produce_xor_from_bitstring(self._translate_bitstring(bitstring))
+
+
+
+  def produce_xor_into(self, bitstring, out_buffer):
+    """
+    <Purpose>
+      Writes an XORed block into out_buffer.   See produce_xor_from_bitstring
+      and the XORdatastore documentation.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.
+
+      out_buffer: a writable buffer of at least sizeofblocks bytes.
+
+    <Exceptions>
+      TypeError is raised if the bitstring or out_buffer is invalid
+
+    <Returns>
+      None
+
+    """
+    table = self._table
+
+    if table is None:
+      return self._xordatastore.produce_xor_into(bitstring, out_buffer)
+
+    self._check_bitstring(bitstring)
+
+    return table.produce_xor_into(self._translate_bitstring(bitstring), out_buffer)
+
+
+
+  def produce_xor_from_bitstrings(self, bitstringlist):
+    """
+    <Purpose>
+      Returns the XORed blocks for several bitstrings.   See
+      produce_xor_from_bitstring.
+
+    <Arguments>
+      bitstringlist: a list of bitstrings.
+
+    <Exceptions>
+      TypeError is raised if the list or any of the bitstrings are invalid
+
+    <Returns>
+      A list with the XORed block for each bitstring (in the same order).
+
+    """
+    table = self._table
+
+    if table is None:
+      return self._xordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+    if type(bitstringlist) != list:
+      raise TypeError("bitstringlist must be a list")
+
+    tablebitstringlist = []
+    for bitstring in bitstringlist:
+      self._check_bitstring(bitstring)
+      tablebitstringlist.append(self._translate_bitstring(bitstring))
+
+    return table.produce_xor_from_bitstrings(tablebitstringlist)
+
+
+
+  def set_data(self, offset, data_to_add):
+    """
+    <Purpose>
+      Sets the raw data in the wrapped XORdatastore.   This throws away the
+      table, so precompute must be called again afterwards.
+
+    <Arguments>
+      See the XORdatastore documentation.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      None
+
+    """
+    self._table = None
+
+    return self._xordatastore.set_data(offset, data_to_add)
+
+
+
+  def get_data(self, offset, quantity):
+    """
+    <Purpose>
+      Returns raw data from the wrapped XORdatastore.
+
+    <Arguments>
+      See the XORdatastore documentation.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      A string containing the data.
+
+    """
+    return self._xordatastore.get_data(offset, quantity)
@@ -0,0 +1,414 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  In-process counters, gauges and histograms that can be rendered in the
+  Prometheus text format (for a /metrics page).
+
+  A metric is described once (describe) and then updated from any thread.
+  Each metric may have labels, e.g.
+
+    registry.describe('requests_total', 'counter', 'Requests handled')
+    registry.increment('requests_total', labels={'type':'hello'})
+
+  A counter or gauge can also be given a function that is called when the
+  metrics are rendered (set_value_function), for values like the queue
+  depth that something else already keeps.
+
+"""
+
+import os
+
+import threading
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+
+# histogram buckets (in seconds) that suit request timings from 10us to 10s
+LATENCY_BUCKETS = [0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+METRIC_TYPES = ['counter', 'gauge', 'histogram']
+
+
+
+def get_resident_bytes():
+  """
+  <Purpose>
+    Returns how much memory this process has resident (RSS).
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    The number of bytes, or None if it is not known here.   Where
+    /proc/self/statm is missing this is the peak RSS instead.
+  """
+  try:
+    residentpages = int(open('/proc/self/statm').read().split()[1])
+    return residentpages * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError, IndexError):
+    pass
+
+  if resource is None:
+    return None
+
+  # kilobytes on Linux, bytes on Mac OS X...
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+
+def _label_string(labels):
+  # Private helper that turns a labels dictionary into the sorted key that
+  # is also the {...} part of a line of output
+  if not labels:
+    return ''
+
+  labelparts = []
+  for labelname in sorted(labels):
+    labelvalue = str(labels[labelname]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    labelparts.append(labelname+'="'+labelvalue+'"')
+
+  return '{'+','.join(labelparts)+'}'
+
+
+
+def _format_value(value):
+  # Private helper that formats a number the way Prometheus expects
+  if value == float('inf'):
+    return '+Inf'
+
+  if type(value) == float and value == int(value) and abs(value) < 1e15:
+    return str(int(value))
+
+  return repr(value)
+
+
+
+
+class MetricsRegistry:
+  """
+  <Purpose>
+    Holds a set of metrics and renders them in the Prometheus text format.
+    All methods are thread safe.
+
+  <Side Effects>
+    None.
+
+  <Example Use>
+    registry = MetricsRegistry()
+    registry.describe('xor_seconds', 'histogram', 'Time to XOR a query')
+
+    registry.observe('xor_seconds', 0.0031)
+
+    print registry.render()
+
+  """
+
+  def __init__(self):
+    """
+    <Purpose>
+      Creates an empty registry.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    """
+    self._lock = threading.Lock()
+
+    # name -> (type, help, buckets) in the order they were described
+    self._descriptions = {}
+    self._names = []
+
+    # name -> {labelstring: value}.   For a histogram the value is
+    # [bucketcounts, sum, count].
+    self._values = {}
+
+    # name -> function for gauges that are read when rendering
+    self._valuefunctions = {}
+
+
+
+  def describe(self, name, metrictype, helpstring, buckets=None):
+    """
+    <Purpose>
+      Adds a metric.   Describing a metric again changes nothing.
+
+    <Arguments>
+      name: the metric name (e.g. 'uppir_xor_seconds')
+
+      metrictype: 'counter', 'gauge' or 'histogram'
+
+      helpstring: a one line description
+
+      buckets: the upper bounds of a histogram's buckets (default
+               LATENCY_BUCKETS)
+
+    <Exceptions>
+      ValueError if the type is unknown.
+
+    <Returns>
+      None
+    """
+    if metrictype not in METRIC_TYPES:
+      raise ValueError("Unknown metric type '"+str(metrictype)+"'")
+
+    if buckets is None:
+      buckets = LATENCY_BUCKETS
+
+    self._lock.acquire()
+    try:
+      if name in self._descriptions:
+        return
+
+      self._descriptions[name] = (metrictype, helpstring, sorted(buckets))
+      self._names.append(name)
+      self._values[name] = {}
+    finally:
+      self._lock.release()
+
+
+
+  def _check_type(self, name, metrictypes):
+    # Private helper that makes sure the metric exists and is one of these
+    # types
+    if name not in self._descriptions:
+      raise ValueError("Unknown metric '"+str(name)+"'")
+
+    if self._descriptions[name][0] not in metrictypes:
+      raise ValueError("Metric '"+name+"' is a "+self._descriptions[name][0])
+
+
+
+  def increment(self, name, amount=1, labels=None):
+    """
+    <Purpose>
+      Adds to a counter or gauge (a gauge may also go down).
+
+    <Arguments>
+      name: the metric
+
+      amount: how much to add (default 1)
+
+      labels: a dictionary of labels (default None)
+
+    <Exceptions>
+      ValueError if the metric is unknown or a histogram.
+
+    <Returns>
+      None
+    """
+    self._lock.acquire()
+    try:
+      self._check_type(name, ['counter', 'gauge'])
+      labelstring = _label_string(labels)
+      self._values[name][labelstring] = self._values[name].get(labelstring, 0) + amount
+    finally:
+      self._lock.release()
+
+
+
+  def set_gauge(self, name, value, labels=None):
+    """
+    <Purpose>
+      Sets a gauge.
+
+    <Arguments>
+      name: the metric
+
+      value: the new value
+
+      labels: a dictionary of labels (default None)
+
+    <Exceptions>
+      ValueError if the metric is unknown or not a gauge.
+
+    <Returns>
+      None
+    """
+    self._lock.acquire()
+    try:
+      self._check_type(name, ['gauge'])
+      self._values[name][_label_string(labels)] = value
+    finally:
+      self._lock.release()
+
+
+
+  def set_value_function(self, name, function):
+    """
+    <Purpose>
+      Has a counter or gauge call function (with no arguments) for its value
+      each time the metrics are rendered.   If the function returns None,
+      the metric is left out.
+
+    <Arguments>
+      name: the metric
+
+      function: the function
+
+    <Exceptions>
+      ValueError if the metric is unknown or a histogram.
+
+    <Returns>
+      None
+    """
+    self._lock.acquire()
+    try:
+      self._check_type(name, ['counter', 'gauge'])
+      self._valuefunctions[name] = function
+    finally:
+      self._lock.release()
+
+
+
+  def observe(self, name, value, labels=None):
+    """
+    <Purpose>
+      Adds a value (e.g. a time in seconds) to a histogram.
+
+    <Arguments>
+      name: the metric
+
+      value: the value
+
+      labels: a dictionary of labels (default None)
+
+    <Exceptions>
+      ValueError if the metric is unknown or not a histogram.
+
+    <Returns>
+      None
+    """
+    self._lock.acquire()
+    try:
+      self._check_type(name, ['histogram'])
+      buckets = self._descriptions[name][2]
+      labelstring = _label_string(labels)
+
+      if labelstring not in self._values[name]:
+        self._values[name][labelstring] = [[0] * len(buckets), 0.0, 0]
+
+      histogram = self._values[name][labelstring]
+      # the counts are per bucket here and made cumulative when rendered
+      for position in range(len(buckets)):
+        if value <= buckets[position]:
+          histogram[0][position] = histogram[0][position] + 1
+          break
+      histogram[1] = histogram[1] + value
+      histogram[2] = histogram[2] + 1
+    finally:
+      self._lock.release()
+
+
+
+  def get_value(self, name, labels=None):
+    """
+    <Purpose>
+      Returns the current value of a counter or gauge, or the (count, sum)
+      of a histogram.
+
+    <Arguments>
+      name: the metric
+
+      labels: a dictionary of labels (default None)
+
+    <Exceptions>
+      ValueError if the metric is unknown.
+
+    <Returns>
+      The value (0 or (0, 0.0) if nothing was recorded).
+    """
+    self._lock.acquire()
+    try:
+      self._check_type(name, METRIC_TYPES)
+      labelstring = _label_string(labels)
+
+      if self._descriptions[name][0] == 'histogram':
+        if labelstring not in self._values[name]:
+          return (0, 0.0)
+        return (self._values[name][labelstring][2], self._values[name][labelstring][1])
+
+      return self._values[name].get(labelstring, 0)
+    finally:
+      self._lock.release()
+
+
+
+  def render(self):
+    """
+    <Purpose>
+      Returns all of the metrics in the Prometheus text format.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      Whatever a value function raises.
+
+    <Returns>
+      A string.
+    """
+    # call the value functions without holding the lock (they may be slow or
+    # take other locks)
+    self._lock.acquire()
+    try:
+      valuefunctions = self._valuefunctions.items()
+    finally:
+      self._lock.release()
+
+    functionvalues = {}
+    for name, function in valuefunctions:
+      functionvalues[name] = function()
+
+    outputlines = []
+
+    self._lock.acquire()
+    try:
+      for name in self._names:
+        metrictype, helpstring, buckets = self._descriptions[name]
+
+        outputlines.append('# HELP '+name+' '+helpstring.replace('\\', '\\\\').replace('\n', '\\n'))
+        outputlines.append('# TYPE '+name+' '+metrictype)
+
+        if name in functionvalues:
+          if functionvalues[name] is not None:
+            outputlines.append(name+' '+_format_value(functionvalues[name]))
+          continue
+
+        for labelstring in sorted(self._values[name]):
+          value = self._values[name][labelstring]
+
+          if metrictype != 'histogram':
+            outputlines.append(name+labelstring+' '+_format_value(value))
+            continue
+
+          bucketcounts, valuesum, valuecount = value
+          # the le label goes with any others
+          if labelstring:
+            labelprefix = labelstring[:-1]+','
+          else:
+            labelprefix = '{'
+
+          cumulativecount = 0
+          for position in range(len(buckets)):
+            cumulativecount = cumulativecount + bucketcounts[position]
+            outputlines.append(name+'_bucket'+labelprefix+'le="'+_format_value(float(buckets[position]))+'"} '+str(cumulativecount))
+          outputlines.append(name+'_bucket'+labelprefix+'le="+Inf"} '+str(valuecount))
+          outputlines.append(name+'_sum'+labelstring+' '+_format_value(valuesum))
+          outputlines.append(name+'_count'+labelstring+' '+str(valuecount))
+
+    finally:
+      self._lock.release()
+
+    return '\n'.join(outputlines)+'\n'
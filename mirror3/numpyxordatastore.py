@@ -0,0 +1,349 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  An XORdatastore that keeps the whole datastore in one contiguous NumPy
+  matrix of 64 bit words (one row per block).   The blocks that a bitstring
+  selects are found with np.unpackbits and XORed together with
+  np.bitwise_xor.reduce.   This gets a Python only mirror close to the
+  speed of the C datastore without having to build fastsimplexordatastore_c.
+
+  The interface (and the error checking) is the same as the Python
+  datastore.
+
+"""
+
+import math
+
+import numpy as np
+
+
+# The selected rows are copied out of the datastore (fancy indexing) before
+# they are reduced.   This bounds the size of that copy.
+_XOR_CHUNK_BYTES = 4*1024*1024
+
+# produce_xor_from_bitstrings applies every query to a tile of this many bytes
+# of blocks before moving on, so a tile should fit in the CPU cache.   Blocks
+# larger than a column are split into columns of this size.
+_XOR_TILE_BYTES = 1024*1024
+_XOR_COLUMN_BYTES = 64*1024
+
+
+def do_xor(string_a, string_b):
+  if type(string_a) != str or type(string_b) != str:
+    raise TypeError("do_xor called with a non-string")
+
+  if len(string_a) != len(string_b):
+    raise ValueError("do_xor requires strings of the same length")
+
+  return (np.frombuffer(string_a, dtype=np.uint8) ^ np.frombuffer(string_b, dtype=np.uint8)).tobytes()
+
+
+class XORDatastore:
+  """
+  <Purpose>
+    Class that has information for an XORdatastore.   This data structure can
+    quickly XOR blocks of data that it stores.   The real work is done by
+    NumPy
+
+  <Side Effects>
+    None.
+
+  """
+
+  # this is the private, internal storage area for data.   _blocks is a
+  # numberofblocks x (sizeofblocks / 8) uint64 matrix and _bytes is a flat
+  # uint8 view of the same memory (used by set_data / get_data).
+  _blocks = None
+  _bytes = None
+
+  # these are public so that a caller can read information about a created
+  # datastore.   They should not be changed.
+  numberofblocks = None
+  sizeofblocks = None
+
+  def __init__(self, block_size, num_blocks):  # allocate
+    """
+    <Purpose>
+      Allocate a place to store data for efficient XOR.
+
+    <Arguments>
+      block_size: the size of each block.   This must be a positive int / long.
+                  The value must be a multiple of 64
+
+      num_blocks: the number of blocks.   This must be a positive integer
+
+    <Exceptions>
+      TypeError is raised if invalid parameters are given.
+
+    """
+
+    if type(block_size) != int and type(block_size) != long:
+      raise TypeError("Block size must be an integer")
+
+    if block_size <= 0:
+      raise TypeError("Block size must be positive")
+
+    if block_size %64 != 0:
+      raise TypeError("Block size must be a multiple of 64")
+
+    if type(num_blocks) != int and type(num_blocks) != long:
+      raise TypeError("Number of blocks must be an integer")
+
+    if num_blocks <= 0:
+      raise TypeError("Number of blocks must be positive")
+
+
+    self.numberofblocks = num_blocks
+    self.sizeofblocks = block_size
+
+    # np.zeros gives us the all zero padding for any 'gaps' in the data.
+    self._blocks = np.zeros((num_blocks, block_size / 8), dtype=np.uint64)
+    self._bytes = self._blocks.reshape(-1).view(np.uint8)
+
+
+
+  def produce_xor_from_bitstring(self, bitstring):
+    """
+    <Purpose>
+      Returns an XORed block from an XORdatastore.   It will always return
+      a string of the size of the datastore blocks
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.   The length
+                 of this string must be ceil(numberofblocks / 8.0).   Extra
+                 bits are ignored (e.g. if are 10 blocks, the last
+                 six bits are ignored).
+
+    <Exceptions>
+      TypeError is raised if the bitstring is invalid
+
+    <Returns>
+      The XORed block.
+
+    """
+    currentblock = np.zeros(self.sizeofblocks / 8, dtype=np.uint64)
+
+    self._xor_into(bitstring, currentblock)
+
+    return currentblock.tobytes()
+
+
+
+  def produce_xor_into(self, bitstring, out_buffer):
+    """
+    <Purpose>
+      Like produce_xor_from_bitstring, but the XORed block is written into
+      a buffer that the caller supplies (and can reuse) instead of a new
+      string.
+
+    <Arguments>
+      bitstring: See produce_xor_from_bitstring.
+
+      out_buffer: a writable buffer (e.g. a bytearray or memoryview) of at
+                  least sizeofblocks bytes.   The first sizeofblocks bytes
+                  are overwritten.
+
+    <Exceptions>
+      TypeError is raised if the bitstring or out_buffer is invalid
+
+    <Returns>
+      None
+
+    """
+    outview = memoryview(out_buffer)
+
+    if outview.readonly:
+      raise TypeError("out_buffer must be writable")
+
+    if len(outview) * outview.itemsize < self.sizeofblocks:
+      raise TypeError("out_buffer is smaller than a block")
+
+    # the caller's memory, seen as 64 bit words
+    currentblock = np.asarray(outview).reshape(-1).view(np.uint8)[:self.sizeofblocks].view(np.uint64)
+    currentblock[:] = 0
+
+    self._xor_into(bitstring, currentblock)
+
+
+
+  def _xor_into(self, bitstring, currentblock):
+    # Private helper that checks a bitstring and XORs the blocks it selects
+    # into currentblock (a uint64 array).
+
+    if type(bitstring) != str:
+      raise TypeError("bitstring must be a string")
+
+    if len(bitstring) != math.ceil(self.numberofblocks/8.0):
+      raise TypeError("bitstring is not of the correct length")
+
+    # unpackbits is MSB first, which matches the bitstring layout.   The
+    # extra bits at the end are dropped here.
+    selectedbits = np.unpackbits(np.frombuffer(bitstring, dtype=np.uint8))
+    selectedblocks = np.flatnonzero(selectedbits[:self.numberofblocks])
+
+    rowsperchunk = max(1, _XOR_CHUNK_BYTES / self.sizeofblocks)
+
+    for start in range(0, len(selectedblocks), rowsperchunk):
+      selectedrows = self._blocks[selectedblocks[start:start+rowsperchunk]]
+      currentblock ^= np.bitwise_xor.reduce(selectedrows, axis=0)
+
+
+
+  def produce_xor_from_bitstrings(self, bitstringlist):
+    """
+    <Purpose>
+      Returns the XORed blocks for several bitstrings.   The datastore is
+      walked once in cache sized tiles of blocks and every query is applied
+      to a tile before moving on to the next one.
+
+    <Arguments>
+      bitstringlist: a list of bitstrings.   Each one must be valid for
+                     produce_xor_from_bitstring.
+
+    <Exceptions>
+      TypeError is raised if the list or any of the bitstrings are invalid
+
+    <Returns>
+      A list with the XORed block for each bitstring (in the same order).
+
+    """
+    if type(bitstringlist) != list:
+      raise TypeError("bitstringlist must be a list")
+
+    for bitstring in bitstringlist:
+      if type(bitstring) != str:
+        raise TypeError("bitstring must be a string")
+
+      if len(bitstring) != math.ceil(self.numberofblocks/8.0):
+        raise TypeError("bitstring is not of the correct length")
+
+    if not bitstringlist:
+      return []
+
+    # one row of bits per query (with the extra bits dropped)
+    selectedbits = np.unpackbits(np.frombuffer(''.join(bitstringlist), dtype=np.uint8))
+    selectedbits = selectedbits.reshape(len(bitstringlist), -1)[:, :self.numberofblocks]
+
+    currentblocks = np.zeros((len(bitstringlist), self.sizeofblocks / 8), dtype=np.uint64)
+
+    # large blocks are split into column ranges so that a tile still holds
+    # several rows
+    wordspercolumn = min(self.sizeofblocks, _XOR_COLUMN_BYTES) / 8
+    rowspertile = max(1, _XOR_TILE_BYTES / (wordspercolumn * 8))
+
+    for columnstart in range(0, self.sizeofblocks / 8, wordspercolumn):
+      columnend = columnstart + wordspercolumn
+
+      for tilestart in range(0, self.numberofblocks, rowspertile):
+        # this is a view, so the tile is only read when the queries use it
+        tile = self._blocks[tilestart:tilestart+rowspertile, columnstart:columnend]
+
+        for querynumber in range(len(bitstringlist)):
+          selectedrows = np.flatnonzero(selectedbits[querynumber, tilestart:tilestart+rowspertile])
+
+          if len(selectedrows):
+            currentblocks[querynumber, columnstart:columnend] ^= np.bitwise_xor.reduce(tile[selectedrows], axis=0)
+
+    return [currentblock.tobytes() for currentblock in currentblocks]
+
+
+
+
+  def set_data(self, offset, data_to_add):
+    """
+    <Purpose>
+      Sets the raw data in an XORdatastore.   It ignores block layout, etc.
+
+    <Arguments>
+      offset: this is a non-negative integer that must be less than the
+              numberofblocks * blocksize.
+
+      data_to_add: the string that should be added.   offset + len(data_to_add)
+                must be less than the numberofblocks * blocksize.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      None
+
+    """
+    if type(offset) != int and type(offset) != long:
+      raise TypeError("Offset must be an integer")
+
+    if offset < 0:
+      raise TypeError("Offset must be non-negative")
+
+    if type(data_to_add) != str:
+      raise TypeError("Data_to_add to XORdatastore must be a string.")
+
+    if offset + len(data_to_add) > self.numberofblocks * self.sizeofblocks:
+      raise TypeError("Offset + added data overflows the XORdatastore")
+
+    self._bytes[offset:offset+len(data_to_add)] = np.frombuffer(data_to_add, dtype=np.uint8)
+
+
+
+
+  def get_data(self, offset, quantity, copy=True):
+    """
+    <Purpose>
+      Returns raw data from an XORdatastore.   It ignores block layout, etc.
+
+    <Arguments>
+      offset: this is a non-negative integer that must be less than the
+              numberofblocks * blocksize.
+
+      quantity: quantity must be a positive integer.   offset + quantity
+                must be less than the numberofblocks * blocksize.
+
+      copy: if False, return a memoryview of the datastore instead of a
+            copy (default True).
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      A string containing the data (or a memoryview).
+
+    """
+    if type(offset) != int and type(offset) != long:
+      raise TypeError("Offset must be an integer")
+
+    if offset < 0:
+      raise TypeError("Offset must be non-negative")
+
+    if type(quantity) != int and type(quantity) != long:
+      raise TypeError("Quantity must be an integer")
+
+    if quantity <= 0:
+      raise TypeError("Quantity must be positive")
+
+    if offset + quantity > self.numberofblocks * self.sizeofblocks:
+      raise TypeError("Quantity + offset is larger than XORdatastore")
+
+    if not copy:
+      # (the view shares the datastore's memory and keeps it alive)
+      return memoryview(self._bytes[offset:offset+quantity])
+
+    return self._bytes[offset:offset+quantity].tobytes()
+
+
+
+
+  def __del__(self):   # deallocate
+    """
+    <Purpose>
+      Deallocate the XORdatastore
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    """
+    # NumPy frees the matrix once the last reference is gone.
+    pass
@@ -0,0 +1,408 @@
+"""
+<Start Date>
+  October 17th, 2026
+
+<Description>
+  A query planner for an XORdatastore.   analyze() records the XOR of all of
+  the blocks (the total parity) and which blocks are all zeros (e.g. the
+  padding between files).   After that each query is answered the cheapest
+  way:
+
+    empty:      no non-zero blocks are selected.   The answer is all zeros.
+    single:     one non-zero block is selected.   It is simply copied out.
+    direct:     the selected non-zero blocks are XORed (zero blocks are
+                dropped from the bitstring first).
+    complement: more than half of the non-zero blocks are selected.   The
+                unselected ones are XORed and the result is XORed with the
+                total parity.
+
+  A random PIR query selects about half of the blocks, so 'complement' is
+  used for roughly half of them and never XORs more than half of the
+  datastore.   get_pathcounts tells how often each path was used.
+
+"""
+
+import math
+
+import binascii
+
+import threading
+
+
+# The evaluation paths (the keys of get_pathcounts()).   'unplanned' is used
+# before analyze is called.
+PLAN_PATHS = ['unplanned', 'empty', 'single', 'direct', 'complement']
+
+
+class PlannedXORDatastore:
+  """
+  <Purpose>
+    Wraps a populated XORdatastore and picks the cheapest way to answer each
+    query.   It has the same interface as an XORdatastore.
+
+  <Side Effects>
+    None.
+
+  <Example Use>
+    myxordatastore = simplexordatastore.XORDatastore(1024, 16)
+    # ... populate myxordatastore ...
+
+    plannedxordatastore = PlannedXORDatastore(myxordatastore,
+        simplexordatastore)
+    plannedxordatastore.analyze()
+
+    # the answer is the same as from myxordatastore
+    plannedxordatastore.produce_xor_from_bitstring(bitstring)
+
+    print plannedxordatastore.get_pathcounts()
+
+  """
+
+  # these are public so that a caller can read information about a created
+  # datastore.   They should not be changed.
+  numberofblocks = None
+  sizeofblocks = None
+
+  # the number of blocks that are not all zeros (after analyze)
+  numberofnonzeroblocks = None
+
+  def __init__(self, xordatastore, xordatastoremodule):
+    """
+    <Purpose>
+      Set up a planner for an XORdatastore.   Queries are passed straight
+      through until analyze is called.
+
+    <Arguments>
+      xordatastore: the XORdatastore to wrap.
+
+      xordatastoremodule: the module that xordatastore came from.   Its
+                          do_xor is used to apply the total parity.
+
+    <Exceptions>
+      None
+
+    """
+    self._xordatastore = xordatastore
+    self._xordatastoremodule = xordatastoremodule
+
+    self.numberofblocks = xordatastore.numberofblocks
+    self.sizeofblocks = xordatastore.sizeofblocks
+
+    self._bitstringlength = int(math.ceil(self.numberofblocks / 8.0))
+
+    self._zeroblock = chr(0) * self.sizeofblocks
+
+    # (nonzeromask, totalparity, numberofnonzeroblocks) or None.   They are replaced together so a
+    # query never sees half of an analysis.
+    self._plan = None
+
+    self._pathcountslock = threading.Lock()
+    self._pathcounts = {}
+    for path in PLAN_PATHS:
+      self._pathcounts[path] = 0
+
+
+
+  def analyze(self):
+    """
+    <Purpose>
+      Finds the all zero blocks and the total parity from the current
+      datastore contents.   Call this after the datastore is populated.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Side Effects>
+      Reads every block.
+
+    <Returns>
+      None
+
+    """
+    # a bit for every non-zero block (MSB first, as in a bitstring)
+    nonzeromask = 0
+    numberofnonzeroblocks = 0
+    for blocknumber in range(self.numberofblocks):
+      nonzeromask = nonzeromask << 1
+      if self._xordatastore.get_data(blocknumber * self.sizeofblocks, self.sizeofblocks) != self._zeroblock:
+        nonzeromask = nonzeromask | 1
+        numberofnonzeroblocks = numberofnonzeroblocks + 1
+
+    # line it up with the (padded) bitstring
+    nonzeromask = nonzeromask << (self._bitstringlength * 8 - self.numberofblocks)
+
+    totalparity = self._xordatastore.produce_xor_from_bitstring(self._long_to_bitstring(nonzeromask))
+
+    self.numberofnonzeroblocks = numberofnonzeroblocks
+    self._plan = (nonzeromask, totalparity, numberofnonzeroblocks)
+
+
+
+  def get_pathcounts(self):
+    """
+    <Purpose>
+      Returns how many queries have used each evaluation path.
+
+    <Arguments>
+      None
+
+    <Exceptions>
+      None
+
+    <Returns>
+      A dictionary from the names in PLAN_PATHS to counts.
+
+    """
+    self._pathcountslock.acquire()
+    try:
+      return self._pathcounts.copy()
+    finally:
+      self._pathcountslock.release()
+
+
+
+  def _count(self, path, numberofqueries=1):
+    # Private helper that counts queries that used path
+    self._pathcountslock.acquire()
+    try:
+      self._pathcounts[path] = self._pathcounts[path] + numberofqueries
+    finally:
+      self._pathcountslock.release()
+
+
+
+  def _long_to_bitstring(self, value):
+    # Private helper that turns a (MSB first) long back into a bitstring
+    return binascii.unhexlify('%0*x' % (self._bitstringlength * 2, value))
+
+
+
+  def _check_bitstring(self, bitstring):
+    # Private helper that checks a bitstring the same way the datastores do
+
+    if type(bitstring) != str:
+      raise TypeError("bitstring must be a string")
+
+    if len(bitstring) != self._bitstringlength:
+      raise TypeError("bitstring is not of the correct length")
+
+
+
+  def _make_plan(self, bitstring, plan):
+    # Private helper that picks the evaluation path for a (checked)
+    # bitstring.   Returns (path, argument) where argument is the block
+    # number for 'single' and the bitstring to XOR for 'direct' and
+    # 'complement'.
+
+    nonzeromask, totalparity, numberofnonzeroblocks = plan
+
+    selected = long(binascii.hexlify(bitstring), 16) & nonzeromask
+
+    if selected == 0:
+      return ('empty', None)
+
+    numberselected = bin(selected).count('1')
+
+    if numberselected == 1:
+      return ('single', self._bitstringlength * 8 - selected.bit_length())
+
+    if numberselected * 2 > numberofnonzeroblocks:
+      return ('complement', self._long_to_bitstring(nonzeromask & ~selected))
+
+    return ('direct', self._long_to_bitstring(selected))
+
+
+
+  def produce_xor_from_bitstring(self, bitstring):
+    """
+    <Purpose>
+      Returns an XORed block.   See the XORdatastore documentation.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.
+
+    <Exceptions>
+      TypeError is raised if the bitstring is invalid
+
+    <Returns>
+      The XORed block.
+
+    """
+    # read this once.   analyze or set_data may change it while we run.
+    plan = self._plan
+
+    if plan is None:
+      self._count('unplanned')
+      return self._xordatastore.produce_xor_from_bitstring(bitstring)
+
+    self._check_bitstring(bitstring)
+
+    path, argument = self._make_plan(bitstring, plan)
+    self._count(path)
+
+    if path == 'empty':
+      return self._zeroblock
+
+    if path == 'single':
+      return self._xordatastore.get_data(argument * self.sizeofblocks, self.sizeofblocks)
+
+    xorresult = self._xordatastore.produce_xor_from_bitstring(argument)
+
+    if path == 'complement':
+      return self._xordatastoremodule.do_xor(xorresult, plan[1])
+
+    return xorresult
+
+
+
+  def produce_xor_into(self, bitstring, out_buffer):
+    """
+    <Purpose>
+      Writes an XORed block into out_buffer.   See the XORdatastore
+      documentation.
+
+    <Arguments>
+      bitstring: a string of bits that indicates what to XOR.
+
+      out_buffer: a writable buffer of at least sizeofblocks bytes.
+
+    <Exceptions>
+      TypeError is raised if the bitstring or out_buffer is invalid
+
+    <Returns>
+      None
+
+    """
+    plan = self._plan
+
+    if plan is None:
+      self._count('unplanned')
+      return self._xordatastore.produce_xor_into(bitstring, out_buffer)
+
+    self._check_bitstring(bitstring)
+
+    path, argument = self._make_plan(bitstring, plan)
+
+    if path == 'direct':
+      self._count(path)
+      return self._xordatastore.produce_xor_into(argument, out_buffer)
+
+    # the other paths build a string anyways...
+    outview = memoryview(out_buffer)
+
+    if outview.readonly:
+      raise TypeError("out_buffer must be writable")
+
+    if len(outview) * outview.itemsize < self.sizeofblocks:
+      raise TypeError("out_buffer is smaller than a block")
+
+    self._count(path)
+
+    if path == 'empty':
+      outview[:self.sizeofblocks] = self._zeroblock
+
+    elif path == 'single':
+      outview[:self.sizeofblocks] = self._xordatastore.get_data(argument * self.sizeofblocks, self.sizeofblocks)
+
+    else:
+      outview[:self.sizeofblocks] = self._xordatastoremodule.do_xor(self._xordatastore.produce_xor_from_bitstring(argument), plan[1])
+
+
+
+  def produce_xor_from_bitstrings(self, bitstringlist):
+    """
+    <Purpose>
+      Returns the XORed blocks for several bitstrings.   The queries that
+      need XORs are passed to the wrapped datastore together.
+
+    <Arguments>
+      bitstringlist: a list of bitstrings.
+
+    <Exceptions>
+      TypeError is raised if the list or any of the bitstrings are invalid
+
+    <Returns>
+      A list with the XORed block for each bitstring (in the same order).
+
+    """
+    plan = self._plan
+
+    if plan is None:
+      resultlist = self._xordatastore.produce_xor_from_bitstrings(bitstringlist)
+      self._count('unplanned', len(resultlist))
+      return resultlist
+
+    if type(bitstringlist) != list:
+      raise TypeError("bitstringlist must be a list")
+
+    for bitstring in bitstringlist:
+      self._check_bitstring(bitstring)
+
+    planlist = []
+    xorbitstringlist = []
+    for bitstring in bitstringlist:
+      path, argument = self._make_plan(bitstring, plan)
+      self._count(path)
+      planlist.append((path, argument))
+      if path == 'direct' or path == 'complement':
+        xorbitstringlist.append(argument)
+
+    xorresultlist = self._xordatastore.produce_xor_from_bitstrings(xorbitstringlist)
+    xorresultlist.reverse()
+
+    resultlist = []
+    for path, argument in planlist:
+      if path == 'empty':
+        resultlist.append(self._zeroblock)
+      elif path == 'single':
+        resultlist.append(self._xordatastore.get_data(argument * self.sizeofblocks, self.sizeofblocks))
+      elif path == 'direct':
+        resultlist.append(xorresultlist.pop())
+      else:
+        resultlist.append(self._xordatastoremodule.do_xor(xorresultlist.pop(), plan[1]))
+
+    return resultlist
+
+
+
+  def set_data(self, offset, data_to_add):
+    """
+    <Purpose>
+      Sets the raw data in the wrapped XORdatastore.   This throws away the
+      analysis, so analyze must be called again afterwards.
+
+    <Arguments>
+      See the XORdatastore documentation.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      None
+
+    """
+    self._plan = None
+
+    return self._xordatastore.set_data(offset, data_to_add)
+
+
+
+  def get_data(self, offset, quantity):
+    """
+    <Purpose>
+      Returns raw data from the wrapped XORdatastore.
+
+    <Arguments>
+      See the XORdatastore documentation.
+
+    <Exceptions>
+      TypeError if the arguments are the wrong type or have invalid values.
+
+    <Returns>
+      A string containing the data.
+
+    """
+    return self._xordatastore.get_data(offset, quantity)
@@ -12,6 +12,10 @@
   fails, you will use a previously non-selected mirror for the remainder of 
   the blocks.
 
+  The mirrors can instead be chosen at random weighted by the spare capacity
+  they advertise (see get_spare_capacity), so busy mirrors are picked less
+  often.   The same number of distinct mirrors is still used.
+
   For more technical explanation, please see the upPIR papers on my website.
   
 
@@ -60,6 +64,75 @@ class InsufficientMirrors(Exception):
   """There are insufficient mirrors to handle your request"""
 
 
+
+def get_spare_capacity(mirrorinfo):
+  """
+  <Purpose>
+    Returns how many more queries a mirror said it could take, from the
+    load figures in its mirrorinfo (see uppirlib.MIRROR_LOAD_KEYS).
+
+  <Arguments>
+    mirrorinfo: a mirror information dictionary (from the vendor).
+
+  <Exceptions>
+    None
+
+  <Returns>
+    A number (0 for a mirror that is full), or None if the mirror did not
+    advertise usable load figures.
+  """
+  if 'load' not in mirrorinfo:
+    return None
+
+  try:
+    uppirlib.check_mirror_load(mirrorinfo['load'])
+  except TypeError:
+    return None
+
+  mirrorload = mirrorinfo['load']
+  return max(mirrorload['capacity'] - mirrorload['queued'] - mirrorload['running'], 0)
+
+
+
+# No mirror is weighted more than this many times the median weight of the
+# mirrors that advertised their load.   Mirrors report their own load, so one
+# (or a few colluding ones) claiming a huge capacity must not be chosen
+# almost every time.
+MAX_WEIGHT_OVER_MEDIAN = 4.0
+
+def _order_by_spare_capacity(mirrorinfolist):
+  # Private helper that returns the mirrors in a random order where a mirror
+  # with more spare capacity is more likely to come first.   Each mirror is
+  # weighted by its spare capacity plus one, so a full mirror can still be
+  # picked (we never rely only on what mirrors say about themselves), up to
+  # MAX_WEIGHT_OVER_MEDIAN times the median weight.   A mirror without load
+  # figures gets the mean weight of those with them.   This is weighted
+  # sampling without replacement (Efraimidis and Spirakis): sort by
+  # random() ** (1 / weight).
+  sparecapacitylist = [get_spare_capacity(mirrorinfo) for mirrorinfo in mirrorinfolist]
+
+  knownweightlist = sorted([sparecapacity + 1.0 for sparecapacity in sparecapacitylist if sparecapacity is not None])
+  if knownweightlist:
+    middle = len(knownweightlist) / 2
+    medianweight = (knownweightlist[middle] + knownweightlist[-middle - 1]) / 2
+    maxweight = medianweight * MAX_WEIGHT_OVER_MEDIAN
+    knownweightlist = [min(weight, maxweight) for weight in knownweightlist]
+    unknownweight = sum(knownweightlist) / len(knownweightlist)
+  else:
+    unknownweight = 1.0
+
+  keyedmirrorlist = []
+  for mirrorinfo, sparecapacity in zip(mirrorinfolist, sparecapacitylist):
+    if sparecapacity is None:
+      weight = unknownweight
+    else:
+      weight = min(sparecapacity + 1.0, maxweight)
+    keyedmirrorlist.append((random.random() ** (1.0 / weight), mirrorinfo))
+
+  keyedmirrorlist.sort(key=lambda keyedmirror: keyedmirror[0], reverse=True)
+  return [mirrorinfo for key, mirrorinfo in keyedmirrorlist]
+
+
 # These provide an easy way for the client XOR request behavior to be 
 # modified.   If you wanted to change the policy by which mirrors are selected,
 # the failure behavior for offline mirrors, or the way in which blocks
@@ -112,7 +185,7 @@ class RandomXORRequestor:
 
 
 
-  def __init__(self, mirrorinfolist, blocklist, manifestdict, privacythreshold, pollinginterval = .1):
+  def __init__(self, mirrorinfolist, blocklist, manifestdict, privacythreshold, pollinginterval = .1, weightbyload = False):
     """
     <Purpose>
       Get ready to handle requests for XOR block strings, etc.
@@ -130,6 +203,11 @@ class RandomXORRequestor:
       pollinginterval: the amount of time to sleep between checking for
                        the ability to serve a mirror.   
 
+      weightbyload: prefer mirrors with more spare capacity when choosing
+                    (and when replacing a failed one) rather than choosing
+                    uniformly.   privacythreshold distinct mirrors are still
+                    used (default False).
+
     <Exceptions>
       TypeError may be raised if invalid parameters are given.
 
@@ -146,8 +224,11 @@ class RandomXORRequestor:
 
     # now we do the 'random' part.   I copy the mirrorinfolist to avoid changing
     # the list in place.
-    self.fullmirrorinfolist = mirrorinfolist[:]
-    random.shuffle(self.fullmirrorinfolist)
+    if weightbyload:
+      self.fullmirrorinfolist = _order_by_spare_capacity(mirrorinfolist)
+    else:
+      self.fullmirrorinfolist = mirrorinfolist[:]
+      random.shuffle(self.fullmirrorinfolist)
 
 
     # let's make a list of mirror information (what has been retrieved, etc.)
@@ -156,6 +237,7 @@ class RandomXORRequestor:
       thisrequestinfo = {}
       thisrequestinfo['mirrorinfo'] = mirrorinfo
       thisrequestinfo['servingrequest'] = False
+      thisrequestinfo['requestsoutstanding'] = 0
       thisrequestinfo['blocksneeded'] = blocklist[:]
       thisrequestinfo['blockbitstringlist'] = []
   
@@ -224,11 +306,45 @@ class RandomXORRequestor:
       when all strings have been retrieved...
 
     """
+    requesttuplelist = self.get_next_xorrequests(1)
+
+    if not requesttuplelist:
+      return ()
+
+    return requesttuplelist[0]
+
+
+
+
+  def get_next_xorrequests(self, maxrequests):
+    """
+    <Purpose>
+      Gets up to maxrequests requesttuples for one mirror, so they can be
+      sent in one batch.   The mirror stays busy until notify_success has
+      been called for all of them (in order), or notify_failure for any one
+      of them.
+
+    <Arguments>
+      maxrequests: the most requesttuples to return (a positive integer)
+
+    <Exceptions>
+      TypeError if maxrequests is not a positive integer.
+
+      InsufficientMirrors if there are not enough mirrors
+ 
+    <Returns>
+      A list of requesttuples (mirrorinfo, blocknumber, bitstring) for the
+      same mirror, or [] when all strings have been retrieved...
+
+    """
+
+    if type(maxrequests) != int or maxrequests <= 0:
+      raise TypeError("maxrequests must be a positive integer")
 
     # Three cases I need to worry about:
-    #   1) nothing that still needs to be requested -> return ()
+    #   1) nothing that still needs to be requested -> return []
     #   2) requests remain, but all mirrors are busy -> block until ready
-    #   3) there is a request ready -> return the tuple
+    #   3) there is a request ready -> return the tuples
     # 
 
     # I'll exit via return.   I will loop to sleep while waiting.   
@@ -256,10 +372,15 @@ class RandomXORRequestor:
       
           # otherwise set it to be taken...
           requestinfo['servingrequest'] = True
-          return (requestinfo['mirrorinfo'], requestinfo['blocksneeded'][0], requestinfo['blockbitstringlist'][0])
+          requestinfo['requestsoutstanding'] = min(maxrequests, len(requestinfo['blocksneeded']))
+
+          requesttuplelist = []
+          for position in range(requestinfo['requestsoutstanding']):
+            requesttuplelist.append((requestinfo['mirrorinfo'], requestinfo['blocksneeded'][position], requestinfo['blockbitstringlist'][position]))
+          return requesttuplelist
 
         if not stillserving:
-          return ()
+          return []
 
       finally:
         # I always want someone else to be able to get the lock
@@ -309,6 +430,7 @@ class RandomXORRequestor:
           # let's mark it as inactive and set up a different mirror
           activemirrorinfo['mirrorinfo'] = nextmirrorinfo
           activemirrorinfo['servingrequest'] = False
+          activemirrorinfo['requestsoutstanding'] = 0
           return
 
       raise Exception("InternalError: Unknown mirror in notify_failure")
@@ -349,8 +471,11 @@ class RandomXORRequestor:
       for activemirrorinfo in self.activemirrorinfolist:
         if activemirrorinfo['mirrorinfo'] == thismirrorsinfo:
         
-          # let's mark it as inactive and pop off the blocks, etc.
-          activemirrorinfo['servingrequest'] = False
+          # let's pop off the blocks, etc. and mark it as inactive once the
+          # whole batch is back
+          activemirrorinfo['requestsoutstanding'] = activemirrorinfo['requestsoutstanding'] - 1
+          if activemirrorinfo['requestsoutstanding'] == 0:
+            activemirrorinfo['servingrequest'] = False
           
           # remove the block and bitstring (asserting they match what we said 
           # before)
@@ -0,0 +1,94 @@
+# this is a few tests of the metrics registry.   If everything passes, there
+# is no output.
+
+import threading
+
+import metricsregistry
+
+
+registry = metricsregistry.MetricsRegistry()
+registry.describe('requests_total', 'counter', 'Requests handled')
+registry.describe('connections', 'gauge', 'Open connections')
+registry.describe('queued', 'gauge', 'Queued tasks')
+registry.describe('xor_seconds', 'histogram', 'Time to XOR', buckets=[0.1, 1.0])
+
+# describing again changes nothing
+registry.describe('requests_total', 'gauge', 'Something else')
+
+registry.increment('requests_total', labels={'type':'hello'})
+registry.increment('requests_total', 2, labels={'type':'xorblock'})
+registry.increment('requests_total', labels={'type':'hello'})
+assert(registry.get_value('requests_total', {'type':'hello'}) == 2)
+assert(registry.get_value('requests_total', {'type':'xorblock'}) == 2)
+assert(registry.get_value('requests_total') == 0)
+
+registry.increment('connections')
+registry.increment('connections', -1)
+registry.set_gauge('connections', 7)
+registry.set_value_function('queued', lambda: 3)
+
+registry.observe('xor_seconds', 0.05)
+registry.observe('xor_seconds', 0.5)
+registry.observe('xor_seconds', 5)
+assert(registry.get_value('xor_seconds') == (3, 5.55))
+
+output = registry.render()
+assert(output.endswith('\n'))
+lines = output.splitlines()
+
+assert(lines[0] == '# HELP requests_total Requests handled')
+assert(lines[1] == '# TYPE requests_total counter')
+assert('requests_total{type="hello"} 2' in lines)
+assert('requests_total{type="xorblock"} 2' in lines)
+assert('connections 7' in lines)
+assert('queued 3' in lines)
+assert('# TYPE xor_seconds histogram' in lines)
+# the buckets are cumulative
+assert('xor_seconds_bucket{le="0.1"} 1' in lines)
+assert('xor_seconds_bucket{le="1"} 2' in lines)
+assert('xor_seconds_bucket{le="+Inf"} 3' in lines)
+assert('xor_seconds_count 3' in lines)
+
+# labels on a histogram go before le
+registry.observe('xor_seconds', 0.01, labels={'kind':'batch'})
+assert('xor_seconds_bucket{kind="batch",le="0.1"} 1' in registry.render().splitlines())
+
+# a value function that returns None is left out
+registry.set_value_function('queued', lambda: None)
+assert('queued' not in [line.split()[0] for line in registry.render().splitlines() if not line.startswith('#')])
+
+
+# the wrong kind of update is an error
+for function, args in [(registry.increment, ('unknown',)), (registry.observe, ('requests_total', 1)), (registry.set_gauge, ('requests_total', 1)), (registry.increment, ('xor_seconds',))]:
+  try:
+    function(*args)
+  except ValueError:
+    pass
+  else:
+    print "a bad update of "+args[0]+" was allowed"
+
+try:
+  registry.describe('x', 'summary', 'unsupported')
+except ValueError:
+  pass
+else:
+  print "an unknown metric type was allowed"
+
+
+# counts are not lost when many threads update at once
+def worker():
+  for number in range(1000):
+    registry.increment('requests_total', labels={'type':'threaded'})
+    registry.observe('xor_seconds', 0.2, labels={'kind':'threaded'})
+
+threadlist = [threading.Thread(target=worker) for number in range(8)]
+for thread in threadlist:
+  thread.start()
+for thread in threadlist:
+  thread.join()
+
+assert(registry.get_value('requests_total', {'type':'threaded'}) == 8000)
+assert(registry.get_value('xor_seconds', {'kind':'threaded'})[0] == 8000)
+
+
+assert(metricsregistry.get_resident_bytes() > 0)
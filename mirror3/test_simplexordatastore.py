@@ -85,6 +85,49 @@ for blockcount in [9,15,16]:
     print "didn't detect incorrect (long) bitstring length"
 
 
+# produce_xor_from_bitstrings must give the same answers as asking one at a time
+letterxordatastore = simplexordatastore.XORDatastore(size, 16)
+
+startpos = 0
+for char in range(ord("A"), ord("Q")):
+  letterxordatastore.set_data(startpos, chr(char) * size)
+  startpos = startpos + size
+
+bitstringlist = [chr(int('10100000', 2)) + chr(int('00000001',2)), chr(0)*2, chr(255)*2, chr(int('01000000', 2)) + chr(0)]
+xorresultlist = letterxordatastore.produce_xor_from_bitstrings(bitstringlist)
+
+assert(len(xorresultlist) == len(bitstringlist))
+for bitstring, xorresult in zip(bitstringlist, xorresultlist):
+  assert(xorresult == letterxordatastore.produce_xor_from_bitstring(bitstring))
+
+assert(xorresultlist[0][0] == 'R')
+assert(letterxordatastore.produce_xor_from_bitstrings([]) == [])
+
+try:
+  letterxordatastore.produce_xor_from_bitstrings([chr(0)*2, chr(0)*3])
+except TypeError:
+  pass
+else:
+  print "didn't detect incorrect bitstring length in a list"
+
 
+# produce_xor_into writes the same answer into a caller's buffer
+outbuffer = bytearray('Z' * (size + 10))
+for bitstring in bitstringlist:
+  assert(letterxordatastore.produce_xor_into(bitstring, outbuffer) == None)
+  assert(str(outbuffer[:size]) == letterxordatastore.produce_xor_from_bitstring(bitstring))
+  # ... and leaves the rest alone
+  assert(str(outbuffer[size:]) == 'Z' * 10)
 
+# the buffer doesn't have to be aligned
+outview = memoryview(outbuffer)[3:3+size]
+letterxordatastore.produce_xor_into(bitstringlist[0], outview)
+assert(outview.tobytes() == xorresultlist[0])
 
+for badbuffer in ['X' * size, bytearray(size - 1), None]:
+  try:
+    letterxordatastore.produce_xor_into(bitstringlist[0], badbuffer)
+  except TypeError:
+    pass
+  else:
+    print "Was allowed to produce_xor_into a bad buffer"
@@ -28,3 +28,6 @@ assert('Invalid request length' == get_response('XORBLOCK'))
 
 # too short of a string (len 0)
 assert('Invalid request type' == get_response('ajskdfjsad'))
+
+# a XORBLOCKS request with no bitstrings
+assert('Invalid request length' == get_response('XORBLOCKS'))